@@ -0,0 +1,332 @@
+"""Per-turn token usage, estimated cost and timings."""
+
+import time
+from collections.abc import AsyncIterator, Iterator, Sequence
+from contextvars import ContextVar
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import AIMessageChunk
+from langchain_core.messages.ai import UsageMetadata, add_usage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from pydantic import BaseModel
+
+from metrics import Counter, Histogram
+from tracing import record_span
+
+TURNS = Counter("agent_turns_total", "Agent turns by outcome", ["status"])
+TOKENS = Counter("agent_tokens_total", "Model tokens consumed by agent turns", ["kind"])
+COST = Counter("agent_cost_usd_total", "Estimated model cost of agent turns in USD")
+TURN_SECONDS = Histogram(
+    "agent_turn_seconds",
+    "Agent turn duration and time spent per phase",
+    ["phase"],
+)
+
+_current_turn: ContextVar["TurnAccounting | None"] = ContextVar("current_turn", default=None)
+
+
+class TokenUsage(BaseModel):
+    input_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+    # Input tokens served from the provider's prompt cache
+    cache_read_tokens: int = 0
+    cost_usd: float = 0.0
+
+
+class TurnTimings(BaseModel):
+    # From receiving the user message to the first streamed token or tool call chunk
+    ttft_ms: float | None = None
+    # Waiting for a turn slot, included in ttft_ms and total_ms
+    queue_ms: float = 0.0
+    model_ms: float = 0.0
+    tool_ms: float = 0.0
+    checkpoint_ms: float = 0.0
+    total_ms: float = 0.0
+
+
+class ModelPrices(BaseModel):
+    """USD per million tokens."""
+
+    input: float = 0.0
+    cached_input: float = 0.0
+    output: float = 0.0
+
+    def cost(self, usage: UsageMetadata) -> float:
+        cached = usage.get("input_token_details", {}).get("cache_read", 0)
+        return (
+            (usage["input_tokens"] - cached) * self.input
+            + cached * self.cached_input
+            + usage["output_tokens"] * self.output
+        ) / 1_000_000
+
+
+def to_token_usage(usage: UsageMetadata | None, prices: ModelPrices) -> TokenUsage:
+    if not usage:
+        return TokenUsage()
+    return TokenUsage(
+        input_tokens=usage["input_tokens"],
+        output_tokens=usage["output_tokens"],
+        total_tokens=usage["total_tokens"],
+        cache_read_tokens=usage.get("input_token_details", {}).get("cache_read", 0),
+        cost_usd=prices.cost(usage),
+    )
+
+
+class TurnAccounting(AsyncCallbackHandler):
+    """Collects token usage and timings for one turn.
+
+    Usage comes from the streamed ``AIMessageChunk``s (``on_chunk``). Model and tool
+    time come from callbacks, so pass the instance in the run's ``callbacks``. Time
+    spent in the checkpointer is attributed through ``TimedCheckpointer`` to the turn
+    started in the current context, until ``finish``.
+    """
+
+    def __init__(self, prices: ModelPrices | None = None) -> None:
+        self.prices = prices or ModelPrices()
+        self.usage: UsageMetadata | None = None
+        self.started = time.perf_counter()
+        self.first_token_at: float | None = None
+        self.model_seconds = 0.0
+        self.tool_seconds = 0.0
+        self.checkpoint_seconds = 0.0
+        self.queue_seconds = 0.0
+        self._runs: dict[UUID, float] = {}
+        self._token = None
+        # Set by ``finish``
+        self.status: str | None = None
+
+    def start(self) -> "TurnAccounting":
+        self.started = time.perf_counter()
+        self._token = _current_turn.set(self)
+        return self
+
+    def on_chunk(self, chunk: AIMessageChunk) -> None:
+        if self.first_token_at is None and (chunk.content or chunk.tool_call_chunks):
+            self.first_token_at = time.perf_counter()
+        if chunk.usage_metadata:
+            self.usage = add_usage(self.usage, chunk.usage_metadata)
+
+    async def on_chat_model_start(
+        self, serialized: dict[str, Any], messages: Sequence, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._runs[run_id] = time.perf_counter()
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if (started := self._runs.pop(run_id, None)) is not None:
+            self.model_seconds += time.perf_counter() - started
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        await self.on_llm_end(None, run_id=run_id)
+
+    async def on_tool_start(
+        self, serialized: dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._runs[run_id] = time.perf_counter()
+
+    async def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if (started := self._runs.pop(run_id, None)) is not None:
+            self.tool_seconds += time.perf_counter() - started
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        await self.on_tool_end(None, run_id=run_id)
+
+    def token_usage(self) -> TokenUsage:
+        return to_token_usage(self.usage, self.prices)
+
+    def timings(self) -> TurnTimings:
+        total = time.perf_counter() - self.started
+        ttft = self.first_token_at - self.started if self.first_token_at is not None else None
+        return TurnTimings(
+            ttft_ms=ttft * 1000 if ttft is not None else None,
+            queue_ms=self.queue_seconds * 1000,
+            model_ms=self.model_seconds * 1000,
+            tool_ms=self.tool_seconds * 1000,
+            checkpoint_ms=self.checkpoint_seconds * 1000,
+            total_ms=total * 1000,
+        )
+
+    def finish(self, status: str) -> None:
+        """Stop attributing checkpoint time and export the turn to the metrics surface."""
+        if self._token is not None:
+            _current_turn.reset(self._token)
+            self._token = None
+        self.status = status
+        TURNS.inc(status=status)
+        usage = self.token_usage()
+        TOKENS.inc(usage.input_tokens - usage.cache_read_tokens, kind="input")
+        TOKENS.inc(usage.cache_read_tokens, kind="cache_read")
+        TOKENS.inc(usage.output_tokens, kind="output")
+        COST.inc(usage.cost_usd)
+        if self.first_token_at is not None:
+            TURN_SECONDS.observe(self.first_token_at - self.started, phase="ttft")
+        TURN_SECONDS.observe(self.model_seconds, phase="model")
+        TURN_SECONDS.observe(self.tool_seconds, phase="tool")
+        TURN_SECONDS.observe(self.checkpoint_seconds, phase="checkpoint")
+        TURN_SECONDS.observe(time.perf_counter() - self.started, phase="total")
+
+
+class SessionAccounting:
+    """Token usage summed over the turns of a session."""
+
+    def __init__(self, prices: ModelPrices | None = None) -> None:
+        self.prices = prices or ModelPrices()
+        self.usage: UsageMetadata | None = None
+        self.turns = 0
+
+    def add(self, turn: TurnAccounting) -> None:
+        self.turns += 1
+        if turn.usage:
+            self.usage = add_usage(self.usage, turn.usage)
+
+    def token_usage(self) -> TokenUsage:
+        return to_token_usage(self.usage, self.prices)
+
+
+class TimedCheckpointer(BaseCheckpointSaver):
+    """Attributes time spent in the wrapped checkpointer to the active turn and its trace.
+
+    Calls made in the background (e.g. by the write-behind writer) are not counted;
+    calls the graph makes concurrently with other work are, so phases may overlap.
+    Listing counts only the time spent fetching items, not the time the caller spends
+    between them.
+    """
+
+    def __init__(self, inner: BaseCheckpointSaver) -> None:
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+
+    def __getattr__(self, name: str) -> Any:
+        # aopen, aclose, aflush, counters of the wrapped checkpointer
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    @staticmethod
+    def _add(started: float, operation: str) -> None:
+        seconds = time.perf_counter() - started
+        if (turn := _current_turn.get()) is not None:
+            turn.checkpoint_seconds += seconds
+        record_span(f"checkpoint.{operation}", seconds)
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        started = time.perf_counter()
+        try:
+            return self.inner.get_tuple(config)
+        finally:
+            self._add(started, "get")
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        items = self.inner.list(config, filter=filter, before=before, limit=limit)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self._add(started, "list")
+            yield item
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        started = time.perf_counter()
+        try:
+            return self.inner.put(config, checkpoint, metadata, new_versions)
+        finally:
+            self._add(started, "put")
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        started = time.perf_counter()
+        try:
+            self.inner.put_writes(config, writes, task_id, task_path)
+        finally:
+            self._add(started, "put_writes")
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.inner.delete_thread(thread_id)
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        started = time.perf_counter()
+        try:
+            return await self.inner.aget_tuple(config)
+        finally:
+            self._add(started, "get")
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = self.inner.alist(config, filter=filter, before=before, limit=limit)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = await anext(items)
+            except StopAsyncIteration:
+                return
+            finally:
+                self._add(started, "list")
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        started = time.perf_counter()
+        try:
+            return await self.inner.aput(config, checkpoint, metadata, new_versions)
+        finally:
+            self._add(started, "put")
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        started = time.perf_counter()
+        try:
+            await self.inner.aput_writes(config, writes, task_id, task_path)
+        finally:
+            self._add(started, "put_writes")
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.inner.adelete_thread(thread_id)
+
+    def get_next_version(self, current: Any, channel: None) -> Any:
+        return self.inner.get_next_version(current, channel)
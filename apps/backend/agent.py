@@ -1,35 +1,99 @@
 import asyncio
+import functools
 import json
+import time
 import uuid
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from dataclasses import dataclass, field
 from datetime import UTC, datetime
 from enum import StrEnum
 from logging import Logger
 from typing import Any
 
 from langchain.chat_models import init_chat_model
-from langchain_core.messages import AIMessageChunk, ToolMessage
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.checkpoint.memory import MemorySaver
-from langgraph.checkpoint.postgres import PostgresSaver
 from langgraph.graph.state import CompiledStateGraph
-from langgraph.prebuilt import create_react_agent
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from config import CheckpointerType, settings, Settings
+from accounting import (
+    ModelPrices,
+    SessionAccounting,
+    TimedCheckpointer,
+    TokenUsage,
+    TurnAccounting,
+    TurnTimings,
+)
+from checkpointing import CachedCheckpointer, PostgresCheckpointer, WriteBehindCheckpointer
+from coalescing import EMPTY_STATE, Flight, TurnCoalescer, turn_key
+from config import (
+    CheckpointCacheValidation,
+    CheckpointDurability,
+    CheckpointerType,
+    CheckpointSerializerType,
+    RenderCadence,
+    Settings,
+    TurnPriority,
+)
+from diagnostics import SessionMemory, TurnBuffers
+from idle import IdlePolicy, IdleScheduler, is_pong
+from log_pipeline import log_context
+from multiplexing import MUX_SESSIONS, FairSender, MuxFrame
+from prompting import OPENAI_CACHE_KEY, USER_MEMORIES, build_agent
+from recording import ReplayChatModel, SessionRecorder
+from rendering import pace, render_cadence
+from scheduling import DeadlineExceeded, TurnScheduler, classify_turn
+from serialization import CheckpointSerializer
+from sharding import ShardedCheckpointer
+from shedding import LoadShedder, UpstreamUnavailable
+from sqlite_checkpointing import SqliteCheckpointer
+from tool_streaming import EagerTools, ToolCallAssembler, side_effect_free
+from tracing import Tracer
+from user_memory import UserMemoryStore, user_identity
+
+# Node of create_react_agent that calls the model
+AGENT_NODE = "agent"
+
+# Sends one frame to the client
+Send = Callable[[dict], Awaitable[None]]
+
+# Frames are encoded as ``send_json`` does, by one encoder: ``json.dumps`` with options
+# builds a new one for every call
+_encode_frame = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
+def frame_sender(websocket: WebSocket) -> Send:
+    """Sends frames to ``websocket`` as compact JSON text."""
+    send_text = websocket.send_text
+
+    async def send(frame: dict) -> None:
+        await send_text(_encode_frame(frame))
+
+    return send
 
 
 # WebSocket Message Types
 class MessageType(StrEnum):
     START = "start"
     TOOL_CALL = "tool_call"
+    TOOL_CALL_DELTA = "tool_call_delta"
     TOOL_RESULT = "tool_result"
     CONTENT_DELTA = "content_delta"
     CONTENT_COMPLETE = "content_complete"
     ERROR = "error"
     END = "end"
+    WARNING = "warning"
+    PING = "ping"
 
 
-# WebSocket API Models
+# WebSocket API Models. Frames sent per token (content and tool call deltas) are built
+# as plain dicts by ``_TurnStream``, with the same fields in the same order.
 class StartMessage(BaseModel):
     type: MessageType = MessageType.START
     timestamp: str = Field(
@@ -44,6 +108,14 @@ class ToolCallMessage(BaseModel):
     tool_call_id: str
 
 
+class ToolCallDeltaMessage(BaseModel):
+    type: MessageType = MessageType.TOOL_CALL_DELTA
+    tool_call_id: str
+    tool_name: str
+    # The next piece of the call's JSON arguments
+    args_delta: str
+
+
 class ToolResultMessage(BaseModel):
     type: MessageType = MessageType.TOOL_RESULT
     tool_call_id: str
@@ -54,7 +126,8 @@ class ToolResultMessage(BaseModel):
 class ContentDeltaMessage(BaseModel):
     type: MessageType = MessageType.CONTENT_DELTA
     delta: str
-    accumulated: str
+    # The text so far, in the token render cadence only (see ``rendering``)
+    accumulated: str | None = None
 
 
 class ContentCompleteMessage(BaseModel):
@@ -68,13 +141,27 @@ class ErrorMessage(BaseModel):
     code: str = "UNKNOWN_ERROR"
 
 
+class WarningMessage(BaseModel):
+    type: MessageType = MessageType.WARNING
+    message: str
+    code: str
+
+
+class PingMessage(BaseModel):
+    type: MessageType = MessageType.PING
+
+
 class EndMessage(BaseModel):
     type: MessageType = MessageType.END
     timestamp: str = Field(
         default_factory=lambda: datetime.now(UTC).isoformat().replace("+00:00", "Z")
     )
+    usage: TokenUsage | None = None
+    session_usage: TokenUsage | None = None
+    timings: TurnTimings | None = None
 
 
+@side_effect_free
 def get_transactions() -> dict[str, Any]:
     """Get financial transactions."""
     return {
@@ -93,145 +180,673 @@ def get_transactions() -> dict[str, Any]:
     }
 
 
-def get_checkpointer(config: Settings):
-    """Get checkpointer based on configuration."""
-    if config.checkpointer_type == CheckpointerType.POSTGRES:
-        checkpointer = PostgresSaver.from_conn_string(config.postgres_connection_string)
-        checkpointer.setup()
-        return checkpointer
-    return MemorySaver()
-
+def get_checkpointer(config: Settings) -> BaseCheckpointSaver:
+    """Get checkpointer based on configuration.
 
-def bootstrap_agent(config: Settings) -> CompiledStateGraph:
+    Postgres checkpointers are opened by the application lifespan, and sharded by thread
+    when several ``postgres_shards`` are configured. With a cache size, the latest
+    checkpoints of hot threads are cached in front of the store. With ``async``
+    durability, writes go through a write-behind queue that batches them across sessions.
+    """
+    serde = None
+    if config.checkpoint_serializer == CheckpointSerializerType.COMPACT:
+        serde = CheckpointSerializer(
+            config.checkpoint_compression, dedup_min_bytes=config.checkpoint_dedup_min_bytes
+        )
+    postgres = config.checkpointer_type == CheckpointerType.POSTGRES
+    cache = config.checkpoint_cache_size > 0
+    if postgres:
+        shards = [
+            PostgresCheckpointer(
+                dsn,
+                max_size=config.postgres_pool_size,
+                serde=serde,
+                notify_changes=cache
+                and config.checkpoint_cache_validation == CheckpointCacheValidation.NOTIFY,
+            )
+            for dsn in config.postgres_shard_dsns
+        ]
+        checkpointer = shards[0]
+        if len(shards) > 1:
+            checkpointer = ShardedCheckpointer(shards, migrate_from=config.postgres_shards_before)
+    elif config.checkpointer_type == CheckpointerType.SQLITE:
+        checkpointer = SqliteCheckpointer(
+            config.sqlite_path,
+            serde=serde,
+            busy_timeout=config.sqlite_busy_timeout,
+            batch_size=config.sqlite_batch_size,
+            full_sync=config.sqlite_full_sync,
+        )
+    else:
+        checkpointer = MemorySaver(serde=serde)
+    if cache:
+        # Only this process writes to a MemorySaver; SQLite has no change notifications
+        validation = None
+        if postgres:
+            validation = config.checkpoint_cache_validation
+        elif config.checkpointer_type == CheckpointerType.SQLITE:
+            validation = CheckpointCacheValidation.VERSION
+        checkpointer = CachedCheckpointer(
+            checkpointer, max_threads=config.checkpoint_cache_size, validation=validation
+        )
+    if config.checkpoint_durability == CheckpointDurability.ASYNC:
+        checkpointer = WriteBehindCheckpointer(
+            checkpointer,
+            max_queue=config.checkpoint_queue_size,
+            batch_size=config.checkpoint_batch_size,
+            flush_interval=config.checkpoint_flush_interval,
+        )
+    return checkpointer
+
+
+SYSTEM_PROMPT = "You are a helpful financial assistant."
+TOOLS = [get_transactions]
+
+
+def bootstrap_model(config: Settings) -> BaseChatModel:
+    """The chat model, or a replay of recorded sessions' model calls if configured."""
+    if config.model_replay_log:
+        patterns = [p.strip() for p in config.model_replay_log.split(",") if p.strip()]
+        return ReplayChatModel.from_logs(patterns, speed=config.model_replay_speed)
+    return init_chat_model("gpt-4o-mini", model_provider="openai", stream_usage=True)
+
+
+def bootstrap_agent(
+    config: Settings,
+    model: BaseChatModel | None = None,
+    eager_tools: EagerTools | None = None,
+    tools: Sequence[BaseTool | Callable] | None = None,
+) -> CompiledStateGraph:
     """Bootstrap and configure the LangGraph agent.
 
+    The graph is compiled once and shared by every session; the model is bound to a
+    stable prompt prefix so that providers can cache it (see ``prompting``).
+
     Args:
         config: Application settings
+        model: Chat model to use, by default ``bootstrap_model(config)``
+        eager_tools: Eager runs of side-effect-free tools, shared with the endpoint
+        tools: Tools to register, by default ``TOOLS``; ignored with ``eager_tools``,
+            which wraps them already
 
     Returns:
         Configured LangGraph agent
     """
-    model = init_chat_model("gpt-4o-mini", model_provider="openai")
-    checkpointer = get_checkpointer(config)
-
-    return create_react_agent(
-        model=model,
-        tools=[get_transactions],
-        prompt="You are a helpful financial assistant.",
-        checkpointer=checkpointer,
+    checkpointer = TimedCheckpointer(get_checkpointer(config))
+
+    return build_agent(
+        model or bootstrap_model(config),
+        eager_tools.tools if eager_tools is not None else tools or TOOLS,
+        SYSTEM_PROMPT,
+        checkpointer,
+        cache_key_param=OPENAI_CACHE_KEY if config.prompt_cache_key else None,
+        user_memories=config.user_memory,
     )
 
 
+class _TurnStream:
+    """One turn's stream: what it accumulates, and the frames each chunk produces.
+
+    Chunks are handled by their type, through ``_CHUNK_HANDLERS``, and add their
+    frames to ``frames``, one queue reused for every chunk.
+    """
+
+    __slots__ = ("buffers", "callbacks", "eager_tools", "frames", "thread_id", "tool_calls", "turn")
+
+    def __init__(
+        self,
+        turn: TurnAccounting,
+        thread_id: str,
+        callbacks: list,
+        eager_tools: EagerTools | None,
+    ) -> None:
+        self.turn = turn
+        self.thread_id = thread_id
+        self.callbacks = callbacks
+        self.eager_tools = eager_tools
+        # The answer so far and the tool name per call id, accounted to the session
+        self.buffers = TurnBuffers()
+        self.tool_calls = ToolCallAssembler()
+        self.frames: deque[dict] = deque()
+
+    def ai_chunk(self, chunk: AIMessageChunk) -> None:
+        self.turn.on_chunk(chunk)
+        if chunk.tool_call_chunks:
+            self._tool_call_chunks(chunk)
+        if content := chunk.content:
+            self.buffers.append(content)
+            # Paced per connection, which adds ``accumulated`` if it asked for it
+            self.frames.append({"type": MessageType.CONTENT_DELTA, "delta": content})
+
+    def _tool_call_chunks(self, chunk: AIMessageChunk) -> None:
+        # Handle tool calls, as their chunks arrive
+        for call_chunk in chunk.tool_call_chunks:
+            call, args = self.tool_calls.push(chunk.id, call_chunk)
+            if call.id is None or call.name is None:
+                continue
+            self.buffers.tool_names[call.id] = call.name
+            self.frames.append(
+                {
+                    "type": MessageType.TOOL_CALL_DELTA,
+                    "tool_call_id": call.id,
+                    "tool_name": call.name,
+                    "args_delta": call_chunk["args"] or "",
+                }
+            )
+            if args is None:
+                continue
+            if self.eager_tools is not None:
+                self.eager_tools.start(self.thread_id, call.id, call.name, args, self.callbacks)
+            self.frames.append(
+                ToolCallMessage(
+                    tool_name=call.name, tool_args=args, tool_call_id=call.id
+                ).model_dump()
+            )
+
+    def tool_message(self, message: ToolMessage) -> None:
+        # Calls whose arguments never parsed as complete go out before results
+        for call in self.tool_calls.unsent():
+            self.frames.append(
+                ToolCallMessage(
+                    tool_name=call.name, tool_args=call.parsed_args(), tool_call_id=call.id
+                ).model_dump()
+            )
+        tool_call_id = message.tool_call_id
+        tool_name = self.buffers.tool_names.get(tool_call_id, message.name)
+        try:
+            result = json.loads(message.content)
+        except json.JSONDecodeError:
+            result = message.content
+        self.frames.append(
+            ToolResultMessage(
+                tool_call_id=tool_call_id, tool_name=tool_name, result=result
+            ).model_dump()
+        )
+
+
+# Handler per type of streamed message; other types are skipped
+_CHUNK_HANDLERS: dict[type, Callable[[_TurnStream, Any], None] | None] = {
+    AIMessageChunk: _TurnStream.ai_chunk,
+    ToolMessage: _TurnStream.tool_message,
+}
+
+
+def _chunk_handler(kind: type) -> Callable[[_TurnStream, Any], None] | None:
+    try:
+        return _CHUNK_HANDLERS[kind]
+    except KeyError:
+        # A subclass: found once, then looked up directly
+        handler = next(
+            (h for base, h in list(_CHUNK_HANDLERS.items()) if h and issubclass(kind, base)), None
+        )
+        _CHUNK_HANDLERS[kind] = handler
+        return handler
+
+
+@dataclass
+class AgentSession:
+    """One conversation: its thread, usage so far and state fingerprint for coalescing."""
+
+    accounting: SessionAccounting
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    state: str = EMPTY_STATE
+
+    @property
+    def config(self) -> RunnableConfig:
+        return {"configurable": {"thread_id": self.id}}
+
+
 class AgentWebSocket:
     def __init__(
         self,
         agent: CompiledStateGraph,
         logger: Logger,
+        durability: CheckpointDurability = CheckpointDurability.SYNC,
+        prices: ModelPrices | None = None,
+        idle_policy: IdlePolicy | None = None,
+        idle_tick: float = 0.5,
+        coalesce: bool = False,
+        scheduler: TurnScheduler | None = None,
+        classify: Callable[[WebSocket, str], tuple[TurnPriority, str]] = classify_turn,
+        shedder: LoadShedder | None = None,
+        tracer: Tracer | None = None,
+        recorder: SessionRecorder | None = None,
+        render_cadence: RenderCadence = RenderCadence.TOKEN,
+        render_max_delay: float = 0.25,
+        render_max_chars: int = 400,
+        mux_max_sessions: int = 100,
+        mux_buffer: int = 64,
+        eager_tools: EagerTools | None = None,
+        session_memory: SessionMemory | None = None,
+        user_memory: UserMemoryStore | None = None,
     ):
         self.agent = agent
         self.logger = logger
+        self.durability = durability
+        self.prices = prices or ModelPrices()
+        self.idle = IdleScheduler(
+            idle_policy or IdlePolicy(),
+            timeout_frame=lambda: ErrorMessage(
+                message="Connection timed out due to user inactivity.",
+                code="TIMEOUT",
+            ).model_dump(),
+            warning_frame=lambda remaining: WarningMessage(
+                message=f"Connection will close in {remaining:.0f}s due to user inactivity.",
+                code="IDLE_WARNING",
+            ).model_dump(),
+            ping_frame=lambda: PingMessage().model_dump(),
+            tick=idle_tick,
+        )
+        self.coalescer = TurnCoalescer() if coalesce else None
+        self.scheduler = scheduler or TurnScheduler()
+        # Priority class and tenant of a turn, from its connection and message
+        self.classify = classify
+        # Watches model calls to adapt the scheduler's limit and reject turns early
+        self.shedder = shedder
+        self.callbacks = [shedder] if shedder is not None else []
+        # Records sampled turns as traces
+        self.tracer = tracer
+        # Records every turn for offline replay
+        self.recorder = recorder
+        # Content delta cadence for clients that do not ask for one
+        self.render_cadence = render_cadence
+        self.render_max_delay = render_max_delay
+        self.render_max_chars = render_max_chars
+        # Sessions per multiplexed connection, and frames each may queue for the socket
+        self.mux_max_sessions = mux_max_sessions
+        self.mux_buffer = mux_buffer
+        # Starts side-effect-free tools as soon as their arguments are streamed
+        self.eager_tools = eager_tools
+        # Live sessions and what they hold, for memory metrics
+        self.session_memory = session_memory
+        # What users said about themselves in earlier sessions, recalled into prompts
+        self.user_memory = user_memory
+
+    @staticmethod
+    async def _send(send: Send, frame: dict, observers: list) -> None:
+        if not observers:
+            await send(frame)
+            return
+        started = time.perf_counter()
+        await send(frame)
+        seconds = time.perf_counter() - started
+        for observer in observers:
+            observer.sent(frame, seconds)
+
+    @staticmethod
+    def _finish_observers(
+        observers: list, turn: TurnAccounting, status: str, error: BaseException | None
+    ) -> None:
+        usage = turn.token_usage()
+        for observer in observers:
+            observer.finish(status, error, usage)
+
+    @staticmethod
+    def _queued(turn: TurnAccounting, observers: list, waited: float) -> None:
+        turn.queue_seconds = waited
+        for observer in observers:
+            observer.queued(waited)
+
+    def _paced(self, websocket: WebSocket, frames: AsyncIterator[dict]) -> AsyncIterator[dict]:
+        return pace(
+            frames,
+            render_cadence(websocket, self.render_cadence),
+            max_delay=self.render_max_delay,
+            max_chars=self.render_max_chars,
+        )
+
+    async def _turn_frames(
+        self,
+        user_msg: str,
+        config: RunnableConfig,
+        turn: TurnAccounting,
+        observers: list = (),
+        memories: Sequence[str] = (),
+    ) -> AsyncIterator[dict]:
+        """Frames streamed to the client for one turn, between START and END.
+
+        Iterate it while holding a scheduler slot. ``memories`` recalled about the user
+        are added to the prompt.
+        """
+        thread_id = config["configurable"]["thread_id"]
+        if memories:
+            config = {**config, "configurable": {**config["configurable"], USER_MEMORIES: memories}}
+        stream = _TurnStream(turn, thread_id, [turn, *self.callbacks, *observers], self.eager_tools)
+        frames = stream.frames
+        if self.session_memory is not None:
+            self.session_memory.turn_started(thread_id, stream.buffers)
+
+        try:
+            async for message_chunk, _metadata in self.agent.astream(
+                {"messages": [{"role": "user", "content": user_msg}]},
+                stream_mode="messages",
+                config={**config, "callbacks": stream.callbacks},
+                durability=self.durability,
+            ):
+                if (handler := _chunk_handler(type(message_chunk))) is None:
+                    continue
+                handler(stream, message_chunk)
+                while frames:
+                    yield frames.popleft()
+        finally:
+            if self.eager_tools is not None:
+                self.eager_tools.discard(thread_id)
+            if self.session_memory is not None:
+                self.session_memory.turn_ended(thread_id)
+
+        # Send CONTENT_COMPLETE message
+        if content := stream.buffers.content:
+            yield ContentCompleteMessage(content=content).model_dump()
+
+    async def _coalesced_turn(
+        self,
+        websocket: WebSocket,
+        send: Send,
+        user_msg: str,
+        session: AgentSession,
+        turn: TurnAccounting,
+        observers: list,
+        priority: TurnPriority,
+        tenant: str,
+        memories: Sequence[str],
+    ) -> str:
+        """Run the turn as, or alongside, an identical one; returns the new state fingerprint.
+
+        The leader's turn makes the model and tool calls, on its own thread and with its
+        own accounting. Followers get the same frames, then the messages the turn added
+        are appended to their threads as if they had made the calls themselves.
+        """
+
+        async def produce(flight: Flight) -> list[BaseMessage]:
+            async with self.scheduler.slot(priority, tenant) as waited:
+                self._queued(turn, observers, waited)
+                frames = self._turn_frames(user_msg, session.config, turn, observers, memories)
+                async for frame in frames:
+                    flight.publish(frame)
+            messages = (await self.agent.aget_state(session.config)).values["messages"]
+            start = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage))
+            return messages[start:]
+
+        flight, leader = self.coalescer.subscribe(
+            turn_key(session.state, user_msg, memories), produce
+        )
+        try:
+            async for frame in self._paced(websocket, flight):
+                await self._send(send, frame, observers)
+            if not leader:
+                await self.agent.aupdate_state(
+                    session.config, {"messages": flight.result}, as_node=AGENT_NODE
+                )
+        finally:
+            # A follower that disconnects leaves the others streaming
+            self.coalescer.unsubscribe(flight)
+        return flight.id
+
+    async def _turn(
+        self, websocket: WebSocket, send: Send, session: AgentSession, user_msg: str
+    ) -> None:
+        """Run one turn of ``session``, sending its frames from START to END or ERROR."""
+        turn = TurnAccounting(self.prices).start()
+        trace = recording = None
+        if self.tracer is not None:
+            trace = self.tracer.start_turn(**{"session.id": session.id})
+        if self.recorder is not None:
+            recording = self.recorder.start_turn(session.id, session.accounting.turns, user_msg)
+        # Trace and recording of the turn; they see its callbacks and frames
+        observers = [o for o in (trace, recording) if o is not None]
+        status, error = "ok", None
+        user_id = None
+        if self.user_memory is not None:
+            user_id = user_identity(websocket, self.user_memory.secret)
+
+        try:
+            # Send START message
+            await self._send(send, StartMessage().model_dump(), observers)
+
+            try:
+                if self.shedder is not None:
+                    self.shedder.admit()
+                priority, tenant = self.classify(websocket, user_msg)
+                memories = await self._recall(user_id, user_msg)
+                if trace is not None:
+                    trace.root.attributes.update(
+                        {
+                            "turn.priority": priority,
+                            "turn.tenant": tenant,
+                            "turn.memories": len(memories),
+                        }
+                    )
+                if self.coalescer is None:
+                    async with self.scheduler.slot(priority, tenant) as waited:
+                        self._queued(turn, observers, waited)
+                        frames = self._turn_frames(
+                            user_msg, session.config, turn, observers, memories
+                        )
+                        async for frame in self._paced(websocket, frames):
+                            await self._send(send, frame, observers)
+                else:
+                    session.state = await self._coalesced_turn(
+                        websocket,
+                        send,
+                        user_msg,
+                        session,
+                        turn,
+                        observers,
+                        priority,
+                        tenant,
+                        memories,
+                    )
+
+                turn.finish("ok")
+                session.accounting.add(turn)
+
+                # Send END message
+                await self._send(
+                    send,
+                    EndMessage(
+                        usage=turn.token_usage(),
+                        session_usage=session.accounting.token_usage(),
+                        timings=turn.timings(),
+                    ).model_dump(),
+                    observers,
+                )
+
+            except UpstreamUnavailable as e:
+                status = "shed"
+                turn.finish(status)
+                session.accounting.add(turn)
+                self.logger.warning("Turn rejected: %s", e)
+                await self._send(
+                    send,
+                    ErrorMessage(
+                        message="The assistant is temporarily unavailable, "
+                        "please try again shortly.",
+                        code="UPSTREAM_UNAVAILABLE",
+                    ).model_dump(),
+                    observers,
+                )
+
+            except DeadlineExceeded as e:
+                status = "expired"
+                turn.finish(status)
+                session.accounting.add(turn)
+                self.logger.warning("Turn not scheduled in time: %s", e)
+                await self._send(
+                    send,
+                    ErrorMessage(
+                        message="The server is busy, please try again later.",
+                        code="DEADLINE_EXCEEDED",
+                    ).model_dump(),
+                    observers,
+                )
+
+            except Exception as e:
+                status, error = "error", e
+                turn.finish(status)
+                session.accounting.add(turn)
+                # The thread may now hold a partial turn no other session shares
+                session.state = uuid.uuid4().hex
+                self.logger.error("Error processing agent events: %s", e)
+                await self._send(
+                    send,
+                    ErrorMessage(
+                        message="Error processing message, please try again later.",
+                        code="PROCESSING_ERROR",
+                    ).model_dump(),
+                    observers,
+                )
+
+        except BaseException:
+            # The client went away mid-turn
+            if turn.status is None:
+                turn.finish("disconnected")
+            self._finish_observers(observers, turn, "disconnected", None)
+            raise
+        self._finish_observers(observers, turn, status, error)
+        if user_id is not None and status == "ok":
+            await self._remember(user_id, user_msg)
+
+    async def _recall(self, user_id: str | None, user_msg: str) -> tuple[str, ...]:
+        if user_id is None:
+            return ()
+        try:
+            return await self.user_memory.recall(user_id, user_msg)
+        except OSError as e:
+            # The turn goes on without them
+            self.logger.warning("Could not recall user memories: %s", e)
+            return ()
+
+    async def _remember(self, user_id: str, user_msg: str) -> None:
+        try:
+            await self.user_memory.remember(user_id, user_msg)
+        except OSError as e:
+            self.logger.warning("Could not remember user facts: %s", e)
 
     async def agent_websocket_endpoint(self, websocket: WebSocket):
         await websocket.accept()
 
-        session_id = str(uuid.uuid4())
-        config = {"configurable": {"thread_id": session_id}}
+        session = AgentSession(SessionAccounting(self.prices))
+        send = frame_sender(websocket)
+        conn = self.idle.register(websocket)
+        if self.session_memory is not None:
+            self.session_memory.open(session.id, websocket)
 
         try:
             while True:
-                try:
-                    user_msg = await asyncio.wait_for(websocket.receive_text(), timeout=15.0)
-                except TimeoutError:
-                    await websocket.send_json(
-                        ErrorMessage(
-                            message="Connection timed out due to user inactivity.",
-                            code="TIMEOUT",
-                        ).model_dump()
-                    )
-                    self.logger.info("Closing connection due to user inactivity")
-                    await websocket.close(code=1000)
+                user_msg = await websocket.receive_text()
+                if conn.closed:
+                    # Timed out while this message was in flight
                     break
+                self.idle.received(conn)
+                if is_pong(user_msg):
+                    continue
 
-                # Send START message
-                await websocket.send_json(StartMessage().model_dump())
+                self.idle.begin_turn(conn)
+                with log_context(session_id=session.id, turn=session.accounting.turns):
+                    await self._turn(websocket, send, session, user_msg)
+                self.idle.end_turn(conn)
 
-                try:
-                    accumulated_content = ""
-                    tool_call_map = {}  # Map tool_call_id to tool name
-
-                    async for message_chunk, _metadata in self.agent.astream(
-                        {"messages": [{"role": "user", "content": user_msg}]},
-                        stream_mode="messages",
-                        config=config,
-                    ):
-                        # Handle tool calls
-                        if isinstance(message_chunk, AIMessageChunk):
-                            if hasattr(message_chunk, "tool_calls") and message_chunk.tool_calls:
-                                for tool_call in message_chunk.tool_calls:
-                                    tool_call_id = tool_call.get("id")
-                                    tool_name = tool_call.get("name")
-                                    tool_args = tool_call.get("args", {})
-
-                                    if tool_call_id and tool_name:
-                                        # Store tool call mapping
-                                        tool_call_map[tool_call_id] = tool_name
-
-                                        # Send TOOL_CALL message
-                                        await websocket.send_json(
-                                            ToolCallMessage(
-                                                tool_name=tool_name,
-                                                tool_args=tool_args,
-                                                tool_call_id=tool_call_id,
-                                            ).model_dump()
-                                        )
-
-                            # Handle content streaming
-                            if message_chunk.content:
-                                accumulated_content += message_chunk.content
-                                await websocket.send_json(
-                                    ContentDeltaMessage(
-                                        delta=message_chunk.content,
-                                        accumulated=accumulated_content,
-                                    ).model_dump()
-                                )
-
-                        # Handle tool results
-                        elif isinstance(message_chunk, ToolMessage):
-                            tool_call_id = message_chunk.tool_call_id
-                            tool_name = tool_call_map.get(tool_call_id, message_chunk.name)
-
-                            try:
-                                result = json.loads(message_chunk.content)
-                            except json.JSONDecodeError:
-                                result = message_chunk.content
-
-                            await websocket.send_json(
-                                ToolResultMessage(
-                                    tool_call_id=tool_call_id,
-                                    tool_name=tool_name,
-                                    result=result,
-                                ).model_dump()
-                            )
-
-                    # Send CONTENT_COMPLETE message
-                    if accumulated_content:
-                        await websocket.send_json(
-                            ContentCompleteMessage(content=accumulated_content).model_dump()
-                        )
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            self.logger.error("Agent encountered error: %s", e)
+        finally:
+            self.idle.unregister(conn)
+            if self.session_memory is not None:
+                self.session_memory.close(session.id)
+
+    async def multiplexed_endpoint(self, websocket: WebSocket):
+        """Many sessions over one socket, each frame tagged with its session (see
+        ``multiplexing``)."""
+        await websocket.accept()
 
-                    # Send END message
-                    await websocket.send_json(EndMessage().model_dump())
+        conn = self.idle.register(websocket)
+        sender = FairSender(frame_sender(websocket), buffer=self.mux_buffer)
+        writer = asyncio.create_task(sender.run())
+        # Per client session id: its inbox of messages and the task running its turns
+        sessions: dict[str, tuple[asyncio.Queue[str], asyncio.Task]] = {}
+        busy = 0
+
+        async def run_session(session_id: str, inbox: asyncio.Queue[str]) -> None:
+            nonlocal busy
+            session = AgentSession(SessionAccounting(self.prices))
+            send = functools.partial(sender.put, session_id)
+            if self.session_memory is not None:
+                self.session_memory.open(session.id, websocket)
+            try:
+                while True:
+                    user_msg = await inbox.get()
+                    # The connection is busy while any of its sessions is in a turn
+                    if not busy:
+                        self.idle.begin_turn(conn)
+                    busy += 1
+                    try:
+                        with log_context(session_id=session.id, turn=session.accounting.turns):
+                            await self._turn(websocket, send, session, user_msg)
+                    finally:
+                        busy -= 1
+                        if not busy and not conn.closed:
+                            self.idle.end_turn(conn)
+            finally:
+                if self.session_memory is not None:
+                    self.session_memory.close(session.id)
+
+        def close_session(session_id: str) -> None:
+            _, task = sessions.pop(session_id)
+            task.cancel()
+            sender.discard(session_id)
+            MUX_SESSIONS.dec()
 
-                except Exception as e:
-                    self.logger.error(f"Error processing agent events: {e}")
-                    await websocket.send_json(
+        try:
+            while True:
+                text = await websocket.receive_text()
+                if conn.closed:
+                    # Timed out while this message was in flight
+                    break
+                self.idle.received(conn)
+                if is_pong(text):
+                    continue
+
+                try:
+                    frame = MuxFrame.model_validate_json(text)
+                except ValidationError:
+                    await sender.put(
+                        None,
                         ErrorMessage(
-                            message="Error processing message, please try again later.",
-                            code="PROCESSING_ERROR",
-                        ).model_dump()
+                            message='Expected {"session_id": ..., "message": ...}.',
+                            code="INVALID_FRAME",
+                        ).model_dump(),
                     )
+                    continue
+
+                if frame.type == "close":
+                    if frame.session_id in sessions:
+                        close_session(frame.session_id)
+                    continue
+                if frame.session_id not in sessions:
+                    if len(sessions) >= self.mux_max_sessions:
+                        await sender.put(
+                            frame.session_id,
+                            ErrorMessage(
+                                message="Too many sessions on this connection.",
+                                code="TOO_MANY_SESSIONS",
+                            ).model_dump(),
+                        )
+                        continue
+                    inbox = asyncio.Queue()
+                    task = asyncio.create_task(run_session(frame.session_id, inbox))
+                    sessions[frame.session_id] = (inbox, task)
+                    MUX_SESSIONS.inc()
+                sessions[frame.session_id][0].put_nowait(frame.message)
 
         except WebSocketDisconnect:
             pass
         except Exception as e:
-            self.logger.error(f"Agent encountered error: {e}")
+            self.logger.error("Agent encountered error: %s", e)
+        finally:
+            self.idle.unregister(conn)
+            tasks = [task for _, task in sessions.values()]
+            for session_id in list(sessions):
+                close_session(session_id)
+            writer.cancel()
+            await asyncio.gather(*tasks, writer, return_exceptions=True)
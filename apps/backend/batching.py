@@ -0,0 +1,411 @@
+"""Many independent questions in one request, for back-office jobs.
+
+``POST /batch`` takes a JSON body ``{"requests": [{"id": ..., "message": ...}, ...]}``
+and streams one JSON line per request as it completes, tagged with its ``id``, in
+completion order. Each request is a one-turn conversation of its own:
+
+- ``mode: "agent"`` (the default) runs the agent graph in-process. At most
+  ``concurrency`` requests of a batch run at once, and each one takes a ``batch``
+  class slot from the turn scheduler, so interactive turns still go first and one
+  batch cannot take every slot of a worker. The graph is invoked rather than streamed,
+  so there are no per-token frames, one non-streaming model request per call, and one
+  checkpoint write per request (``exit`` durability), whose thread is deleted once
+  the request completes.
+- ``mode: "provider"`` sends the requests through the provider's batch API (OpenAI's
+  ``/v1/batches``) at its batch prices. Tool calls are run locally between rounds of
+  batches, up to ``max_rounds`` model calls per request. Results arrive when the
+  provider finishes a round, which can take up to its completion window; the response
+  stays open until then.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections.abc import AsyncIterator, Callable
+from enum import StrEnum
+from typing import Any
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages.ai import UsageMetadata, add_usage
+from langchain_core.tools import BaseTool, tool
+from langgraph.graph.state import CompiledStateGraph
+from pydantic import BaseModel, Field, ValidationError
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from accounting import ModelPrices, TokenUsage, TurnAccounting, TurnTimings, to_token_usage
+from config import CheckpointDurability, Settings, TurnPriority
+from metrics import Counter
+from prompting import PromptPrefix
+from scheduling import DEFAULT_TENANT, DeadlineExceeded, TurnScheduler
+from shedding import LoadShedder, UpstreamUnavailable
+
+logger = logging.getLogger("uvicorn")
+
+BATCH_REQUESTS = Counter(
+    "agent_batch_requests_total", "Batch requests completed, by mode and status", ["mode", "status"]
+)
+
+# Share of the normal price charged for provider batch requests
+PROVIDER_BATCH_DISCOUNT = 0.5
+_FINISHED = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchMode(StrEnum):
+    AGENT = "agent"
+    PROVIDER = "provider"
+
+
+class BatchItem(BaseModel):
+    id: str = Field(min_length=1)
+    message: str = Field(min_length=1)
+
+
+class BatchRequest(BaseModel):
+    requests: list[BatchItem] = Field(min_length=1)
+    mode: BatchMode = BatchMode.AGENT
+
+
+class BatchResult(BaseModel):
+    id: str
+    # ok, error, shed or expired
+    status: str
+    content: str | None = None
+    tool_calls: list[dict[str, Any]] = Field(default_factory=list)
+    usage: TokenUsage | None = None
+    timings: TurnTimings | None = None
+    error: str | None = None
+    code: str | None = None
+
+
+def _error(item_id: str, code: str, message: str, **fields: Any) -> BatchResult:
+    status = {"UPSTREAM_UNAVAILABLE": "shed", "DEADLINE_EXCEEDED": "expired"}.get(code, "error")
+    return BatchResult(id=item_id, status=status, code=code, error=message, **fields)
+
+
+class ProviderBatch:
+    """Runs one-turn conversations through an OpenAI-compatible batch API.
+
+    ``client`` is an ``openai.AsyncOpenAI``. Requests carry the prompt prefix's system
+    message and tool schemas, and share one prompt cache key.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model_name: str,
+        prefix: PromptPrefix,
+        *,
+        prices: ModelPrices | None = None,
+        poll_interval: float = 30.0,
+        completion_window: str = "24h",
+        max_rounds: int = 4,
+    ) -> None:
+        self.client = client
+        self.model_name = model_name
+        self.prefix = prefix
+        prices = prices or ModelPrices()
+        self.prices = ModelPrices(
+            input=prices.input * PROVIDER_BATCH_DISCOUNT,
+            cached_input=prices.cached_input * PROVIDER_BATCH_DISCOUNT,
+            output=prices.output * PROVIDER_BATCH_DISCOUNT,
+        )
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.max_rounds = max_rounds
+        self.tools: dict[str, BaseTool] = {
+            t.name: t for t in (t if isinstance(t, BaseTool) else tool(t) for t in prefix.tools)
+        }
+
+    def request_line(self, item_id: str, messages: list[dict[str, Any]]) -> dict[str, Any]:
+        body = {
+            "model": self.model_name,
+            "messages": messages,
+            "prompt_cache_key": f"{self.prefix.fingerprint}-batch",
+        }
+        if self.prefix.schemas:
+            body["tools"] = self.prefix.schemas
+        return {"custom_id": item_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+    async def run(self, items: list[BatchItem], tenant: str) -> AsyncIterator[BatchResult]:
+        system = {"role": "system", "content": self.prefix.system_message.content}
+        conversations = {
+            item.id: [system, {"role": "user", "content": item.message}] for item in items
+        }
+        usage: dict[str, UsageMetadata | None] = dict.fromkeys(conversations)
+        tool_calls: dict[str, list[dict[str, Any]]] = {item.id: [] for item in items}
+        started = time.perf_counter()
+
+        for _ in range(self.max_rounds):
+            lines = [self.request_line(i, messages) for i, messages in conversations.items()]
+            rows = await self._submit(lines)
+            pending = {}
+            for item_id, messages in conversations.items():
+                row = rows.get(item_id)
+                response = (row or {}).get("response") or {}
+                if not row or row.get("error") or response.get("status_code") != 200:
+                    error = (row or {}).get("error") or response.get("body", {}).get("error") or {}
+                    message = error.get("message", "The provider did not complete the request.")
+                    yield _error(item_id, "PROVIDER_ERROR", message)
+                    continue
+                body = response["body"]
+                usage[item_id] = add_usage(usage[item_id], _usage(body.get("usage") or {}))
+                message = body["choices"][0]["message"]
+                if not message.get("tool_calls"):
+                    yield BatchResult(
+                        id=item_id,
+                        status="ok",
+                        content=message.get("content") or "",
+                        tool_calls=tool_calls[item_id],
+                        usage=to_token_usage(usage[item_id], self.prices),
+                        timings=TurnTimings(total_ms=(time.perf_counter() - started) * 1000),
+                    )
+                    continue
+                try:
+                    calls = [
+                        (call["id"], call["function"]["name"], _arguments(call))
+                        for call in message["tool_calls"]
+                    ]
+                except ValueError:
+                    yield _error(
+                        item_id,
+                        "INVALID_TOOL_CALL",
+                        "The model called a tool with invalid arguments.",
+                    )
+                    continue
+                messages.append(
+                    {
+                        "role": "assistant",
+                        "content": message.get("content"),
+                        "tool_calls": message["tool_calls"],
+                    }
+                )
+                for call_id, name, args in calls:
+                    tool_calls[item_id].append({"id": call_id, "name": name, "args": args})
+                    messages.append(
+                        {
+                            "role": "tool",
+                            "tool_call_id": call_id,
+                            "content": await self._call(name, args),
+                        }
+                    )
+                pending[item_id] = messages
+            conversations = pending
+            if not conversations:
+                return
+        for item_id in conversations:
+            yield _error(
+                item_id, "TOO_MANY_TOOL_ROUNDS", "The request needed too many model calls."
+            )
+
+    async def _call(self, name: str, args: dict[str, Any]) -> str:
+        if (tool_ := self.tools.get(name)) is None:
+            return f"Error: {name} is not a valid tool."
+        try:
+            output = await tool_.ainvoke(args)
+        except Exception as e:
+            return f"Error: {e}"
+        return output if isinstance(output, str) else json.dumps(output)
+
+    async def _submit(self, lines: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+        """Output rows of one provider batch, by ``custom_id``; cancels it if abandoned."""
+        payload = "".join(json.dumps(line) + "\n" for line in lines).encode()
+        upload = await self.client.files.create(file=("batch.jsonl", payload), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        try:
+            while batch.status not in _FINISHED:
+                await asyncio.sleep(self.poll_interval)
+                batch = await self.client.batches.retrieve(batch.id)
+        except BaseException:
+            await asyncio.shield(self.client.batches.cancel(batch.id))
+            raise
+        rows = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await self.client.files.content(file_id)
+                for line in content.text.splitlines():
+                    if line.strip():
+                        row = json.loads(line)
+                        rows[row["custom_id"]] = row
+        return rows
+
+
+def _arguments(call: dict[str, Any]) -> dict[str, Any]:
+    """A provider tool call's arguments; ``ValueError`` unless they are a JSON object."""
+    args = json.loads(call["function"]["arguments"] or "{}")
+    if not isinstance(args, dict):
+        raise ValueError("Tool call arguments must be a JSON object")
+    return args
+
+
+def _usage(usage: dict[str, Any]) -> UsageMetadata:
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    return {
+        "input_tokens": usage.get("prompt_tokens", 0),
+        "output_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+        "input_token_details": {"cache_read": cached},
+    }
+
+
+class BatchRunner:
+    """Serves ``POST /batch``: runs a batch's requests and streams their results."""
+
+    def __init__(
+        self,
+        agent: CompiledStateGraph,
+        scheduler: TurnScheduler | None = None,
+        *,
+        prices: ModelPrices | None = None,
+        shedder: LoadShedder | None = None,
+        concurrency: int = 16,
+        max_items: int = 10_000,
+        provider: ProviderBatch | None = None,
+    ) -> None:
+        self.agent = agent
+        self.scheduler = scheduler or TurnScheduler()
+        self.prices = prices or ModelPrices()
+        self.shedder = shedder
+        self.callbacks = [shedder] if shedder is not None else []
+        self.concurrency = concurrency
+        self.max_items = max_items
+        self.provider = provider
+
+    async def run(self, items: list[BatchItem], tenant: str) -> AsyncIterator[BatchResult]:
+        """Results of ``items`` through the agent, as they complete."""
+        results: asyncio.Queue[BatchResult] = asyncio.Queue()
+        pending = iter(items)
+
+        async def worker() -> None:
+            # Workers share the iterator, so at most ``concurrency`` requests run at once
+            for item in pending:
+                await results.put(await self.run_one(item, tenant))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(items)))]
+        try:
+            for _ in items:
+                yield await results.get()
+        finally:
+            # The client went away: stop the batch's remaining requests
+            for task in workers:
+                task.cancel()
+
+    async def run_one(self, item: BatchItem, tenant: str) -> BatchResult:
+        turn = TurnAccounting(self.prices).start()
+        thread_id = f"batch-{uuid.uuid4()}"
+        config = {
+            "configurable": {"thread_id": thread_id},
+            "callbacks": [turn, *self.callbacks],
+        }
+        try:
+            if self.shedder is not None:
+                self.shedder.admit()
+            async with self.scheduler.slot(TurnPriority.BATCH, tenant) as waited:
+                turn.queue_seconds = waited
+                state = await self.agent.ainvoke(
+                    {"messages": [{"role": "user", "content": item.message}]},
+                    config,
+                    durability=CheckpointDurability.EXIT,
+                )
+            messages = state["messages"]
+            start = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage))
+            tool_calls = []
+            for message in messages[start + 1 :]:
+                if isinstance(message, AIMessage):
+                    turn.usage = add_usage(turn.usage, message.usage_metadata)
+                    tool_calls += [
+                        {"id": c["id"], "name": c["name"], "args": c["args"]}
+                        for c in message.tool_calls
+                    ]
+            result = BatchResult(
+                id=item.id, status="ok", content=str(messages[-1].content), tool_calls=tool_calls
+            )
+        except UpstreamUnavailable:
+            result = _error(
+                item.id, "UPSTREAM_UNAVAILABLE", "The assistant is temporarily unavailable."
+            )
+        except DeadlineExceeded:
+            result = _error(item.id, "DEADLINE_EXCEEDED", "The server is busy.")
+        except Exception as e:
+            logger.error("Error processing batch request %s: %s", item.id, e)
+            result = _error(item.id, "PROCESSING_ERROR", "Error processing message.")
+        finally:
+            # Nobody resumes a batch request's thread
+            await self._delete_thread(thread_id)
+        turn.finish(result.status)
+        result.usage = turn.token_usage()
+        result.timings = turn.timings()
+        return result
+
+    async def _delete_thread(self, thread_id: str) -> None:
+        checkpointer = self.agent.checkpointer
+        if not checkpointer:
+            return
+        try:
+            await asyncio.shield(checkpointer.adelete_thread(thread_id))
+        except Exception as e:
+            logger.warning("Failed to delete batch thread %s: %s", thread_id, e)
+
+    async def batch_endpoint(self, request: Request) -> Response:
+        try:
+            batch = BatchRequest.model_validate_json(await request.body())
+        except ValidationError as e:
+            return JSONResponse(
+                {
+                    "code": "INVALID_REQUEST",
+                    "detail": e.errors(include_url=False, include_input=False),
+                },
+                status_code=422,
+            )
+        if len(batch.requests) > self.max_items:
+            return JSONResponse(
+                {"code": "TOO_MANY_REQUESTS", "detail": f"At most {self.max_items} per batch."},
+                status_code=413,
+            )
+        if len({item.id for item in batch.requests}) < len(batch.requests):
+            return JSONResponse(
+                {"code": "INVALID_REQUEST", "detail": "Request ids must be unique."},
+                status_code=422,
+            )
+        if batch.mode == BatchMode.PROVIDER and self.provider is None:
+            return JSONResponse(
+                {"code": "INVALID_REQUEST", "detail": "Provider batch mode is not available."},
+                status_code=422,
+            )
+        tenant = request.query_params.get("tenant") or request.headers.get(
+            "x-tenant-id", DEFAULT_TENANT
+        )
+        run: Callable[..., AsyncIterator[BatchResult]] = (
+            self.provider.run if batch.mode == BatchMode.PROVIDER else self.run
+        )
+
+        async def lines() -> AsyncIterator[str]:
+            async for result in run(batch.requests, tenant):
+                BATCH_REQUESTS.inc(mode=batch.mode, status=result.status)
+                yield result.model_dump_json(exclude_none=True) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def provider_batch_from_settings(
+    config: Settings, model: Any, prefix: PromptPrefix, prices: ModelPrices | None = None
+) -> ProviderBatch | None:
+    """Provider batch mode for ``model``, if enabled and the model has an OpenAI client."""
+    client = getattr(model, "root_async_client", None)
+    if not config.batch_provider_mode or client is None:
+        return None
+    return ProviderBatch(
+        client,
+        model.model_name,
+        prefix,
+        prices=prices,
+        poll_interval=config.batch_provider_poll_interval,
+        completion_window=config.batch_provider_completion_window,
+        max_rounds=config.batch_provider_max_rounds,
+    )
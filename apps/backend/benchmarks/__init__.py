@@ -0,0 +1,6 @@
+"""Offline benchmarks; run with ``python -m benchmarks.<name>`` from apps/backend."""
+
+import os
+
+# Benchmarks run against the fake model, but Settings still requires an API key.
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
@@ -0,0 +1,129 @@
+"""Throughput of many independent questions: interactive websocket turns vs ``POST /batch``.
+
+Serves the agent endpoints with the fake model under uvicorn and answers
+``--questions`` questions, a third of them tool-calling, three ways:
+
+- ``ws x1``: one socket, one question at a time, as back-office jobs do today;
+- ``ws xN``: ``--parallel`` sockets, each taking the next question when it is done;
+- ``batch``: one ``POST /batch`` with every question, ``--parallel`` at a time.
+
+Each question is a fresh session. The fake model takes ``--first-token-delay`` plus
+``--token-delay`` per token, streamed or not.
+
+    python -m benchmarks.batch_throughput --questions 200 --parallel 16
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+import httpx
+from langgraph.checkpoint.memory import MemorySaver
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from websockets.asyncio.client import connect
+
+from agent import SYSTEM_PROMPT, TOOLS, AgentWebSocket
+from batching import BatchRunner
+from benchmarks.common import serve
+from fake_model import FakeStreamingChatModel
+from prompting import build_agent
+
+QUESTIONS = ["Tell me about budgeting", "Show my transactions", "How can I save more?"]
+
+
+def create_app() -> Starlette:
+    """Websocket and batch endpoints serving the fake model, for ``uvicorn --factory``."""
+    model = FakeStreamingChatModel(
+        token_delay=float(os.environ.get("BENCH_TOKEN_DELAY", 0)),
+        first_token_delay=float(os.environ.get("BENCH_FIRST_TOKEN_DELAY", 0)),
+    )
+    agent = build_agent(model, TOOLS, SYSTEM_PROMPT, MemorySaver())
+    aws = AgentWebSocket(agent, logging.getLogger("uvicorn"))
+    batches = BatchRunner(agent, concurrency=int(os.environ.get("BENCH_PARALLEL", 16)))
+
+    async def health(_) -> JSONResponse:
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/batch", batches.batch_endpoint, methods=["POST"]),
+            WebSocketRoute("/ws/agent", aws.agent_websocket_endpoint),
+        ]
+    )
+
+
+async def ws_worker(url: str, questions: list[str]) -> int:
+    answered = 0
+    while questions:
+        question = questions.pop()
+        # A fresh session per question, as the batch endpoint gives each request
+        async with connect(url, ping_interval=None, max_queue=None) as websocket:
+            await websocket.send(question)
+            async for frame in websocket:
+                if frame.startswith('{"type":"end"'):
+                    answered += 1
+                    break
+                if frame.startswith('{"type":"error"'):
+                    break
+    return answered
+
+
+async def run_ws(port: int, questions: list[str], sockets: int) -> int:
+    """Questions answered over ``sockets`` sockets in parallel."""
+    url = f"ws://127.0.0.1:{port}/ws/agent"
+    pending = list(questions)
+    return sum(await asyncio.gather(*(ws_worker(url, pending) for _ in range(sockets))))
+
+
+async def run_batch(port: int, questions: list[str]) -> int:
+    """Questions answered in one batch."""
+    body = {"requests": [{"id": str(n), "message": q} for n, q in enumerate(questions)]}
+    answered = 0
+    url = f"http://127.0.0.1:{port}/batch"
+    async with (
+        httpx.AsyncClient(timeout=None) as client,
+        client.stream("POST", url, json=body) as response,
+    ):
+        async for line in response.aiter_lines():
+            answered += bool(line) and json.loads(line)["status"] == "ok"
+    return answered
+
+
+async def main(args: argparse.Namespace) -> None:
+    questions = [QUESTIONS[n % len(QUESTIONS)] for n in range(args.questions)]
+    env = {
+        "BENCH_TOKEN_DELAY": str(args.token_delay),
+        "BENCH_FIRST_TOKEN_DELAY": str(args.first_token_delay),
+        "BENCH_PARALLEL": str(args.parallel),
+        "IDLE_TIMEOUT": "3600",
+    }
+    with serve("benchmarks.batch_throughput:create_app", env, factory=True) as (_, port):
+        # Warm up imports, the graph and both paths
+        await run_ws(port, questions[:3], 1)
+        await run_batch(port, questions[:3])
+
+        print(f"{'path':>8} {'questions/s':>11} {'elapsed s':>9}")
+        for label, run in (
+            ("ws x1", lambda: run_ws(port, questions, 1)),
+            (f"ws x{args.parallel}", lambda: run_ws(port, questions, args.parallel)),
+            ("batch", lambda: run_batch(port, questions)),
+        ):
+            started = time.perf_counter()
+            answered = await run()
+            elapsed = time.perf_counter() - started
+            print(f"{label:>8} {answered / elapsed:>11.1f} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--parallel", type=int, default=16, help="sockets, or batch concurrency")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--first-token-delay", type=float, default=0.1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,114 @@
+"""Turn latency and checkpoint write throughput of each checkpointer backend.
+
+Runs the agent with the fake model over ``memory``, ``sqlite`` (a WAL database in a
+temporary directory, or ``--sqlite-path``) and, with ``--postgres-dsn``, ``postgres``:
+
+- ``turn ms``: ``--sessions`` concurrent sessions of ``--turns`` turns each, with
+  ``sync`` durability, so every agent step waits for its checkpoint;
+- ``puts/s``: ``--puts`` checkpoints of a finished conversation written to new
+  threads, ``--concurrency`` at a time.
+
+    python -m benchmarks.checkpoint_backends --sessions 20 --turns 5
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from agent import get_transactions
+from benchmarks.checkpoint_durability import QUESTIONS
+from benchmarks.common import summarize
+from checkpointing import PostgresCheckpointer
+from fake_model import FakeStreamingChatModel
+from sqlite_checkpointing import SqliteCheckpointer
+
+
+async def run_turns(checkpointer, args: argparse.Namespace) -> list[float]:
+    agent = create_react_agent(
+        model=FakeStreamingChatModel(),
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        checkpointer=checkpointer,
+    )
+    latencies: list[float] = []
+
+    async def session(n: int) -> None:
+        config = {"configurable": {"thread_id": f"bench-backends-{n}-{uuid.uuid4()}"}}
+        for turn in range(args.turns):
+            started = time.perf_counter()
+            async for _ in agent.astream(
+                {"messages": [{"role": "user", "content": QUESTIONS[turn % len(QUESTIONS)]}]},
+                stream_mode="messages",
+                config=config,
+                durability="sync",
+            ):
+                pass
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(session(n) for n in range(args.sessions)))
+    return latencies
+
+
+async def run_puts(checkpointer, args: argparse.Namespace) -> float:
+    """Checkpoints written per second."""
+    memory = MemorySaver()
+    await run_turns(memory, argparse.Namespace(sessions=1, turns=args.turns))
+    latest = next(iter(memory.list(None)))
+    versions = latest.checkpoint["channel_versions"]
+    pending = iter(range(args.puts))
+
+    async def writer() -> None:
+        for n in pending:
+            config = {"configurable": {"thread_id": f"bench-puts-{n}", "checkpoint_ns": ""}}
+            checkpoint = {**latest.checkpoint, "id": str(uuid.uuid4())}
+            await checkpointer.aput(config, checkpoint, latest.metadata, versions)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer() for _ in range(args.concurrency)))
+    return args.puts / (time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as scratch:
+        backends = {
+            "memory": MemorySaver,
+            "sqlite": lambda: SqliteCheckpointer(
+                args.sqlite_path or str(Path(scratch) / "checkpoints.sqlite"),
+                full_sync=args.full_sync,
+            ),
+        }
+        if args.postgres_dsn:
+            backends["postgres"] = lambda: PostgresCheckpointer(args.postgres_dsn)
+
+        print(f"{'backend':<9} {'turn ms':>8} {'p95 ms':>8} {'puts/s':>8} {'commits':>8}")
+        for name, make in backends.items():
+            checkpointer = make()
+            if hasattr(checkpointer, "aopen"):
+                await checkpointer.aopen()
+            turns = summarize(await run_turns(checkpointer, args))
+            puts = await run_puts(checkpointer, args)
+            commits = getattr(checkpointer, "commits", "")
+            if hasattr(checkpointer, "aclose"):
+                await checkpointer.aclose()
+            print(
+                f"{name:<9} {turns['mean'] * 1000:>8.2f} {turns['p95'] * 1000:>8.2f} "
+                f"{puts:>8.0f} {commits:>8}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--puts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sqlite-path", default=None)
+    parser.add_argument("--full-sync", action="store_true", help="SQLite synchronous=FULL")
+    parser.add_argument("--postgres-dsn", default=None)
+    asyncio.run(main(parser.parse_args()))
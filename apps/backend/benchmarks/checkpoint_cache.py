@@ -0,0 +1,117 @@
+"""Checkpoint load latency per turn with and without the checkpoint cache.
+
+Each session runs ``--turns`` turns; every turn starts by loading the thread's latest
+checkpoint. Loads are timed with the cache off, and on with each validation mode:
+``version`` checks the latest checkpoint id per hit, ``notify`` trusts change
+notifications. By default checkpoints go to an in-memory store that sleeps ``--rtt``
+per round trip (see ``checkpoint_durability``); pass ``--postgres-dsn`` to measure
+against a real database instead.
+
+    python -m benchmarks.checkpoint_cache --sessions 50 --turns 5
+"""
+
+import argparse
+import asyncio
+import time
+
+from langgraph.prebuilt import create_react_agent
+
+from agent import get_transactions
+from benchmarks.checkpoint_durability import QUESTIONS, SimulatedDatabaseSaver
+from benchmarks.common import summarize
+from checkpointing import CachedCheckpointer, PostgresCheckpointer
+from config import CheckpointCacheValidation
+from fake_model import FakeStreamingChatModel
+
+MODES = ["off", *CheckpointCacheValidation]
+
+
+class SimulatedSharedDatabase(SimulatedDatabaseSaver):
+    """The simulated store, with the validation queries of ``PostgresCheckpointer``."""
+
+    async def alatest_checkpoint_id(self, thread_id: str, checkpoint_ns: str) -> str | None:
+        await self._round_trip()
+        latest = self.get_tuple({"configurable": {"thread_id": thread_id}})
+        return latest.checkpoint["id"] if latest else None
+
+    async def anotifications(self):
+        yield None
+        # No other worker writes
+        await asyncio.Event().wait()
+
+
+async def run_mode(mode: str, args: argparse.Namespace) -> dict:
+    if args.postgres_dsn:
+        store = PostgresCheckpointer(args.postgres_dsn, notify_changes=mode == "notify")
+    else:
+        store = SimulatedSharedDatabase(args.rtt)
+    checkpointer = store
+    if mode != "off":
+        checkpointer = CachedCheckpointer(
+            store, max_threads=args.cache_size, validation=CheckpointCacheValidation(mode)
+        )
+    if hasattr(checkpointer, "aopen"):
+        await checkpointer.aopen()
+    # Let the cache start listening
+    await asyncio.sleep(0.1)
+
+    loads: list[float] = []
+    load = checkpointer.aget_tuple
+
+    async def timed_load(config):
+        started = time.perf_counter()
+        try:
+            return await load(config)
+        finally:
+            loads.append(time.perf_counter() - started)
+
+    checkpointer.aget_tuple = timed_load
+    agent = create_react_agent(
+        model=FakeStreamingChatModel(token_delay=args.token_delay),
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        checkpointer=checkpointer,
+    )
+
+    async def session(n: int) -> None:
+        config = {"configurable": {"thread_id": f"bench-cache-{mode}-{n}-{time.time_ns()}"}}
+        for turn in range(args.turns):
+            async for _ in agent.astream(
+                {"messages": [{"role": "user", "content": QUESTIONS[turn % len(QUESTIONS)]}]},
+                stream_mode="messages",
+                config=config,
+            ):
+                pass
+
+    await asyncio.gather(*(session(n) for n in range(args.sessions)))
+    if hasattr(checkpointer, "aclose"):
+        await checkpointer.aclose()
+
+    return {
+        "mode": mode,
+        # The first turn of a session finds nothing to load
+        "load_ms": {k: v * 1000 for k, v in summarize(loads[args.sessions :]).items()},
+        "hit_rate": getattr(checkpointer, "hit_rate", 0.0),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{'cache':<8} {'hit rate':>8} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in MODES:
+        result = await run_mode(mode, args)
+        load = result["load_ms"]
+        print(
+            f"{result['mode']:<8} {result['hit_rate']:>8.2f} {load['mean']:>8.2f} "
+            f"{load['p50']:>8.2f} {load['p99']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--cache-size", type=int, default=10_000)
+    parser.add_argument("--rtt", type=float, default=0.002, help="simulated round trip (s)")
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--postgres-dsn", default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,140 @@
+"""DB round trips per turn and turn latency for each checkpoint durability mode.
+
+By default checkpoints go to an in-memory store that sleeps ``--rtt`` per round
+trip, which isolates the effect of the durability mode from database speed. Pass
+``--postgres-dsn`` to measure against a real database instead.
+
+    python -m benchmarks.checkpoint_durability --sessions 50 --turns 3
+"""
+
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from agent import get_transactions
+from benchmarks.common import summarize
+from checkpointing import PostgresCheckpointer, WriteBehindCheckpointer
+from config import CheckpointDurability
+from fake_model import FakeStreamingChatModel
+
+QUESTIONS = ["Show me my transactions", "My name is Bob", "What is my name?"]
+
+
+class SimulatedDatabaseSaver(MemorySaver):
+    """MemorySaver that charges one network round trip per call."""
+
+    def __init__(self, rtt: float):
+        super().__init__()
+        self.rtt = rtt
+        self.round_trips = 0
+
+    async def _round_trip(self) -> None:
+        self.round_trips += 1
+        await asyncio.sleep(self.rtt)
+
+    async def aget_tuple(self, config):
+        await self._round_trip()
+        return await super().aget_tuple(config)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        await self._round_trip()
+        return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await self._round_trip()
+        await super().aput_writes(config, writes, task_id, task_path)
+
+    async def aput_batch(self, puts, writes):
+        await self._round_trip()
+        for put in puts:
+            await super().aput(put.config, put.checkpoint, put.metadata, put.new_versions)
+        for item in writes:
+            await super().aput_writes(item.config, item.writes, item.task_id, item.task_path)
+
+
+class CountingPostgresCheckpointer(PostgresCheckpointer):
+    """Counts pipelines/statements sent to Postgres as round trips."""
+
+    round_trips = 0
+
+    @asynccontextmanager
+    async def _cursor(self, *, pipeline: bool = False):
+        self.round_trips += 1
+        async with super()._cursor(pipeline=pipeline) as cur:
+            yield cur
+
+
+async def run_mode(mode: CheckpointDurability, args: argparse.Namespace) -> dict:
+    if args.postgres_dsn:
+        store = CountingPostgresCheckpointer(args.postgres_dsn)
+    else:
+        store = SimulatedDatabaseSaver(args.rtt)
+    checkpointer = store
+    if mode == CheckpointDurability.ASYNC:
+        checkpointer = WriteBehindCheckpointer(
+            store, batch_size=args.batch_size, flush_interval=args.flush_interval
+        )
+    if hasattr(checkpointer, "aopen"):
+        await checkpointer.aopen()
+    agent = create_react_agent(
+        model=FakeStreamingChatModel(token_delay=args.token_delay),
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        checkpointer=checkpointer,
+    )
+
+    latencies: list[float] = []
+
+    async def session(n: int) -> None:
+        config = {"configurable": {"thread_id": f"bench-{mode}-{n}-{time.time_ns()}"}}
+        for turn in range(args.turns):
+            started = time.perf_counter()
+            async for _ in agent.astream(
+                {"messages": [{"role": "user", "content": QUESTIONS[turn % len(QUESTIONS)]}]},
+                stream_mode="messages",
+                config=config,
+                durability=mode.value,
+            ):
+                pass
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(n) for n in range(args.sessions)))
+    elapsed = time.perf_counter() - started
+    if hasattr(checkpointer, "aclose"):
+        await checkpointer.aclose()
+
+    turns = args.sessions * args.turns
+    return {
+        "mode": mode.value,
+        "round_trips_per_turn": store.round_trips / turns,
+        "turn_latency_ms": {k: v * 1000 for k, v in summarize(latencies).items()},
+        "turns_per_sec": turns / elapsed,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{'mode':<6} {'rt/turn':>8} {'mean ms':>9} {'p95 ms':>9} {'turns/s':>9}")
+    for mode in CheckpointDurability:
+        result = await run_mode(mode, args)
+        latency = result["turn_latency_ms"]
+        print(
+            f"{result['mode']:<6} {result['round_trips_per_turn']:>8.2f} "
+            f"{latency['mean']:>9.1f} {latency['p95']:>9.1f} {result['turns_per_sec']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--rtt", type=float, default=0.002, help="simulated round trip (s)")
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--postgres-dsn", default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""Checkpoint lookup latency on a bloated table versus after retention.
+
+Fills Postgres with ``--threads`` threads of ``--checkpoints`` checkpoints each,
+written round-robin as concurrent sessions would, then measures ``aget_tuple``
+(the lookup at the start of every turn) before pruning, after pruning to
+``--keep-last``, and after the ``VACUUM`` autovacuum would eventually run.
+
+    python -m benchmarks.checkpoint_retention --postgres-dsn postgresql://...
+
+Retention applies to the whole database; use a scratch one.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import UTC, datetime
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base.id import uuid6
+from psycopg import AsyncConnection
+
+from benchmarks.common import summarize
+from checkpointing import PendingPut, PendingWrites, PostgresCheckpointer
+from retention import CheckpointRetention
+
+PREFIX = "bench-retention-"
+
+
+async def fill(saver: PostgresCheckpointer, threads: list[str], checkpoints: int) -> None:
+    versions = dict.fromkeys(threads)
+    parents = dict.fromkeys(threads)
+    for step in range(checkpoints):
+        puts, writes = [], []
+        for thread_id in threads:
+            versions[thread_id] = saver.get_next_version(versions[thread_id], None)
+            checkpoint = {
+                "v": 4,
+                "id": str(uuid6(clock_seq=step)),
+                "ts": datetime.now(UTC).isoformat(),
+                "channel_values": {
+                    "messages": [HumanMessage(f"question {step}"), AIMessage(f"answer {step}")]
+                },
+                "channel_versions": {"messages": versions[thread_id]},
+                "versions_seen": {},
+            }
+            config = {
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": "",
+                    "checkpoint_id": parents[thread_id],
+                }
+            }
+            puts.append(
+                PendingPut(config, checkpoint, {"step": step}, checkpoint["channel_versions"])
+            )
+            written = {
+                "configurable": {**config["configurable"], "checkpoint_id": checkpoint["id"]}
+            }
+            writes.append(PendingWrites(written, [("messages", [AIMessage("pending")])], "task"))
+            parents[thread_id] = checkpoint["id"]
+        await saver.aput_batch(puts, writes)
+
+
+async def measure(saver: PostgresCheckpointer, threads: list[str], lookups: int) -> dict:
+    latencies = []
+    for thread_id in random.choices(threads, k=lookups):
+        started = time.perf_counter()
+        await saver.aget_tuple({"configurable": {"thread_id": thread_id}})
+        latencies.append(time.perf_counter() - started)
+    async with saver._cursor() as cur:
+        await cur.execute(
+            "SELECT pg_total_relation_size('checkpoints') + "
+            "pg_total_relation_size('checkpoint_blobs') + "
+            "pg_total_relation_size('checkpoint_writes') AS size"
+        )
+        size = (await cur.fetchone())["size"]
+    return {"latency_ms": {k: v * 1000 for k, v in summarize(latencies).items()}, "size": size}
+
+
+async def main(args: argparse.Namespace) -> None:
+    saver = PostgresCheckpointer(args.postgres_dsn)
+    await saver.aopen()
+    threads = [f"{PREFIX}{n}" for n in range(args.threads)]
+    try:
+        started = time.perf_counter()
+        await fill(saver, threads, args.checkpoints)
+        print(
+            f"Wrote {args.threads * args.checkpoints} checkpoints "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        results = {"bloated": await measure(saver, threads, args.lookups)}
+
+        started = time.perf_counter()
+        stats = await CheckpointRetention(args.postgres_dsn, keep_last=args.keep_last).run()
+        print(f"Retention took {time.perf_counter() - started:.1f}s: {stats}")
+        results["pruned"] = await measure(saver, threads, args.lookups)
+
+        async with await AsyncConnection.connect(args.postgres_dsn, autocommit=True) as conn:
+            await conn.execute("VACUUM ANALYZE checkpoints, checkpoint_blobs, checkpoint_writes")
+        results["pruned+vacuum"] = await measure(saver, threads, args.lookups)
+
+        print(f"{'table':<14} {'size MB':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, r in results.items():
+            latency = r["latency_ms"]
+            print(
+                f"{name:<14} {r['size'] / 1e6:>9.1f} {latency['p50']:>8.2f} "
+                f"{latency['p95']:>8.2f} {latency['p99']:>8.2f}"
+            )
+    finally:
+        for thread_id in threads:
+            await saver.adelete_thread(thread_id)
+        await saver.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--postgres-dsn", required=True)
+    parser.add_argument("--threads", type=int, default=500)
+    parser.add_argument("--checkpoints", type=int, default=200)
+    parser.add_argument("--keep-last", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
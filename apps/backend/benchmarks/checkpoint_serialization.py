@@ -0,0 +1,119 @@
+"""Checkpoint storage size and encode/decode throughput per serializer.
+
+Replays a session's checkpoints (the message list after every message, as the
+``messages`` channel is rewritten each step) through the default serializer and
+each compact variant. Payload dedup is applied across the whole session, as the
+Postgres checkpointer does.
+
+    python -m benchmarks.checkpoint_serialization --turns 40
+    python -m benchmarks.checkpoint_serialization --session recorded.json
+
+``--session`` takes a JSON list of messages in ``messages_to_dict`` format.
+"""
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    ToolMessage,
+    messages_from_dict,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from config import CheckpointCompression
+from serialization import CheckpointSerializer
+
+
+def synthetic_session(turns: int, transactions: int, seed: int = 7) -> list[BaseMessage]:
+    """A session alternating small talk with repeated and fresh transaction lookups."""
+    rng = random.Random(seed)
+    history = [
+        {"id": str(i), "amount": f"{rng.uniform(-200, 200):.2f}", "date_time": "2025-10-05"}
+        for i in range(transactions)
+    ]
+    messages: list[BaseMessage] = []
+    for turn in range(turns):
+        messages.append(HumanMessage(f"Question {turn}: what did I spend?"))
+        if turn % 2 == 0:
+            call_id = f"call_{turn}"
+            messages.append(
+                AIMessage(
+                    "",
+                    tool_calls=[{"name": "get_transactions", "args": {}, "id": call_id}],
+                    usage_metadata={"input_tokens": 100, "output_tokens": 8, "total_tokens": 108},
+                )
+            )
+            # Every fourth lookup returns new data; the rest repeat the last result
+            if turn % 8 == 0:
+                history = history[1:] + [history[0]]
+            messages.append(
+                ToolMessage(
+                    json.dumps({"data": history}), tool_call_id=call_id, name="get_transactions"
+                )
+            )
+        messages.append(AIMessage(f"Here is a summary of your spending for question {turn}."))
+    return messages
+
+
+def measure(name: str, serde, snapshots: list[list[BaseMessage]], dedup: bool) -> dict:
+    payload_bytes = 0
+    started = time.perf_counter()
+    if dedup:
+        with serde.collect_payloads() as payloads:
+            blobs = [serde.dumps_typed(snapshot) for snapshot in snapshots]
+        payload_bytes = sum(len(data) for _, data in payloads.values())
+    else:
+        blobs = [serde.dumps_typed(snapshot) for snapshot in snapshots]
+    encode = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for blob in blobs:
+        serde.loads_typed(blob)
+    decode = time.perf_counter() - started
+    return {
+        "serializer": name,
+        "stored_bytes": sum(len(data) for _, data in blobs) + payload_bytes,
+        "encode_s": encode,
+        "decode_s": decode,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    if args.session:
+        messages = messages_from_dict(json.loads(Path(args.session).read_text()))
+    else:
+        messages = synthetic_session(args.turns, args.transactions)
+    snapshots = [messages[: n + 1] for n in range(len(messages))]
+
+    results = [measure("default", JsonPlusSerializer(), snapshots, dedup=False)]
+    for compression in CheckpointCompression:
+        for dedup in (False, True):
+            serde = CheckpointSerializer(compression, dedup_min_bytes=args.dedup_min_bytes)
+            name = f"compact/{compression}" + ("/dedup" if dedup else "")
+            results.append(measure(name, serde, snapshots, dedup))
+
+    baseline = results[0]
+    logical_mb = baseline["stored_bytes"] / 1e6
+    print(f"{len(snapshots)} checkpoints, {logical_mb:.1f} MB with the default serializer")
+    print(f"{'serializer':<22} {'stored MB':>10} {'ratio':>7} {'enc MB/s':>9} {'dec MB/s':>9}")
+    for r in results:
+        print(
+            f"{r['serializer']:<22} {r['stored_bytes'] / 1e6:>10.2f} "
+            f"{baseline['stored_bytes'] / r['stored_bytes']:>6.1f}x "
+            f"{logical_mb / r['encode_s']:>9.1f} {logical_mb / r['decode_s']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--session", help="JSON file of recorded messages")
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--transactions", type=int, default=200)
+    parser.add_argument("--dedup-min-bytes", type=int, default=1024)
+    main(parser.parse_args())
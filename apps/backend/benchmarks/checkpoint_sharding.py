@@ -0,0 +1,57 @@
+"""Checkpoint throughput as the number of Postgres shards grows.
+
+With the DSNs of N databases, runs the ``checkpoint_backends`` workloads over the first
+1, 2, ... N of them, sharded by thread:
+
+- ``turn ms``: ``--sessions`` concurrent sessions of ``--turns`` turns each, with
+  ``sync`` durability;
+- ``puts/s``: ``--puts`` checkpoints written to new threads, ``--concurrency`` at a
+  time, and how that compares with one shard.
+
+Shards sharing a host share its CPU and disk; give each its own to see them scale.
+
+    python -m benchmarks.checkpoint_sharding --postgres-dsn postgresql://...5433/a \\
+        postgresql://...5434/a postgresql://...5435/a --concurrency 64
+"""
+
+import argparse
+import asyncio
+
+from benchmarks.checkpoint_backends import run_puts, run_turns
+from benchmarks.common import summarize
+from checkpointing import PostgresCheckpointer
+from sharding import ShardedCheckpointer
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{'shards':>6} {'turn ms':>8} {'p95 ms':>8} {'puts/s':>8} {'speedup':>8}")
+    single = None
+    for count in range(1, len(args.postgres_dsn) + 1):
+        checkpointer = ShardedCheckpointer(
+            [
+                PostgresCheckpointer(dsn, max_size=args.pool_size)
+                for dsn in args.postgres_dsn[:count]
+            ]
+        )
+        await checkpointer.aopen()
+        try:
+            turns = summarize(await run_turns(checkpointer, args))
+            puts = await run_puts(checkpointer, args)
+        finally:
+            await checkpointer.aclose()
+        single = single or puts
+        print(
+            f"{count:>6} {turns['mean'] * 1000:>8.2f} {turns['p95'] * 1000:>8.2f} "
+            f"{puts:>8.0f} {puts / single:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--postgres-dsn", nargs="+", required=True, help="one per shard")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--puts", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--pool-size", type=int, default=10, help="connections per shard")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,133 @@
+"""Client cost of streaming an answer, per token vs block render cadence.
+
+A browser-free simulation of what the frontend does with the frames of one answer.
+Tokens arrive every ``--token-delay`` seconds of simulated time, and are framed as the
+server frames them:
+
+- ``token``: a frame per token carrying ``accumulated``. The client parses each frame
+  and re-renders the whole message, as ``useAgentWebSocket`` did.
+- ``block``: the tokens go through the server's ``DeltaBuffer``. The client parses
+  each frame, appends its delta, and renders at most once per display frame
+  (``requestAnimationFrame``, every 16.7 ms).
+
+Rendering stands in for React and markdown: escaping the whole message and splitting
+it into paragraphs and lines, which is linear in its length. The client CPU time is
+measured; the clock is simulated, so the run is fast and repeatable.
+
+    python -m benchmarks.client_render --tokens 200 1000 4000
+"""
+
+import argparse
+import html
+import json
+import math
+import random
+import time
+
+from rendering import DeltaBuffer
+
+DISPLAY_FRAME = 1 / 60
+WORDS = ["your", "spending", "on", "food", "rose", "this", "month", "while", "bills", "fell"]
+
+
+def answer_tokens(count: int, seed: int = 0) -> list[str]:
+    """Tokens of an answer of sentences, paragraphs and the odd code block."""
+    rng = random.Random(seed)
+    tokens: list[str] = []
+    while len(tokens) < count:
+        if rng.random() < 0.1:
+            tokens += ["```python\n", "total = ", "sum(amounts)\n", "```\n"]
+            continue
+        sentence = [f"{rng.choice(WORDS)} " for _ in range(rng.randint(6, 18))]
+        sentence[-1] = sentence[-1].rstrip() + rng.choice([". ", ".\n\n", "? "])
+        tokens += sentence
+    return tokens[:count]
+
+
+def render(text: str) -> int:
+    """Stand-in for re-rendering a message: work linear in its length."""
+    paragraphs = html.escape(text).split("\n\n")
+    return sum(len(line) for paragraph in paragraphs for line in paragraph.splitlines())
+
+
+def token_frames(tokens: list[str], token_delay: float) -> list[tuple[float, str]]:
+    """Frames as sent in the token cadence, with their simulated send times."""
+    frames, accumulated = [], ""
+    for n, token in enumerate(tokens):
+        accumulated += token
+        frame = {"type": "content_delta", "delta": token, "accumulated": accumulated}
+        frames.append((n * token_delay, json.dumps(frame)))
+    return frames
+
+
+def block_frames(tokens: list[str], token_delay: float) -> list[tuple[float, str]]:
+    """Frames as sent in the block cadence, with their simulated send times."""
+    now = 0.0
+    buffer = DeltaBuffer(clock=lambda: now)
+    frames = []
+    for n, token in enumerate(tokens):
+        now = n * token_delay
+        if ready := buffer.push(token):
+            frames.append((now, json.dumps({"type": "content_delta", "delta": ready})))
+    if held := buffer.flush():
+        frames.append((now, json.dumps({"type": "content_delta", "delta": held})))
+    return frames
+
+
+def render_every_frame(frames: list[tuple[float, str]]) -> int:
+    """The previous client: re-render the accumulated text for every frame."""
+    for _, frame in frames:
+        render(json.loads(frame)["accumulated"])
+    return len(frames)
+
+
+def render_per_display_frame(frames: list[tuple[float, str]]) -> int:
+    """The block client: append deltas, render once per display frame."""
+    renders, content = 0, ""
+    pending: float | None = None
+    for at, frame in frames:
+        # A display frame that came before this websocket frame renders what was buffered
+        if pending is not None and pending <= at:
+            render(content)
+            renders += 1
+            pending = None
+        content += json.loads(frame)["delta"]
+        if pending is None:
+            pending = math.ceil(at / DISPLAY_FRAME + 1e-9) * DISPLAY_FRAME
+    if pending is not None:
+        render(content)
+        renders += 1
+    return renders
+
+
+def main(args: argparse.Namespace) -> None:
+    print(
+        f"{'tokens':>6} {'cadence':>7} {'frames':>6} {'renders':>7} {'KiB':>8} "
+        f"{'client ms':>9} {'us/token':>8}"
+    )
+    for count in args.tokens:
+        tokens = answer_tokens(count)
+        for label, server, client in (
+            ("token", token_frames, render_every_frame),
+            ("block", block_frames, render_per_display_frame),
+        ):
+            frames = server(tokens, args.token_delay)
+            sent = sum(len(frame) for _, frame in frames)
+            cpu = []
+            for _ in range(args.repeat):
+                started = time.process_time()
+                renders = client(frames)
+                cpu.append(time.process_time() - started)
+            best = min(cpu)
+            print(
+                f"{count:>6} {label:>7} {len(frames):>6} {renders:>7} {sent / 1024:>8.1f} "
+                f"{best * 1000:>9.2f} {best / count * 1e6:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, nargs="+", default=[200, 1000, 4000])
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds per token")
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
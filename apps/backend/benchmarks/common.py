@@ -0,0 +1,141 @@
+"""Helpers shared by the benchmark scripts."""
+
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of ``values`` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Mean/p50/p95/p99 of ``values``."""
+    return {
+        "mean": statistics.fmean(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def serve(
+    target: str,
+    env: dict[str, str],
+    *,
+    factory: bool = False,
+    ws_ping_interval: float | None = None,
+    workers: int | None = None,
+    reuse_port: bool = False,
+) -> Iterator[tuple[subprocess.Popen, int]]:
+    """Run ``target`` under uvicorn in a subprocess; yields its ``(process, port)``.
+
+    uvicorn's per-connection protocol pings are off unless ``ws_ping_interval`` is
+    given, so that they do not skew measurements. With ``workers``, the app runs under
+    the tuned server profile (``python -m server``) instead. The app must serve
+    ``/health``.
+    """
+    port = free_port()
+    if workers is None:
+        script = (
+            "import uvicorn\n"
+            f"uvicorn.run({target!r}, host='127.0.0.1', port={port}, factory={factory},"
+            f" ws_ping_interval={ws_ping_interval}, log_level='warning', backlog=4096)\n"
+        )
+        command = [sys.executable, "-c", script]
+    else:
+        command = [sys.executable, "-m", "server", "--app", target, "--port", str(port)]
+        command += ["--host", "127.0.0.1", "--workers", str(workers)]
+        command += ["--factory"] * factory + ["--reuse-port"] * reuse_port
+    server = subprocess.Popen(
+        command,
+        env={**os.environ, **env},
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    try:
+        for _ in range(200 * (workers or 1)):
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/health")
+                break
+            except OSError:
+                time.sleep(0.05)
+        else:
+            raise RuntimeError(f"{target} did not start")
+        yield server, port
+    finally:
+        server.terminate()
+        server.wait()
+
+
+# Version of the results file layout written by ``write_results``
+RESULTS_SCHEMA = 1
+
+
+def write_results(path: str | Path, suite: str, config: dict, results: dict) -> None:
+    """Write results as stable JSON: sorted keys, one file per suite run."""
+    document = {"schema": RESULTS_SCHEMA, "suite": suite, "config": config, "results": results}
+    Path(path).write_text(json.dumps(document, indent=2, sort_keys=True) + "\n")
+
+
+def load_results(path: str | Path) -> dict:
+    document = json.loads(Path(path).read_text())
+    if document.get("schema") != RESULTS_SCHEMA:
+        raise ValueError(f"{path}: unsupported results schema {document.get('schema')!r}")
+    return document
+
+
+def compare(
+    current: dict,
+    baseline: dict,
+    thresholds: dict[str, float],
+    *,
+    stats: tuple[str, ...] = ("p50", "p99"),
+    min_delta_ms: float = 1.0,
+) -> list[str]:
+    """Regressions of ``current`` against ``baseline`` results, one line each.
+
+    Both map a group (e.g. a concurrency level) to metrics. ``*_ms`` metrics are
+    summaries where lower is better; a stat regresses when it exceeds the baseline by
+    more than the metric's relative threshold and by at least ``min_delta_ms``. Other
+    numeric metrics are rates where higher is better. Metrics without a threshold, or
+    missing from either side, are not compared.
+    """
+    regressions = []
+    for group, metrics in sorted(current.items()):
+        for name, threshold in sorted(thresholds.items()):
+            value, base = metrics.get(name), baseline.get(group, {}).get(name)
+            if value is None or base is None:
+                continue
+            if name.endswith("_ms"):
+                for stat in stats:
+                    limit = max(base[stat] * (1 + threshold), base[stat] + min_delta_ms)
+                    if value[stat] > limit:
+                        regressions.append(
+                            f"{group} {name} {stat}: {value[stat]:.2f} > {limit:.2f} "
+                            f"(baseline {base[stat]:.2f}, +{threshold:.0%})"
+                        )
+            elif value < base * (1 - threshold):
+                regressions.append(
+                    f"{group} {name}: {value:.2f} < {base * (1 - threshold):.2f} "
+                    f"(baseline {base:.2f}, -{threshold:.0%})"
+                )
+    return regressions
@@ -0,0 +1,100 @@
+"""Server RSS and CPU per 10k idle websocket connections.
+
+Starts one uvicorn worker, opens ``--connections`` websockets that never send a
+message, and reports the worker's resident memory growth and the CPU it burns while
+they sit idle, scaled to 10k connections.
+
+    python -m benchmarks.idle_connections --connections 10000 --keepalive-interval 5
+
+Raise the open file limit (``ulimit -n``) above the connection count first.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from websockets.asyncio.client import connect
+
+from benchmarks.common import serve
+
+
+def rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmRSS not found")
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of /proc/pid/stat
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def idle_cpu(pid: int, window: float) -> float:
+    """Fraction of one core used over ``window`` seconds."""
+    before = cpu_seconds(pid)
+    time.sleep(window)
+    return (cpu_seconds(pid) - before) / window
+
+
+async def open_connections(url: str, count: int, concurrency: int = 200) -> list:
+    sockets = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def open_one() -> None:
+        async with semaphore:
+            # No client-side pings: only the server's keepalive policy is measured
+            sockets.append(await connect(url, ping_interval=None, max_queue=None))
+
+    await asyncio.gather(*(open_one() for _ in range(count)))
+    return sockets
+
+
+async def main(args: argparse.Namespace) -> None:
+    env = {
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+        "CHECKPOINTER_TYPE": "memory",
+        "IDLE_TIMEOUT": "3600",
+        "KEEPALIVE_INTERVAL": str(args.keepalive_interval),
+    }
+    ping_interval = args.ws_ping_interval or None
+    with serve("main:app", env, ws_ping_interval=ping_interval) as (server, port):
+        base_rss = rss_bytes(server.pid)
+        base_cpu = await asyncio.to_thread(idle_cpu, server.pid, args.window)
+
+        started = time.perf_counter()
+        sockets = await open_connections(f"ws://127.0.0.1:{port}/ws/agent", args.connections)
+        opened = time.perf_counter() - started
+        await asyncio.sleep(2)
+
+        rss = rss_bytes(server.pid)
+        cpu = await asyncio.to_thread(idle_cpu, server.pid, args.window)
+        scale = 10_000 / args.connections
+        print(f"Opened {len(sockets)} connections in {opened:.1f}s")
+        print(f"{'':<28} {'RSS MB':>8} {'CPU %':>7}")
+        print(f"{'worker, no connections':<28} {base_rss / 1e6:>8.1f} {base_cpu * 100:>7.2f}")
+        print(f"{'worker, all idle':<28} {rss / 1e6:>8.1f} {cpu * 100:>7.2f}")
+        print(
+            f"{'per 10k idle connections':<28} {(rss - base_rss) * scale / 1e6:>8.1f} "
+            f"{(cpu - base_cpu) * scale * 100:>7.2f}"
+        )
+        print(f"{'per connection (KB)':<28} {(rss - base_rss) / args.connections / 1e3:>8.1f}")
+        await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=10_000)
+    parser.add_argument("--keepalive-interval", type=float, default=0.0)
+    parser.add_argument(
+        "--ws-ping-interval",
+        type=float,
+        default=0.0,
+        help="uvicorn's per-connection protocol pings (0 disables)",
+    )
+    parser.add_argument("--window", type=float, default=10.0, help="CPU sampling window (s)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,130 @@
+"""Event-loop lag during an error storm, logging synchronously or through the pipeline.
+
+Logs ``--rate`` errors per second from ``--sites`` call sites for ``--duration``
+seconds, in the event loop, as a failing model would make every turn log. Records are written to a
+pipe drained by another process at ``--drain-kbps``, a log driver falling behind.
+Meanwhile a probe sleeps ``--interval`` seconds in a loop and records how late it wakes
+up. Modes:
+
+- ``sync``: a ``StreamHandler`` with uvicorn's format, writing on the event loop;
+- ``text`` and ``json``: ``LogPipeline`` with that format.
+
+It reports the probe's lag, the errors logged per second, and the records written
+and dropped (rate limited or past the queue).
+
+    python -m benchmarks.log_storm --rate 10000 --duration 5
+"""
+
+import argparse
+import asyncio
+import logging
+import subprocess
+import sys
+import time
+
+from uvicorn.logging import DefaultFormatter
+
+from benchmarks.common import summarize
+from config import LogFormat
+from log_pipeline import LOG_RECORDS_DROPPED, LogPipeline
+
+# Reads stdin at most argv[1] KB per second, and prints the bytes read on EOF
+DRAIN = """
+import sys, time
+rate, total = float(sys.argv[1]) * 1000, 0
+started = time.perf_counter()
+while chunk := sys.stdin.buffer.read1(4096):
+    total += len(chunk)
+    time.sleep(max(started + total / rate - time.perf_counter(), 0))
+print(total)
+"""
+
+
+async def probe(interval: float, lags: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(time.perf_counter() - expected, 0.0))
+
+
+async def storm(logs: list[logging.Logger], rate: float, duration: float) -> int:
+    """Log ``rate`` errors a second, every millisecond; returns the number logged."""
+    started = time.perf_counter()
+    logged = 0
+    while (elapsed := time.perf_counter() - started) < duration:
+        for _ in range(int(elapsed * rate) - logged):
+            log = logs[logged % len(logs)]
+            log.error("Error processing agent events: %s", ConnectionError("upstream reset"))
+            logged += 1
+        await asyncio.sleep(0.001)
+    return logged
+
+
+async def run_mode(mode: str, args: argparse.Namespace) -> dict:
+    drain = subprocess.Popen(
+        [sys.executable, "-c", DRAIN, str(args.drain_kbps)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    sink = drain.stdin
+    log = logging.getLogger(f"uvicorn.storm.{mode}")
+    log.propagate = False
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(DefaultFormatter("%(levelprefix)s %(message)s", use_colors=False))
+    log.handlers = [handler]
+    pipeline = None
+    if mode != "sync":
+        pipeline = LogPipeline(LogFormat(mode), max_queue=args.queue_size, stream=sink)
+        pipeline.install([log.name])
+
+    dropped = {r: LOG_RECORDS_DROPPED.value(reason=r) for r in ("rate_limited", "queue_full")}
+    lags: list[float] = []
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe(args.interval, lags, stop))
+    started = time.perf_counter()
+    # Each logger is a call site of its own for rate limiting
+    logs = [log.getChild(str(n)) for n in range(args.sites)]
+    logged = await storm(logs, args.rate, args.duration)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+
+    if pipeline is not None:
+        await asyncio.to_thread(pipeline.close)
+    sink.close()
+    written = int(await asyncio.to_thread(drain.stdout.read) or 0)
+    drain.wait()
+    return {
+        "lag_ms": {k: v * 1000 for k, v in summarize(lags).items()},
+        "max_lag_ms": max(lags) * 1000,
+        "errors_per_sec": logged / elapsed,
+        "kb_written": written / 1000,
+        "dropped": {r: LOG_RECORDS_DROPPED.value(reason=r) - v for r, v in dropped.items()},
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"{'mode':<6} {'lag p50':>8} {'lag p99':>8} {'lag max':>8} {'errors/s':>9} "
+        f"{'KB out':>8} {'limited':>8} {'q full':>8}"
+    )
+    for mode in ("sync", "text", "json"):
+        result = await run_mode(mode, args)
+        print(
+            f"{mode:<6} {result['lag_ms']['p50']:>8.1f} {result['lag_ms']['p99']:>8.1f} "
+            f"{result['max_lag_ms']:>8.1f} {result['errors_per_sec']:>9.0f} "
+            f"{result['kb_written']:>8.1f} {result['dropped']['rate_limited']:>8.0f} "
+            f"{result['dropped']['queue_full']:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=10000, help="errors per second")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--sites", type=int, default=1, help="distinct call sites")
+    parser.add_argument("--drain-kbps", type=float, default=100, help="log driver throughput")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--interval", type=float, default=0.005, help="probe sleep, seconds")
+    asyncio.run(main(parser.parse_args()))
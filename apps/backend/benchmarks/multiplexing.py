@@ -0,0 +1,214 @@
+"""Connections and per-session server overhead: one socket per session vs multiplexed.
+
+Serves both endpoints with the fake model under uvicorn, once per mode. ``sockets``
+opens a ``/ws/agent`` socket per session; ``mux`` spreads the sessions over
+``--connections`` sockets to ``/ws/agent/mux``. Every session then runs ``--turns``
+turns at once. It reports the server's resident memory growth per open session, its
+CPU time per turn, time to the first delta, the largest gap between a session's deltas
+(how fairly sessions share a socket) and turns per second.
+
+    python -m benchmarks.multiplexing --sessions 1000 --connections 4
+
+Raise the open file limit (``ulimit -n``) above the session count first.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from websockets.asyncio.client import connect
+
+from agent import AgentWebSocket, get_transactions
+from benchmarks.common import serve, summarize
+from benchmarks.idle_connections import cpu_seconds, rss_bytes
+from fake_model import FakeStreamingChatModel
+from idle import IdlePolicy
+
+QUESTION = "Tell me about budgeting"
+
+
+def create_app() -> Starlette:
+    """Both endpoints serving the fake model, for ``uvicorn --factory``."""
+    agent = create_react_agent(
+        model=FakeStreamingChatModel(token_delay=float(os.environ.get("BENCH_TOKEN_DELAY", 0))),
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        checkpointer=MemorySaver(),
+    )
+    aws = AgentWebSocket(
+        agent,
+        logging.getLogger("uvicorn"),
+        idle_policy=IdlePolicy(timeout=3600),
+        mux_max_sessions=int(os.environ["BENCH_MUX_SESSIONS"]),
+    )
+
+    async def health(_) -> JSONResponse:
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(
+        routes=[
+            Route("/health", health),
+            WebSocketRoute("/ws/agent", aws.agent_websocket_endpoint),
+            WebSocketRoute("/ws/agent/mux", aws.multiplexed_endpoint),
+        ]
+    )
+
+
+class Samples:
+    def __init__(self) -> None:
+        self.ttft: list[float] = []
+        self.max_gap: list[float] = []
+        self.turns = 0
+        self.errors = 0
+
+    def turn(self, sent: float, deltas: list[float], failed: bool) -> None:
+        if failed or not deltas:
+            self.errors += 1
+            return
+        self.turns += 1
+        self.ttft.append(deltas[0] - sent)
+        gaps = [b - a for a, b in zip(deltas, deltas[1:], strict=False)]
+        self.max_gap.append(max(gaps, default=0.0))
+
+
+class SocketSession:
+    """A session on a socket of its own."""
+
+    def __init__(self, websocket) -> None:
+        self.websocket = websocket
+
+    async def turn(self, samples: Samples) -> None:
+        sent = time.perf_counter()
+        await self.websocket.send(QUESTION)
+        deltas = []
+        async for text in self.websocket:
+            frame = json.loads(text)
+            if frame["type"] == "content_delta":
+                deltas.append(time.perf_counter())
+            elif frame["type"] in ("end", "error"):
+                samples.turn(sent, deltas, frame["type"] == "error")
+                return
+
+
+class MuxConnection:
+    """A multiplexed socket, routing frames to its sessions' queues."""
+
+    def __init__(self, websocket) -> None:
+        self.websocket = websocket
+        self.queues: dict[str, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self) -> None:
+        async for text in self.websocket:
+            frame = json.loads(text)
+            self.queues[frame.get("session_id")].put_nowait((time.perf_counter(), frame))
+
+
+class MuxSession:
+    """A session on a multiplexed socket."""
+
+    def __init__(self, connection: MuxConnection, session_id: str) -> None:
+        self.connection = connection
+        self.session_id = session_id
+
+    async def turn(self, samples: Samples) -> None:
+        queue = self.connection.queues[self.session_id]
+        sent = time.perf_counter()
+        await self.connection.websocket.send(
+            json.dumps({"session_id": self.session_id, "message": QUESTION})
+        )
+        deltas = []
+        while True:
+            received, frame = await queue.get()
+            if frame["type"] == "content_delta":
+                deltas.append(received)
+            elif frame["type"] in ("end", "error"):
+                samples.turn(sent, deltas, frame["type"] == "error")
+                return
+
+
+async def open_sockets(url: str, count: int, concurrency: int = 200) -> list:
+    sockets = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def open_one() -> None:
+        async with semaphore:
+            sockets.append(await connect(url, ping_interval=None, max_queue=None, open_timeout=120))
+
+    await asyncio.gather(*(open_one() for _ in range(count)))
+    return sockets
+
+
+async def run_mode(mode: str, args: argparse.Namespace) -> dict:
+    env = {
+        "BENCH_TOKEN_DELAY": str(args.token_delay),
+        "BENCH_MUX_SESSIONS": str(args.sessions),
+    }
+    samples = Samples()
+    with serve("benchmarks.multiplexing:create_app", env, factory=True) as (server, port):
+        base_rss = rss_bytes(server.pid)
+        if mode == "sockets":
+            sockets = await open_sockets(f"ws://127.0.0.1:{port}/ws/agent", args.sessions)
+            sessions = [SocketSession(ws) for ws in sockets]
+        else:
+            sockets = await open_sockets(f"ws://127.0.0.1:{port}/ws/agent/mux", args.connections)
+            connections = [MuxConnection(ws) for ws in sockets]
+            sessions = [
+                MuxSession(connections[n % len(connections)], str(n)) for n in range(args.sessions)
+            ]
+
+        async def run_session(session) -> None:
+            for _ in range(args.turns):
+                await session.turn(samples)
+
+        base_cpu = cpu_seconds(server.pid)
+        started = time.perf_counter()
+        await asyncio.gather(*(run_session(session) for session in sessions))
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(server.pid) - base_cpu
+        # Sessions are still open, with a conversation each
+        rss = rss_bytes(server.pid) - base_rss
+        await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+
+    return {
+        "connections": len(sockets),
+        "kb_per_session": rss / args.sessions / 1e3,
+        "cpu_ms_per_turn": cpu / max(samples.turns, 1) * 1000,
+        "ttft_ms": {k: v * 1000 for k, v in summarize(samples.ttft).items()},
+        "max_gap_ms": {k: v * 1000 for k, v in summarize(samples.max_gap).items()},
+        "turns_per_sec": samples.turns / elapsed,
+        "errors": samples.errors,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"{'mode':<8} {'conns':>6} {'KB/sess':>8} {'CPU ms/turn':>11} {'ttft p50':>8} "
+        f"{'ttft p99':>8} {'gap p99':>8} {'turns/s':>8} {'errors':>6}"
+    )
+    for mode in ("sockets", "mux"):
+        result = await run_mode(mode, args)
+        print(
+            f"{mode:<8} {result['connections']:>6} {result['kb_per_session']:>8.1f} "
+            f"{result['cpu_ms_per_turn']:>11.2f} {result['ttft_ms']['p50']:>8.1f} "
+            f"{result['ttft_ms']['p99']:>8.1f} {result['max_gap_ms']['p99']:>8.1f} "
+            f"{result['turns_per_sec']:>8.1f} {result['errors']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--connections", type=int, default=4, help="multiplexed sockets")
+    parser.add_argument("--turns", type=int, default=3, help="turns per session")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    asyncio.run(main(parser.parse_args()))
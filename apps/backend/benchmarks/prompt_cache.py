@@ -0,0 +1,92 @@
+"""Request payload size, cached prompt share and TTFT over repeated turns.
+
+Compares the agent as ``create_react_agent`` builds it from a model, a tool list and a
+prompt string ("before") with ``prompting.build_agent`` ("after"): tools bound once in
+a stable order, a prebuilt system message and a per-session prompt cache key. The
+fake model simulates a provider's prompt cache over ``--shards`` cache shards. It
+charges ``--prefill-delay`` seconds per input token it cannot serve from cache before
+the first token. Requests without a cache key land on a random shard.
+
+    python -m benchmarks.prompt_cache --sessions 20 --turns 10
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from agent import SYSTEM_PROMPT, get_transactions
+from benchmarks.common import percentile
+from fake_model import FakeStreamingChatModel
+from prompting import build_agent
+
+QUESTIONS = ["Tell me about budgeting", "Show my transactions", "How can I save more?"]
+
+
+def build(variant: str, model: FakeStreamingChatModel):
+    if variant == "before":
+        return create_react_agent(
+            model=model, tools=[get_transactions], prompt=SYSTEM_PROMPT, checkpointer=MemorySaver()
+        )
+    return build_agent(model, [get_transactions], SYSTEM_PROMPT, MemorySaver())
+
+
+async def session(agent, n: int, turns: int, ttft: list[list[float]], usage: list[list]) -> None:
+    config = {"configurable": {"thread_id": f"session-{n}"}}
+    for t in range(turns):
+        sent = time.perf_counter()
+        first = None
+        async for chunk, _ in agent.astream(
+            # Distinct per session, so that sessions only share the prompt prefix
+            {"messages": [{"role": "user", "content": f"{QUESTIONS[t % 3]} (session {n})"}]},
+            config,
+            stream_mode="messages",
+        ):
+            if first is None and (chunk.content or getattr(chunk, "tool_call_chunks", None)):
+                first = time.perf_counter() - sent
+                ttft[t].append(first)
+            if getattr(chunk, "usage_metadata", None):
+                details = chunk.usage_metadata.get("input_token_details", {})
+                usage[t].append(
+                    (chunk.usage_metadata["input_tokens"], details.get("cache_read", 0))
+                )
+
+
+async def run(variant: str, args: argparse.Namespace) -> None:
+    model = FakeStreamingChatModel(cache_shards=args.shards, prefill_delay=args.prefill_delay)
+    agent = build(variant, model)
+    ttft: list[list[float]] = [[] for _ in range(args.turns)]
+    usage: list[list[tuple[int, int]]] = [[] for _ in range(args.turns)]
+    await asyncio.gather(
+        *(session(agent, n, args.turns, ttft, usage) for n in range(args.sessions))
+    )
+
+    sizes = model.payload_sizes
+    print(f"\n{variant}: {len(sizes)} requests, mean payload {statistics.fmean(sizes):.0f} bytes")
+    print(f"{'turn':>4} {'input tok':>9} {'cached':>7} {'ttft p50':>9} {'ttft p99':>9}")
+    for t in range(args.turns):
+        inputs = sum(n for n, _ in usage[t])
+        cached = sum(c for _, c in usage[t])
+        print(
+            f"{t + 1:>4} {inputs / len(usage[t]):>9.0f} {cached / inputs:>7.0%} "
+            f"{percentile(ttft[t], 50) * 1000:>9.1f} {percentile(ttft[t], 99) * 1000:>9.1f}"
+        )
+
+
+async def main(args: argparse.Namespace) -> None:
+    for variant in ("before", "after"):
+        await run(variant, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--shards", type=int, default=8, help="simulated provider cache shards")
+    parser.add_argument(
+        "--prefill-delay", type=float, default=0.0005, help="seconds per uncached input token"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,171 @@
+"""Replay recorded sessions against the server and compare latencies with the recording.
+
+Reads session logs written with ``SESSION_RECORD_DIR`` and serves ``main:app`` with
+``MODEL_REPLAY_LOG`` pointing at them, so that the model streams each recorded call
+with its recorded tokens, gaps, tool calls and usage. Sessions are opened at their
+recorded start offsets. Each turn is sent at its recorded offset within the session,
+or when the previous turn ends if that is later, so that think time is kept. Messages
+are tagged ``[replay:<session>:<turn>]`` for the replay model to find its script.
+
+``--speed`` divides both the arrival offsets and the model's delays; at 10 an hour of
+traffic replays in six minutes, at ten times the load. Time to first frame (tool call
+or content) and turn duration are reported next to the recorded ones at the same
+speed; the difference is time the server added under the replayed load.
+
+    python -m benchmarks.replay "recordings/sessions-*.jsonl*" --speed 10
+    python -m benchmarks.replay "recordings/*.gz" --url ws://127.0.0.1:8000/ws/agent
+
+With ``--url``, the server must already run with ``MODEL_REPLAY_LOG`` set to the same
+logs.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import defaultdict
+
+from websockets.asyncio.client import connect
+
+from benchmarks.common import serve, summarize, write_results
+from recording import read_turns
+
+SUITE = "replay"
+FIRST_FRAMES = ('{"type":"tool_call"', '{"type":"content_delta"')
+
+
+def recorded_ttft(turn: dict) -> float | None:
+    """Seconds from START to the first tool call or content frame of a recorded turn."""
+    start = next((at for at, kind in turn["out"] if kind == "start"), 0.0)
+    first = next((at for at, kind in turn["out"] if kind in ("tool_call", "content_delta")), None)
+    return None if first is None else (first - start) / 1000
+
+
+class Samples:
+    def __init__(self) -> None:
+        self.ttft: list[float] = []
+        self.turn: list[float] = []
+        self.recorded_ttft: list[float] = []
+        self.recorded_turn: list[float] = []
+        # How late turns were sent against their schedule
+        self.lag: list[float] = []
+        self.turns = 0
+        self.errors = 0
+
+
+async def session(
+    url: str, turns: list[dict], started: float, origin: int, speed: float, samples: Samples
+) -> None:
+    """Replay one session's turns; ``started`` is when the recording's ``origin`` is now."""
+    first_ts = turns[0]["ts"]
+    opens = started + (first_ts - origin) / 1000 / speed
+    await asyncio.sleep(max(0.0, opens - time.perf_counter()))
+    async with connect(url, ping_interval=None, max_queue=None, open_timeout=120) as websocket:
+        opened = time.perf_counter()
+        for turn in turns:
+            due = opened + (turn["ts"] - first_ts) / 1000 / speed
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            sent = time.perf_counter()
+            samples.lag.append(sent - due)
+            await websocket.send(f"[replay:{turn['s']}:{turn['n']}] {turn['in']}")
+            first = None
+            async for frame in websocket:
+                if first is None and frame.startswith(FIRST_FRAMES):
+                    first = time.perf_counter() - sent
+                elif frame.startswith('{"type":"end"'):
+                    samples.turns += 1
+                    break
+                elif frame.startswith('{"type":"error"'):
+                    samples.errors += 1
+                    break
+            samples.turn.append(time.perf_counter() - sent)
+            samples.recorded_turn.append(turn["ms"] / 1000 / speed)
+            if first is not None and (recorded := recorded_ttft(turn)) is not None:
+                samples.ttft.append(first)
+                samples.recorded_ttft.append(recorded / speed)
+
+
+async def replay(url: str, sessions: list[list[dict]], speed: float) -> dict:
+    samples = Samples()
+    origin = min(turns[0]["ts"] for turns in sessions)
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(session(url, turns, started, origin, speed, samples) for turns in sessions)
+    )
+    elapsed = time.perf_counter() - started
+
+    def ms(values: list[float]) -> dict[str, float]:
+        return {k: round(v * 1000, 3) for k, v in summarize(values).items()}
+
+    return {
+        "sessions": len(sessions),
+        "turns": samples.turns,
+        "errors": samples.errors,
+        "elapsed_s": round(elapsed, 3),
+        "ttft_ms": ms(samples.ttft),
+        "recorded_ttft_ms": ms(samples.recorded_ttft),
+        "turn_ms": ms(samples.turn),
+        "recorded_turn_ms": ms(samples.recorded_turn),
+        "lag_ms": ms(samples.lag),
+    }
+
+
+def load_sessions(patterns: list[str], limit: int | None) -> list[list[dict]]:
+    """Recorded turns that made model calls, grouped by session in turn order."""
+    by_session: dict[str, list[dict]] = defaultdict(list)
+    for turn in read_turns(patterns):
+        if turn.get("st") == "ok" and turn["calls"]:
+            by_session[turn["s"]].append(turn)
+    sessions = [sorted(turns, key=lambda t: t["n"]) for turns in by_session.values()]
+    sessions.sort(key=lambda turns: turns[0]["ts"])
+    return sessions[:limit] if limit else sessions
+
+
+async def main(args: argparse.Namespace) -> int:
+    sessions = load_sessions(args.logs, args.sessions)
+    if not sessions:
+        print(f"No recorded turns in {args.logs}")
+        return 1
+    print(f"Replaying {len(sessions)} sessions, {sum(map(len, sessions))} turns at {args.speed}x")
+
+    if args.url:
+        result = await replay(args.url, sessions, args.speed)
+    else:
+        env = {
+            "MODEL_REPLAY_LOG": ",".join(os.path.abspath(p) for p in args.logs),
+            "MODEL_REPLAY_SPEED": str(args.speed),
+            "SESSION_RECORD_DIR": "",
+            "MODEL_WARMUP": "false",
+            "IDLE_TIMEOUT": "3600",
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "unused"),
+        }
+        with serve("main:app", env) as (_, port):
+            result = await replay(f"ws://127.0.0.1:{port}/ws/agent", sessions, args.speed)
+
+    print(f"{result['turns']} turns, {result['errors']} errors in {result['elapsed_s']:.1f}s")
+    print(f"{'':>16} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for label, key in (
+        ("ttft recorded", "recorded_ttft_ms"),
+        ("ttft replayed", "ttft_ms"),
+        ("turn recorded", "recorded_turn_ms"),
+        ("turn replayed", "turn_ms"),
+        ("send lag", "lag_ms"),
+    ):
+        values = result[key]
+        print(f"{label:>16} {values['p50']:>9.1f} {values['p95']:>9.1f} {values['p99']:>9.1f}")
+
+    if args.output:
+        config = {"logs": args.logs, "speed": args.speed, "sessions": len(sessions)}
+        write_results(args.output, SUITE, config, result)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("logs", nargs="+", help="session log files or globs, gzipped or not")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up")
+    parser.add_argument("--sessions", type=int, help="replay only the first N sessions")
+    parser.add_argument("--url", help="replay against this running server instead")
+    parser.add_argument("--output", help="write results JSON here")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,154 @@
+"""Throughput of the tuned server profile from 1 to N workers.
+
+For each worker count in ``--workers``, serves the fake-model endpoint with
+``python -m server`` and drives it from ``--clients`` client processes, so the load
+generator does not share one event loop. It measures:
+
+- sockets/sec: websocket handshakes completed per second, each connection closed
+  right away;
+- tokens/sec: ``content_delta`` frames per second across ``--sessions`` concurrent
+  sessions running ``--turns`` turns each, with no token delay.
+
+Both are also reported per core used, ``min(workers, cores)``. Clients and server
+share the machine, so per-core rates fall once the clients need cores of their own.
+
+    python -m benchmarks.server_scaling --workers 1,2,4 --clients 4
+    python -m benchmarks.server_scaling --workers 4 --reuse-port
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from websockets.asyncio.client import connect
+
+from benchmarks.common import serve, write_results
+from server import available_cores
+
+SUITE = "server_scaling"
+QUESTION = "Tell me about budgeting"
+
+
+async def _connections(url: str, count: int, concurrency: int) -> int:
+    done = 0
+    remaining = count
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        nonlocal done
+        async with limit, connect(url, ping_interval=None, open_timeout=60):
+            done += 1
+
+    while remaining:
+        batch = min(remaining, concurrency * 4)
+        remaining -= batch
+        # Failed handshakes are counted as errors by the caller
+        await asyncio.gather(*(one() for _ in range(batch)), return_exceptions=True)
+    return done
+
+
+async def _tokens(url: str, sessions: int, turns: int) -> int:
+    tokens = 0
+
+    async def session() -> None:
+        nonlocal tokens
+        async with connect(url, ping_interval=None, max_queue=None, open_timeout=60) as ws:
+            for _ in range(turns):
+                await ws.send(QUESTION)
+                async for frame in ws:
+                    if frame.startswith('{"type":"content_delta"'):
+                        tokens += 1
+                    elif frame.startswith(('{"type":"end"', '{"type":"error"')):
+                        break
+
+    await asyncio.gather(*(session() for _ in range(sessions)))
+    return tokens
+
+
+def connect_client(url: str, count: int, concurrency: int) -> int:
+    return asyncio.run(_connections(url, count, concurrency))
+
+
+def token_client(url: str, sessions: int, turns: int) -> int:
+    return asyncio.run(_tokens(url, sessions, turns))
+
+
+def run(pool: ProcessPoolExecutor, clients: int, fn, *args) -> tuple[int, float]:
+    """Run ``fn(*args)`` in every client process; returns the summed result and seconds."""
+    started = time.perf_counter()
+    total = sum(pool.map(fn, *([arg] * clients for arg in args)))
+    return total, time.perf_counter() - started
+
+
+def main(args: argparse.Namespace) -> None:
+    cores = available_cores()
+    levels = [int(level) for level in args.workers.split(",")]
+    env = {"IDLE_TIMEOUT": "3600"}
+    print(f"{cores} cores available, {args.clients} client processes")
+    print(
+        f"{'workers':>7} {'sockets/s':>10} {'per core':>9} {'tokens/s':>10} {'per core':>9} "
+        f"{'errors':>6}"
+    )
+    results = {}
+    with ProcessPoolExecutor(args.clients) as pool:
+        for workers in levels:
+            with serve(
+                "benchmarks.streaming_latency:create_app",
+                env,
+                factory=True,
+                workers=workers,
+                reuse_port=args.reuse_port,
+            ) as (_, port):
+                url = f"ws://127.0.0.1:{port}/ws/agent"
+                # Let every worker finish starting up, and warm up the client pool
+                time.sleep(1 + workers * 0.5)
+                run(pool, args.clients, token_client, url, workers, 1)
+
+                per_client = args.connections // args.clients
+                opened, seconds = run(
+                    pool, args.clients, connect_client, url, per_client, args.concurrency
+                )
+                sockets_per_sec = opened / seconds
+                sessions = args.sessions // args.clients
+                tokens, seconds = run(pool, args.clients, token_client, url, sessions, args.turns)
+                tokens_per_sec = tokens / seconds
+
+            used = min(workers, cores)
+            errors = per_client * args.clients - opened
+            results[str(workers)] = {
+                "sockets_per_sec": round(sockets_per_sec, 1),
+                "sockets_per_sec_per_core": round(sockets_per_sec / used, 1),
+                "tokens_per_sec": round(tokens_per_sec, 1),
+                "tokens_per_sec_per_core": round(tokens_per_sec / used, 1),
+                "errors": errors,
+            }
+            print(
+                f"{workers:>7} {sockets_per_sec:>10.0f} {sockets_per_sec / used:>9.0f} "
+                f"{tokens_per_sec:>10.0f} {tokens_per_sec / used:>9.0f} {errors:>6}"
+            )
+
+    if args.output:
+        config = {
+            "workers": levels,
+            "clients": args.clients,
+            "connections": args.connections,
+            "sessions": args.sessions,
+            "turns": args.turns,
+            "reuse_port": args.reuse_port,
+            "cores": cores,
+        }
+        write_results(args.output, SUITE, config, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4", help="worker counts to measure")
+    parser.add_argument("--clients", type=int, default=2, help="client processes")
+    parser.add_argument("--connections", type=int, default=2000, help="handshakes per level")
+    parser.add_argument("--concurrency", type=int, default=64, help="handshakes in flight")
+    parser.add_argument("--sessions", type=int, default=200, help="concurrent token sessions")
+    parser.add_argument("--turns", type=int, default=5, help="turns per token session")
+    parser.add_argument("--reuse-port", action="store_true")
+    parser.add_argument("--output", help="write results JSON here")
+    main(parser.parse_args())
@@ -0,0 +1,172 @@
+"""End-to-end streaming latency over real websockets at increasing concurrency.
+
+Serves the agent endpoint with the fake model under uvicorn, then for each level in
+``--levels`` opens that many sockets at once and runs ``--turns`` turns on each. It
+measures connect time, time to ``start``, time to the first ``content_delta``, the
+gap between deltas and turn throughput.
+
+    python -m benchmarks.streaming_latency --output results.json
+    python -m benchmarks.streaming_latency --baseline benchmarks/baselines/streaming_latency.json
+
+With ``--baseline``, the run is compared against stored results and exits with status
+1 if a metric regressed by more than its threshold; ``--update-baseline`` rewrites
+the baseline from this run instead. Baselines are only comparable on the machine
+they were recorded on.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from websockets.asyncio.client import connect
+
+from agent import AgentWebSocket, get_transactions
+from benchmarks.common import compare, load_results, serve, summarize, write_results
+from fake_model import FakeStreamingChatModel
+
+SUITE = "streaming_latency"
+QUESTION = "Tell me about budgeting"
+
+# Allowed relative regression per metric before --baseline fails the run
+THRESHOLDS = {
+    "connect_ms": 0.5,
+    "start_ms": 0.3,
+    "ttft_ms": 0.3,
+    "gap_ms": 0.3,
+    "turns_per_sec": 0.2,
+}
+
+
+def create_app() -> Starlette:
+    """The production endpoint serving the fake model, for ``uvicorn --factory``."""
+    agent = create_react_agent(
+        model=FakeStreamingChatModel(token_delay=float(os.environ.get("BENCH_TOKEN_DELAY", 0))),
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        checkpointer=MemorySaver(),
+    )
+    aws = AgentWebSocket(agent, logging.getLogger("uvicorn"))
+
+    async def health(_) -> JSONResponse:
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(
+        routes=[Route("/health", health), WebSocketRoute("/ws/agent", aws.agent_websocket_endpoint)]
+    )
+
+
+class Samples:
+    def __init__(self) -> None:
+        self.connect: list[float] = []
+        self.start: list[float] = []
+        self.ttft: list[float] = []
+        self.gap: list[float] = []
+        self.turns = 0
+        self.errors = 0
+
+
+async def session(url: str, turns: int, samples: Samples) -> None:
+    started = time.perf_counter()
+    async with connect(url, ping_interval=None, max_queue=None, open_timeout=120) as websocket:
+        samples.connect.append(time.perf_counter() - started)
+        for _ in range(turns):
+            sent = time.perf_counter()
+            await websocket.send(QUESTION)
+            last_delta = None
+            # Frames are compact JSON with "type" first, so a prefix check avoids parsing
+            async for frame in websocket:
+                now = time.perf_counter()
+                if frame.startswith('{"type":"content_delta"'):
+                    if last_delta is None:
+                        samples.ttft.append(now - sent)
+                    else:
+                        samples.gap.append(now - last_delta)
+                    last_delta = now
+                elif frame.startswith('{"type":"start"'):
+                    samples.start.append(now - sent)
+                elif frame.startswith('{"type":"end"'):
+                    samples.turns += 1
+                    break
+                elif frame.startswith('{"type":"error"'):
+                    samples.errors += 1
+                    break
+
+
+async def run_level(url: str, sockets: int, turns: int) -> dict:
+    samples = Samples()
+    started = time.perf_counter()
+    await asyncio.gather(*(session(url, turns, samples) for _ in range(sockets)))
+    elapsed = time.perf_counter() - started
+
+    def ms(values: list[float]) -> dict[str, float]:
+        return {k: round(v * 1000, 3) for k, v in summarize(values).items()}
+
+    return {
+        "connect_ms": ms(samples.connect),
+        "start_ms": ms(samples.start),
+        "ttft_ms": ms(samples.ttft),
+        "gap_ms": ms(samples.gap),
+        "turns_per_sec": round(samples.turns / elapsed, 3),
+        "errors": samples.errors,
+    }
+
+
+async def main(args: argparse.Namespace) -> int:
+    levels = [int(level) for level in args.levels.split(",")]
+    env = {"BENCH_TOKEN_DELAY": str(args.token_delay), "IDLE_TIMEOUT": "3600"}
+    results = {}
+    with serve("benchmarks.streaming_latency:create_app", env, factory=True) as (_, port):
+        url = f"ws://127.0.0.1:{port}/ws/agent"
+        # Warm up imports, the graph and the connection path
+        await run_level(url, 1, 2)
+        print(
+            f"{'sockets':>7} {'connect p50':>11} {'start p50':>9} {'ttft p50':>8} "
+            f"{'ttft p99':>8} {'gap p50':>7} {'gap p99':>7} {'turns/s':>8} {'errors':>6}"
+        )
+        for level in levels:
+            result = results[str(level)] = await run_level(url, level, args.turns)
+            print(
+                f"{level:>7} {result['connect_ms']['p50']:>11.2f} "
+                f"{result['start_ms']['p50']:>9.2f} {result['ttft_ms']['p50']:>8.2f} "
+                f"{result['ttft_ms']['p99']:>8.2f} {result['gap_ms']['p50']:>7.2f} "
+                f"{result['gap_ms']['p99']:>7.2f} {result['turns_per_sec']:>8.1f} "
+                f"{result['errors']:>6}"
+            )
+
+    config = {"levels": levels, "turns": args.turns, "token_delay": args.token_delay}
+    if args.output:
+        write_results(args.output, SUITE, config, results)
+    if args.baseline and args.update_baseline:
+        write_results(args.baseline, SUITE, config, results)
+        print(f"Baseline written to {args.baseline}")
+    elif args.baseline:
+        baseline = load_results(args.baseline)
+        if baseline["config"] != config:
+            print(f"Baseline was recorded with {baseline['config']}, not {config}")
+            return 1
+        regressions = compare(results, baseline["results"], THRESHOLDS)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", default="1,100,1000", help="concurrent sockets per level")
+    parser.add_argument("--turns", type=int, default=5, help="turns per socket")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="compare against (or update) this results JSON")
+    parser.add_argument("--update-baseline", action="store_true")
+    sys.exit(asyncio.run(main(parser.parse_args())))
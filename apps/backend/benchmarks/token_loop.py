@@ -0,0 +1,126 @@
+"""CPU time and memory churn per streamed token, from model chunk to encoded frame.
+
+Runs ``AgentWebSocket``'s frame loop over a stub graph that streams ``--tokens``
+content chunks, paces the frames at each render cadence and encodes them as the
+endpoint does, so only the server's own per-token work is measured:
+
+- ``us/token``: CPU time per token, the best of ``--rounds`` turns;
+- ``B/token``: bytes allocated and in use at once while handling a token, over what
+  was in use before it, on average. The answer growing by a copy per token shows
+  up here as a figure that grows with ``--tokens``;
+- ``sent B``: bytes of frames sent per token.
+
+The token cadence carries the whole answer so far in every frame, so its figures
+grow with the answer by design; the block cadence's should not. Either way, a token
+should need no more memory than its frame's text and that text's encoding.
+
+    python -m benchmarks.token_loop --tokens 200 2000
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+import tracemalloc
+
+from langchain_core.messages import AIMessageChunk
+
+from accounting import TurnAccounting
+from agent import AgentWebSocket, frame_sender
+from config import RenderCadence
+
+WORD = " budget"
+
+
+class StubGraph:
+    """Streams the same answer every turn; ``probe`` runs before each chunk."""
+
+    def __init__(self, tokens: int) -> None:
+        self.chunks = [(AIMessageChunk(content=WORD, id="run-1"), {}) for _ in range(tokens)]
+        self.probe = None
+
+    async def astream(self, *args, **kwargs):
+        for chunk in self.chunks:
+            if self.probe is not None:
+                self.probe()
+            yield chunk
+
+
+class StubWebSocket:
+    def __init__(self, cadence: RenderCadence) -> None:
+        self.query_params = {"cadence": cadence.value}
+        self.headers = {}
+        self.sent = 0
+
+    async def send_text(self, text: str) -> None:
+        self.sent += len(text)
+
+
+class InFlight:
+    """Peak traced memory above the starting point of each token, summed over tokens."""
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.tokens = 0
+        self.base = None
+
+    def __call__(self) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        if self.base is not None:
+            self.total += max(peak - self.base, 0)
+            self.tokens += 1
+        tracemalloc.reset_peak()
+        self.base = current
+
+
+async def run_turn(aws: AgentWebSocket, cadence: RenderCadence) -> StubWebSocket:
+    websocket = StubWebSocket(cadence)
+    send = frame_sender(websocket)
+    config = {"configurable": {"thread_id": "bench"}}
+    frames = aws._turn_frames("Tell me about budgeting", config, TurnAccounting())
+    async for frame in aws._paced(websocket, frames):
+        await aws._send(send, frame, [])
+    return websocket
+
+
+async def measure(tokens: int, cadence: RenderCadence, rounds: int = 5) -> dict[str, float]:
+    """CPU microseconds, bytes in flight and bytes sent per token, for an answer of
+    ``tokens``."""
+    graph = StubGraph(tokens)
+    aws = AgentWebSocket(graph, logging.getLogger("bench"))
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.process_time()
+        await run_turn(aws, cadence)
+        best = min(best, time.process_time() - started)
+
+    graph.probe = probe = InFlight()
+    tracemalloc.start()
+    try:
+        websocket = await run_turn(aws, cadence)
+    finally:
+        tracemalloc.stop()
+        graph.probe = None
+    return {
+        "us_per_token": best / tokens * 1e6,
+        "bytes_per_token": probe.total / max(probe.tokens, 1),
+        "sent_per_token": websocket.sent / tokens,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{'cadence':<8} {'tokens':>7} {'us/token':>9} {'B/token':>9} {'sent B':>8}")
+    for cadence in (RenderCadence.TOKEN, RenderCadence.BLOCK):
+        for tokens in args.tokens:
+            result = await measure(tokens, cadence, args.rounds)
+            print(
+                f"{cadence.value:<8} {tokens:>7} {result['us_per_token']:>9.2f} "
+                f"{result['bytes_per_token']:>9.0f} {result['sent_per_token']:>8.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, nargs="+", default=[200, 2000])
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+"""Event-loop lag while a CPU-bound tool runs inline, in a thread, or in a process.
+
+Runs ``--calls`` concurrent calls of a synthetic forecasting tool, which aggregates a
+history of ``--transactions`` transactions ``--rounds`` times in pure Python, in each
+execution mode. Meanwhile a probe sleeps ``--interval`` seconds in a loop and records
+how late it wakes up: the delay every other socket of the worker would see between
+two frames. It reports the probe's lag, the tools' latency and the calls per second.
+
+    python -m benchmarks.tool_execution --calls 8 --transactions 20000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import summarize
+from tool_execution import ToolExecution, ToolExecutor, runs_in
+
+CATEGORIES = ("groceries", "rent", "transport", "dining", "utilities")
+
+
+@runs_in(ToolExecution.PROCESS)
+def forecast_spending(transactions: list[dict], rounds: int) -> dict[str, float]:
+    """Forecast next month's spending per category from the transaction history."""
+    forecast: dict[str, float] = {}
+    for n in range(rounds):
+        totals: dict[str, float] = {}
+        for transaction in transactions:
+            category = transaction["category"]
+            totals[category] = totals.get(category, 0.0) + float(transaction["amount"])
+        for category, total in totals.items():
+            forecast[category] = (forecast.get(category, 0.0) * n + total) / (n + 1)
+    return forecast
+
+
+def history(size: int) -> list[dict]:
+    return [
+        {"id": str(n), "category": CATEGORIES[n % len(CATEGORIES)], "amount": f"-{n % 100}.99"}
+        for n in range(size)
+    ]
+
+
+async def probe(interval: float, lags: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(time.perf_counter() - expected, 0.0))
+
+
+async def run_mode(executor: ToolExecutor, mode: ToolExecution, args: argparse.Namespace) -> dict:
+    kwargs = {"transactions": history(args.transactions), "rounds": args.rounds}
+    lags: list[float] = []
+    latencies: list[float] = []
+    stop = asyncio.Event()
+
+    async def call() -> None:
+        started = time.perf_counter()
+        await executor.run(forecast_spending, mode, kwargs, None)
+        latencies.append(time.perf_counter() - started)
+
+    prober = asyncio.create_task(probe(args.interval, lags, stop))
+    await asyncio.sleep(args.interval * 2)
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(args.calls)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await prober
+    return {
+        "lag_ms": {k: v * 1000 for k, v in summarize(lags).items()},
+        "max_lag_ms": max(lags) * 1000,
+        "latency_ms": {k: v * 1000 for k, v in summarize(latencies).items()},
+        "calls_per_sec": args.calls / elapsed,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    executor = ToolExecutor(thread_workers=args.workers, process_workers=args.workers, timeout=None)
+    executor.wrap([forecast_spending])
+    await executor.start()
+    print(
+        f"{'mode':<8} {'lag p50':>8} {'lag p99':>8} {'lag max':>8} "
+        f"{'tool p50':>9} {'tool p99':>9} {'calls/s':>8}"
+    )
+    try:
+        for mode in ToolExecution:
+            result = await run_mode(executor, mode, args)
+            print(
+                f"{mode:<8} {result['lag_ms']['p50']:>8.1f} {result['lag_ms']['p99']:>8.1f} "
+                f"{result['max_lag_ms']:>8.1f} {result['latency_ms']['p50']:>9.1f} "
+                f"{result['latency_ms']['p99']:>9.1f} {result['calls_per_sec']:>8.2f}"
+            )
+    finally:
+        await executor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=8, help="concurrent tool calls")
+    parser.add_argument("--transactions", type=int, default=20000, help="history size")
+    parser.add_argument("--rounds", type=int, default=5, help="passes over the history")
+    parser.add_argument("--workers", type=int, default=2, help="threads and processes")
+    parser.add_argument("--interval", type=float, default=0.005, help="probe sleep, seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,136 @@
+"""Time to the first tool call and tool result, with and without eager tool execution.
+
+Serves the agent endpoint under uvicorn with a fake model that answers each question
+with ``--calls`` parallel calls to a side-effect-free tool taking ``--tool-delay``
+seconds, streaming their arguments ``--chunk-size`` characters per token. Each of
+``--sessions`` sessions runs ``--turns`` turns, once with ``EAGER_TOOLS`` off and
+once on. It reports the time from sending the question to the first ``tool_call_delta``
+(the tool's name), the first ``tool_call`` and the first ``tool_result``, and to ``end``.
+
+    python -m benchmarks.tool_streaming --calls 3 --tool-delay 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from websockets.asyncio.client import connect
+
+from agent import AgentWebSocket
+from benchmarks.common import serve, summarize
+from fake_model import FakeStreamingChatModel
+from prompting import build_agent
+from tool_streaming import EagerTools, side_effect_free
+
+QUESTION = "How much did I spend on each account?"
+FRAMES = ("tool_call_delta", "tool_call", "tool_result", "end")
+
+
+@side_effect_free
+async def get_account_transactions(account: str, since: str) -> dict[str, Any]:
+    """Get an account's transactions since a date."""
+    await asyncio.sleep(float(os.environ.get("BENCH_TOOL_DELAY", 0)))
+    return {"data": [{"id": "1", "account": account, "amount": "-10.99", "date_time": since}]}
+
+
+class ParallelToolModel(FakeStreamingChatModel):
+    """Answers questions with parallel calls to ``get_account_transactions``."""
+
+    calls: int = 3
+
+    def _respond(self, messages: list[BaseMessage], tools: list[dict] | None) -> AIMessage:
+        if not isinstance(messages[-1], HumanMessage):
+            return super()._respond(messages, tools)
+        return AIMessage(
+            content="",
+            tool_calls=[
+                {
+                    "name": "get_account_transactions",
+                    "args": {"account": f"account-{n:04d}", "since": "2025-10-01T00:00:00Z"},
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                }
+                for n in range(self.calls)
+            ],
+        )
+
+
+def create_app() -> Starlette:
+    """The endpoint serving the parallel tool model, for ``uvicorn --factory``."""
+    model = ParallelToolModel(
+        calls=int(os.environ["BENCH_CALLS"]),
+        token_delay=float(os.environ["BENCH_TOKEN_DELAY"]),
+        tool_args_chunk_size=int(os.environ["BENCH_CHUNK_SIZE"]),
+    )
+    eager = EagerTools([get_account_transactions]) if os.environ["BENCH_EAGER"] == "1" else None
+    tools = eager.tools if eager is not None else [get_account_transactions]
+    agent = build_agent(model, tools, "You are a helpful financial assistant.", MemorySaver())
+    aws = AgentWebSocket(agent, logging.getLogger("uvicorn"), eager_tools=eager)
+
+    async def health(_) -> JSONResponse:
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(
+        routes=[Route("/health", health), WebSocketRoute("/ws/agent", aws.agent_websocket_endpoint)]
+    )
+
+
+async def session(url: str, turns: int, samples: dict[str, list[float]]) -> None:
+    async with connect(url, ping_interval=None, max_queue=None) as websocket:
+        for _ in range(turns):
+            sent = time.perf_counter()
+            await websocket.send(QUESTION)
+            seen = set()
+            async for text in websocket:
+                kind = json.loads(text)["type"]
+                if kind in FRAMES and kind not in seen:
+                    seen.add(kind)
+                    samples[kind].append(time.perf_counter() - sent)
+                if kind in ("end", "error"):
+                    break
+
+
+async def run_mode(eager: bool, args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    env = {
+        "BENCH_EAGER": "1" if eager else "0",
+        "BENCH_CALLS": str(args.calls),
+        "BENCH_TOKEN_DELAY": str(args.token_delay),
+        "BENCH_CHUNK_SIZE": str(args.chunk_size),
+        "BENCH_TOOL_DELAY": str(args.tool_delay),
+        "IDLE_TIMEOUT": "3600",
+    }
+    samples: dict[str, list[float]] = {kind: [] for kind in FRAMES}
+    with serve("benchmarks.tool_streaming:create_app", env, factory=True) as (_, port):
+        url = f"ws://127.0.0.1:{port}/ws/agent"
+        await asyncio.gather(*(session(url, args.turns, samples) for _ in range(args.sessions)))
+    return {kind: {k: v * 1000 for k, v in summarize(samples[kind]).items()} for kind in FRAMES}
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"{'eager':<6}" + "".join(f" {kind + ' p50 ms':>20}" for kind in FRAMES))
+    for eager in (False, True):
+        result = await run_mode(eager, args)
+        print(
+            f"{'on' if eager else 'off':<6}"
+            + "".join(f" {result[k]['p50']:>20.1f}" for k in FRAMES)
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=3, help="parallel tool calls per answer")
+    parser.add_argument("--chunk-size", type=int, default=8, help="argument characters per token")
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--tool-delay", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
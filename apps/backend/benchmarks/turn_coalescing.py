@@ -0,0 +1,131 @@
+"""Upstream model calls and turn latency for a burst of mostly identical questions.
+
+``--sessions`` fresh sessions connect within ``--burst`` seconds and each asks one
+question: ``--hot`` of them the same one, the rest one of ``--questions`` others. The
+endpoint is driven in-process, with and without coalescing, against the fake model.
+
+    python -m benchmarks.turn_coalescing --sessions 1000 --hot 0.8
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+from starlette.websockets import WebSocketDisconnect
+
+from agent import AgentWebSocket, get_transactions
+from benchmarks.common import summarize
+from fake_model import FakeStreamingChatModel
+
+
+class CountingModel(FakeStreamingChatModel):
+    """Fake model that counts streamed generations."""
+
+    calls: int = 0
+
+    async def _astream(self, *args, **kwargs):
+        self.calls += 1
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+
+class BurstWebSocket:
+    """Sends one message, records when frames arrive and disconnects after END."""
+
+    def __init__(self, text: str) -> None:
+        self.inbox: asyncio.Queue[str | None] = asyncio.Queue()
+        self.inbox.put_nowait(text)
+        self.started = time.perf_counter()
+        self.first_delta: float | None = None
+        self.finished: float | None = None
+
+    async def accept(self) -> None:
+        pass
+
+    async def receive_text(self) -> str:
+        if (text := await self.inbox.get()) is None:
+            raise WebSocketDisconnect()
+        return text
+
+    async def send_json(self, data: dict) -> None:
+        if data["type"] == "content_delta" and self.first_delta is None:
+            self.first_delta = time.perf_counter()
+        elif data["type"] in ("end", "error"):
+            self.finished = time.perf_counter()
+            self.inbox.put_nowait(None)
+
+    async def close(self, code: int = 1000) -> None:
+        self.inbox.put_nowait(None)
+
+
+def workload(args: argparse.Namespace) -> list[tuple[float, str]]:
+    rng = random.Random(args.seed)
+    others = [
+        f"Question number {n}: how can I save more each month?" for n in range(args.questions)
+    ]
+    return [
+        (
+            rng.uniform(0, args.burst),
+            "What is the status of my transfer?" if rng.random() < args.hot else rng.choice(others),
+        )
+        for _ in range(args.sessions)
+    ]
+
+
+async def run(coalesce: bool, args: argparse.Namespace) -> dict:
+    model = CountingModel(token_delay=args.token_delay)
+    agent = create_react_agent(
+        model=model,
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        checkpointer=MemorySaver(),
+    )
+    aws = AgentWebSocket(agent, logging.getLogger("bench"), coalesce=coalesce)
+    sockets: list[BurstWebSocket] = []
+
+    async def session(delay: float, text: str) -> None:
+        await asyncio.sleep(delay)
+        websocket = BurstWebSocket(text)
+        sockets.append(websocket)
+        await aws.agent_websocket_endpoint(websocket)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(delay, text) for delay, text in workload(args)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "upstream_calls": model.calls,
+        "ttft_ms": summarize([(ws.first_delta - ws.started) * 1000 for ws in sockets]),
+        "turn_ms": summarize([(ws.finished - ws.started) * 1000 for ws in sockets]),
+        "elapsed_s": elapsed,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"{'coalesce':<9} {'calls':>7} {'ttft p50':>9} {'ttft p99':>9} "
+        f"{'turn p50':>9} {'turn p99':>9} {'wall s':>7}"
+    )
+    for coalesce in (False, True):
+        result = await run(coalesce, args)
+        ttft, turn = result["ttft_ms"], result["turn_ms"]
+        print(
+            f"{str(coalesce).lower():<9} {result['upstream_calls']:>7} {ttft['p50']:>9.1f} "
+            f"{ttft['p99']:>9.1f} {turn['p50']:>9.1f} {turn['p99']:>9.1f} "
+            f"{result['elapsed_s']:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--burst", type=float, default=1.0, help="arrival window (s)")
+    parser.add_argument("--hot", type=float, default=0.8, help="share asking the same question")
+    parser.add_argument("--questions", type=int, default=20, help="distinct other questions")
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
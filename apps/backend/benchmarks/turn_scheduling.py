@@ -0,0 +1,156 @@
+"""Interactive turn latency while batch sessions saturate the turn slots.
+
+``--interactive`` sessions ask short questions with ``--think`` seconds between turns,
+while ``--batch`` sessions keep asking long analytical ones. Both run in-process
+through the endpoint with ``--slots`` concurrent turns, once with every turn in one
+FIFO class and once classified by priority.
+
+    python -m benchmarks.turn_scheduling --slots 8 --interactive 50 --batch 40
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+from starlette.websockets import WebSocketDisconnect
+
+from agent import AgentWebSocket
+from benchmarks.common import summarize
+from config import TurnPriority
+from fake_model import FakeStreamingChatModel
+from scheduling import TurnScheduler, classify_turn
+
+ANALYTICAL = "Analyse my spending over the last year by category"
+
+
+class MixedModel(FakeStreamingChatModel):
+    """Fake model whose analytical answers are ``analysis_tokens`` long."""
+
+    analysis_tokens: int = 300
+
+    def _respond(self, messages, tools):
+        if ANALYTICAL in str(messages[-1].content):
+            return AIMessage(content=" ".join(["spending"] * self.analysis_tokens))
+        return super()._respond(messages, tools)
+
+
+class ScriptedWebSocket:
+    """Sends ``turns`` messages ``think`` seconds apart and records each turn's latency."""
+
+    def __init__(self, text: str, turns: int, think: float, query: dict[str, str]) -> None:
+        self.text = text
+        self.remaining = turns
+        self.think = think
+        self.query_params = query
+        self.headers: dict[str, str] = {}
+        self.inbox: asyncio.Queue[str | None] = asyncio.Queue()
+        self.sent_at = 0.0
+        self.first_delta: float | None = None
+        self.ttft: list[float] = []
+        self.latencies: list[float] = []
+        self.errors = 0
+        self._send_next()
+
+    def _send_next(self) -> None:
+        if not self.remaining:
+            self.inbox.put_nowait(None)
+            return
+        self.remaining -= 1
+        self.sent_at = time.perf_counter()
+        self.first_delta = None
+        self.inbox.put_nowait(self.text)
+
+    async def accept(self) -> None:
+        pass
+
+    async def receive_text(self) -> str:
+        if (text := await self.inbox.get()) is None:
+            raise WebSocketDisconnect()
+        return text
+
+    async def send_json(self, data: dict) -> None:
+        if data["type"] == "content_delta" and self.first_delta is None:
+            self.first_delta = time.perf_counter()
+            self.ttft.append(self.first_delta - self.sent_at)
+        elif data["type"] in ("end", "error"):
+            self.latencies.append(time.perf_counter() - self.sent_at)
+            self.errors += data["type"] == "error"
+            asyncio.get_running_loop().call_later(self.think, self._send_next)
+
+    async def close(self, code: int = 1000) -> None:
+        self.inbox.put_nowait(None)
+
+
+async def run(prioritized: bool, args: argparse.Namespace) -> dict:
+    agent = create_react_agent(
+        model=MixedModel(token_delay=args.token_delay),
+        tools=[],
+        checkpointer=MemorySaver(),
+    )
+
+    def fifo(websocket, user_msg: str) -> tuple[TurnPriority, str]:
+        return TurnPriority.INTERACTIVE, "default"
+
+    aws = AgentWebSocket(
+        agent,
+        logging.getLogger("bench"),
+        scheduler=TurnScheduler(args.slots, deadlines={TurnPriority.INTERACTIVE: 120.0}),
+        classify=classify_turn if prioritized else fifo,
+    )
+    rng = random.Random(args.seed)
+    interactive = [
+        ScriptedWebSocket("What is my balance?", args.turns, args.think, {"tenant": f"u{n}"})
+        for n in range(args.interactive)
+    ]
+    batch = [
+        ScriptedWebSocket(ANALYTICAL, args.turns, 0.0, {"priority": "batch", "tenant": "reports"})
+        for _ in range(args.batch)
+    ]
+
+    async def session(websocket: ScriptedWebSocket) -> None:
+        await asyncio.sleep(rng.uniform(0, args.think))
+        await aws.agent_websocket_endpoint(websocket)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(ws) for ws in batch + interactive))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "interactive_ttft_ms": summarize([t * 1000 for ws in interactive for t in ws.ttft]),
+        "interactive_turn_ms": summarize([t * 1000 for ws in interactive for t in ws.latencies]),
+        "batch_turn_ms": summarize([t * 1000 for ws in batch for t in ws.latencies]),
+        "errors": sum(ws.errors for ws in interactive + batch),
+        "elapsed_s": elapsed,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(
+        f"{'scheduling':<11} {'int ttft p50':>12} {'int ttft p99':>12} {'int turn p99':>12} "
+        f"{'batch p50':>10} {'errors':>6} {'wall s':>7}"
+    )
+    for prioritized in (False, True):
+        result = await run(prioritized, args)
+        ttft, turn = result["interactive_ttft_ms"], result["interactive_turn_ms"]
+        print(
+            f"{'priority' if prioritized else 'fifo':<11} {ttft['p50']:>12.1f} "
+            f"{ttft['p99']:>12.1f} {turn['p99']:>12.1f} {result['batch_turn_ms']['p50']:>10.1f} "
+            f"{result['errors']:>6} {result['elapsed_s']:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--interactive", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=40)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--think", type=float, default=1.0, help="seconds between turns")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+"""Retrieval latency of user memories as the number of facts stored grows.
+
+Fills a ``UserMemoryStore`` with synthetic facts, spread evenly over ``--users`` users,
+up to ``--memories`` in all. One more user is given ``--max-per-user`` facts, the
+most any user keeps. Each time the store grows tenfold, from 10,000 facts, it times
+``--queries`` retrievals for random users and as many for that user:
+
+- ``per user``: facts of a typical user;
+- ``p50 us``/``p99 us``: retrieval latency, for a typical user and the full one;
+- ``prompt``: characters added to the prompt by the top ``k`` facts, against all the
+  full user's facts, which replaying their history would add at least;
+- ``RSS MB``: the process's peak resident memory.
+
+    python -m benchmarks.user_memory --memories 1000000 --users 10000
+"""
+
+import argparse
+import random
+import resource
+import string
+import time
+
+from benchmarks.common import summarize
+from user_memory import Fact, UserMemoryStore
+
+TEMPLATES = (
+    "The user prefers {} {} for {}.",
+    "The user's favorite {} is {} {}.",
+    "The user often asks: how much did I spend on {} and {} in {}?",
+    "The user doesn't like {} {} {}.",
+)
+
+
+def synthetic_fact(rng: random.Random, vocabulary: list[str], n: int) -> Fact:
+    template = rng.choice(TEMPLATES)
+    return Fact("preference", f"fact-{n}", template.format(*rng.sample(vocabulary, 3)))
+
+
+def latencies(store: UserMemoryStore, users: list[str], queries: list[str]) -> list[float]:
+    timings = []
+    for user_id, query in zip(users, queries, strict=True):
+        started = time.perf_counter()
+        store.search(user_id, query)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(0)
+    vocabulary = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+        for _ in range(args.vocabulary)
+    ]
+    store = UserMemoryStore(
+        k=args.k,
+        min_score=0.0,
+        max_per_user=args.max_per_user,
+        max_memories=args.memories + args.max_per_user,
+    )
+    users = [f"user-{n}" for n in range(args.users)]
+    for n in range(args.max_per_user):
+        store.add("full", synthetic_fact(rng, vocabulary, n))
+    all_facts = sum(len(m.text) for m in store.facts_of("full"))
+
+    print(
+        f"{'facts':>9} {'per user':>8} {'build/s':>8} {'p50 us':>7} {'p99 us':>7} "
+        f"{'full p50':>8} {'full p99':>8} {'prompt':>7} {'replay':>7} {'RSS MB':>7}"
+    )
+    added, target = 0, 10_000
+    while target <= args.memories:
+        started, step = time.perf_counter(), target - added
+        while added < target:
+            store.add(users[added % len(users)], synthetic_fact(rng, vocabulary, added))
+            added += 1
+        build = step / (time.perf_counter() - started)
+
+        queries = [" ".join(rng.sample(vocabulary, 3)) for _ in range(args.queries)]
+        typical = summarize(latencies(store, rng.choices(users, k=args.queries), queries))
+        full = summarize(latencies(store, ["full"] * args.queries, queries))
+        prompt = sum(len(m.text) for m in store.search("full", queries[0]))
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(
+            f"{store.count:>9} {target / len(users):>8.0f} {build:>8.0f} "
+            f"{typical['p50'] * 1e6:>7.1f} {typical['p99'] * 1e6:>7.1f} "
+            f"{full['p50'] * 1e6:>8.1f} {full['p99'] * 1e6:>8.1f} "
+            f"{prompt:>7} {all_facts:>7} {rss:>7.0f}"
+        )
+        target *= 10
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--memories", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--max-per-user", type=int, default=1000)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("-k", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,853 @@
+"""Checkpointer lifecycle, write-behind batching and caching of latest checkpoints."""
+
+import asyncio
+import json
+import logging
+from collections import Counter, OrderedDict
+from collections.abc import AsyncIterator, Sequence
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.postgres.base import BasePostgresSaver
+from psycopg import AsyncConnection, Capabilities
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from config import CheckpointCacheValidation
+from metrics import Counter as MetricCounter
+from metrics import Gauge
+from serialization import CheckpointSerializer
+
+logger = logging.getLogger("uvicorn")
+
+# Postgres accepts at most 65535 bind parameters per statement.
+MAX_BIND_PARAMS = 65535
+
+CREATE_CHECKPOINT_PAYLOADS_SQL = """
+    CREATE TABLE IF NOT EXISTS checkpoint_payloads (
+        digest BYTEA PRIMARY KEY,
+        type TEXT NOT NULL,
+        payload BYTEA NOT NULL,
+        touched_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+# Tables created before ``touched_at`` existed
+ADD_PAYLOADS_TOUCHED_AT_SQL = """
+    ALTER TABLE checkpoint_payloads
+    ADD COLUMN IF NOT EXISTS touched_at TIMESTAMPTZ NOT NULL DEFAULT now()
+"""
+
+# ``touched_at`` is refreshed at most hourly when a payload is referenced again, so
+# retention can tell payloads that may be referenced by in-flight writes apart from
+# garbage without rewriting the row on every checkpoint.
+PAYLOAD_TOUCH_INTERVAL = "1 hour"
+
+UPSERT_CHECKPOINT_PAYLOADS_SQL = f"""
+    INSERT INTO checkpoint_payloads (digest, type, payload)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (digest) DO UPDATE SET touched_at = now()
+    WHERE checkpoint_payloads.touched_at < now() - interval '{PAYLOAD_TOUCH_INTERVAL}'
+"""
+
+SELECT_CHECKPOINT_PAYLOADS_SQL = """
+    SELECT digest, type, payload FROM checkpoint_payloads WHERE digest = ANY(%s)
+"""
+
+SELECT_LATEST_CHECKPOINT_ID_SQL = """
+    SELECT checkpoint_id FROM checkpoints
+    WHERE thread_id = %s AND checkpoint_ns = %s
+    ORDER BY checkpoint_id DESC LIMIT 1
+"""
+
+CHECKPOINT_CHANGES_CHANNEL = "checkpoint_changes"
+
+# Notify CHECKPOINT_CHANGES_CHANNEL of checkpoints written or deleted, and of writes
+# to a checkpoint, as a JSON array [op, thread_id, checkpoint_ns, checkpoint_id]. An
+# op is "put", "delete" or "write". Notifications are sent when the write commits, and
+# identical ones from one statement are sent once.
+CREATE_CHECKPOINT_NOTIFY_SQL = [
+    f"""
+    CREATE OR REPLACE FUNCTION notify_checkpoint_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('{CHECKPOINT_CHANGES_CHANNEL}', json_build_array(
+                'delete', OLD.thread_id, OLD.checkpoint_ns, OLD.checkpoint_id)::text);
+            RETURN OLD;
+        END IF;
+        PERFORM pg_notify('{CHECKPOINT_CHANGES_CHANNEL}', json_build_array(
+            TG_ARGV[0], NEW.thread_id, NEW.checkpoint_ns, NEW.checkpoint_id)::text);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE TRIGGER checkpoints_notify
+    AFTER INSERT OR UPDATE OR DELETE ON checkpoints
+    FOR EACH ROW EXECUTE FUNCTION notify_checkpoint_change('put')
+    """,
+    """
+    CREATE OR REPLACE TRIGGER checkpoint_writes_notify
+    AFTER INSERT OR UPDATE ON checkpoint_writes
+    FOR EACH ROW EXECUTE FUNCTION notify_checkpoint_change('write')
+    """,
+]
+
+CACHE_LOOKUPS = MetricCounter(
+    "checkpoint_cache_lookups_total",
+    "Checkpoint loads through the checkpoint cache, by result: hit, miss or stale",
+    ["result"],
+)
+CACHED_THREADS = Gauge("checkpoint_cache_threads", "Threads whose latest checkpoint is cached")
+
+
+@dataclass(slots=True)
+class PendingPut:
+    config: RunnableConfig
+    checkpoint: Checkpoint
+    metadata: CheckpointMetadata
+    new_versions: ChannelVersions
+
+
+@dataclass(slots=True)
+class PendingWrites:
+    config: RunnableConfig
+    writes: Sequence[tuple[str, Any]]
+    task_id: str
+    task_path: str = ""
+
+
+def _multi_row(sql: str, row_count: int) -> str:
+    """Expand a single-row ``INSERT ... VALUES (...)`` statement to ``row_count`` rows."""
+    head, _, tail = sql.partition("VALUES")
+    row, _, conflict = tail.partition(")")
+    return f"{head}VALUES {', '.join([row.strip() + ')'] * row_count)}{conflict}"
+
+
+def _dedupe(rows: list[tuple], key_len: int) -> list[tuple]:
+    """Keep the last row for each primary key; an upsert may not touch a row twice."""
+    return list({row[:key_len]: row for row in rows}.values())
+
+
+def next_checkpoint_config(config: RunnableConfig, checkpoint: Checkpoint) -> RunnableConfig:
+    """The config ``aput`` returns: the thread and namespace of ``config``, at ``checkpoint``."""
+    configurable = config["configurable"]
+    return {
+        "configurable": {
+            "thread_id": configurable["thread_id"],
+            "checkpoint_ns": configurable["checkpoint_ns"],
+            "checkpoint_id": checkpoint["id"],
+        }
+    }
+
+
+def _checkpoint_row(put: PendingPut) -> tuple[tuple, dict[str, Any], ChannelVersions]:
+    """Split a checkpoint into its table row and the channel values stored as blobs.
+
+    Mirrors ``AsyncPostgresSaver.aput``: primitive values stay inline in the checkpoint.
+    """
+    configurable = put.config["configurable"]
+    copy = put.checkpoint.copy()
+    copy["channel_values"] = copy["channel_values"].copy()
+    blob_values = {}
+    for k, v in put.checkpoint["channel_values"].items():
+        if v is None or isinstance(v, str | int | float | bool):
+            continue
+        blob_values[k] = copy["channel_values"].pop(k)
+    row = (
+        configurable["thread_id"],
+        configurable["checkpoint_ns"],
+        put.checkpoint["id"],
+        configurable.get("checkpoint_id"),
+        Jsonb(copy),
+        Jsonb(get_checkpoint_metadata(put.config, put.metadata)),
+    )
+    blob_versions = {k: v for k, v in put.new_versions.items() if k in blob_values}
+    return row, blob_values, blob_versions
+
+
+class PostgresCheckpointer(AsyncPostgresSaver):
+    """``AsyncPostgresSaver`` over a connection pool that is opened at application startup.
+
+    The agent graph is built at import time, before an event loop is running, so the
+    pool is created closed and opened (and the schema migrated) in ``aopen``.
+
+    All writes go through ``aput_batch``. With a ``CheckpointSerializer``, large tool
+    payloads are stored once in ``checkpoint_payloads`` in the same pipeline as the
+    blobs that reference them, and fetched (via a per-process cache) before loading.
+
+    With ``notify_changes``, ``setup`` installs triggers that report every checkpoint
+    change to ``anotifications`` listeners in all processes.
+    """
+
+    def __init__(
+        self,
+        conn_string: str,
+        *,
+        min_size: int = 1,
+        max_size: int = 10,
+        serde=None,
+        notify_changes: bool = False,
+    ) -> None:
+        BasePostgresSaver.__init__(self, serde=serde)
+        self.notify_changes = notify_changes
+        self.conn = AsyncConnectionPool(
+            conn_string,
+            min_size=min_size,
+            max_size=max_size,
+            open=False,
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+        )
+        self.pipe = None
+        self.lock = asyncio.Lock()
+        self.supports_pipeline = Capabilities().has_pipeline()
+
+    async def aopen(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        await self.conn.open()
+        await self.setup()
+
+    async def aclose(self) -> None:
+        await self.conn.close()
+
+    async def setup(self) -> None:
+        await super().setup()
+        async with self._cursor() as cur:
+            await cur.execute(CREATE_CHECKPOINT_PAYLOADS_SQL)
+            await cur.execute(ADD_PAYLOADS_TOUCHED_AT_SQL)
+            if self.notify_changes:
+                for sql in CREATE_CHECKPOINT_NOTIFY_SQL:
+                    await cur.execute(sql)
+
+    async def alatest_checkpoint_id(self, thread_id: str, checkpoint_ns: str) -> str | None:
+        """Id of the thread's latest checkpoint, without loading it."""
+        async with self.conn.connection() as conn:
+            cur = await conn.execute(SELECT_LATEST_CHECKPOINT_ID_SQL, (thread_id, checkpoint_ns))
+            row = await cur.fetchone()
+        return row["checkpoint_id"] if row else None
+
+    async def anotifications(self) -> AsyncIterator[tuple[str, str, str, str] | None]:
+        """Checkpoint changes by any process, as ``(op, thread_id, checkpoint_ns, checkpoint_id)``.
+
+        Listens on a connection of its own. ``None`` is yielded once listening; changes
+        committed before that are not reported.
+        """
+        async with await AsyncConnection.connect(self.conn.conninfo, autocommit=True) as conn:
+            await conn.execute(f"LISTEN {CHECKPOINT_CHANGES_CHANNEL}")
+            yield None
+            async for notify in conn.notifies():
+                yield tuple(json.loads(notify.payload))
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        await self.aput_batch([PendingPut(config, checkpoint, metadata, new_versions)], [])
+        return next_checkpoint_config(config, checkpoint)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await self.aput_batch([], [PendingWrites(config, writes, task_id, task_path)])
+
+    async def _load_checkpoint_tuple(self, value) -> CheckpointTuple:
+        if not isinstance(self.serde, CheckpointSerializer):
+            return await super()._load_checkpoint_tuple(value)
+        digests = {
+            digest
+            for *_, type_, blob in (value["channel_values"] or []) + (value["pending_writes"] or [])
+            for digest in self.serde.referenced_payloads(type_.decode(), blob)
+        }
+        if not digests:
+            return await super()._load_checkpoint_tuple(value)
+        with self.serde.provide_payloads(await self._fetch_payloads(digests)):
+            return await super()._load_checkpoint_tuple(value)
+
+    async def _fetch_payloads(self, digests: set[bytes]) -> dict[bytes, str]:
+        payloads = self.serde.cached_payloads(digests)
+        if missing := digests - payloads.keys():
+            # A separate pooled connection: the caller may hold ``self.lock``.
+            async with self.conn.connection() as conn:
+                cur = await conn.execute(SELECT_CHECKPOINT_PAYLOADS_SQL, [list(missing)])
+                for row in await cur.fetchall():
+                    payloads[row["digest"]] = self.serde.decode_payload(row["type"], row["payload"])
+        return payloads
+
+    def _dump_batch(
+        self, puts: list[PendingPut], writes: list[PendingWrites]
+    ) -> list[tuple[str, list[tuple]]]:
+        collect = (
+            self.serde.collect_payloads()
+            if isinstance(self.serde, CheckpointSerializer)
+            else nullcontext({})
+        )
+        with collect as payloads:
+            checkpoint_rows, blob_rows = [], []
+            for put in puts:
+                row, blob_values, blob_versions = _checkpoint_row(put)
+                checkpoint_rows.append(row)
+                blob_rows.extend(self._dump_blobs(row[0], row[1], blob_values, blob_versions))
+
+            upsert_rows, insert_rows = [], []
+            for item in writes:
+                configurable = item.config["configurable"]
+                rows = self._dump_writes(
+                    configurable["thread_id"],
+                    configurable["checkpoint_ns"],
+                    configurable["checkpoint_id"],
+                    item.task_id,
+                    item.task_path,
+                    item.writes,
+                )
+                if all(channel in WRITES_IDX_MAP for channel, _ in item.writes):
+                    upsert_rows.extend(rows)
+                else:
+                    insert_rows.extend(rows)
+
+        return [
+            (
+                UPSERT_CHECKPOINT_PAYLOADS_SQL,
+                [(digest, *payload) for digest, payload in payloads.items()],
+            ),
+            (self.UPSERT_CHECKPOINT_BLOBS_SQL, _dedupe(blob_rows, 4)),
+            (self.UPSERT_CHECKPOINTS_SQL, _dedupe(checkpoint_rows, 3)),
+            # (thread_id, checkpoint_ns, checkpoint_id, task_id, task_path, idx): key skips path
+            (
+                self.UPSERT_CHECKPOINT_WRITES_SQL,
+                list({r[:4] + r[5:6]: r for r in upsert_rows}.values()),
+            ),
+            (self.INSERT_CHECKPOINT_WRITES_SQL, insert_rows),
+        ]
+
+    async def aput_batch(self, puts: list[PendingPut], writes: list[PendingWrites]) -> None:
+        """Persist checkpoints and writes from many threads in a single pipeline.
+
+        Each table gets one multi-row ``INSERT`` (split only to respect the bind
+        parameter limit), so a batch costs one round trip regardless of its size.
+        """
+        statements = await asyncio.to_thread(self._dump_batch, puts, writes)
+        async with self._cursor(pipeline=True) as cur:
+            for sql, rows in statements:
+                if not rows:
+                    continue
+                chunk = max(1, MAX_BIND_PARAMS // len(rows[0]))
+                for start in range(0, len(rows), chunk):
+                    part = rows[start : start + chunk]
+                    await cur.execute(
+                        _multi_row(sql, len(part)), [value for row in part for value in row]
+                    )
+
+
+class WriteBehindCheckpointer(BaseCheckpointSaver):
+    """Acknowledges checkpoint writes once queued and persists them in batches.
+
+    Writes from all sessions share one bounded queue; a background task drains it
+    into the wrapped saver when ``batch_size`` items are waiting or ``flush_interval``
+    seconds after the first one arrived. A full queue applies backpressure to the
+    writing turn instead of growing without bound.
+
+    Crash semantics: anything still queued when the process dies is lost, so a
+    session resumes from its last flushed checkpoint. ``aclose`` drains the queue on
+    graceful shutdown. Reads of a thread wait for that thread's queued writes, so a
+    worker always reads its own writes.
+    """
+
+    def __init__(
+        self,
+        inner: BaseCheckpointSaver,
+        *,
+        max_queue: int = 1024,
+        batch_size: int = 64,
+        flush_interval: float = 0.05,
+        max_retries: int = 3,
+    ) -> None:
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.flushes = 0
+        self.dropped = 0
+        self._pending: Counter[str] = Counter()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue[PendingPut | PendingWrites]
+        self._settled: asyncio.Condition
+        self._wakeup: asyncio.Event
+        self._urgent = 0
+        self._task: asyncio.Task | None = None
+
+    async def aopen(self) -> None:
+        if (aopen := getattr(self.inner, "aopen", None)) is not None:
+            await aopen()
+
+    async def aclose(self) -> None:
+        await self.aflush()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if (aclose := getattr(self.inner, "aclose", None)) is not None:
+            await aclose()
+
+    async def aflush(self) -> None:
+        """Flush immediately and wait until everything queued so far has been written."""
+        await self._wait_settled(None)
+
+    def _ensure_writer(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(self.max_queue)
+            self._settled = asyncio.Condition()
+            self._wakeup = asyncio.Event()
+            self._urgent = 0
+            self._pending.clear()
+            self._task = loop.create_task(self._run())
+
+    async def _enqueue(self, item: PendingPut | PendingWrites) -> None:
+        self._ensure_writer()
+        self._pending[item.config["configurable"]["thread_id"]] += 1
+        await self._queue.put(item)
+        self._wakeup.set()
+
+    async def _wait_settled(self, thread_id: str | None) -> None:
+        """Wait for queued writes (of one thread, or all) without waiting out the timer."""
+        if self._task is None or self._loop is not asyncio.get_running_loop():
+            return
+        if thread_id is not None and thread_id not in self._pending:
+            return
+        self._urgent += 1
+        self._wakeup.set()
+        try:
+            if thread_id is None:
+                await self._queue.join()
+            else:
+                async with self._settled:
+                    await self._settled.wait_for(lambda: thread_id not in self._pending)
+        finally:
+            self._urgent -= 1
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0 or self._urgent:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except TimeoutError:
+                    break
+            try:
+                await self._write(batch)
+            finally:
+                async with self._settled:
+                    for item in batch:
+                        thread_id = item.config["configurable"]["thread_id"]
+                        self._pending[thread_id] -= 1
+                        if not self._pending[thread_id]:
+                            del self._pending[thread_id]
+                        self._queue.task_done()
+                    self._settled.notify_all()
+
+    async def _write(self, batch: list[PendingPut | PendingWrites]) -> None:
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                if (aput_batch := getattr(self.inner, "aput_batch", None)) is not None:
+                    await aput_batch(
+                        [item for item in batch if isinstance(item, PendingPut)],
+                        [item for item in batch if isinstance(item, PendingWrites)],
+                    )
+                else:
+                    for item in batch:
+                        if isinstance(item, PendingPut):
+                            await self.inner.aput(
+                                item.config, item.checkpoint, item.metadata, item.new_versions
+                            )
+                        else:
+                            await self.inner.aput_writes(
+                                item.config, item.writes, item.task_id, item.task_path
+                            )
+                self.flushes += 1
+                return
+            except Exception as e:
+                logger.warning("Checkpoint flush attempt %d failed: %s", attempt, e)
+                await asyncio.sleep(min(0.1 * 2**attempt, 2.0))
+        self.dropped += len(batch)
+        logger.error("Dropped %d checkpoint writes after %d attempts", len(batch), self.max_retries)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        await self._enqueue(PendingPut(config, checkpoint, metadata, new_versions))
+        return next_checkpoint_config(config, checkpoint)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await self._enqueue(PendingWrites(config, list(writes), task_id, task_path))
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        await self._wait_settled(config["configurable"].get("thread_id"))
+        return await self.inner.aget_tuple(config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        await self._wait_settled(config["configurable"].get("thread_id") if config else None)
+        async for item in self.inner.alist(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self._wait_settled(thread_id)
+        await self.inner.adelete_thread(thread_id)
+
+    def get_next_version(self, current: Any, channel: None) -> Any:
+        return self.inner.get_next_version(current, channel)
+
+
+def _copy_checkpoint(checkpoint: Checkpoint) -> Checkpoint:
+    """A copy the graph may update in place; unlike ``copy_checkpoint``, keeps every key."""
+    return {
+        **checkpoint,
+        "channel_values": checkpoint["channel_values"].copy(),
+        "channel_versions": checkpoint["channel_versions"].copy(),
+        "versions_seen": {k: v.copy() for k, v in checkpoint["versions_seen"].items()},
+    }
+
+
+@dataclass(slots=True)
+class _CachedCheckpoint:
+    config: RunnableConfig
+    checkpoint: Checkpoint
+    metadata: CheckpointMetadata
+    parent_config: RunnableConfig | None
+    # (task_id, idx) -> (task_id, channel, value), as keyed in ``checkpoint_writes``
+    writes: dict[tuple[str, int], tuple[str, str, Any]]
+
+    @property
+    def checkpoint_id(self) -> str:
+        return self.checkpoint["id"]
+
+    def to_tuple(self) -> CheckpointTuple:
+        # The graph updates the checkpoint it loads in place
+        return CheckpointTuple(
+            self.config,
+            _copy_checkpoint(self.checkpoint),
+            self.metadata.copy(),
+            self.parent_config,
+            [self.writes[key] for key in sorted(self.writes)],
+        )
+
+
+class CachedCheckpointer(BaseCheckpointSaver):
+    """Write-through LRU cache of the latest checkpoint of up to ``max_threads`` threads.
+
+    Each turn starts by loading its thread's latest checkpoint, which the same worker
+    usually wrote moments before. Checkpoints and writes are cached once the wrapped
+    saver has stored them, as it would return them, and lookups of a thread's latest
+    (or the cached) checkpoint are served from memory. Loaded checkpoints are cached
+    too, unless they have pending writes.
+
+    Other workers may write the same thread, e.g. after a client reconnects. With
+    ``version`` validation, a hit is checked against the wrapped saver's
+    ``alatest_checkpoint_id``. With ``notify``, entries are evicted as the saver's
+    ``anotifications`` report newer checkpoints or writes to a cached one; while not
+    listening, every lookup goes to the saver. ``None`` skips validation, for a saver
+    that only this process writes.
+
+    Wrap the store itself, under any write-behind queue, so only persisted writes are
+    cached.
+    """
+
+    def __init__(
+        self,
+        inner: BaseCheckpointSaver,
+        *,
+        max_threads: int = 10_000,
+        validation: CheckpointCacheValidation | None = None,
+    ) -> None:
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+        self.max_threads = max_threads
+        self.validation = validation
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, str], _CachedCheckpoint] = OrderedDict()
+        # Loads in flight per thread: [count, changed meanwhile]
+        self._loading: dict[tuple[str, str], list] = {}
+        self._listening = False
+        self._listener: asyncio.Task | None = None
+
+    async def aopen(self) -> None:
+        if (aopen := getattr(self.inner, "aopen", None)) is not None:
+            await aopen()
+        if self.validation == CheckpointCacheValidation.NOTIFY:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def aclose(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        self._clear()
+        if (aclose := getattr(self.inner, "aclose", None)) is not None:
+            await aclose()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _trusted(self) -> bool:
+        return self.validation != CheckpointCacheValidation.NOTIFY or self._listening
+
+    def _install(self, key: tuple[str, str], entry: _CachedCheckpoint) -> None:
+        current = self._entries.get(key)
+        if current is not None and current.checkpoint_id > entry.checkpoint_id:
+            return
+        if current is None:
+            CACHED_THREADS.inc()
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_threads:
+            self._entries.popitem(last=False)
+            CACHED_THREADS.dec()
+
+    def _evict(self, key: tuple[str, str]) -> None:
+        if self._entries.pop(key, None) is not None:
+            CACHED_THREADS.dec()
+
+    def _clear(self) -> None:
+        CACHED_THREADS.dec(len(self._entries))
+        self._entries.clear()
+
+    def _cache_put(self, put: PendingPut) -> None:
+        configurable = put.config["configurable"]
+        parent_id = configurable.get("checkpoint_id")
+        parent_config = (
+            {
+                "configurable": {
+                    "thread_id": configurable["thread_id"],
+                    "checkpoint_ns": configurable["checkpoint_ns"],
+                    "checkpoint_id": parent_id,
+                }
+            }
+            if parent_id
+            else None
+        )
+        entry = _CachedCheckpoint(
+            next_checkpoint_config(put.config, put.checkpoint),
+            _copy_checkpoint(put.checkpoint),
+            get_checkpoint_metadata(put.config, put.metadata),
+            parent_config,
+            {},
+        )
+        self._install((configurable["thread_id"], configurable["checkpoint_ns"]), entry)
+
+    def _cache_writes(self, item: PendingWrites) -> None:
+        configurable = item.config["configurable"]
+        key = (configurable["thread_id"], configurable["checkpoint_ns"])
+        entry = self._entries.get(key)
+        if entry is None or entry.checkpoint_id != configurable["checkpoint_id"]:
+            return
+        # Special channels overwrite earlier writes, others keep them (as in Postgres)
+        upsert = all(channel in WRITES_IDX_MAP for channel, _ in item.writes)
+        for idx, (channel, value) in enumerate(item.writes):
+            write_key = (item.task_id, WRITES_IDX_MAP.get(channel, idx))
+            if upsert or write_key not in entry.writes:
+                entry.writes[write_key] = (item.task_id, channel, value)
+
+    async def _listen(self) -> None:
+        delay = 0.1
+        while True:
+            try:
+                async for change in self.inner.anotifications():
+                    if change is None:
+                        # Changes made while not listening are unknown
+                        self._clear()
+                        self._listening = True
+                        delay = 0.1
+                    else:
+                        self._on_change(*change)
+            except Exception as e:
+                logger.warning("Checkpoint change notifications interrupted: %s", e)
+            self._listening = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    def _on_change(self, op: str, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> None:
+        key = (thread_id, checkpoint_ns)
+        if (loading := self._loading.get(key)) is not None:
+            loading[1] = True
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        # A worker's own puts are reported with the id it cached; deletes and writes
+        # only matter to the cached checkpoint
+        if op == "put":
+            stale = checkpoint_id > entry.checkpoint_id
+        else:
+            stale = checkpoint_id == entry.checkpoint_id
+        if stale:
+            self._evict(key)
+
+    async def _current(self, key: tuple[str, str], entry: _CachedCheckpoint) -> bool:
+        if self.validation != CheckpointCacheValidation.VERSION:
+            return True
+        return await self.inner.alatest_checkpoint_id(*key) == entry.checkpoint_id
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        configurable = config["configurable"]
+        key = (configurable["thread_id"], configurable.get("checkpoint_ns", ""))
+        checkpoint_id = get_checkpoint_id(config)
+        entry = self._entries.get(key) if self._trusted() else None
+        if entry is not None and checkpoint_id in (None, entry.checkpoint_id):
+            if await self._current(key, entry):
+                self.hits += 1
+                CACHE_LOOKUPS.inc(result="hit")
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                return entry.to_tuple()
+            CACHE_LOOKUPS.inc(result="stale")
+            if self._entries.get(key) is entry:
+                self._evict(key)
+        else:
+            CACHE_LOOKUPS.inc(result="miss")
+        self.misses += 1
+
+        loading = self._loading.setdefault(key, [0, False])
+        loading[0] += 1
+        try:
+            loaded = await self.inner.aget_tuple(config)
+        finally:
+            loading[0] -= 1
+            if not loading[0]:
+                del self._loading[key]
+        cacheable = checkpoint_id is None and loaded is not None and not loaded.pending_writes
+        if cacheable and not loading[1] and self._trusted():
+            entry = _CachedCheckpoint(
+                loaded.config,
+                _copy_checkpoint(loaded.checkpoint),
+                loaded.metadata,
+                loaded.parent_config,
+                {},
+            )
+            self._install(key, entry)
+        return loaded
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        async for item in self.inner.alist(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        result = await self.inner.aput(config, checkpoint, metadata, new_versions)
+        self._cache_put(PendingPut(config, checkpoint, metadata, new_versions))
+        return result
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await self.inner.aput_writes(config, writes, task_id, task_path)
+        self._cache_writes(PendingWrites(config, writes, task_id, task_path))
+
+    async def aput_batch(self, puts: list[PendingPut], writes: list[PendingWrites]) -> None:
+        if (aput_batch := getattr(self.inner, "aput_batch", None)) is not None:
+            await aput_batch(puts, writes)
+        else:
+            for put in puts:
+                await self.inner.aput(put.config, put.checkpoint, put.metadata, put.new_versions)
+            for item in writes:
+                await self.inner.aput_writes(item.config, item.writes, item.task_id, item.task_path)
+        # Writes may be to a checkpoint of the same batch
+        for put in puts:
+            self._cache_put(put)
+        for item in writes:
+            self._cache_writes(item)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.inner.adelete_thread(thread_id)
+        for key in [key for key in self._entries if key[0] == thread_id]:
+            self._evict(key)
+
+    def get_next_version(self, current: Any, channel: None) -> Any:
+        return self.inner.get_next_version(current, channel)
+
+
+def find_checkpointer[T: BaseCheckpointSaver](
+    checkpointer: BaseCheckpointSaver | None, cls: type[T]
+) -> T | None:
+    """The ``cls`` under the timing, cache and write-behind wrappers, if there is one."""
+    while checkpointer is not None and not isinstance(checkpointer, cls):
+        checkpointer = getattr(checkpointer, "inner", None)
+    return checkpointer
+
+
+async def open_checkpointer(checkpointer: BaseCheckpointSaver | None) -> None:
+    """Open connections and run migrations for checkpointers that need it."""
+    if (aopen := getattr(checkpointer, "aopen", None)) is not None:
+        await aopen()
+
+
+async def close_checkpointer(checkpointer: BaseCheckpointSaver | None) -> None:
+    """Flush pending writes and release connections held by the checkpointer."""
+    if (aclose := getattr(checkpointer, "aclose", None)) is not None:
+        await aclose()
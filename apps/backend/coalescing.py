@@ -0,0 +1,138 @@
+"""Single-flight coalescing of identical in-flight turns.
+
+Sessions whose conversation state is the same and who send the same message at the
+same time would each make an identical model call. ``TurnCoalescer`` runs the first
+of them (the leader) as a ``Flight`` in its own task and fans its frames out to every
+session that asks for the same key (followers) while it is in flight. Each subscriber
+replays the frames from the start, so all of them see the identical sequence.
+
+State is fingerprinted by equivalence class rather than by content: every fresh
+session shares the empty fingerprint, and sessions that received the same flight
+share the flight's id afterwards. A turn that was not shared gives its session a new
+fingerprint of its own, so model output that happened to match is never assumed to.
+"""
+
+import asyncio
+import hashlib
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from typing import Any
+
+from metrics import Counter
+
+COALESCED_TURNS = Counter(
+    "agent_coalesced_turns_total",
+    "Turns run by the coalescer: leaders call the model, followers share their output",
+    ["role"],
+)
+
+# Fingerprint of a session whose thread has no messages yet
+EMPTY_STATE = ""
+
+
+def turn_key(state: str, user_msg: str, memories: Sequence[str] = ()) -> str:
+    """Key identifying turns that would produce the same model calls.
+
+    ``memories`` are what was recalled about the user for the turn, also in its prompt.
+    """
+    return hashlib.sha256("\0".join([state, user_msg, *memories]).encode()).hexdigest()
+
+
+class Flight:
+    """One upstream generation and the frames it has produced so far."""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        # Fingerprint of the state every subscriber ends up in
+        self.id = uuid.uuid4().hex
+        self.frames: list[dict] = []
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.done = False
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+    def publish(self, frame: dict) -> None:
+        self.frames.append(frame)
+        self._notify()
+
+    def _notify(self) -> None:
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    async def __aiter__(self) -> AsyncIterator[dict]:
+        """Every frame from the start; raises the upstream error, if any, at the end."""
+        sent = 0
+        while True:
+            wakeup = self._wakeup
+            while sent < len(self.frames):
+                yield self.frames[sent]
+                sent += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await wakeup.wait()
+
+
+class TurnCoalescer:
+    """Shares one upstream generation between identical concurrent turns."""
+
+    def __init__(self) -> None:
+        self._flights: dict[str, Flight] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def subscribe(
+        self, key: str, produce: Callable[[Flight], Awaitable[Any]]
+    ) -> tuple[Flight, bool]:
+        """Join the flight for ``key``, starting it with ``produce`` if there is none.
+
+        ``produce`` publishes the flight's frames and returns its result; it runs in a
+        task started from the caller's context. Returns the flight and whether the
+        caller is its leader. Call ``unsubscribe`` when done, including on errors.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.subscribers += 1
+            COALESCED_TURNS.inc(role="follower")
+            return flight, False
+
+        flight = Flight(key)
+        flight.subscribers = 1
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(self._run(flight, produce))
+        COALESCED_TURNS.inc(role="leader")
+        return flight, True
+
+    def unsubscribe(self, flight: Flight) -> None:
+        flight.subscribers -= 1
+        if not flight.subscribers and not flight.done:
+            # Nobody is listening any more: stop paying for the generation. Settled here,
+            # as a task cancelled before it first runs never reaches its ``finally``.
+            self._settle(flight, ConnectionAbortedError("Coalesced turn was abandoned"))
+            flight.task.cancel()
+
+    async def _run(self, flight: Flight, produce: Callable[[Flight], Awaitable[Any]]) -> None:
+        error = None
+        try:
+            flight.result = await produce(flight)
+        except asyncio.CancelledError:
+            error = ConnectionAbortedError("Coalesced turn was abandoned")
+        except Exception as e:
+            error = e
+        finally:
+            self._settle(flight, error)
+
+    def _settle(self, flight: Flight, error: BaseException | None) -> None:
+        if flight.done:
+            return
+        # Later arrivals start a new flight rather than joining a finished one
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        flight.error = error
+        flight.done = True
+        flight._notify()
@@ -10,6 +10,82 @@ class CheckpointerType(StrEnum):
 
     MEMORY = "memory"
     POSTGRES = "postgres"
+    SQLITE = "sqlite"
+
+
+class CheckpointDurability(StrEnum):
+    """When checkpoint writes must be durable relative to the agent turn.
+
+    - ``sync``: every super-step is persisted before the next one starts.
+    - ``async``: writes are acknowledged once queued and flushed in batches
+      by a background writer; a crash loses whatever is still queued.
+    - ``exit``: only the final state of a turn is persisted, before ``END``
+      is sent; a crash mid-turn loses the whole turn.
+    """
+
+    SYNC = "sync"
+    ASYNC = "async"
+    EXIT = "exit"
+
+
+class CheckpointSerializerType(StrEnum):
+    """Encoding used for checkpoint blobs."""
+
+    DEFAULT = "default"
+    COMPACT = "compact"
+
+
+class CheckpointCompression(StrEnum):
+    """Compression applied to compact checkpoint blobs."""
+
+    NONE = "none"
+    ZSTD = "zstd"
+    LZ4 = "lz4"
+
+
+class CheckpointCacheValidation(StrEnum):
+    """How cached checkpoints are kept consistent with writes by other workers.
+
+    - ``version``: every cache hit checks the thread's latest checkpoint id in Postgres,
+      a cheap index lookup instead of loading the checkpoint.
+    - ``notify``: a trigger notifies every worker of checkpoint changes
+      (LISTEN/NOTIFY), and hits are served without a round trip. Changes made just
+      before a read on another worker may be missed until the notification arrives.
+    """
+
+    VERSION = "version"
+    NOTIFY = "notify"
+
+
+class TurnPriority(StrEnum):
+    """Scheduling class of an agent turn, highest priority first."""
+
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
+
+class RenderCadence(StrEnum):
+    """How content deltas are paced for a client.
+
+    - ``token``: one ``content_delta`` per model token, with the text so far in
+      ``accumulated``.
+    - ``block``: deltas are held back until a sentence or markdown block ends, and
+      carry only the new text.
+    """
+
+    TOKEN = "token"
+    BLOCK = "block"
+
+
+class LogFormat(StrEnum):
+    """How log records are written.
+
+    - ``text``: uvicorn's format, to the streams uvicorn writes to.
+    - ``json``: one object per line on stdout, with the session and turn logged.
+    """
+
+    TEXT = "text"
+    JSON = "json"
 
 
 class Settings(BaseSettings):
@@ -28,9 +104,195 @@ class Settings(BaseSettings):
     # Server Configuration
     server_host: str = "127.0.0.1"
     server_port: int = 3000
+    # Server profile (python -m server); 0 workers runs one per available core
+    server_workers: int = 0
+    # Give each worker its own SO_REUSEPORT listening socket
+    server_reuse_port: bool = False
+    # With SO_REUSEPORT, give up once this many workers crash within the window (0 never)
+    server_restart_limit: int = 5
+    server_restart_window: float = 60.0
+    server_backlog: int = 4096
+    # Largest websocket message accepted (uvicorn's default), and incoming messages
+    # buffered per connection
+    ws_max_size: int = 16 * 1024 * 1024
+    ws_max_queue: int = 8
+    # Per-message deflate costs ~90 KB of compression state per connection
+    ws_per_message_deflate: bool = False
+
+    # Idle connection policy, in seconds; 0 disables warning and keepalive
+    idle_timeout: float = 15.0
+    idle_warning: float = 0.0
+    keepalive_interval: float = 0.0
+    keepalive_timeout: float = 0.0
+    # Resolution of the idle timer wheel
+    idle_tick: float = 0.5
+
+    # Multiplexed sessions at /ws/agent/mux: sessions per connection, 0 disables the
+    # endpoint; and frames each session may queue while the socket is busy
+    mux_max_sessions: int = 0
+    mux_session_buffer: int = 64
+
+    # Turn scheduling: turns running at once per worker, 0 for no limit
+    max_concurrent_turns: int = 0
+    # Seconds a turn may wait for a slot before it is rejected, per priority class
+    interactive_turn_deadline: float = 30.0
+    batch_turn_deadline: float = 600.0
+    # Turns this close to their deadline are scheduled ahead of higher priority classes
+    turn_deadline_slack: float = 1.0
+    # Weighted fair share of slots between tenants within a class, e.g. {"acme": 2}
+    tenant_weights: dict[str, float] = {}
+
+    # Load shedding: adapt the turn limit to model latency and errors, and trip a breaker
+    load_shedding: bool = False
+    # Model calls slower than this to their first token count as failures (seconds)
+    model_latency_threshold: float = 5.0
+    # Bounds of the adaptive turn limit; it starts at max_concurrent_turns, if set
+    adaptive_turn_limit_min: int = 1
+    adaptive_turn_limit_max: int = 256
+    # Open the breaker when this share of the last breaker_window calls failed
+    breaker_failure_rate: float = 0.5
+    breaker_window: int = 20
+    breaker_min_calls: int = 10
+    # Seconds the breaker stays open before probing the model again
+    breaker_cooldown: float = 10.0
+
+    # Content delta cadence for clients that do not ask for one (cadence query parameter)
+    render_cadence: RenderCadence = RenderCadence.TOKEN
+    # In block cadence, flush held-back text after this many seconds or characters
+    render_max_delay: float = 0.25
+    render_max_chars: int = 400
+
+    # Share one model call between concurrent identical turns of sessions in the same state
+    turn_coalescing: bool = False
+
+    # Start side-effect-free tools as soon as their arguments are streamed, before the
+    # model's message ends
+    eager_tools: bool = False
+
+    # Tool execution (see tool_execution): threads for tools that run in a thread, warm
+    # worker processes for those that run in a process, and the seconds a call may take
+    # unless its tool declares otherwise
+    tool_thread_workers: int = 4
+    tool_process_workers: int = 2
+    tool_timeout: float = 30.0
+    # Calls and results larger than this many bytes go to worker processes through
+    # shared memory rather than their pipe
+    tool_shm_threshold: int = 32 * 1024
+
+    # Tracing: OTLP/JSON spans per turn, appended to a file or posted to an OTLP/HTTP
+    # collector (e.g. http://localhost:4318); neither set disables tracing
+    trace_file: str | None = None
+    trace_otlp_endpoint: str | None = None
+    # Share of turns traced; turns that fail or take at least trace_slow_turn_threshold
+    # seconds are exported too when it is set, at the cost of recording every turn
+    trace_sample_rate: float = 0.1
+    trace_slow_turn_threshold: float = 0.0
+    # Spans queued for export before whole traces are dropped, and spans per export
+    trace_queue_size: int = 8192
+    trace_batch_size: int = 512
+    trace_flush_interval: float = 2.0
+
+    # Logging: records are queued and written by a thread; past log_queue_size queued
+    # records further ones are dropped, and 0 writes them synchronously on the event loop
+    log_format: LogFormat = LogFormat.TEXT
+    log_queue_size: int = 10000
+    # Per call site, warnings and errors past log_burst in log_burst_interval seconds are
+    # sampled, one in log_sample written
+    log_burst: int = 10
+    log_burst_interval: float = 1.0
+    log_sample: int = 100
+
+    # Bearer token for the /admin endpoints (live sessions' memory, heap snapshots);
+    # unset disables them
+    admin_token: str | None = None
+    # Largest sessions in memory metrics and /admin/sessions
+    session_memory_top: int = 10
+    # Seconds between samples of the sessions' memory metrics
+    session_memory_interval: float = 15.0
+    # Heap tracing stops by itself this many seconds after it was started
+    heap_trace_timeout: float = 600.0
+
+    # POST /batch: requests of one batch running at once, and requests per batch
+    batch_concurrency: int = 16
+    batch_max_items: int = 10_000
+    # Allow batches through the provider's batch API (OpenAI /v1/batches)
+    batch_provider_mode: bool = False
+    # Seconds between provider batch status checks, its completion window, and model
+    # calls per request before giving up on tool calls
+    batch_provider_poll_interval: float = 30.0
+    batch_provider_completion_window: str = "24h"
+    batch_provider_max_rounds: int = 4
+
+    # Long-term memory of users across sessions (see user_memory): facts learned from
+    # their messages, keyed by the x-user-id header. Off by default; needs the secret
+    user_memory: bool = False
+    # Key the authenticating proxy signs x-user-id with (HMAC-SHA256); headers not
+    # signed with it identify nobody, so a client cannot read another user's facts
+    user_memory_secret: str | None = None
+    # Facts added to a turn's prompt at most, and the relevance they need, from 0 to 1
+    user_memory_top_k: int = 5
+    user_memory_min_score: float = 0.2
+    # Facts kept per user and in all, per worker; the least recently used go first
+    user_memory_max_per_user: int = 1000
+    user_memory_max: int = 1_000_000
+    # Journal of facts shared by the workers of a host; unset keeps them in memory only
+    user_memory_path: str | None = None
+
+    # Directory to record every turn to for offline replay, off when unset
+    session_record_dir: str | None = None
+    # Size at which a log segment is gzipped, and gzipped segments kept
+    session_record_max_bytes: int = 64 * 1024 * 1024
+    session_record_max_files: int = 20
+    # Replace message text, tokens and tool arguments with filler of the same length
+    session_record_redact: bool = False
+    # Recorded logs (comma-separated files or globs) to replay instead of calling the model
+    model_replay_log: str | None = None
+    # Divides the recorded delays between replayed tokens
+    model_replay_speed: float = 1.0
+
+    # Send each session's prompt cache key with model calls (OpenAI prompt_cache_key)
+    prompt_cache_key: bool = True
+    # Open the model client's connection at startup rather than on the first turn
+    model_warmup: bool = True
+
+    # Model pricing in USD per million tokens, for cost accounting (gpt-4o-mini)
+    model_input_price: float = 0.15
+    model_cached_input_price: float = 0.075
+    model_output_price: float = 0.60
 
     # Checkpointer Configuration
     checkpointer_type: CheckpointerType = CheckpointerType.MEMORY
+    checkpoint_durability: CheckpointDurability = CheckpointDurability.SYNC
+    # Write-behind batching (used when checkpoint_durability=async)
+    checkpoint_queue_size: int = 1024
+    checkpoint_batch_size: int = 64
+    checkpoint_flush_interval: float = 0.05
+    # Threads whose latest checkpoint is cached in memory, 0 disables the cache
+    checkpoint_cache_size: int = 0
+    checkpoint_cache_validation: CheckpointCacheValidation = CheckpointCacheValidation.VERSION
+    # Serialization
+    checkpoint_serializer: CheckpointSerializerType = CheckpointSerializerType.DEFAULT
+    checkpoint_compression: CheckpointCompression = CheckpointCompression.NONE
+    # Tool results at least this long are stored once and referenced (postgres, compact only)
+    checkpoint_dedup_min_bytes: int = 1024
+    # Retention (postgres only); unset keeps everything
+    checkpoint_keep_last: int | None = None
+    # Delete threads whose newest checkpoint is older than this many seconds
+    checkpoint_thread_ttl: float | None = None
+    # Archive expired threads as gzipped JSON lines here before deleting them
+    checkpoint_archive_dir: str | None = None
+    # Seconds between background runs; 0 leaves retention to the CLI
+    checkpoint_retention_interval: float = 3600.0
+    checkpoint_retention_batch_size: int = 500
+
+    # SQLite Configuration: one database file shared by the workers of a host
+    sqlite_path: str = "checkpoints.sqlite"
+    # Seconds to wait for another worker's write lock before failing
+    sqlite_busy_timeout: float = 5.0
+    # Writes committed together at most
+    sqlite_batch_size: int = 256
+    # Sync every commit to disk; otherwise the last commits may be lost on power failure
+    sqlite_full_sync: bool = False
 
     # PostgreSQL Configuration
     postgres_user: str = "langchain"
@@ -38,6 +300,14 @@ class Settings(BaseSettings):
     postgres_db: str = "langchain"
     postgres_host: str = "localhost"
     postgres_port: int = 5432
+    # Connections per database, or per shard
+    postgres_pool_size: int = 10
+    # Comma-separated DSNs to shard checkpoints over by thread, in place of the database
+    # above. Append new shards at the end: a shard is identified by its position.
+    postgres_shards: str = ""
+    # While shards are being added, the number there were before; threads that moved are
+    # moved on first access (and by `python -m sharding`)
+    postgres_shards_before: int = 0
 
     @property
     def postgres_connection_string(self) -> str:
@@ -47,6 +317,12 @@ class Settings(BaseSettings):
             f"@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
         )
 
+    @property
+    def postgres_shard_dsns(self) -> list[str]:
+        """DSNs of the checkpoint shards; the single database if not sharded."""
+        dsns = [dsn.strip() for dsn in self.postgres_shards.split(",") if dsn.strip()]
+        return dsns or [self.postgres_connection_string]
+
 
 # Global settings instance
 settings = Settings()
@@ -0,0 +1,373 @@
+"""Memory held by each live session, and heap snapshots diffed on demand.
+
+``SessionMemory`` accounts, per open session:
+
+- ``socket``: bytes queued on its connection, in the transport's write buffer and the
+  kernel's send and receive queues (Linux). Sessions multiplexed on one socket share it
+  evenly. ASGI does not expose the transport; see ``connection_transport`` for how it
+  is found, and why this is 0 under servers other than uvicorn.
+- ``turn``: the answer text and tool names buffered by the turn in flight.
+- ``checkpoints``: the serialized checkpoints, channel values and pending writes of its
+  thread, which hold the graph state. Only an in-memory saver keeps these in the
+  process; with Postgres or SQLite, they are 0.
+
+These are sampled every ``interval`` seconds by ``run_periodically``, not computed when
+metrics are scraped, as a scrape would then walk every checkpoint on the event loop:
+``agent_session_memory_bytes{component}`` sums them over sessions,
+``agent_live_sessions`` counts the sessions, and
+``agent_session_memory_largest_bytes{rank}`` has the totals of the ``top`` largest.
+
+``HeapDiagnostics`` serves ``/admin/heap`` to clients presenting the admin token.
+Nothing is traced until ``POST`` starts ``tracemalloc`` and takes the first snapshot.
+Each ``GET`` then takes another and returns the allocation sites that grew most since
+the first. ``DELETE`` stops tracing, as does the ``timeout`` if nobody does. While on,
+tracing slows every allocation down, and snapshots take a while on a large heap; they
+are taken in a thread. Each worker process traces its own heap.
+"""
+
+import asyncio
+import hmac
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.websockets import WebSocket
+
+from checkpointing import find_checkpointer
+from metrics import Gauge
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    # Not POSIX: only the transport's write buffer is counted
+    fcntl = termios = None
+
+SESSION_MEMORY = Gauge(
+    "agent_session_memory_bytes", "Memory held by live sessions, by component", ["component"]
+)
+LIVE_SESSIONS = Gauge("agent_live_sessions", "Sessions open on this worker")
+LARGEST_SESSIONS = Gauge(
+    "agent_session_memory_largest_bytes", "Memory held by the largest live sessions", ["rank"]
+)
+
+COMPONENTS = ("socket", "turn", "checkpoints")
+
+
+@dataclass(slots=True)
+class TurnBuffers:
+    """What a turn accumulates as it streams."""
+
+    # The answer's pieces, joined only when ``content`` is read
+    parts: list[str] = field(default_factory=list)
+    # Tool name per tool call id
+    tool_names: dict[str, str] = field(default_factory=dict)
+
+    def append(self, text: str) -> None:
+        self.parts.append(text)
+
+    @property
+    def content(self) -> str:
+        if len(self.parts) > 1:
+            self.parts[:] = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+    def nbytes(self) -> int:
+        return (
+            sys.getsizeof(self.parts)
+            + sum(sys.getsizeof(part) for part in self.parts)
+            + sys.getsizeof(self.tool_names)
+            + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.tool_names.items())
+        )
+
+
+@dataclass(slots=True)
+class SessionUsage:
+    session_id: str
+    socket: int = 0
+    turn: int = 0
+    checkpoints: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.socket + self.turn + self.checkpoints
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            **{component: getattr(self, component) for component in COMPONENTS},
+            "total": self.total,
+        }
+
+
+# Unsent bytes of a socket (Linux)
+_OUTQ = getattr(termios, "TIOCOUTQ", None)
+
+
+def _queued(sock: Any, request: int) -> int:
+    try:
+        return int.from_bytes(fcntl.ioctl(sock.fileno(), request, b"\0" * 4), sys.byteorder)
+    except (OSError, ValueError):
+        return 0
+
+
+def connection_transport(websocket: WebSocket) -> asyncio.Transport | None:
+    """The websocket's transport, or ``None`` if its server does not let it be found.
+
+    There is no ASGI interface for this. uvicorn's ASGI ``send`` is a bound method of
+    the connection's protocol, which has the transport, and Starlette keeps ``send`` as
+    ``WebSocket._send``. Under other servers, or should either change, this falls back
+    to ``None``, and the connection's queued bytes count as 0 rather than failing.
+    """
+    protocol = getattr(getattr(websocket, "_send", None), "__self__", None)
+    transport = getattr(protocol, "transport", None)
+    return transport if isinstance(transport, asyncio.Transport) else None
+
+
+def socket_bytes(websocket: WebSocket) -> int:
+    """Bytes queued on the websocket's connection, if its transport can be found."""
+    transport = connection_transport(websocket)
+    if transport is None or transport.is_closing():
+        return 0
+    size = transport.get_write_buffer_size()
+    if _OUTQ is not None and (sock := transport.get_extra_info("socket")) is not None:
+        size += _queued(sock, _OUTQ) + _queued(sock, termios.FIONREAD)
+    return size
+
+
+def checkpoint_bytes(saver: InMemorySaver, thread_ids: set[str]) -> dict[str, int]:
+    """Serialized bytes an in-memory saver holds for each of ``thread_ids``."""
+    sizes: dict[str, int] = defaultdict(int)
+    for thread_id in thread_ids:
+        for checkpoints in saver.storage.get(thread_id, {}).values():
+            for checkpoint, metadata, _ in checkpoints.values():
+                sizes[thread_id] += len(checkpoint[1]) + len(metadata[1])
+    for (thread_id, *_), (_, value) in saver.blobs.items():
+        if thread_id in thread_ids:
+            sizes[thread_id] += len(value)
+    for (thread_id, *_), writes in saver.writes.items():
+        if thread_id in thread_ids:
+            sizes[thread_id] += sum(len(write[2][1]) for write in writes.values())
+    return sizes
+
+
+class SessionMemory:
+    """The live sessions of a worker, and the memory each one holds."""
+
+    def __init__(
+        self, checkpointer: BaseCheckpointSaver | None = None, top: int = 10, interval: float = 15.0
+    ) -> None:
+        self.saver = find_checkpointer(checkpointer, InMemorySaver)
+        self.top = top
+        self.interval = interval
+        self._sockets: dict[str, WebSocket] = {}
+        self._turns: dict[str, TurnBuffers] = {}
+        self._ranked = 0
+
+    def open(self, session_id: str, websocket: WebSocket) -> None:
+        self._sockets[session_id] = websocket
+
+    def close(self, session_id: str) -> None:
+        self._sockets.pop(session_id, None)
+        self._turns.pop(session_id, None)
+
+    def turn_started(self, session_id: str, buffers: TurnBuffers) -> None:
+        if session_id in self._sockets:
+            self._turns[session_id] = buffers
+
+    def turn_ended(self, session_id: str) -> None:
+        self._turns.pop(session_id, None)
+
+    def usage(self) -> list[SessionUsage]:
+        """Every live session's memory, largest first."""
+        sharing = Counter(id(websocket) for websocket in self._sockets.values())
+        connections = {id(websocket): websocket for websocket in self._sockets.values()}
+        socket_sizes = {key: socket_bytes(websocket) for key, websocket in connections.items()}
+        checkpoints = (
+            checkpoint_bytes(self.saver, set(self._sockets)) if self.saver is not None else {}
+        )
+        usages = []
+        for session_id, websocket in self._sockets.items():
+            buffers = self._turns.get(session_id)
+            usages.append(
+                SessionUsage(
+                    session_id,
+                    socket=socket_sizes[id(websocket)] // sharing[id(websocket)],
+                    turn=buffers.nbytes() if buffers is not None else 0,
+                    checkpoints=checkpoints.get(session_id, 0),
+                )
+            )
+        return sorted(usages, key=lambda usage: usage.total, reverse=True)
+
+    def collect(self) -> None:
+        usages = self.usage()
+        LIVE_SESSIONS.set(len(usages))
+        for component in COMPONENTS:
+            SESSION_MEMORY.set(sum(getattr(u, component) for u in usages), component=component)
+        largest = usages[: self.top]
+        for rank in range(1, max(self._ranked, len(largest)) + 1):
+            total = largest[rank - 1].total if rank <= len(largest) else 0
+            LARGEST_SESSIONS.set(total, rank=str(rank))
+        self._ranked = len(largest)
+
+    async def run_periodically(self) -> None:
+        """Refresh the gauges every ``interval`` seconds until cancelled."""
+        while True:
+            self.collect()
+            await asyncio.sleep(self.interval)
+
+    async def sessions_endpoint(self, request: Request) -> JSONResponse:
+        top = _count_param(request, "top", self.top)
+        if top is None:
+            return _invalid_count("top")
+        return JSONResponse(
+            {"pid": os.getpid(), "sessions": [u.as_dict() for u in self.usage()[:top]]}
+        )
+
+
+class HeapDiagnostics:
+    """``tracemalloc`` snapshots, taken on demand and diffed against the first one."""
+
+    def __init__(self, timeout: float = 600.0, frames: int = 1, top: int = 20) -> None:
+        self.timeout = timeout
+        self.frames = frames
+        self.top = top
+        self._baseline: tracemalloc.Snapshot | None = None
+        self._started = 0.0
+        self._stop_timer: asyncio.TimerHandle | None = None
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+
+    @property
+    def tracing(self) -> bool:
+        # Set from ``start`` until ``stop``, while the first snapshot is taken too
+        return self._stop_timer is not None
+
+    async def start(self, frames: int | None = None) -> dict[str, Any]:
+        """Start tracing unless it is on, and take a new first snapshot."""
+        if not self.tracing:
+            tracemalloc.start(frames or self.frames)
+            self._started = time.monotonic()
+            self._stop_timer = asyncio.get_running_loop().call_later(self.timeout, self.stop)
+        baseline = await self._take_snapshot()
+        if baseline is not None:
+            self._baseline = baseline
+        return self.status()
+
+    def stop(self) -> None:
+        if self._stop_timer is not None:
+            self._stop_timer.cancel()
+            self._stop_timer = None
+        self._baseline = None
+        tracemalloc.stop()
+
+    async def _take_snapshot(self) -> tracemalloc.Snapshot | None:
+        """A snapshot, or ``None`` if tracing was stopped before it could be taken."""
+        if not self.tracing:
+            return None
+        try:
+            return await asyncio.to_thread(self._snapshot)
+        except RuntimeError:
+            # take_snapshot raises once tracemalloc is stopped
+            return None
+
+    def status(self) -> dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "pid": os.getpid(),
+            "tracing": self.tracing,
+            "traced_seconds": time.monotonic() - self._started if self.tracing else 0.0,
+            "traced_bytes": current,
+            "peak_traced_bytes": peak,
+        }
+
+    async def diff(self, top: int | None = None, group_by: str = "lineno") -> dict[str, Any] | None:
+        """The allocation sites that grew most since the first snapshot; ``None`` if
+        tracing is off, or stopped meanwhile."""
+        baseline = self._baseline
+        if baseline is None:
+            return None
+        snapshot = await self._take_snapshot()
+        if snapshot is None:
+            return None
+        stats = await asyncio.to_thread(snapshot.compare_to, baseline, group_by)
+        return {
+            **self.status(),
+            "top": [
+                {
+                    "trace": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size": stat.size,
+                    "size_diff": stat.size_diff,
+                    "count": stat.count,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats[: top or self.top]
+            ],
+        }
+
+    async def endpoint(self, request: Request) -> JSONResponse:
+        """``POST`` starts tracing (again), ``GET`` diffs, ``DELETE`` stops tracing."""
+        params = request.query_params
+        if request.method == "POST":
+            frames = _count_param(request, "frames", self.frames)
+            if frames is None:
+                return _invalid_count("frames")
+            return JSONResponse(await self.start(frames))
+        if request.method == "DELETE":
+            if self.tracing:
+                self.stop()
+            return JSONResponse(self.status())
+        if self._baseline is None:
+            return self._not_tracing()
+        group_by = params.get("group_by", "lineno")
+        if group_by not in ("lineno", "filename", "traceback"):
+            return JSONResponse({"error": f"Unknown group_by {group_by}"}, 400)
+        top = _count_param(request, "top", self.top)
+        if top is None:
+            return _invalid_count("top")
+        report = await self.diff(top, group_by)
+        return JSONResponse(report) if report is not None else self._not_tracing()
+
+    def _not_tracing(self) -> JSONResponse:
+        return JSONResponse({**self.status(), "error": "Not tracing; POST first"}, 409)
+
+
+def _count_param(request: Request, name: str, default: int) -> int | None:
+    """A positive integer query parameter, ``default`` if absent, ``None`` if invalid."""
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    return int(value) if value.isascii() and value.isdigit() and int(value) > 0 else None
+
+
+def _invalid_count(name: str) -> JSONResponse:
+    return JSONResponse({"error": f"{name} must be a positive integer"}, 400)
+
+
+def require_token(token: str, endpoint):
+    """``endpoint`` for requests with ``Authorization: Bearer <token>`` only."""
+    expected = f"Bearer {token}".encode()
+
+    async def protected(request: Request) -> JSONResponse:
+        presented = request.headers.get("authorization", "").encode()
+        if not hmac.compare_digest(presented, expected):
+            return JSONResponse({"error": "Unauthorized"}, 401)
+        return await endpoint(request)
+
+    return protected
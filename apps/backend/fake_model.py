@@ -0,0 +1,261 @@
+"""Deterministic offline chat model for tests and benchmarks."""
+
+import asyncio
+import hashlib
+import json
+import operator
+import random
+import re
+import time
+import uuid
+from collections.abc import AsyncIterator, Iterator, Sequence
+from functools import reduce
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+    message_chunk_to_message,
+)
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+_TOKEN_RE = re.compile(r"\S+\s*")
+_NAME_RE = re.compile(r"my name is (\w+)", re.IGNORECASE)
+# A name remembered from an earlier session (see ``user_memory``)
+_REMEMBERED_NAME_RE = re.compile(r"user's name is (\w+)")
+
+
+class UpstreamError(Exception):
+    """Error injected by ``FakeStreamingChatModel``, standing in for a provider error."""
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """Chat model that streams canned replies word by word.
+
+    Asking about transactions triggers a ``get_transactions`` tool call when the
+    tool is bound; tool results are summarised; everything else gets ``reply``.
+    ``first_token_delay`` and ``error_rate`` simulate a slow or failing provider and
+    can be changed while the model is in use to inject latency spikes and outages.
+
+    With ``cache_shards`` set, it also simulates a provider's prompt cache. Each
+    request's prompt (tool definitions, then messages) is remembered by the shard
+    that served it. A later request pays ``prefill_delay`` per input token before its
+    first token, except for the longest prefix its shard has seen, which is reported
+    as ``cache_read`` tokens. Requests with a ``prompt_cache_key`` always go to the
+    same shard; requests without one go to a random shard, as when a provider spreads
+    load. ``payload_sizes`` records the JSON size of every request.
+    """
+
+    reply: str = (
+        "I am a helpful financial assistant. I can look up your recent transactions "
+        "and help you understand your spending."
+    )
+    token_delay: float = 0.0
+    tool_args_chunk_size: int = 8
+    first_token_delay: float = 0.0
+    # Share of calls that raise UpstreamError before streaming anything
+    error_rate: float = 0.0
+    # Simulated prompt cache: shards, and seconds per uncached input token
+    cache_shards: int = 0
+    prefill_delay: float = 0.0
+
+    _caches: list[set[str]] = PrivateAttr(default_factory=list)
+    _payload_sizes: list[int] = PrivateAttr(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _respond(self, messages: list[BaseMessage], tools: list[dict] | None) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            try:
+                count = len(json.loads(last.content).get("data", []))
+            except (TypeError, ValueError, AttributeError):
+                count = 0
+            return AIMessage(content=f"You have {count} recent transactions.")
+
+        text = last.content if isinstance(last.content, str) else ""
+        tool_names = {t["function"]["name"] for t in tools or []}
+        if "transaction" in text.lower() and "get_transactions" in tool_names:
+            return AIMessage(
+                content="",
+                tool_calls=[
+                    {"name": "get_transactions", "args": {}, "id": f"call_{uuid.uuid4().hex[:12]}"}
+                ],
+            )
+
+        if "my name" in text.lower() and "?" in text:
+            for message in reversed(messages[:-1]):
+                if isinstance(message, HumanMessage) and (
+                    match := _NAME_RE.search(str(message.content))
+                ):
+                    return AIMessage(content=f"Your name is {match.group(1)}.")
+                if isinstance(message, SystemMessage) and (
+                    match := _REMEMBERED_NAME_RE.search(str(message.content))
+                ):
+                    return AIMessage(content=f"Your name is {match.group(1)}.")
+        return AIMessage(content=self.reply)
+
+    @property
+    def payload_sizes(self) -> list[int]:
+        return self._payload_sizes
+
+    def _prefill(self, messages: list[BaseMessage], kwargs: dict[str, Any]) -> tuple[int, int]:
+        """Input tokens of a request and how many of them the prompt cache served."""
+        tools = kwargs.get("tools") or []
+        payload = {
+            "messages": [{"role": m.type, "content": m.content} for m in messages],
+            "tools": tools,
+        }
+        self._payload_sizes.append(len(json.dumps(payload, separators=(",", ":"))))
+
+        # Prompt prefixes at message boundaries, each with its length in tokens
+        digest = hashlib.sha256(json.dumps(tools, sort_keys=True).encode())
+        tokens = len(_TOKEN_RE.findall(json.dumps(tools))) if tools else 0
+        prefixes = []
+        for message in messages:
+            digest.update(f"{message.type}:{message.content}".encode())
+            tokens += len(_TOKEN_RE.findall(str(message.content)))
+            prefixes.append((digest.copy().hexdigest(), tokens))
+        if not self.cache_shards:
+            return tokens, 0
+
+        if not self._caches:
+            self._caches = [set() for _ in range(self.cache_shards)]
+        if (key := kwargs.get("prompt_cache_key")) is not None:
+            shard = int(hashlib.sha256(key.encode()).hexdigest(), 16) % self.cache_shards
+        else:
+            shard = random.randrange(self.cache_shards)
+        cache = self._caches[shard]
+        cached = next((n for prefix, n in reversed(prefixes) if prefix in cache), 0)
+        cache.update(prefix for prefix, _ in prefixes)
+        return tokens, cached
+
+    def _usage(self, output: AIMessage, input_tokens: int, cached_tokens: int = 0) -> UsageMetadata:
+        output_tokens = max(1, len(_TOKEN_RE.findall(str(output.content))))
+        usage: UsageMetadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        if cached_tokens:
+            usage["input_token_details"] = {"cache_read": cached_tokens}
+        return usage
+
+    def _chunks(
+        self, messages: list[BaseMessage], tools: list[dict] | None, prefill: tuple[int, int]
+    ) -> Iterator[AIMessageChunk]:
+        message = self._respond(messages, tools)
+        usage = self._usage(message, *prefill)
+        if message.tool_calls:
+            for index, tool_call in enumerate(message.tool_calls):
+                args = json.dumps(tool_call["args"])
+                size = self.tool_args_chunk_size
+                pieces = [args[i : i + size] for i in range(0, len(args), size)] or [""]
+                for n, piece in enumerate(pieces):
+                    yield AIMessageChunk(
+                        content="",
+                        tool_call_chunks=[
+                            {
+                                "name": tool_call["name"] if n == 0 else None,
+                                "args": piece,
+                                "id": tool_call["id"] if n == 0 else None,
+                                "index": index,
+                            }
+                        ],
+                    )
+        else:
+            for token in _TOKEN_RE.findall(message.content):
+                yield AIMessageChunk(content=token)
+        yield AIMessageChunk(content="", usage_metadata=usage)
+
+    def _maybe_fail(self) -> None:
+        if self.error_rate and random.random() < self.error_rate:
+            raise UpstreamError("Injected upstream error")
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._maybe_fail()
+        prefill = self._prefill(messages, kwargs)
+        message = self._respond(messages, kwargs.get("tools"))
+        message.usage_metadata = self._usage(message, *prefill)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Like a non-streaming provider request, the reply arrives after its last token
+        if self.first_token_delay:
+            await asyncio.sleep(self.first_token_delay)
+        self._maybe_fail()
+        prefill = self._prefill(messages, kwargs)
+        if self.prefill_delay:
+            await asyncio.sleep(self.prefill_delay * (prefill[0] - prefill[1]))
+        chunks = list(self._chunks(messages, kwargs.get("tools"), prefill))
+        if self.token_delay:
+            await asyncio.sleep(self.token_delay * len(chunks))
+        message = message_chunk_to_message(reduce(operator.add, chunks))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if self.first_token_delay:
+            time.sleep(self.first_token_delay)
+        self._maybe_fail()
+        prefill = self._prefill(messages, kwargs)
+        if self.prefill_delay:
+            time.sleep(self.prefill_delay * (prefill[0] - prefill[1]))
+        for chunk in self._chunks(messages, kwargs.get("tools"), prefill):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if self.first_token_delay:
+            await asyncio.sleep(self.first_token_delay)
+        self._maybe_fail()
+        prefill = self._prefill(messages, kwargs)
+        if self.prefill_delay:
+            await asyncio.sleep(self.prefill_delay * (prefill[0] - prefill[1]))
+        for chunk in self._chunks(messages, kwargs.get("tools"), prefill):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            # Like provider models, report every chunk, tool call and usage chunks included
+            if run_manager:
+                await run_manager.on_llm_new_token(
+                    chunk.content, chunk=ChatGenerationChunk(message=chunk)
+                )
+            yield ChatGenerationChunk(message=chunk)
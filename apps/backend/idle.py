@@ -0,0 +1,258 @@
+"""Idle connection policy driven by one timer wheel per process.
+
+Rather than a timeout per ``receive`` for every socket, each connection is a slotted
+record in a hashed timer wheel. A single task advances the wheel every ``tick``
+seconds and handles the connections whose slot came up: closing them once idle for
+``timeout``, warning them ``warning`` seconds before that, and pinging them every
+``keepalive_interval``. Activity only updates a timestamp; the entry is moved when
+its slot fires early, so a busy connection costs nothing per message.
+"""
+
+import asyncio
+import json
+import logging
+import math
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from starlette.websockets import WebSocket
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger("uvicorn")
+
+IDLE_CONNECTIONS = Gauge("idle_connections", "Open websocket connections waiting for input")
+IDLE_EVENTS = Counter(
+    "idle_connection_events_total", "Idle timeouts, warnings and keepalive pings", ["event"]
+)
+
+# Frame a client may send in reply to a ping; it is not treated as a user message
+PONG = '{"type": "pong"}'
+
+
+def is_pong(text: str) -> bool:
+    """Whether a client's message is a pong, however its JSON is spaced."""
+    if not text.startswith("{"):
+        return False
+    try:
+        frame = json.loads(text)
+    except ValueError:
+        return False
+    return isinstance(frame, dict) and frame.get("type") == "pong"
+
+
+@dataclass(frozen=True, slots=True)
+class IdlePolicy:
+    """When to warn, ping and close connections that are waiting for input (seconds).
+
+    ``0`` disables ``warning``, ``keepalive_interval`` and ``keepalive_timeout``.
+    ``keepalive_timeout`` closes connections that sent nothing at all, not even a pong,
+    for that long, to reap dead peers sooner than the TCP stack does.
+    """
+
+    timeout: float = 15.0
+    warning: float = 0.0
+    keepalive_interval: float = 0.0
+    keepalive_timeout: float = 0.0
+
+
+class IdleConnection:
+    """Per-connection idle state, kept small as most connections are idle."""
+
+    __slots__ = (
+        "websocket",
+        "last_activity",
+        "last_received",
+        "last_ping",
+        "slot",
+        "busy",
+        "warned",
+        "closed",
+    )
+
+    def __init__(self, websocket: WebSocket, now: float) -> None:
+        self.websocket = websocket
+        self.last_activity = now
+        self.last_received = now
+        self.last_ping = now
+        self.slot = -1
+        self.busy = False
+        self.warned = False
+        self.closed = False
+
+
+class TimerWheel:
+    """Hashed timer wheel: ``slots`` buckets of ``tick`` seconds.
+
+    Entries due further ahead than the wheel spans are placed in the furthest slot
+    and re-scheduled by the caller when it fires.
+    """
+
+    def __init__(self, tick: float, slots: int = 512) -> None:
+        self.tick = tick
+        self._slots: list[set[IdleConnection]] = [set() for _ in range(slots)]
+        self._cursor = 0
+
+    def schedule(self, entry: IdleConnection, delay: float) -> None:
+        self.cancel(entry)
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self._slots) - 1)
+        entry.slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[entry.slot].add(entry)
+
+    def cancel(self, entry: IdleConnection) -> None:
+        if entry.slot >= 0:
+            self._slots[entry.slot].discard(entry)
+            entry.slot = -1
+
+    def advance(self) -> set[IdleConnection]:
+        """Move to the next slot and return the entries that were in it."""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        due, self._slots[self._cursor] = self._slots[self._cursor], set()
+        for entry in due:
+            entry.slot = -1
+        return due
+
+
+class IdleScheduler:
+    """Applies an ``IdlePolicy`` to every registered connection from one task.
+
+    ``timeout_frame``, ``warning_frame`` and ``ping_frame`` build the frames sent to
+    the client. The task is started lazily on the running event loop.
+    """
+
+    def __init__(
+        self,
+        policy: IdlePolicy,
+        *,
+        timeout_frame: Callable[[], dict],
+        warning_frame: Callable[[float], dict],
+        ping_frame: Callable[[], dict],
+        tick: float = 0.5,
+    ) -> None:
+        self.policy = policy
+        self.tick = tick
+        self.timeout_frame = timeout_frame
+        self.warning_frame = warning_frame
+        self.ping_frame = ping_frame
+        self.connections = 0
+        self._wheel = TimerWheel(tick)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+        self._sends: set[asyncio.Task] = set()
+
+    def _ensure_running(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wheel = TimerWheel(self.tick)
+            self._task = loop.create_task(self._run())
+        return loop
+
+    def register(self, websocket: WebSocket) -> IdleConnection:
+        now = self._ensure_running().time()
+        conn = IdleConnection(websocket, now)
+        self._wheel.schedule(conn, self._next_due(conn, now) - now)
+        self.connections += 1
+        IDLE_CONNECTIONS.inc()
+        return conn
+
+    def unregister(self, conn: IdleConnection) -> None:
+        self._wheel.cancel(conn)
+        conn.closed = True
+        self.connections -= 1
+        IDLE_CONNECTIONS.dec()
+        if not self.connections and self._task is not None:
+            # Nothing to watch: stop ticking until the next connection
+            self._task.cancel()
+            self._task = self._loop = None
+
+    def received(self, conn: IdleConnection) -> None:
+        """Any frame from the client, including pongs."""
+        conn.last_received = self._loop.time()
+
+    def begin_turn(self, conn: IdleConnection) -> None:
+        conn.busy = True
+        conn.last_received = conn.last_activity = self._loop.time()
+
+    def end_turn(self, conn: IdleConnection) -> None:
+        now = self._loop.time()
+        conn.busy = False
+        conn.warned = False
+        conn.last_received = conn.last_activity = now
+        # The slot may be far ahead if the turn started just after a ping
+        self._wheel.schedule(conn, self._next_due(conn, now) - now)
+
+    def _next_due(self, conn: IdleConnection, now: float) -> float:
+        policy = self.policy
+        if conn.busy:
+            return now + policy.timeout
+        due = conn.last_activity + policy.timeout
+        if policy.warning and not conn.warned:
+            due = min(due, conn.last_activity + policy.timeout - policy.warning)
+        if policy.keepalive_interval:
+            due = min(due, max(conn.last_ping, conn.last_received) + policy.keepalive_interval)
+        if policy.keepalive_timeout:
+            due = min(due, conn.last_received + policy.keepalive_timeout)
+        return due
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            now = loop.time()
+            for conn in self._wheel.advance():
+                if not conn.closed:
+                    self._check(conn, now)
+
+    def _check(self, conn: IdleConnection, now: float) -> None:
+        policy = self.policy
+        if not conn.busy:
+            idle = now - conn.last_activity
+            silent = now - conn.last_received
+            if idle >= policy.timeout or (
+                policy.keepalive_timeout and silent >= policy.keepalive_timeout
+            ):
+                self._close(conn)
+                return
+            if policy.warning and not conn.warned and idle >= policy.timeout - policy.warning:
+                conn.warned = True
+                IDLE_EVENTS.inc(event="warning")
+                self._send(conn, self.warning_frame(policy.timeout - idle))
+            if (
+                policy.keepalive_interval
+                and now - max(conn.last_ping, conn.last_received) >= policy.keepalive_interval
+            ):
+                conn.last_ping = now
+                IDLE_EVENTS.inc(event="ping")
+                self._send(conn, self.ping_frame())
+        self._wheel.schedule(conn, self._next_due(conn, now) - now)
+
+    def _close(self, conn: IdleConnection) -> None:
+        # Marked before any await, so a message arriving now is not processed
+        conn.closed = True
+        IDLE_EVENTS.inc(event="timeout")
+        self._spawn(self._close_connection(conn))
+
+    async def _close_connection(self, conn: IdleConnection) -> None:
+        try:
+            await conn.websocket.send_json(self.timeout_frame())
+            logger.info("Closing connection due to user inactivity")
+            await conn.websocket.close(code=1000)
+        except Exception as e:
+            logger.debug("Failed to close idle connection: %s", e)
+
+    def _send(self, conn: IdleConnection, frame: dict) -> None:
+        self._spawn(self._send_frame(conn, frame))
+
+    async def _send_frame(self, conn: IdleConnection, frame: dict) -> None:
+        try:
+            await conn.websocket.send_json(frame)
+        except Exception as e:
+            logger.debug("Failed to send idle frame: %s", e)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._sends.add(task)
+        task.add_done_callback(self._sends.discard)
@@ -0,0 +1,269 @@
+"""Logging off the event loop: records are queued, and formatted and written by a thread.
+
+Writing a log line to stdout blocks when the pipe behind it is full, as it is when
+Docker's log driver falls behind. A storm of errors logged from the event loop then
+stalls every socket of the worker. ``LogPipeline`` replaces the handlers of the
+server's loggers with ``QueuedLogHandler``s, which do nothing on the loop but:
+
+- drop repeated warnings and errors: per call site, ``burst`` records per ``interval``
+  seconds go through, then one in ``sample``. The next record let through carries the
+  count of those suppressed since;
+- attach the session and turn set with ``log_context``;
+- append the record to a bounded queue, or drop it if the queue is full.
+
+A writer thread formats queued records in batches and writes each batch with one call
+per stream. Log with %-style arguments (``logger.error("Turn failed: %s", e)``) rather
+than f-strings, so that messages are only formatted there, and only if written.
+
+With the ``text`` format, records keep the formatter and stream of the handlers they
+replaced (uvicorn's). With ``json``, every record is an object on a line of stdout,
+with ``time``, ``level``, ``logger``, ``message``, ``session_id`` and ``turn`` when
+set, ``suppressed`` and ``exception``.
+"""
+
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from typing import Any, TextIO
+
+from config import LogFormat, Settings
+from metrics import Counter
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total", "Log records not written, by reason", ["reason"]
+)
+
+_context: ContextVar[dict[str, Any] | None] = ContextVar("log_context", default=None)
+
+# Call sites whose window has ended are forgotten past this many
+_MAX_SITES = 1024
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """Tag the records logged in this context, and tasks it starts, with ``fields``."""
+    token = _context.set({**(_context.get() or {}), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+@dataclass(slots=True)
+class _Window:
+    start: float
+    count: int = 0
+    suppressed: int = 0
+
+
+class RepeatFilter(logging.Filter):
+    """Rate limits warnings and errors per call site, then samples them.
+
+    One filter is shared by the pipeline's handlers, so that a call site is limited
+    once, and records are filtered on whichever thread logs them: windows are updated
+    under a lock.
+    """
+
+    def __init__(
+        self,
+        burst: int = 10,
+        interval: float = 1.0,
+        sample: int = 100,
+        level: int = logging.WARNING,
+    ) -> None:
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.sample = sample
+        self.level = level
+        self._windows: dict[tuple[str, str, int], _Window] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        with self._lock:
+            return self._count(key, record, time.monotonic())
+
+    def _count(self, key: tuple[str, str, int], record: logging.LogRecord, now: float) -> bool:
+        window = self._windows.get(key)
+        if window is None or now - window.start >= self.interval:
+            suppressed = window.suppressed if window is not None else 0
+            if window is None and len(self._windows) >= _MAX_SITES:
+                self._prune(now)
+            window = self._windows[key] = _Window(now, suppressed=suppressed)
+        window.count += 1
+        if window.count > self.burst and (window.count - self.burst) % self.sample:
+            window.suppressed += 1
+            LOG_RECORDS_DROPPED.inc(reason="rate_limited")
+            return False
+        if window.suppressed:
+            record.suppressed = window.suppressed
+            window.suppressed = 0
+        return True
+
+    def _prune(self, now: float) -> None:
+        for key, window in list(self._windows.items()):
+            if now - window.start >= self.interval:
+                del self._windows[key]
+
+
+class JsonFormatter(logging.Formatter):
+    """A record as one line of JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, UTC).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "context", {}),
+        }
+        if suppressed := getattr(record, "suppressed", 0):
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class QueuedLogHandler(logging.Handler):
+    """Hands records to the pipeline's writer; formatted and written there."""
+
+    def __init__(self, pipeline: "LogPipeline", formatter: logging.Formatter, stream: TextIO):
+        super().__init__()
+        self.pipeline = pipeline
+        self.stream = stream
+        self.setFormatter(formatter)
+        self.addFilter(pipeline.filter)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if context := _context.get():
+            record.context = context
+        self.pipeline.submit(self, record)
+
+
+class LogPipeline:
+    """The queue between ``QueuedLogHandler``s and the thread writing their records."""
+
+    def __init__(
+        self,
+        format: LogFormat = LogFormat.TEXT,
+        *,
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.1,
+        burst: int = 10,
+        interval: float = 1.0,
+        sample: int = 100,
+        stream: TextIO | None = None,
+    ) -> None:
+        self.format = format
+        # Where json records go, stdout by default
+        self.stream = stream
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.filter = RepeatFilter(burst, interval, sample)
+        self._queue: deque[tuple[QueuedLogHandler, logging.LogRecord]] = deque()
+        self._ready = threading.Condition()
+        self._closed = False
+        self._thread: threading.Thread | None = None
+        self._replaced: dict[logging.Logger, tuple[list[logging.Handler], bool]] = {}
+
+    def submit(self, handler: QueuedLogHandler, record: logging.LogRecord) -> None:
+        with self._ready:
+            if self._closed or len(self._queue) >= self.max_queue:
+                LOG_RECORDS_DROPPED.inc(reason="queue_full")
+                return
+            self._queue.append((handler, record))
+            if len(self._queue) >= self.batch_size:
+                self._ready.notify()
+
+    def install(self, names: Sequence[str] = ("uvicorn", "uvicorn.access")) -> None:
+        """Start the writer, and route the named loggers' records through it.
+
+        With the ``text`` format, loggers without stream handlers of their own (when
+        not run by uvicorn) are left to propagate as before.
+        """
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        for name in names:
+            log = logging.getLogger(name)
+            if self.format == LogFormat.JSON:
+                handlers = [QueuedLogHandler(self, JsonFormatter(), self.stream or sys.stdout)]
+            else:
+                handlers = [
+                    QueuedLogHandler(self, h.formatter or logging.Formatter(), h.stream)
+                    for h in log.handlers
+                    if isinstance(h, logging.StreamHandler)
+                ]
+                if not handlers:
+                    continue
+            self._replaced[log] = (log.handlers, log.propagate)
+            log.handlers, log.propagate = handlers, False
+
+    def _run(self) -> None:
+        while True:
+            with self._ready:
+                if not self._closed and len(self._queue) < self.batch_size:
+                    self._ready.wait(self.flush_interval)
+                count = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for _ in range(count)]
+                closed = self._closed
+            if batch:
+                self._write(batch)
+            elif closed:
+                return
+
+    def _write(self, batch: list[tuple[QueuedLogHandler, logging.LogRecord]]) -> None:
+        lines: dict[TextIO, list[str]] = {}
+        for handler, record in batch:
+            try:
+                line = handler.format(record)
+            except Exception:
+                handler.handleError(record)
+                continue
+            suppressed = getattr(record, "suppressed", 0)
+            if suppressed and self.format == LogFormat.TEXT:
+                line += f" ({suppressed} similar suppressed)"
+            lines.setdefault(handler.stream, []).append(line)
+        for stream, text in lines.items():
+            try:
+                stream.write("\n".join(text) + "\n")
+                stream.flush()
+            except Exception:
+                LOG_RECORDS_DROPPED.inc(len(text), reason="write_failed")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write what is queued, stop the thread and restore the replaced handlers."""
+        for log, (handlers, propagate) in self._replaced.items():
+            log.handlers, log.propagate = handlers, propagate
+        self._replaced.clear()
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def log_pipeline_from_settings(config: Settings) -> LogPipeline | None:
+    """The configured pipeline, or ``None`` to log synchronously as uvicorn does."""
+    if config.log_queue_size <= 0:
+        return None
+    return LogPipeline(
+        config.log_format,
+        max_queue=config.log_queue_size,
+        burst=config.log_burst,
+        interval=config.log_burst_interval,
+        sample=config.log_sample,
+    )
@@ -1,29 +1,190 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 
 from starlette.applications import Starlette
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 from starlette.routing import Route, WebSocketRoute
 
-from agent import AgentWebSocket, bootstrap_agent
-from config import settings
+from accounting import ModelPrices
+from agent import SYSTEM_PROMPT, TOOLS, AgentWebSocket, bootstrap_agent, bootstrap_model
+from batching import BatchRunner, provider_batch_from_settings
+from checkpointing import close_checkpointer, find_checkpointer, open_checkpointer
+from config import TurnPriority, settings
+from diagnostics import HeapDiagnostics, SessionMemory, require_token
+from idle import IdlePolicy
+from log_pipeline import log_pipeline_from_settings
+from metrics import metrics_endpoint
+from prompting import PromptPrefix, warm_up
+from recording import recorder_from_settings
+from retention import retention_from_settings
+from scheduling import TurnScheduler
+from sharding import ShardedCheckpointer
+from shedding import AIMDLimiter, CircuitBreaker, LoadShedder
+from tool_execution import ToolExecutor
+from tool_streaming import EagerTools
+from tracing import tracer_from_settings
+from user_memory import user_memory_from_settings
 
 logger = logging.getLogger("uvicorn")
 
-agent = bootstrap_agent(settings)
+model = bootstrap_model(settings)
+tool_executor = ToolExecutor(
+    thread_workers=settings.tool_thread_workers,
+    process_workers=settings.tool_process_workers,
+    timeout=settings.tool_timeout,
+    shm_threshold=settings.tool_shm_threshold,
+)
+tools = tool_executor.wrap(TOOLS)
+eager_tools = EagerTools(tools) if settings.eager_tools else None
+agent = bootstrap_agent(settings, model, eager_tools, tools)
+scheduler = TurnScheduler(
+    settings.max_concurrent_turns,
+    deadlines={
+        TurnPriority.INTERACTIVE: settings.interactive_turn_deadline,
+        TurnPriority.BATCH: settings.batch_turn_deadline,
+    },
+    weights=settings.tenant_weights,
+    slack=settings.turn_deadline_slack,
+)
+shedder = None
+if settings.load_shedding:
+    shedder = LoadShedder(
+        scheduler,
+        limiter=AIMDLimiter(
+            settings.max_concurrent_turns or settings.adaptive_turn_limit_max,
+            min_limit=settings.adaptive_turn_limit_min,
+            max_limit=settings.adaptive_turn_limit_max,
+        ),
+        breaker=CircuitBreaker(
+            window=settings.breaker_window,
+            min_calls=settings.breaker_min_calls,
+            failure_rate=settings.breaker_failure_rate,
+            cooldown=settings.breaker_cooldown,
+        ),
+        latency_threshold=settings.model_latency_threshold,
+    )
+prices = ModelPrices(
+    input=settings.model_input_price,
+    cached_input=settings.model_cached_input_price,
+    output=settings.model_output_price,
+)
+session_memory = SessionMemory(
+    agent.checkpointer, top=settings.session_memory_top, interval=settings.session_memory_interval
+)
+if (sharded := find_checkpointer(agent.checkpointer, ShardedCheckpointer)) is not None:
+    sharded.register()
+tracer = tracer_from_settings(settings)
+recorder = recorder_from_settings(settings)
+user_memory = user_memory_from_settings(settings)
 aws = AgentWebSocket(
     agent,
     logger,
+    durability=settings.checkpoint_durability,
+    prices=prices,
+    idle_policy=IdlePolicy(
+        timeout=settings.idle_timeout,
+        warning=settings.idle_warning,
+        keepalive_interval=settings.keepalive_interval,
+        keepalive_timeout=settings.keepalive_timeout,
+    ),
+    idle_tick=settings.idle_tick,
+    coalesce=settings.turn_coalescing,
+    scheduler=scheduler,
+    shedder=shedder,
+    tracer=tracer,
+    recorder=recorder,
+    render_cadence=settings.render_cadence,
+    render_max_delay=settings.render_max_delay,
+    render_max_chars=settings.render_max_chars,
+    mux_max_sessions=settings.mux_max_sessions,
+    mux_buffer=settings.mux_session_buffer,
+    eager_tools=eager_tools,
+    session_memory=session_memory,
+    user_memory=user_memory,
+)
+batches = BatchRunner(
+    agent,
+    scheduler,
+    prices=prices,
+    shedder=shedder,
+    concurrency=settings.batch_concurrency,
+    max_items=settings.batch_max_items,
+    provider=provider_batch_from_settings(
+        settings, model, PromptPrefix(SYSTEM_PROMPT, tools), prices
+    ),
 )
 
 
+log_pipeline = log_pipeline_from_settings(settings)
+
+
+@asynccontextmanager
+async def lifespan(_: Starlette):
+    if log_pipeline is not None:
+        log_pipeline.install()
+    await open_checkpointer(agent.checkpointer)
+    if user_memory is not None:
+        await user_memory.refresh()
+    await tool_executor.start()
+    warmup_task = asyncio.create_task(warm_up(model)) if settings.model_warmup else None
+    session_memory_task = asyncio.create_task(session_memory.run_periodically())
+    retention_task = None
+    retention = retention_from_settings(settings)
+    if retention is not None and settings.checkpoint_retention_interval > 0:
+        retention_task = asyncio.create_task(
+            retention.run_periodically(settings.checkpoint_retention_interval)
+        )
+    try:
+        yield
+    finally:
+        session_memory_task.cancel()
+        if retention_task is not None:
+            retention_task.cancel()
+        if warmup_task is not None:
+            warmup_task.cancel()
+        await close_checkpointer(agent.checkpointer)
+        await tool_executor.close()
+        if tracer is not None:
+            await asyncio.to_thread(tracer.close)
+        if recorder is not None:
+            recorder.close()
+        if log_pipeline is not None:
+            await asyncio.to_thread(log_pipeline.close)
+
+
 async def health_check(_: Request) -> JSONResponse:
     return JSONResponse({"status": "ok"})
 
 
-app = Starlette(
-    routes=[
-        Route("/health", health_check),
-        WebSocketRoute("/ws/agent", aws.agent_websocket_endpoint),
-    ],
-)
+routes = [
+    Route("/health", health_check),
+    Route("/metrics", metrics_endpoint),
+    Route("/batch", batches.batch_endpoint, methods=["POST"]),
+    WebSocketRoute("/ws/agent", aws.agent_websocket_endpoint),
+]
+if settings.mux_max_sessions > 0:
+    routes.append(WebSocketRoute("/ws/agent/mux", aws.multiplexed_endpoint))
+if settings.admin_token:
+    heap = HeapDiagnostics(timeout=settings.heap_trace_timeout)
+    routes += [
+        Route(
+            "/admin/sessions", require_token(settings.admin_token, session_memory.sessions_endpoint)
+        ),
+        Route(
+            "/admin/heap",
+            require_token(settings.admin_token, heap.endpoint),
+            methods=["GET", "POST", "DELETE"],
+        ),
+    ]
+    if user_memory is not None:
+        routes.append(
+            Route(
+                "/admin/users/{user_id}/memories",
+                require_token(settings.admin_token, user_memory.memories_endpoint),
+                methods=["GET", "DELETE"],
+            )
+        )
+
+app = Starlette(routes=routes, lifespan=lifespan)
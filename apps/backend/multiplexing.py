@@ -0,0 +1,114 @@
+"""Many conversations over one websocket, for a backend-for-frontend.
+
+``/ws/agent`` runs one conversation per socket, so a service relaying thousands of
+end users holds thousands of sockets, each with its own TLS session through the proxy.
+On ``/ws/agent/mux`` every frame names a session instead:
+
+- the client sends ``{"session_id": "...", "message": "..."}`` to run a turn of that
+  session, and ``{"session_id": "...", "type": "close"}`` to end it;
+- the server sends the frames of ``/ws/agent``, each with the ``session_id`` of its turn.
+  Frames about the connection itself (pings, idle warnings and timeouts, malformed
+  client frames) carry no ``session_id``.
+
+A session starts with its first message, on a thread of its own, up to
+``max_sessions`` per connection. Its turns run one at a time, in the order sent;
+messages sent during a turn wait for it, as they would on a socket of their own.
+Turns of different sessions run concurrently, each in its own scheduler slot.
+
+One task per connection writes the frames. It takes one frame from each session with
+frames waiting in turn, so a session streaming a long answer does not hold back the
+deltas of the others. A session whose ``buffer`` frames are still unsent waits before
+queueing more, which slows only that session's turn when the socket cannot keep up.
+"""
+
+import asyncio
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Literal
+
+from pydantic import BaseModel, Field, model_validator
+
+from metrics import Gauge
+
+MUX_SESSIONS = Gauge("mux_sessions", "Sessions open on multiplexed connections")
+
+
+class MuxFrame(BaseModel):
+    """A frame sent by the client on a multiplexed connection."""
+
+    session_id: str = Field(min_length=1, max_length=128)
+    type: Literal["message", "close"] = "message"
+    message: str | None = None
+
+    @model_validator(mode="after")
+    def _has_message(self) -> "MuxFrame":
+        if self.type == "message" and self.message is None:
+            raise ValueError("message frames need a message")
+        return self
+
+
+class _Outbox:
+    __slots__ = ("frames", "space", "ready")
+
+    def __init__(self) -> None:
+        self.frames: deque[dict] = deque()
+        self.space = asyncio.Event()
+        # Whether the session is in the writer's round
+        self.ready = False
+
+
+class FairSender:
+    """Writes the frames of many sessions to one socket, round robin between sessions.
+
+    ``put`` queues a frame, tagged with its session, and waits while ``buffer`` frames
+    of that session are unsent. ``run`` sends them with ``send`` until cancelled.
+    """
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]], buffer: int = 64) -> None:
+        self.send = send
+        self.buffer = buffer
+        self._outboxes: dict[str | None, _Outbox] = {}
+        # Sessions with frames to send, in the order they are served
+        self._round: deque[str | None] = deque()
+        self._wakeup = asyncio.Event()
+
+    async def put(self, session_id: str | None, frame: dict) -> None:
+        outbox = self._outboxes.get(session_id)
+        if outbox is None:
+            outbox = self._outboxes[session_id] = _Outbox()
+        while len(outbox.frames) >= self.buffer:
+            outbox.space.clear()
+            await outbox.space.wait()
+            if self._outboxes.get(session_id) is not outbox:
+                # Discarded while waiting
+                return
+        outbox.frames.append(frame if session_id is None else {**frame, "session_id": session_id})
+        if not outbox.ready:
+            outbox.ready = True
+            self._round.append(session_id)
+            self._wakeup.set()
+
+    def discard(self, session_id: str) -> None:
+        """Drop the session's unsent frames, and the frame of a ``put`` waiting for space."""
+        outbox = self._outboxes.pop(session_id, None)
+        if outbox is None:
+            return
+        if outbox.ready:
+            self._round.remove(session_id)
+        outbox.frames.clear()
+        outbox.space.set()
+
+    async def run(self) -> None:
+        while True:
+            while not self._round:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            session_id = self._round.popleft()
+            outbox = self._outboxes[session_id]
+            frame = outbox.frames.popleft()
+            outbox.space.set()
+            if outbox.frames:
+                self._round.append(session_id)
+            else:
+                outbox.ready = False
+            await self.send(frame)
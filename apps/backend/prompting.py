@@ -0,0 +1,159 @@
+"""A stable, precomputed prompt prefix for the agent's model calls.
+
+Providers cache the longest prefix of a request they have recently served and charge
+less, and answer sooner, for the cached part. Every request of the agent starts with
+the tool definitions and the system prompt, followed by the conversation so far. A
+session's consecutive requests therefore share everything except the newest
+messages, as long as that start is byte-identical. ``PromptPrefix`` makes sure of
+this:
+
+- Tool schemas are converted once, in name order, and bound to the model when the
+  process starts. Every request carries the same definitions without converting them
+  again.
+- The system prompt is a single ``SystemMessage``, built once, with nothing
+  per-request in it.
+- ``with_memories`` puts what is remembered about the user (see ``user_memory``) just
+  before their newest message, where it only changes the end of the request. It is
+  not stored in the thread.
+- ``SessionCacheBinding`` adds a prompt cache key to each call. The key is the
+  prefix fingerprint plus the session's thread id (OpenAI's ``prompt_cache_key``), so
+  a session's requests are routed to the provider cache that holds its history.
+
+The graph is compiled once per process around the bound model and shared by all
+sessions. ``warm_up`` opens the model client's connection before the first turn.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from collections.abc import AsyncIterator, Callable, Iterator, Sequence
+from typing import Any
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableBinding, RunnableConfig
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.prebuilt import create_react_agent
+
+logger = logging.getLogger("uvicorn")
+
+# Keyword argument carrying the cache key, for models whose API has one
+OPENAI_CACHE_KEY = "prompt_cache_key"
+# Key of the user's memories retrieved for a turn, in its config's ``configurable``
+USER_MEMORIES = "user_memories"
+MEMORIES_PREAMBLE = "What you remember about the user from earlier conversations:"
+
+
+class PromptPrefix:
+    """System prompt and tool definitions that start every model request."""
+
+    def __init__(self, system_prompt: str, tools: Sequence[BaseTool | Callable]) -> None:
+        self.system_message = SystemMessage(content=system_prompt)
+        schemas = [convert_to_openai_tool(tool) for tool in tools]
+        order = sorted(range(len(schemas)), key=lambda i: schemas[i]["function"]["name"])
+        self.tools = [tools[i] for i in order]
+        self.schemas = [schemas[i] for i in order]
+        canonical = json.dumps([system_prompt, self.schemas], sort_keys=True, separators=(",", ":"))
+        # Same prompt and tools, same fingerprint, in every process
+        self.fingerprint = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+class SessionCacheBinding(RunnableBinding):
+    """A model bound to the prefix's tools that keys each call by its session."""
+
+    cache_key_param: str | None = OPENAI_CACHE_KEY
+    fingerprint: str = ""
+
+    def _cache_kwargs(self, config: RunnableConfig | None) -> dict[str, str]:
+        thread_id = (config or {}).get("configurable", {}).get("thread_id")
+        if self.cache_key_param is None or thread_id is None:
+            return {}
+        return {self.cache_key_param: f"{self.fingerprint}-{thread_id}"}
+
+    def invoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        return super().invoke(input, config, **self._cache_kwargs(config), **kwargs)
+
+    async def ainvoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        return await super().ainvoke(input, config, **self._cache_kwargs(config), **kwargs)
+
+    def stream(
+        self, input: Any, config: RunnableConfig | None = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        yield from super().stream(input, config, **self._cache_kwargs(config), **kwargs)
+
+    async def astream(
+        self, input: Any, config: RunnableConfig | None = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        async for chunk in super().astream(input, config, **self._cache_kwargs(config), **kwargs):
+            yield chunk
+
+
+def with_memories(
+    system_message: SystemMessage,
+) -> Callable[[dict, RunnableConfig], list[BaseMessage]]:
+    """The agent's prompt: the system message and the conversation, with the turn's
+    ``USER_MEMORIES`` before the user's newest message."""
+
+    def prompt(state: dict, config: RunnableConfig) -> list[BaseMessage]:
+        messages = state["messages"]
+        memories = config.get("configurable", {}).get(USER_MEMORIES)
+        if not memories:
+            return [system_message, *messages]
+        last = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage))
+        note = SystemMessage(
+            content="\n".join([MEMORIES_PREAMBLE, *(f"- {memory}" for memory in memories)])
+        )
+        return [system_message, *messages[:last], note, *messages[last:]]
+
+    return prompt
+
+
+def bind_prefix(
+    model: BaseChatModel, prefix: PromptPrefix, cache_key_param: str | None = OPENAI_CACHE_KEY
+) -> SessionCacheBinding:
+    bound = model.bind_tools(prefix.schemas)
+    return SessionCacheBinding(
+        bound=bound.bound,
+        kwargs=bound.kwargs,
+        config=bound.config,
+        cache_key_param=cache_key_param,
+        fingerprint=prefix.fingerprint,
+    )
+
+
+def build_agent(
+    model: BaseChatModel,
+    tools: Sequence[BaseTool | Callable],
+    system_prompt: str,
+    checkpointer: BaseCheckpointSaver | None = None,
+    *,
+    cache_key_param: str | None = OPENAI_CACHE_KEY,
+    user_memories: bool = False,
+) -> CompiledStateGraph:
+    """The agent graph around a model pre-bound to a stable prompt prefix.
+
+    With ``user_memories``, turns may pass memories to add to the prompt (see
+    ``with_memories``).
+    """
+    prefix = PromptPrefix(system_prompt, tools)
+    return create_react_agent(
+        model=bind_prefix(model, prefix, cache_key_param),
+        tools=prefix.tools,
+        prompt=with_memories(prefix.system_message) if user_memories else prefix.system_message,
+        checkpointer=checkpointer,
+    )
+
+
+async def warm_up(model: BaseChatModel, timeout: float = 10.0) -> None:
+    """Open the model client's connection pool with a cheap request, if it has one."""
+    client = getattr(model, "root_async_client", None)
+    if client is None:
+        return
+    try:
+        await asyncio.wait_for(client.models.list(), timeout)
+    except Exception as e:
+        logger.warning("Model warm-up failed: %s", e)
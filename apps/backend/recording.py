@@ -0,0 +1,343 @@
+"""Session recording for offline replay.
+
+``SessionRecorder`` appends one compact JSON line per finished turn to a log
+segment. The line holds the inbound message, the timing of every token of every
+model call, the tool calls and their results, and the outbound frames:
+
+    {"s": session, "n": turn, "ts": epoch ms, "in": message, "st": status,
+     "ms": total ms, "q": queue ms,
+     "calls": [{"at": ms, "tok": [[gap ms, text], ...], "tc": [[id, name, args]],
+                "u": [input, output, cached]}],
+     "tools": [[id, name, at ms, duration ms]],
+     "out": [[at ms, frame type], ...]}
+
+Times are milliseconds from the turn's start; the gap before a call's first token is
+its time to first token. Tool calls are replayed as a single chunk at their first
+chunk's time. Each worker writes its own segments, ``sessions-<time>-<pid>-<n>.jsonl``.
+A segment is closed at ``max_bytes`` and gzipped in the background. Only the newest
+``max_files`` closed segments are kept. With ``redact``, message text, tokens and
+tool arguments are replaced by filler of the same length; timings and sizes are kept.
+
+``ReplayChatModel`` reproduces recorded calls for ``benchmarks.replay``. The replay
+client tags each message with ``[replay:<session>:<turn>]``, and the model streams
+the matching call with its recorded tokens, gaps, tool calls and usage. Turns that
+followed a coalesced turn made no model calls of their own; they are answered like
+unrecorded ones, by the fake model.
+"""
+
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler, AsyncCallbackManagerForLLMRun
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGenerationChunk
+from pydantic import PrivateAttr
+
+from accounting import TokenUsage
+from config import Settings
+from fake_model import FakeStreamingChatModel
+from metrics import Counter
+
+logger = logging.getLogger("uvicorn")
+
+RECORDED_TURNS = Counter("agent_recorded_turns_total", "Turns written to the session log")
+
+REPLAY_TAG = re.compile(r"^\[replay:([^:\]]+):(\d+)\] ")
+_FILLER = re.compile(r"\S")
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def _redact(text: str) -> str:
+    return _FILLER.sub("x", text)
+
+
+class SessionRecorder:
+    """Appends turn records to size-rotated log segments in ``directory``."""
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_files: int = 20,
+        redact: bool = False,
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.redact = redact
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._size = 0
+        self._segments = 0
+        self._compressing: list[threading.Thread] = []
+        self._pruning = threading.Lock()
+
+    def start_turn(self, session_id: str, turn: int, message: str) -> "TurnRecording":
+        return TurnRecording(self, session_id, turn, message)
+
+    def write(self, record: dict[str, Any]) -> None:
+        line = json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n"
+        if self._file is not None and self._size + len(line) > self.max_bytes:
+            self._rotate()
+        if self._file is None:
+            stamp = time.strftime("%Y%m%dT%H%M%S")
+            name = f"sessions-{stamp}-{os.getpid()}-{self._segments}.jsonl"
+            self._segments += 1
+            path = os.path.join(self.directory, name)
+            self._file = open(path, "a", encoding="utf-8")  # noqa: SIM115
+            self._size = self._file.tell()
+        self._file.write(line)
+        # One write per turn; keep whole lines on disk for tailing and crash safety
+        self._file.flush()
+        self._size += len(line)
+        RECORDED_TURNS.inc()
+
+    def _rotate(self) -> None:
+        path = self._file.name
+        self._file.close()
+        self._file = None
+        thread = threading.Thread(target=self._compress, args=(path,), daemon=True)
+        thread.start()
+        self._compressing = [t for t in self._compressing if t.is_alive()] + [thread]
+
+    def _compress(self, path: str) -> None:
+        with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+        with self._pruning:
+            closed = sorted(
+                glob.glob(os.path.join(self.directory, "sessions-*.jsonl.gz")),
+                key=os.path.getmtime,
+            )
+            for old in closed[: max(0, len(closed) - self.max_files)]:
+                os.remove(old)
+
+    def close(self) -> None:
+        """Close the open segment and wait for closed ones to be compressed."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for thread in self._compressing:
+            thread.join()
+
+
+class TurnRecording(AsyncCallbackHandler):
+    """Records one turn; pass it in the run's ``callbacks``."""
+
+    def __init__(self, recorder: SessionRecorder, session_id: str, turn: int, message: str):
+        self.recorder = recorder
+        self.started = time.perf_counter()
+        self.record: dict[str, Any] = {
+            "s": session_id,
+            "n": turn,
+            "ts": int(time.time() * 1000),
+            "in": _redact(message) if recorder.redact else message,
+            "q": 0.0,
+            "calls": [],
+            "tools": [],
+            "out": [],
+        }
+        # run_id -> (call, time of its last token) or tool start time
+        self._calls: dict[UUID, tuple[dict[str, Any], float]] = {}
+        self._tools: dict[UUID, float] = {}
+        # run_id -> tool call index -> [id, name, args]
+        self._tool_calls: dict[UUID, dict[int, list[str]]] = {}
+
+    def _at(self, now: float) -> float:
+        return _ms(now - self.started)
+
+    def queued(self, seconds: float) -> None:
+        self.record["q"] = _ms(seconds)
+
+    def sent(self, frame: dict[str, Any], seconds: float) -> None:
+        self.record["out"].append([self._at(time.perf_counter()), frame["type"]])
+
+    def finish(self, status: str, error: BaseException | None, usage: TokenUsage) -> None:
+        self.record["st"] = status
+        self.record["ms"] = self._at(time.perf_counter())
+        self.recorder.write(self.record)
+
+    async def on_chat_model_start(
+        self, serialized: dict[str, Any], messages: list, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        now = time.perf_counter()
+        call = {"at": self._at(now), "tok": [], "tc": [], "u": [0, 0, 0]}
+        self.record["calls"].append(call)
+        self._calls[run_id] = (call, now)
+        self._tool_calls[run_id] = {}
+
+    async def on_llm_new_token(
+        self, token: str, *, run_id: UUID, chunk: Any = None, **kwargs: Any
+    ) -> None:
+        if (entry := self._calls.get(run_id)) is None:
+            return
+        call, last = entry
+        message = getattr(chunk, "message", None)
+        pieces = message.tool_call_chunks if isinstance(message, AIMessageChunk) else []
+        if not token and not pieces:
+            return
+        now = time.perf_counter()
+        call["tok"].append([_ms(now - last), _redact(token) if self.recorder.redact else token])
+        self._calls[run_id] = (call, now)
+        if pieces:
+            pending = self._tool_calls[run_id]
+            for piece in pieces:
+                tool_call = pending.setdefault(piece.get("index") or 0, ["", "", ""])
+                tool_call[0] = tool_call[0] or piece.get("id") or ""
+                tool_call[1] = tool_call[1] or piece.get("name") or ""
+                tool_call[2] += piece.get("args") or ""
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if (entry := self._calls.pop(run_id, None)) is None:
+            return
+        call, _ = entry
+        try:
+            usage = response.generations[0][0].message.usage_metadata or {}
+        except (AttributeError, IndexError):
+            usage = {}
+        if usage:
+            cached = usage.get("input_token_details", {}).get("cache_read", 0)
+            call["u"] = [usage["input_tokens"], usage["output_tokens"], cached]
+        for tool_call in self._tool_calls.pop(run_id, {}).values():
+            if self.recorder.redact:
+                tool_call[2] = "{}"
+            call["tc"].append(tool_call)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        await self.on_llm_end(None, run_id=run_id)
+
+    async def on_tool_start(
+        self, serialized: dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._tools[run_id] = time.perf_counter()
+
+    async def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if (started := self._tools.pop(run_id, None)) is None:
+            return
+        self.record["tools"].append(
+            [
+                getattr(output, "tool_call_id", ""),
+                getattr(output, "name", "") or "",
+                self._at(started),
+                _ms(time.perf_counter() - started),
+            ]
+        )
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        await self.on_tool_end(None, run_id=run_id)
+
+
+def read_turns(patterns: list[str]) -> Iterator[dict[str, Any]]:
+    """Turn records from log segments, gzipped or not, in file order."""
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+class ReplayChatModel(FakeStreamingChatModel):
+    """Replays recorded model calls, with their token timings, for tagged messages.
+
+    ``speed`` divides every recorded delay. Untagged or unrecorded turns get the fake
+    model's canned replies.
+    """
+
+    speed: float = 1.0
+
+    _scripts: dict[tuple[str, int], list[dict[str, Any]]] = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def from_logs(cls, patterns: list[str], **kwargs: Any) -> "ReplayChatModel":
+        model = cls(**kwargs)
+        for turn in read_turns(patterns):
+            model._scripts[(turn["s"], turn["n"])] = turn["calls"]
+        return model
+
+    def _script(self, messages: list[BaseMessage]) -> dict[str, Any] | None:
+        """The recorded call this request stands for, if any."""
+        start = next(
+            (i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)),
+            None,
+        )
+        if start is None or not (match := REPLAY_TAG.match(str(messages[start].content))):
+            return None
+        calls = self._scripts.get((match.group(1), int(match.group(2))))
+        index = sum(isinstance(m, AIMessage) for m in messages[start + 1 :])
+        return calls[index] if calls and index < len(calls) else None
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if (call := self._script(messages)) is None:
+            async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+                yield chunk
+            return
+        for chunk in self._replay(call):
+            if isinstance(chunk, float):
+                await asyncio.sleep(chunk)
+                continue
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content, chunk=chunk)
+            yield chunk
+
+    def _replay(self, call: dict[str, Any]) -> Iterator[ChatGenerationChunk | float]:
+        """The recorded call's chunks, preceded by the delays to wait before them."""
+        tool_calls = [
+            {"id": id_, "name": name, "args": args, "index": index}
+            for index, (id_, name, args) in enumerate(call["tc"])
+        ]
+        for gap, text in call["tok"]:
+            yield gap / 1000 / self.speed
+            if text:
+                yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+            elif tool_calls:
+                message = AIMessageChunk(content="", tool_call_chunks=tool_calls)
+                tool_calls = []
+                yield ChatGenerationChunk(message=message)
+        if tool_calls:
+            message = AIMessageChunk(content="", tool_call_chunks=tool_calls)
+            yield ChatGenerationChunk(message=message)
+        input_tokens, output_tokens, cached = call["u"]
+        usage: UsageMetadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        if cached:
+            usage["input_token_details"] = {"cache_read": cached}
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+
+def recorder_from_settings(config: Settings) -> SessionRecorder | None:
+    """The configured session recorder, or ``None`` if recording is off."""
+    if not config.session_record_dir:
+        return None
+    return SessionRecorder(
+        config.session_record_dir,
+        max_bytes=config.session_record_max_bytes,
+        max_files=config.session_record_max_files,
+        redact=config.session_record_redact,
+    )
@@ -0,0 +1,128 @@
+"""Pacing of content deltas to what a client can render cheaply.
+
+A browser that re-renders the whole message for every ``content_delta`` does work
+quadratic in the answer's length. That is worse when each frame also carries the
+whole text so far in ``accumulated``. A client can ask for a cadence with the
+``cadence`` query parameter or the ``X-Render-Cadence`` header:
+
+- ``token`` (the default) sends a frame per model token with ``accumulated``.
+- ``block`` holds text back in a ``DeltaBuffer`` until a sentence or a markdown block
+  (a line, or a fenced code block) ends. Every frame then renders as complete text,
+  and carries only the new ``delta``; the client appends. Text is never held longer
+  than ``max_delay`` seconds past the next token, nor beyond ``max_chars``, and is
+  flushed before any other frame.
+
+The turn's frames are produced once, and paced per connection, so followers of a
+coalesced turn get their own cadence.
+"""
+
+import re
+import time
+from collections.abc import AsyncIterator, Callable
+
+from starlette.websockets import WebSocket
+
+from config import RenderCadence
+
+CONTENT_DELTA = "content_delta"
+
+# A sentence ends at terminal punctuation, with closing quotes or brackets, before
+# whitespace; a block at a newline
+_SENTENCE_END = re.compile(r"[.!?][\"')\]*_]*\s")
+_FENCE = "```"
+
+
+def render_cadence(websocket: WebSocket, default: RenderCadence) -> RenderCadence:
+    """The cadence the client asked for, from its query string or headers."""
+    cadence = websocket.query_params.get("cadence") or websocket.headers.get("x-render-cadence", "")
+    try:
+        return RenderCadence(cadence.lower())
+    except ValueError:
+        return default
+
+
+class DeltaBuffer:
+    """Holds content back until it ends at a sentence or markdown block boundary."""
+
+    def __init__(
+        self,
+        max_delay: float = 0.25,
+        max_chars: int = 400,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.max_delay = max_delay
+        self.max_chars = max_chars
+        self.clock = clock
+        self._text = ""
+        self._since = 0.0
+        # Inside a fenced code block, only line ends are boundaries
+        self._in_fence = False
+
+    def push(self, delta: str) -> str:
+        """Add ``delta``; returns the text ready to send, possibly empty."""
+        if not self._text:
+            self._since = self.clock()
+        self._text += delta
+        if len(self._text) >= self.max_chars or self.clock() - self._since >= self.max_delay:
+            return self.flush()
+        end = self._boundary()
+        if end == 0:
+            return ""
+        ready, self._text = self._text[:end], self._text[end:]
+        if self._text:
+            self._since = self.clock()
+        return ready
+
+    def flush(self) -> str:
+        """All text held back."""
+        text, self._text = self._text, ""
+        self._track_fences(text)
+        return text
+
+    def _boundary(self) -> int:
+        """End of the last complete sentence or block in the held text, or 0."""
+        end = self._text.rfind("\n") + 1
+        if end:
+            self._track_fences(self._text[:end])
+        if self._in_fence:
+            return end
+        tail = self._text[end:]
+        sentences = [m.end() for m in _SENTENCE_END.finditer(tail)]
+        if sentences and _FENCE not in tail:
+            end += sentences[-1]
+        return end
+
+    def _track_fences(self, text: str) -> None:
+        if text.count(_FENCE) % 2:
+            self._in_fence = not self._in_fence
+
+
+async def pace(
+    frames: AsyncIterator[dict],
+    cadence: RenderCadence,
+    *,
+    max_delay: float = 0.25,
+    max_chars: int = 400,
+) -> AsyncIterator[dict]:
+    """``frames`` with their content deltas paced at ``cadence``."""
+    if cadence == RenderCadence.TOKEN:
+        # Every frame carries the text so far, so each one costs a copy of it
+        accumulated = ""
+        async for frame in frames:
+            if frame["type"] == CONTENT_DELTA:
+                accumulated += frame["delta"]
+                frame = {**frame, "accumulated": accumulated}
+            yield frame
+        return
+
+    buffer = DeltaBuffer(max_delay, max_chars)
+    async for frame in frames:
+        if frame["type"] == CONTENT_DELTA:
+            if ready := buffer.push(frame["delta"]):
+                yield {"type": CONTENT_DELTA, "delta": ready}
+            continue
+        if held := buffer.flush():
+            yield {"type": CONTENT_DELTA, "delta": held}
+        yield frame
+    if held := buffer.flush():
+        yield {"type": CONTENT_DELTA, "delta": held}
@@ -0,0 +1,416 @@
+"""Checkpoint retention for Postgres: prune history, expire idle threads, archive them.
+
+Runs in the server as a periodic background task or from the command line:
+
+    python -m retention --keep-last 20 --ttl 2592000 --archive-dir archive/
+
+Work is done in batches of ``batch_size`` threads, each batch in its own short
+statements with a ``lock_timeout``, pausing between batches so the job never holds
+locks on the hot checkpoint tables for long. Only one worker runs it at a time.
+"""
+
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import os
+from collections.abc import Sequence
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from psycopg import AsyncConnection
+from psycopg.errors import LockNotAvailable
+from psycopg.rows import dict_row
+
+from config import CheckpointerType, Settings
+from serialization import DIGEST_SIZE, CheckpointSerializer
+
+logger = logging.getLogger("uvicorn")
+
+# Session-level advisory lock held for the duration of a run, shared by all workers
+ADVISORY_LOCK_KEY = 7_270_521_028
+
+# Unreferenced payloads are only deleted once untouched for this long. It must exceed
+# ``checkpointing.PAYLOAD_TOUCH_INTERVAL`` plus the duration of a run.
+PAYLOAD_GRACE = timedelta(days=1)
+
+EXPIRED_THREADS_SQL = """
+    SELECT thread_id FROM checkpoints
+    WHERE thread_id > %s
+    GROUP BY thread_id
+    HAVING max(checkpoint->>'ts') < %s
+    ORDER BY thread_id
+    LIMIT %s
+"""
+
+# Expiry is re-checked in the deleting statement in case a thread was resumed
+DELETE_EXPIRED_SQL = """
+    WITH expired AS (
+        SELECT thread_id FROM checkpoints
+        WHERE thread_id = ANY(%(threads)s)
+        GROUP BY thread_id
+        HAVING max(checkpoint->>'ts') < %(cutoff)s
+    ), checkpoints_deleted AS (
+        DELETE FROM checkpoints WHERE thread_id IN (SELECT thread_id FROM expired) RETURNING 1
+    ), blobs_deleted AS (
+        DELETE FROM checkpoint_blobs WHERE thread_id IN (SELECT thread_id FROM expired)
+        RETURNING 1
+    ), writes_deleted AS (
+        DELETE FROM checkpoint_writes WHERE thread_id IN (SELECT thread_id FROM expired)
+        RETURNING 1
+    )
+    SELECT
+        (SELECT count(*) FROM expired) AS threads,
+        (SELECT count(*) FROM checkpoints_deleted) AS checkpoints,
+        (SELECT count(*) FROM blobs_deleted) AS blobs,
+        (SELECT count(*) FROM writes_deleted) AS writes
+"""
+
+OVERGROWN_THREADS_SQL = """
+    SELECT thread_id FROM checkpoints
+    WHERE thread_id > %s
+    GROUP BY thread_id
+    HAVING count(*) > %s
+    ORDER BY thread_id
+    LIMIT %s
+"""
+
+PRUNE_CHECKPOINTS_SQL = """
+    WITH ranked AS (
+        SELECT thread_id, checkpoint_ns, checkpoint_id,
+            row_number() OVER (
+                PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+            ) AS rank
+        FROM checkpoints
+        WHERE thread_id = ANY(%(threads)s)
+    ), checkpoints_deleted AS (
+        DELETE FROM checkpoints c USING ranked r
+        WHERE r.rank > %(keep_last)s
+            AND c.thread_id = r.thread_id
+            AND c.checkpoint_ns = r.checkpoint_ns
+            AND c.checkpoint_id = r.checkpoint_id
+        RETURNING c.thread_id, c.checkpoint_ns, c.checkpoint_id
+    ), writes_deleted AS (
+        DELETE FROM checkpoint_writes w USING checkpoints_deleted d
+        WHERE w.thread_id = d.thread_id
+            AND w.checkpoint_ns = d.checkpoint_ns
+            AND w.checkpoint_id = d.checkpoint_id
+        RETURNING 1
+    )
+    SELECT
+        (SELECT count(*) FROM checkpoints_deleted) AS checkpoints,
+        (SELECT count(*) FROM writes_deleted) AS writes
+"""
+
+# Blobs are written before the checkpoint that references them, so a blob newer than
+# every remaining checkpoint may belong to a checkpoint still being written.
+PRUNE_BLOBS_SQL = """
+    DELETE FROM checkpoint_blobs b
+    WHERE b.thread_id = ANY(%s)
+        AND NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = b.thread_id
+                AND c.checkpoint_ns = b.checkpoint_ns
+                AND c.checkpoint->'channel_versions'->>b.channel = b.version
+        )
+        AND b.version < (
+            SELECT max(c.checkpoint->'channel_versions'->>b.channel) FROM checkpoints c
+            WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+        )
+"""
+
+# Digests from the ``compact+ref`` header: a 2-byte count followed by the digests
+REFERENCED_PAYLOADS_SQL = f"""
+    SELECT DISTINCT substring(blob FROM 3 + {DIGEST_SIZE} * i FOR {DIGEST_SIZE}) AS digest
+    FROM (
+        SELECT blob FROM checkpoint_blobs WHERE type LIKE 'compact+ref%'
+        UNION ALL
+        SELECT blob FROM checkpoint_writes WHERE type LIKE 'compact+ref%'
+    ) refs,
+    generate_series(0, get_byte(blob, 0) * 256 + get_byte(blob, 1) - 1) AS i
+"""
+
+STALE_PAYLOADS_SQL = """
+    SELECT digest FROM checkpoint_payloads
+    WHERE digest > %s AND touched_at < %s
+    ORDER BY digest
+    LIMIT %s
+"""
+
+DELETE_PAYLOADS_SQL = """
+    DELETE FROM checkpoint_payloads WHERE digest = ANY(%s) AND touched_at < %s
+"""
+
+ARCHIVE_QUERIES = {
+    "checkpoints": """
+        SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type,
+            checkpoint, metadata
+        FROM checkpoints WHERE thread_id = ANY(%s)
+    """,
+    "blobs": """
+        SELECT thread_id, checkpoint_ns, channel, version, type, blob
+        FROM checkpoint_blobs WHERE thread_id = ANY(%s)
+    """,
+    "writes": """
+        SELECT thread_id, checkpoint_ns, checkpoint_id, task_id, task_path, idx, channel,
+            type, blob
+        FROM checkpoint_writes WHERE thread_id = ANY(%s)
+    """,
+}
+
+
+@dataclass(slots=True)
+class RetentionStats:
+    threads_expired: int = 0
+    checkpoints_deleted: int = 0
+    blobs_deleted: int = 0
+    writes_deleted: int = 0
+    payloads_deleted: int = 0
+
+
+def _encode_bytes(value: Any) -> str:
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Cannot archive {type(value).__name__}")
+
+
+class CheckpointRetention:
+    """Applies the retention policy to the checkpoint tables.
+
+    - ``keep_last``: keep only the newest N checkpoints per thread and namespace.
+    - ``ttl``: delete threads whose newest checkpoint is older than this.
+    - ``archive_dir``: before deleting an expired thread, append its rows (and the
+      payloads they reference) as one JSON line to a gzipped file per run. ``bytea``
+      columns are base64 encoded.
+
+    Payloads no longer referenced by any blob or write are deleted afterwards.
+
+    Given the DSNs of several checkpoint shards, it runs each in turn and locks each on
+    its own, so workers may run different shards at once.
+    """
+
+    def __init__(
+        self,
+        conn_string: str | Sequence[str],
+        *,
+        keep_last: int | None = None,
+        ttl: timedelta | None = None,
+        archive_dir: str | Path | None = None,
+        batch_size: int = 500,
+        pause: float = 0.1,
+        lock_timeout: float = 2.0,
+        payload_grace: timedelta = PAYLOAD_GRACE,
+    ) -> None:
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("keep_last must be at least 1")
+        self.conn_strings = [conn_string] if isinstance(conn_string, str) else list(conn_string)
+        self.keep_last = keep_last
+        self.ttl = ttl
+        self.archive_dir = Path(archive_dir) if archive_dir else None
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lock_timeout = lock_timeout
+        self.payload_grace = payload_grace
+
+    async def run(self) -> RetentionStats | None:
+        """Run once; returns ``None`` if other workers are already running every shard."""
+        stats = None
+        for conn_string in self.conn_strings:
+            if (shard_stats := await self._run(conn_string)) is None:
+                continue
+            if stats is None:
+                stats = shard_stats
+            else:
+                for name, value in asdict(shard_stats).items():
+                    setattr(stats, name, getattr(stats, name) + value)
+        return stats
+
+    async def _run(self, conn_string: str) -> RetentionStats | None:
+        async with await AsyncConnection.connect(
+            conn_string, autocommit=True, prepare_threshold=None, row_factory=dict_row
+        ) as conn:
+            await conn.execute(f"SET lock_timeout = {int(self.lock_timeout * 1000)}")
+            cur = await conn.execute(
+                "SELECT pg_try_advisory_lock(%s) AS locked", [ADVISORY_LOCK_KEY]
+            )
+            if not (await cur.fetchone())["locked"]:
+                return None
+            stats = RetentionStats()
+            if self.ttl is not None:
+                await self._expire_threads(conn, stats)
+            if self.keep_last is not None:
+                await self._prune_threads(conn, stats)
+            await self._delete_unreferenced_payloads(conn, stats)
+            return stats
+
+    async def run_periodically(self, interval: float) -> None:
+        """Run every ``interval`` seconds until cancelled."""
+        while True:
+            try:
+                if (stats := await self.run()) is not None:
+                    logger.info("Checkpoint retention: %s", asdict(stats))
+            except Exception as e:
+                logger.error("Checkpoint retention failed: %s", e)
+            await asyncio.sleep(interval)
+
+    async def _batches(self, conn: AsyncConnection, sql: str, arg: Any):
+        """Yield batches of thread ids selected by ``sql``, walking the table by key."""
+        last = ""
+        while True:
+            cur = await conn.execute(sql, [last, arg, self.batch_size])
+            threads = [row["thread_id"] for row in await cur.fetchall()]
+            if not threads:
+                return
+            yield threads
+            last = threads[-1]
+            await asyncio.sleep(self.pause)
+
+    async def _expire_threads(self, conn: AsyncConnection, stats: RetentionStats) -> None:
+        started = datetime.now(UTC)
+        cutoff = (started - self.ttl).isoformat()
+        archive = None
+        if self.archive_dir is not None:
+            name = f"checkpoints-{started:%Y%m%dT%H%M%S}-{os.getpid()}.jsonl.gz"
+            archive = self.archive_dir / name
+
+        async for threads in self._batches(conn, EXPIRED_THREADS_SQL, cutoff):
+            if archive is not None:
+                await self._archive(conn, archive, threads)
+            try:
+                cur = await conn.execute(DELETE_EXPIRED_SQL, {"threads": threads, "cutoff": cutoff})
+            except LockNotAvailable:
+                logger.warning("Checkpoint retention skipped %d busy threads", len(threads))
+                continue
+            row = await cur.fetchone()
+            stats.threads_expired += row["threads"]
+            stats.checkpoints_deleted += row["checkpoints"]
+            stats.blobs_deleted += row["blobs"]
+            stats.writes_deleted += row["writes"]
+
+    async def _prune_threads(self, conn: AsyncConnection, stats: RetentionStats) -> None:
+        async for threads in self._batches(conn, OVERGROWN_THREADS_SQL, self.keep_last):
+            try:
+                cur = await conn.execute(
+                    PRUNE_CHECKPOINTS_SQL, {"threads": threads, "keep_last": self.keep_last}
+                )
+                row = await cur.fetchone()
+                stats.checkpoints_deleted += row["checkpoints"]
+                stats.writes_deleted += row["writes"]
+                cur = await conn.execute(PRUNE_BLOBS_SQL, [threads])
+                stats.blobs_deleted += cur.rowcount
+            except LockNotAvailable:
+                logger.warning("Checkpoint retention skipped %d busy threads", len(threads))
+
+    async def _delete_unreferenced_payloads(
+        self, conn: AsyncConnection, stats: RetentionStats
+    ) -> None:
+        # Anything referenced after this point was touched, so is newer than the cutoff
+        cutoff = datetime.now(UTC) - self.payload_grace
+        cur = await conn.execute(REFERENCED_PAYLOADS_SQL)
+        referenced = {row["digest"] for row in await cur.fetchall()}
+        last = b""
+        while True:
+            cur = await conn.execute(STALE_PAYLOADS_SQL, [last, cutoff, self.batch_size])
+            digests = [row["digest"] for row in await cur.fetchall()]
+            if not digests:
+                return
+            last = digests[-1]
+            if unreferenced := [d for d in digests if d not in referenced]:
+                cur = await conn.execute(DELETE_PAYLOADS_SQL, [unreferenced, cutoff])
+                stats.payloads_deleted += cur.rowcount
+            await asyncio.sleep(self.pause)
+
+    async def _archive(self, conn: AsyncConnection, path: Path, threads: list[str]) -> None:
+        records: dict[str, dict[str, Any]] = {
+            thread_id: {"thread_id": thread_id, "payloads": {}} | {k: [] for k in ARCHIVE_QUERIES}
+            for thread_id in threads
+        }
+        digests: dict[bytes, set[str]] = {}
+        for table, sql in ARCHIVE_QUERIES.items():
+            cur = await conn.execute(sql, [threads])
+            for row in await cur.fetchall():
+                records[row["thread_id"]][table].append(row)
+                if table == "checkpoints" or row["type"] is None:
+                    continue
+                for digest in CheckpointSerializer.referenced_payloads(row["type"], row["blob"]):
+                    digests.setdefault(digest, set()).add(row["thread_id"])
+        if digests:
+            cur = await conn.execute(
+                "SELECT digest, type, payload FROM checkpoint_payloads WHERE digest = ANY(%s)",
+                [list(digests)],
+            )
+            for row in await cur.fetchall():
+                for thread_id in digests[row["digest"]]:
+                    records[thread_id]["payloads"][row["digest"].hex()] = [
+                        row["type"],
+                        row["payload"],
+                    ]
+        lines = [
+            json.dumps(record, default=_encode_bytes) + "\n"
+            for record in records.values()
+            if record["checkpoints"]
+        ]
+        await asyncio.to_thread(self._append, path, lines)
+
+    @staticmethod
+    def _append(path: Path, lines: list[str]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Each call appends a gzip member; readers see one continuous stream
+        with open(path, "ab") as f:
+            f.write(gzip.compress("".join(lines).encode()))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def retention_from_settings(config: Settings) -> CheckpointRetention | None:
+    """The configured retention job, or ``None`` if there is nothing to do."""
+    if config.checkpointer_type != CheckpointerType.POSTGRES:
+        return None
+    if config.checkpoint_keep_last is None and config.checkpoint_thread_ttl is None:
+        return None
+    return CheckpointRetention(
+        config.postgres_shard_dsns,
+        keep_last=config.checkpoint_keep_last,
+        ttl=(
+            timedelta(seconds=config.checkpoint_thread_ttl)
+            if config.checkpoint_thread_ttl is not None
+            else None
+        ),
+        archive_dir=config.checkpoint_archive_dir,
+        batch_size=config.checkpoint_retention_batch_size,
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    retention = CheckpointRetention(
+        args.postgres_dsn,
+        keep_last=args.keep_last,
+        ttl=timedelta(seconds=args.ttl) if args.ttl is not None else None,
+        archive_dir=args.archive_dir,
+        batch_size=args.batch_size,
+        pause=args.pause,
+    )
+    stats = await retention.run()
+    if stats is None:
+        print("Another worker is running checkpoint retention")
+    else:
+        print(json.dumps(asdict(stats)))
+
+
+if __name__ == "__main__":
+    from config import settings
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keep-last", type=int, default=settings.checkpoint_keep_last)
+    parser.add_argument(
+        "--ttl", type=float, default=settings.checkpoint_thread_ttl, help="idle seconds"
+    )
+    parser.add_argument("--archive-dir", default=settings.checkpoint_archive_dir)
+    parser.add_argument("--batch-size", type=int, default=settings.checkpoint_retention_batch_size)
+    parser.add_argument("--pause", type=float, default=0.1)
+    parser.add_argument("--postgres-dsn", nargs="+", default=settings.postgres_shard_dsns)
+    asyncio.run(main(parser.parse_args()))
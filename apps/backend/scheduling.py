@@ -0,0 +1,207 @@
+"""Admission of agent turns to a bounded number of slots per worker.
+
+Waiting turns are served by priority class, and within a class by weighted fair
+queuing between tenants: each turn gets a virtual finish tag of
+``max(class virtual time, tenant's last tag) + 1 / weight`` and the smallest tag goes
+first, so a tenant with many queued turns cannot crowd out one with a few. Every turn
+has a deadline for starting, from its class. A turn within ``slack`` of its deadline is
+scheduled ahead of higher classes, so batch turns are delayed but not starved. A turn
+that cannot start before its deadline fails with ``DeadlineExceeded``, rather than
+running after its user has given up.
+"""
+
+import asyncio
+import heapq
+import itertools
+from collections.abc import AsyncIterator, Mapping
+from contextlib import asynccontextmanager
+
+from starlette.websockets import WebSocket
+
+from config import TurnPriority
+from metrics import Gauge, Histogram
+
+QUEUE_SECONDS = Histogram(
+    "agent_turn_queue_seconds", "Time turns waited for a slot, per priority class", ["priority"]
+)
+QUEUED_TURNS = Gauge("agent_queued_turns", "Turns waiting for a slot", ["priority"])
+ACTIVE_TURNS = Gauge("agent_active_turns", "Turns holding a slot")
+
+DEFAULT_TENANT = "default"
+# Tenant tags are pruned once they fall behind the class's virtual time
+_MAX_TENANTS = 1024
+
+
+class DeadlineExceeded(Exception):
+    """A turn could not be scheduled before its deadline."""
+
+
+def classify_turn(websocket: WebSocket, user_msg: str) -> tuple[TurnPriority, str]:
+    """Priority class and tenant of a turn, from the client's connection metadata.
+
+    Read from the ``priority`` and ``tenant`` query parameters, or the
+    ``X-Turn-Priority`` and ``X-Tenant-Id`` headers; unknown priorities are interactive.
+    """
+    priority = websocket.query_params.get("priority") or websocket.headers.get(
+        "x-turn-priority", ""
+    )
+    tenant = websocket.query_params.get("tenant") or websocket.headers.get(
+        "x-tenant-id", DEFAULT_TENANT
+    )
+    try:
+        return TurnPriority(priority.lower()), tenant
+    except ValueError:
+        return TurnPriority.INTERACTIVE, tenant
+
+
+class _Waiter:
+    __slots__ = ("priority", "tag", "deadline", "future")
+
+    def __init__(
+        self, priority: TurnPriority, tag: float, deadline: float, future: asyncio.Future
+    ) -> None:
+        self.priority = priority
+        self.tag = tag
+        self.deadline = deadline
+        self.future = future
+
+
+class TurnScheduler:
+    """Grants at most ``limit`` concurrent turn slots (``0`` for no limit).
+
+    ``deadlines`` is the longest a turn of each class may wait for a slot, in seconds.
+    """
+
+    def __init__(
+        self,
+        limit: int = 0,
+        *,
+        deadlines: Mapping[TurnPriority, float] | None = None,
+        weights: Mapping[str, float] | None = None,
+        slack: float = 1.0,
+    ) -> None:
+        self.limit = limit
+        self.deadlines = {
+            TurnPriority.INTERACTIVE: 30.0,
+            TurnPriority.BATCH: 600.0,
+            **(deadlines or {}),
+        }
+        self.weights = dict(weights or {})
+        self.slack = slack
+        self.active = 0
+        self.pending = 0
+        self._order = itertools.count()
+        # Per class: heap of (tag, order, waiter), its virtual time and tenants' last tags
+        self._queues: dict[TurnPriority, list[tuple[float, int, _Waiter]]] = {
+            priority: [] for priority in TurnPriority
+        }
+        self._virtual_time = dict.fromkeys(TurnPriority, 0.0)
+        self._tenant_tags: dict[TurnPriority, dict[str, float]] = {p: {} for p in TurnPriority}
+        self._deadlines: list[tuple[float, int, _Waiter]] = []
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: TurnPriority, tenant: str = DEFAULT_TENANT
+    ) -> AsyncIterator[float]:
+        """Hold a slot for the duration of the block; yields the seconds spent waiting."""
+        waited = await self.acquire(priority, tenant)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    async def acquire(self, priority: TurnPriority, tenant: str = DEFAULT_TENANT) -> float:
+        """Wait for a slot and return the seconds waited; call ``release`` afterwards."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if not self.limit or (self.active < self.limit and not self.pending):
+            self._grant()
+            QUEUE_SECONDS.observe(0.0, priority=priority)
+            return 0.0
+
+        waiter = self._enqueue(priority, tenant, now + self.deadlines[priority], loop)
+        QUEUED_TURNS.inc(priority=priority)
+        try:
+            self._dispatch()
+            async with asyncio.timeout_at(waiter.deadline):
+                await asyncio.shield(waiter.future)
+        except TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self.pending -= 1
+                raise DeadlineExceeded(
+                    f"No {priority} turn slot within {self.deadlines[priority]:.0f}s"
+                ) from None
+            # Granted as the deadline passed: take the slot after all
+        except asyncio.CancelledError:
+            if waiter.future.cancel():
+                self.pending -= 1
+            else:
+                # The slot was granted to a turn that is no longer there
+                self.release()
+            raise
+        finally:
+            QUEUED_TURNS.dec(priority=priority)
+        waited = loop.time() - now
+        QUEUE_SECONDS.observe(waited, priority=priority)
+        return waited
+
+    def set_limit(self, limit: int) -> None:
+        self.limit = limit
+        self._dispatch()
+
+    def release(self) -> None:
+        self.active -= 1
+        ACTIVE_TURNS.dec()
+        self._dispatch()
+
+    def _grant(self) -> None:
+        self.active += 1
+        ACTIVE_TURNS.inc()
+
+    def _enqueue(
+        self,
+        priority: TurnPriority,
+        tenant: str,
+        deadline: float,
+        loop: asyncio.AbstractEventLoop,
+    ) -> _Waiter:
+        tags = self._tenant_tags[priority]
+        virtual_time = self._virtual_time[priority]
+        if len(tags) > _MAX_TENANTS:
+            # Tenants behind the virtual time would start from it anyway
+            self._tenant_tags[priority] = tags = {t: v for t, v in tags.items() if v > virtual_time}
+        tag = max(virtual_time, tags.get(tenant, 0.0)) + 1 / self.weights.get(tenant, 1.0)
+        tags[tenant] = tag
+
+        waiter = _Waiter(priority, tag, deadline, loop.create_future())
+        order = next(self._order)
+        heapq.heappush(self._queues[priority], (tag, order, waiter))
+        heapq.heappush(self._deadlines, (deadline, order, waiter))
+        self.pending += 1
+        return waiter
+
+    def _next(self, now: float) -> _Waiter | None:
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][2].future.done():
+            heapq.heappop(deadlines)
+        if deadlines and deadlines[0][0] - now <= self.slack:
+            # About to miss its deadline: earliest deadline first, whatever its class
+            return heapq.heappop(deadlines)[2]
+        for priority in TurnPriority:
+            queue = self._queues[priority]
+            while queue:
+                _, _, waiter = heapq.heappop(queue)
+                if not waiter.future.done():
+                    self._virtual_time[priority] = waiter.tag
+                    return waiter
+        return None
+
+    def _dispatch(self) -> None:
+        if not self.pending:
+            return
+        now = asyncio.get_running_loop().time()
+        while self.active < self.limit and (waiter := self._next(now)) is not None:
+            self.pending -= 1
+            self._grant()
+            waiter.future.set_result(None)
@@ -0,0 +1,284 @@
+"""Compact checkpoint serialization with optional compression and payload dedup."""
+
+import hashlib
+import struct
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any
+
+import ormsgpack
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer, _msgpack_default, _option
+
+from config import CheckpointCompression
+
+# Message classes encoded as ``[code, non-default fields]``. Codes are persisted:
+# append new classes, never reorder.
+MESSAGE_TYPES: tuple[type[BaseMessage], ...] = (
+    HumanMessage,
+    AIMessage,
+    ToolMessage,
+    SystemMessage,
+    AIMessageChunk,
+)
+_MESSAGE_CODES = {cls: code for code, cls in enumerate(MESSAGE_TYPES)}
+
+# JsonPlusSerializer uses ext codes 0-6.
+EXT_COMPACT_MESSAGE = 100
+
+COMPACT = "compact"
+REF = "ref"
+# Tool message content replaced by a payload reference: marker + sha256 hex digest.
+REF_MARKER = "\x00payload:"
+DIGEST_SIZE = 32
+
+# (type, bytes) of a stored payload, keyed by digest
+Payloads = dict[bytes, tuple[str, bytes]]
+
+_collected: ContextVar[Payloads | None] = ContextVar("collected_payloads", default=None)
+_provided: ContextVar[dict[bytes, str] | None] = ContextVar("provided_payloads", default=None)
+
+
+class _Codec:
+    """Compression codec; compressor objects are per thread as dumps run in worker threads."""
+
+    def __init__(self, name: CheckpointCompression):
+        self.name = name
+        self._local = threading.local()
+        if name == CheckpointCompression.ZSTD:
+            try:
+                import zstandard
+            except ImportError as e:
+                raise ImportError(
+                    "zstd checkpoint compression requires the 'zstandard' package "
+                    "(uv sync --extra compression)"
+                ) from e
+            self._zstd = zstandard
+        elif name == CheckpointCompression.LZ4:
+            try:
+                import lz4.frame
+            except ImportError as e:
+                raise ImportError(
+                    "lz4 checkpoint compression requires the 'lz4' package "
+                    "(uv sync --extra compression)"
+                ) from e
+            self._lz4 = lz4.frame
+
+    def compress(self, data: bytes) -> bytes:
+        if self.name == CheckpointCompression.ZSTD:
+            if (compressor := getattr(self._local, "compressor", None)) is None:
+                compressor = self._local.compressor = self._zstd.ZstdCompressor(level=3)
+            return compressor.compress(data)
+        return self._lz4.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.name == CheckpointCompression.ZSTD:
+            if (decompressor := getattr(self._local, "decompressor", None)) is None:
+                decompressor = self._local.decompressor = self._zstd.ZstdDecompressor()
+            return decompressor.decompress(data)
+        return self._lz4.decompress(data)
+
+
+class PayloadCache:
+    """Thread-safe LRU of decoded payloads, bounded by total characters."""
+
+    def __init__(self, max_chars: int = 64 * 1024 * 1024):
+        self.max_chars = max_chars
+        self.size = 0
+        self._items: OrderedDict[bytes, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: bytes) -> str | None:
+        with self._lock:
+            if (value := self._items.get(digest)) is not None:
+                self._items.move_to_end(digest)
+            return value
+
+    def put(self, digest: bytes, value: str) -> None:
+        with self._lock:
+            if digest in self._items:
+                self._items.move_to_end(digest)
+                return
+            self._items[digest] = value
+            self.size += len(value)
+            while self.size > self.max_chars and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class CheckpointSerializer:
+    """Checkpoint serializer producing smaller blobs than ``JsonPlusSerializer``.
+
+    - Messages are packed as ``[type code, non-default fields]`` instead of a full
+      pydantic dump with module and class names.
+    - Bodies of at least ``compress_min_bytes`` are compressed with zstd or lz4.
+    - Inside ``collect_payloads()``, ``ToolMessage`` contents of at least
+      ``dedup_min_bytes`` are replaced by a sha256 reference and handed to the saver
+      to store once, so the same tool result is not rewritten into every checkpoint.
+      Outside it (e.g. with ``MemorySaver``) content stays inline.
+
+    The type string records the encoding (``compact[+ref][+codec]``) so blobs
+    written with other settings, or by ``JsonPlusSerializer``, still load.
+    """
+
+    def __init__(
+        self,
+        compression: CheckpointCompression = CheckpointCompression.NONE,
+        *,
+        dedup_min_bytes: int = 1024,
+        compress_min_bytes: int = 256,
+        cache: PayloadCache | None = None,
+    ):
+        self.compression = compression
+        self.dedup_min_bytes = dedup_min_bytes
+        self.compress_min_bytes = compress_min_bytes
+        self.cache = cache or PayloadCache()
+        self._jsonplus = JsonPlusSerializer()
+        self._codecs: dict[str, _Codec] = {}
+        self._codec = self._get_codec(compression) if compression != "none" else None
+
+    def _get_codec(self, name: str) -> _Codec:
+        if (codec := self._codecs.get(name)) is None:
+            codec = self._codecs[name] = _Codec(CheckpointCompression(name))
+        return codec
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._jsonplus.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self._jsonplus.loads(data)
+
+    def _default(self, refs: list[bytes], obj: Any) -> Any:
+        code = _MESSAGE_CODES.get(type(obj))
+        if code is None:
+            return _msgpack_default(obj)
+        fields = obj.model_dump(exclude_defaults=True)
+        fields.pop("type", None)
+        content = fields.get("content")
+        collected = _collected.get()
+        if (
+            collected is not None
+            and code == _MESSAGE_CODES[ToolMessage]
+            and isinstance(content, str)
+            and len(content) >= self.dedup_min_bytes
+        ):
+            encoded = content.encode()
+            digest = hashlib.sha256(encoded).digest()
+            if digest not in collected:
+                collected[digest] = self._encode_payload(encoded)
+                self.cache.put(digest, content)
+            fields["content"] = REF_MARKER + digest.hex()
+            refs.append(digest)
+        return ormsgpack.Ext(
+            EXT_COMPACT_MESSAGE,
+            ormsgpack.packb([code, fields], default=partial(self._default, refs), option=_option),
+        )
+
+    def _ext_hook(self, resolved: dict[bytes, str], code: int, data: bytes) -> Any:
+        if code != EXT_COMPACT_MESSAGE:
+            return self._jsonplus._unpack_ext_hook(code, data)
+        type_code, fields = ormsgpack.unpackb(
+            data, ext_hook=partial(self._ext_hook, resolved), option=ormsgpack.OPT_NON_STR_KEYS
+        )
+        content = fields.get("content")
+        if isinstance(content, str) and content.startswith(REF_MARKER):
+            fields["content"] = resolved[bytes.fromhex(content[len(REF_MARKER) :])]
+        return MESSAGE_TYPES[type_code](**fields)
+
+    def _resolve(self, digest: bytes) -> str:
+        provided = _provided.get()
+        if provided is not None and (value := provided.get(digest)) is not None:
+            return value
+        if (value := self.cache.get(digest)) is not None:
+            return value
+        raise LookupError(f"Checkpoint payload {digest.hex()} is not available")
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if obj is None or isinstance(obj, bytes | bytearray):
+            return self._jsonplus.dumps_typed(obj)
+        refs: list[bytes] = []
+        try:
+            body = ormsgpack.packb(obj, default=partial(self._default, refs), option=_option)
+        except ormsgpack.MsgpackEncodeError:
+            return self._jsonplus.dumps_typed(obj)
+
+        parts, header = [COMPACT], b""
+        if refs:
+            unique = list(dict.fromkeys(refs))
+            parts.append(REF)
+            header = struct.pack(">H", len(unique)) + b"".join(unique)
+        if self._codec is not None and len(body) >= self.compress_min_bytes:
+            body = self._codec.compress(body)
+            parts.append(self._codec.name)
+        return "+".join(parts), header + body
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, blob = data
+        parts = type_.split("+")
+        if parts[0] != COMPACT:
+            return self._jsonplus.loads_typed(data)
+        resolved = {}
+        if REF in parts:
+            # Resolve up front: errors raised inside ext hooks lose their type.
+            digests = self.referenced_payloads(type_, blob)
+            resolved = {digest: self._resolve(digest) for digest in digests}
+            blob = blob[2 + len(digests) * DIGEST_SIZE :]
+        if len(parts) > 1 and parts[-1] != REF:
+            blob = self._get_codec(parts[-1]).decompress(blob)
+        return ormsgpack.unpackb(
+            blob, ext_hook=partial(self._ext_hook, resolved), option=ormsgpack.OPT_NON_STR_KEYS
+        )
+
+    def _encode_payload(self, data: bytes) -> tuple[str, bytes]:
+        if self._codec is not None and len(data) >= self.compress_min_bytes:
+            return self._codec.name, self._codec.compress(data)
+        return "raw", data
+
+    def decode_payload(self, type_: str, data: bytes) -> str:
+        """Decode a payload row written by ``collect_payloads``."""
+        if type_ != "raw":
+            data = self._get_codec(type_).decompress(data)
+        return data.decode()
+
+    @staticmethod
+    def referenced_payloads(type_: str, blob: bytes | None) -> list[bytes]:
+        """Digests a blob refers to, read from its header without decoding it."""
+        if blob is None or REF not in type_.split("+"):
+            return []
+        (count,) = struct.unpack_from(">H", blob)
+        return [blob[2 + i * DIGEST_SIZE : 2 + (i + 1) * DIGEST_SIZE] for i in range(count)]
+
+    @contextmanager
+    def collect_payloads(self) -> Iterator[Payloads]:
+        """Deduplicate tool payloads dumped in this context into the yielded dict."""
+        payloads: Payloads = {}
+        token = _collected.set(payloads)
+        try:
+            yield payloads
+        finally:
+            _collected.reset(token)
+
+    @contextmanager
+    def provide_payloads(self, payloads: dict[bytes, str]) -> Iterator[None]:
+        """Make fetched payloads available to ``loads_typed`` in this context."""
+        for digest, value in payloads.items():
+            self.cache.put(digest, value)
+        token = _provided.set(payloads)
+        try:
+            yield
+        finally:
+            _provided.reset(token)
+
+    def cached_payloads(self, digests: Iterable[bytes]) -> dict[bytes, str]:
+        return {d: value for d in digests if (value := self.cache.get(d)) is not None}
@@ -0,0 +1,205 @@
+"""Tuned uvicorn server profile: ``python -m server``.
+
+- uvloop and httptools are used when installed (``uv sync --extra server``), with a
+  warning otherwise.
+- One worker runs per available core, counting CPU affinity and the cgroup CPU
+  quota, unless ``SERVER_WORKERS`` is set.
+- Websocket frames are capped at ``WS_MAX_SIZE``, and at most ``WS_MAX_QUEUE``
+  incoming messages are buffered per connection, since clients send one short
+  message per turn.
+- Per-message deflate is off by default. Its compression context costs about 90 KB
+  per connection, and CPU per streamed token.
+- uvicorn's per-connection pings are off; ``KEEPALIVE_INTERVAL`` pings idle
+  connections from one shared task instead.
+
+By default, workers share one listening socket, as with ``uvicorn --workers``. With
+``SERVER_REUSE_PORT`` each worker binds its own ``SO_REUSEPORT`` socket. The kernel
+then spreads new connections evenly across workers, rather than waking them all to
+race for each one. Crashed workers are restarted with backoff, until
+``SERVER_RESTART_LIMIT`` crashes fall within ``SERVER_RESTART_WINDOW`` seconds.
+"""
+
+import argparse
+import importlib.util
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from collections import deque
+from typing import Any
+
+import uvicorn
+
+from config import Settings
+
+logger = logging.getLogger("uvicorn")
+
+
+def available_cores() -> int:
+    """Cores this process may run on, including any cgroup v2 CPU quota."""
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cores or 1)
+
+
+def server_options(
+    config: Settings, app: str = "main:app", *, factory: bool = False
+) -> dict[str, Any]:
+    """Keyword arguments for ``uvicorn.Config`` under the tuned profile."""
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    if loop != "uvloop" or http != "httptools":
+        logger.warning("uvloop/httptools not installed, using %s/%s", loop, http)
+    return {
+        "app": app,
+        "factory": factory,
+        "host": config.server_host,
+        "port": config.server_port,
+        "loop": loop,
+        "http": http,
+        "ws": "websockets",
+        "ws_max_size": config.ws_max_size,
+        "ws_max_queue": config.ws_max_queue,
+        "ws_per_message_deflate": config.ws_per_message_deflate,
+        "ws_ping_interval": None,
+        "backlog": config.server_backlog,
+        "log_level": "info",
+    }
+
+
+class RestartBackoff:
+    """Delays before restarting crashed workers.
+
+    The delay doubles with each crash in the last ``window`` seconds, from ``initial`` up
+    to ``maximum``. Once ``limit`` crashes fall in the window there is none: give up.
+    """
+
+    def __init__(
+        self, limit: int, window: float, *, initial: float = 0.5, maximum: float = 30.0
+    ) -> None:
+        self.limit = limit
+        self.window = window
+        self.initial = initial
+        self.maximum = maximum
+        self._crashes: deque[float] = deque()
+
+    def crashed(self, now: float) -> float | None:
+        """Record a crash at ``now``; the delay before restarting, or None to give up."""
+        self._crashes.append(now)
+        while self._crashes[0] <= now - self.window:
+            self._crashes.popleft()
+        if self.limit and len(self._crashes) >= self.limit:
+            return None
+        return min(self.maximum, self.initial * 2 ** (len(self._crashes) - 1))
+
+
+def reuse_port_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def _serve_reuse_port(options: dict[str, Any]) -> None:
+    config = uvicorn.Config(**options)
+    uvicorn.Server(config).run(sockets=[reuse_port_socket(config.host, config.port)])
+
+
+def run_reuse_port(options: dict[str, Any], workers: int, backoff: RestartBackoff) -> None:
+    """Run ``workers`` processes, each accepting on its own SO_REUSEPORT socket.
+
+    Exits with status 1 when ``backoff`` gives up on crashing workers.
+    """
+    context = multiprocessing.get_context("spawn")
+    processes: list[multiprocessing.Process] = []
+    # Monotonic time each crashed worker's slot is restarted at
+    restart_at: dict[int, float] = {}
+    stopping = failed = False
+
+    def spawn() -> multiprocessing.Process:
+        process = context.Process(target=_serve_reuse_port, args=(options,), daemon=False)
+        process.start()
+        return process
+
+    def stop(*_) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info("Starting %d workers with SO_REUSEPORT on port %s", workers, options["port"])
+    processes = [spawn() for _ in range(workers)]
+    while not stopping:
+        time.sleep(0.1)
+        now = time.monotonic()
+        for n, process in enumerate(processes):
+            if stopping:
+                break
+            if n in restart_at:
+                if now >= restart_at[n]:
+                    del restart_at[n]
+                    processes[n] = spawn()
+            elif not process.is_alive():
+                if (delay := backoff.crashed(now)) is None:
+                    logger.error(
+                        "Worker %s exited with %s; %d crashes in %ss, giving up",
+                        process.pid,
+                        process.exitcode,
+                        backoff.limit,
+                        backoff.window,
+                    )
+                    stopping = failed = True
+                    break
+                logger.warning(
+                    "Worker %s exited with %s, restarting in %.1fs",
+                    process.pid,
+                    process.exitcode,
+                    delay,
+                )
+                restart_at[n] = now + delay
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+    if failed:
+        raise SystemExit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the server with the tuned profile")
+    parser.add_argument("--app", default="main:app", help="ASGI app import string")
+    parser.add_argument("--factory", action="store_true", help="--app is an app factory")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int, help="default: SERVER_WORKERS or one per core")
+    parser.add_argument("--reuse-port", action="store_true", default=None)
+    args = parser.parse_args()
+
+    config = Settings()
+    options = server_options(config, args.app, factory=args.factory)
+    if args.host:
+        options["host"] = args.host
+    if args.port:
+        options["port"] = args.port
+    workers = args.workers or config.server_workers or available_cores()
+    reuse_port = config.server_reuse_port if args.reuse_port is None else args.reuse_port
+
+    if reuse_port and workers > 1:
+        backoff = RestartBackoff(config.server_restart_limit, config.server_restart_window)
+        run_reuse_port(options, workers, backoff)
+    else:
+        uvicorn.run(**options, workers=workers)
+
+
+if __name__ == "__main__":
+    main()
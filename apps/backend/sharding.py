@@ -0,0 +1,474 @@
+"""Checkpoints spread over several Postgres databases by a consistent hash of the thread id.
+
+Every thread lives on one shard, chosen by ``HashRing``: each shard owns ``VNODES``
+points of a 64-bit ring, and a thread belongs to the shard owning the first point at or
+after the hash of its id. A shard is identified by its position in the list of DSNs,
+so a database can move to another host without moving its threads. New shards are
+appended; each takes an even share of the threads from all existing shards, and no
+thread moves between the existing ones.
+
+``ShardedCheckpointer`` routes every call to the shard of its thread, each shard a
+``PostgresCheckpointer`` with a pool of its own. Batched writes are split by shard and
+written concurrently.
+
+Adding shards, online:
+
+1. Append their DSNs, set ``migrate_from`` to the previous number of shards and roll
+   the workers. Before touching a thread that the new shards now own, a worker moves
+   whatever is left of it on its previous shard. This costs one query to the previous
+   shard per access to such a thread.
+2. Run ``python -m sharding --migrate-from N`` to move the threads nobody touched.
+3. Unset ``migrate_from`` once it reports nothing left to move.
+
+A thread is moved in one transaction on each side: its rows are locked on the source,
+copied to the target (where newer rows win), and the rows copied are deleted from the
+source. A checkpoint written to the source meanwhile, by a worker still on the old
+shard list, stays there for the next move. Removing shards is not supported.
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import time
+from collections import Counter as TallyCounter
+from collections import defaultdict
+from collections.abc import AsyncIterator, Iterator, Sequence
+from contextlib import contextmanager
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from psycopg import AsyncConnection
+from psycopg.types.json import Jsonb
+
+from checkpointing import PendingPut, PendingWrites, PostgresCheckpointer
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from serialization import CheckpointSerializer
+
+logger = logging.getLogger("uvicorn")
+
+# Points per shard on the ring; every process must agree on it
+VNODES = 256
+
+SHARD_OPERATIONS = Histogram(
+    "checkpoint_shard_seconds", "Checkpoint operations per shard, by operation", ["shard", "op"]
+)
+SHARD_ERRORS = Counter(
+    "checkpoint_shard_errors_total", "Failed checkpoint operations per shard", ["shard", "op"]
+)
+SHARD_POOL = Gauge(
+    "checkpoint_shard_pool_connections",
+    "Connections of each shard's pool: open, idle, or requests waiting for one",
+    ["shard", "state"],
+)
+THREADS_MOVED = Counter(
+    "checkpoint_threads_moved_total",
+    "Threads moved to the shard that now owns them",
+    ["source", "target"],
+)
+
+THREAD_EXISTS_SQL = """
+    SELECT EXISTS (SELECT 1 FROM checkpoints WHERE thread_id = %(thread_id)s)
+        OR EXISTS (SELECT 1 FROM checkpoint_blobs WHERE thread_id = %(thread_id)s)
+        OR EXISTS (SELECT 1 FROM checkpoint_writes WHERE thread_id = %(thread_id)s)
+        AS found
+"""
+
+# Columns of each table, in the order its rows are copied; its key comes first
+TABLES = {
+    "checkpoint_blobs": (
+        ("thread_id", "checkpoint_ns", "channel", "version"),
+        ("type", "blob"),
+    ),
+    "checkpoints": (
+        ("thread_id", "checkpoint_ns", "checkpoint_id"),
+        ("parent_checkpoint_id", "type", "checkpoint", "metadata"),
+    ),
+    "checkpoint_writes": (
+        ("thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"),
+        ("task_path", "channel", "type", "blob"),
+    ),
+}
+JSONB_COLUMNS = {"checkpoint", "metadata"}
+
+THREAD_IDS_SQL = """
+    SELECT thread_id FROM checkpoints WHERE thread_id > %(after)s
+    UNION
+    SELECT thread_id FROM checkpoint_blobs WHERE thread_id > %(after)s
+    ORDER BY thread_id
+    LIMIT %(limit)s
+"""
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Maps thread ids onto ``shards`` shards, moving few of them as shards are added."""
+
+    def __init__(self, shards: int, vnodes: int = VNODES) -> None:
+        if shards < 1:
+            raise ValueError("A ring needs at least one shard")
+        self.shards = shards
+        points = sorted(
+            (_hash(f"shard-{shard}#{vnode}"), shard)
+            for shard in range(shards)
+            for vnode in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard(self, thread_id: str) -> int:
+        i = bisect.bisect_left(self._hashes, _hash(thread_id))
+        return self._owners[i % len(self._owners)]
+
+
+def _select_sql(table: str) -> str:
+    key, values = TABLES[table]
+    return f"SELECT {', '.join(key + values)} FROM {table} WHERE thread_id = %s FOR UPDATE"
+
+
+def _insert_sql(table: str) -> str:
+    key, values = TABLES[table]
+    columns = key + values
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) ON CONFLICT DO NOTHING"
+    )
+
+
+def _delete_sql(table: str) -> str:
+    key, _ = TABLES[table]
+    types = ", ".join(f"%s::{'int' if column == 'idx' else 'text'}[]" for column in key[1:])
+    return (
+        f"DELETE FROM {table} WHERE thread_id = %s "
+        f"AND ({', '.join(key[1:])}) IN (SELECT * FROM unnest({types}))"
+    )
+
+
+async def move_thread(source: AsyncConnection, target: AsyncConnection, thread_id: str) -> bool:
+    """Move a thread's checkpoints, blobs and writes; ``False`` if there were none to move.
+
+    Payloads the rows reference are copied too, and left on the source for retention.
+    """
+    cur = await source.execute(THREAD_EXISTS_SQL, {"thread_id": thread_id})
+    if not (await cur.fetchone())["found"]:
+        return False
+    async with source.transaction():
+        rows = {}
+        for table in TABLES:
+            cur = await source.execute(_select_sql(table), [thread_id])
+            rows[table] = await cur.fetchall()
+        digests = {
+            digest
+            for table in ("checkpoint_blobs", "checkpoint_writes")
+            for row in rows[table]
+            if row["type"] is not None
+            for digest in CheckpointSerializer.referenced_payloads(row["type"], row["blob"])
+        }
+        payloads = []
+        if digests:
+            cur = await source.execute(
+                "SELECT digest, type, payload FROM checkpoint_payloads WHERE digest = ANY(%s)",
+                [list(digests)],
+            )
+            payloads = [(r["digest"], r["type"], r["payload"]) for r in await cur.fetchall()]
+
+        async with target.transaction(), target.cursor() as cur:
+            if payloads:
+                await cur.executemany(
+                    "INSERT INTO checkpoint_payloads (digest, type, payload) "
+                    "VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                    payloads,
+                )
+            for table, table_rows in rows.items():
+                if table_rows:
+                    await cur.executemany(
+                        _insert_sql(table),
+                        [
+                            [Jsonb(v) if k in JSONB_COLUMNS else v for k, v in row.items()]
+                            for row in table_rows
+                        ],
+                    )
+
+        for table, table_rows in rows.items():
+            if table_rows:
+                key = TABLES[table][0][1:]
+                await source.execute(
+                    _delete_sql(table),
+                    [thread_id, *([row[column] for row in table_rows] for column in key)],
+                )
+    # Another mover may have taken the rows while this one waited for their locks
+    return any(rows.values())
+
+
+class ShardedCheckpointer(BaseCheckpointSaver):
+    """Routes each thread to its shard, moving it there first while shards are added.
+
+    Listing without a thread lists every shard in turn.
+    """
+
+    def __init__(self, shards: Sequence[BaseCheckpointSaver], *, migrate_from: int = 0) -> None:
+        super().__init__(serde=shards[0].serde)
+        self.shards = list(shards)
+        self.ring = HashRing(len(self.shards))
+        if migrate_from > len(self.shards):
+            raise ValueError("Shards can only be added, not removed")
+        self.previous = HashRing(migrate_from) if 0 < migrate_from < len(self.shards) else None
+
+    async def aopen(self) -> None:
+        await asyncio.gather(
+            *(aopen() for s in self.shards if (aopen := getattr(s, "aopen", None)) is not None)
+        )
+
+    async def aclose(self) -> None:
+        await asyncio.gather(
+            *(aclose() for s in self.shards if (aclose := getattr(s, "aclose", None)) is not None)
+        )
+
+    @contextmanager
+    def _timed(self, shard: int, op: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            SHARD_ERRORS.inc(shard=str(shard), op=op)
+            raise
+        finally:
+            SHARD_OPERATIONS.observe(time.perf_counter() - started, shard=str(shard), op=op)
+
+    async def _owner(self, thread_id: str) -> int:
+        """The thread's shard, having moved the thread there if it was elsewhere."""
+        shard = self.ring.shard(thread_id)
+        if self.previous is not None and (previous := self.previous.shard(thread_id)) != shard:
+            source, target = self.shards[previous], self.shards[shard]
+            with self._timed(previous, "move"):
+                async with source.conn.connection() as src, target.conn.connection() as dst:
+                    moved = await move_thread(src, dst, thread_id)
+            if moved:
+                THREADS_MOVED.inc(source=str(previous), target=str(shard))
+        return shard
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        shard = await self._owner(config["configurable"]["thread_id"])
+        with self._timed(shard, "get"):
+            return await self.shards[shard].aget_tuple(config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        if config is not None and (thread_id := config["configurable"].get("thread_id")):
+            shards = [self.shards[await self._owner(thread_id)]]
+        else:
+            shards = self.shards
+        for shard in shards:
+            async for item in shard.alist(config, filter=filter, before=before, limit=limit):
+                yield item
+                if limit is not None:
+                    limit -= 1
+                    if limit <= 0:
+                        return
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        shard = await self._owner(config["configurable"]["thread_id"])
+        with self._timed(shard, "put"):
+            return await self.shards[shard].aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        shard = await self._owner(config["configurable"]["thread_id"])
+        with self._timed(shard, "put_writes"):
+            await self.shards[shard].aput_writes(config, writes, task_id, task_path)
+
+    async def aput_batch(self, puts: list[PendingPut], writes: list[PendingWrites]) -> None:
+        """Split the batch by shard, and write the parts concurrently."""
+        parts: dict[int, tuple[list[PendingPut], list[PendingWrites]]] = defaultdict(
+            lambda: ([], [])
+        )
+        for put in puts:
+            parts[await self._owner(put.config["configurable"]["thread_id"])][0].append(put)
+        for item in writes:
+            parts[await self._owner(item.config["configurable"]["thread_id"])][1].append(item)
+
+        async def write(shard: int, puts: list[PendingPut], writes: list[PendingWrites]) -> None:
+            saver = self.shards[shard]
+            with self._timed(shard, "put_batch"):
+                if (aput_batch := getattr(saver, "aput_batch", None)) is not None:
+                    await aput_batch(puts, writes)
+                    return
+                for put in puts:
+                    await saver.aput(put.config, put.checkpoint, put.metadata, put.new_versions)
+                for item in writes:
+                    await saver.aput_writes(item.config, item.writes, item.task_id, item.task_path)
+
+        await asyncio.gather(*(write(shard, *part) for shard, part in parts.items()))
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        shard = await self._owner(thread_id)
+        with self._timed(shard, "delete"):
+            await self.shards[shard].adelete_thread(thread_id)
+
+    async def alatest_checkpoint_id(self, thread_id: str, checkpoint_ns: str) -> str | None:
+        shard = await self._owner(thread_id)
+        with self._timed(shard, "latest"):
+            return await self.shards[shard].alatest_checkpoint_id(thread_id, checkpoint_ns)
+
+    async def anotifications(self) -> AsyncIterator[tuple[str, str, str, str] | None]:
+        """Checkpoint changes on any shard; ``None`` once listening to all of them.
+
+        Ends with an error as soon as any shard's listener does.
+        """
+        queue: asyncio.Queue[tuple[str, str, str, str] | Exception | None] = asyncio.Queue()
+
+        async def forward(saver: BaseCheckpointSaver) -> None:
+            try:
+                async for change in saver.anotifications():
+                    queue.put_nowait(change)
+                queue.put_nowait(ConnectionError("Checkpoint notifications ended"))
+            except Exception as e:
+                queue.put_nowait(e)
+
+        tasks = [asyncio.create_task(forward(saver)) for saver in self.shards]
+        try:
+            listening = 0
+            while True:
+                change = await queue.get()
+                if isinstance(change, Exception):
+                    raise change
+                if change is not None:
+                    yield change
+                    continue
+                listening += 1
+                if listening == len(tasks):
+                    yield None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def get_next_version(self, current: Any, channel: None) -> Any:
+        return self.shards[0].get_next_version(current, channel)
+
+    def collect(self) -> None:
+        for shard, saver in enumerate(self.shards):
+            if (pool := getattr(saver, "conn", None)) is None:
+                continue
+            stats = pool.get_stats()
+            SHARD_POOL.set(stats.get("pool_size", 0), shard=str(shard), state="open")
+            SHARD_POOL.set(stats.get("pool_available", 0), shard=str(shard), state="idle")
+            SHARD_POOL.set(stats.get("requests_waiting", 0), shard=str(shard), state="waiting")
+
+    def register(self) -> None:
+        """Refresh the pool gauges whenever metrics are scraped."""
+        REGISTRY.add_collector(self.collect)
+
+
+async def rebalance(
+    dsns: Sequence[str],
+    migrate_from: int,
+    *,
+    batch_size: int = 500,
+    pause: float = 0.1,
+    dry_run: bool = False,
+) -> dict[tuple[int, int], int]:
+    """Move threads off the first ``migrate_from`` shards to their owners among ``dsns``.
+
+    Returns the number of threads moved (or to move, with ``dry_run``) per source and
+    target shard.
+    """
+    if not 0 < migrate_from <= len(dsns):
+        raise ValueError("migrate_from must be between 1 and the number of shards")
+    ring = HashRing(len(dsns))
+    savers = [PostgresCheckpointer(dsn, max_size=2) for dsn in dsns]
+    # Creates the tables on new shards
+    await asyncio.gather(*(saver.aopen() for saver in savers))
+    moved: TallyCounter[tuple[int, int]] = TallyCounter()
+    try:
+        for source in range(migrate_from):
+            async with savers[source].conn.connection() as conn:
+                after = ""
+                while True:
+                    cur = await conn.execute(THREAD_IDS_SQL, {"after": after, "limit": batch_size})
+                    threads = [row["thread_id"] for row in await cur.fetchall()]
+                    if not threads:
+                        break
+                    after = threads[-1]
+                    for thread_id in threads:
+                        if (target := ring.shard(thread_id)) == source:
+                            continue
+                        if not dry_run:
+                            async with savers[target].conn.connection() as target_conn:
+                                if not await move_thread(conn, target_conn, thread_id):
+                                    continue
+                            THREADS_MOVED.inc(source=str(source), target=str(target))
+                        moved[source, target] += 1
+                    logger.info("Rebalanced shard %d past %s: %s", source, after, dict(moved))
+                    await asyncio.sleep(pause)
+    finally:
+        await asyncio.gather(*(saver.aclose() for saver in savers))
+    return dict(moved)
+
+
+async def main(args: argparse.Namespace) -> None:
+    moved = await rebalance(
+        args.postgres_dsn,
+        args.migrate_from,
+        batch_size=args.batch_size,
+        pause=args.pause,
+        dry_run=args.dry_run,
+    )
+    print(
+        json.dumps(
+            {
+                "dry_run": args.dry_run,
+                "threads": sum(moved.values()),
+                "moves": [
+                    {"source": source, "target": target, "threads": count}
+                    for (source, target), count in sorted(moved.items())
+                ],
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    from config import settings
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--migrate-from",
+        type=int,
+        default=settings.postgres_shards_before,
+        help="number of shards before the new ones were appended",
+    )
+    parser.add_argument("--batch-size", type=int, default=500, help="threads listed at a time")
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds between batches")
+    parser.add_argument("--dry-run", action="store_true", help="count threads to move only")
+    parser.add_argument("--postgres-dsn", nargs="+", default=settings.postgres_shard_dsns)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,201 @@
+"""Load shedding driven by the latency and error rate of model calls.
+
+``LoadShedder`` is a callback handler that watches every model call the agent makes.
+Calls that fail, or take longer than ``latency_threshold`` to their first token, count
+as failures. They feed two controls:
+
+- ``AIMDLimiter`` adapts the turn scheduler's limit: it grows by one slot per window of
+  successful calls while the limit is in use, and shrinks by ``backoff`` at most once
+  per observed latency when calls fail. Excess turns queue in the scheduler.
+- ``CircuitBreaker`` opens when the failure rate over the last ``window`` calls
+  reaches ``failure_rate``. While open, turns are rejected up front with
+  ``UpstreamUnavailable`` rather than queued to fail later. After ``cooldown`` it lets
+  ``probes`` turns through and closes again if their calls succeed.
+"""
+
+import time
+from collections import deque
+from enum import StrEnum
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from metrics import Counter, Gauge
+from scheduling import TurnScheduler
+
+BREAKER_STATE = Gauge(
+    "agent_model_breaker_state", "Model circuit breaker state (0 closed, 1 half-open, 2 open)"
+)
+CONCURRENCY_LIMIT = Gauge("agent_adaptive_turn_limit", "Concurrent turns allowed by the limiter")
+MODEL_CALLS = Counter("agent_model_calls_total", "Model calls seen by load shedding", ["outcome"])
+SHED_TURNS = Counter("agent_shed_turns_total", "Turns rejected while the breaker was open")
+
+
+class UpstreamUnavailable(Exception):
+    """The model circuit breaker is open."""
+
+
+class BreakerState(StrEnum):
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+
+_STATE_VALUES = {BreakerState.CLOSED: 0, BreakerState.HALF_OPEN: 1, BreakerState.OPEN: 2}
+
+
+class AIMDLimiter:
+    """Additive-increase, multiplicative-decrease concurrency limit."""
+
+    def __init__(
+        self, initial: int, *, min_limit: int = 1, max_limit: int = 256, backoff: float = 0.9
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def record(self, ok: bool, latency: float, in_flight: int, now: float) -> None:
+        if not ok:
+            # Once per round trip: the calls that failed together share one cause
+            if now - self._last_decrease >= latency:
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+                self._last_decrease = now
+        elif in_flight * 2 >= self._limit:
+            # Only grow a limit that is being used, by one per window of successes
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+
+class CircuitBreaker:
+    """Opens on a high failure rate over recent calls; half-opens after ``cooldown``."""
+
+    def __init__(
+        self,
+        *,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        cooldown: float = 10.0,
+        probes: int = 1,
+    ) -> None:
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.probes = probes
+        self.state = BreakerState.CLOSED
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_started: deque[float] = deque()
+
+    def allow(self, now: float) -> bool:
+        if self.state == BreakerState.OPEN:
+            if now - self._opened_at < self.cooldown:
+                return False
+            self._set_state(BreakerState.HALF_OPEN)
+        if self.state == BreakerState.HALF_OPEN:
+            # A probe that never reported (e.g. it made no model call) frees its place
+            while self._probes_started and now - self._probes_started[0] >= self.cooldown:
+                self._probes_started.popleft()
+            if len(self._probes_started) >= self.probes:
+                return False
+            self._probes_started.append(now)
+        return True
+
+    def record(self, ok: bool, now: float) -> None:
+        if self.state == BreakerState.HALF_OPEN:
+            if ok:
+                self._reset()
+            else:
+                self._open(now)
+            return
+        if self.state == BreakerState.OPEN:
+            return
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= not self._outcomes[0]
+        self._outcomes.append(ok)
+        self._failures += not ok
+        outcomes = len(self._outcomes)
+        if outcomes >= self.min_calls and self._failures / outcomes >= self.failure_rate:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self._opened_at = now
+        self._probes_started.clear()
+        self._set_state(BreakerState.OPEN)
+
+    def _reset(self) -> None:
+        self._outcomes.clear()
+        self._failures = 0
+        self._probes_started.clear()
+        self._set_state(BreakerState.CLOSED)
+
+    def _set_state(self, state: BreakerState) -> None:
+        self.state = state
+        BREAKER_STATE.set(_STATE_VALUES[state])
+
+
+class LoadShedder(AsyncCallbackHandler):
+    """Adapts ``scheduler``'s limit and gates turns on the model's recent health.
+
+    Pass the instance in every turn's ``callbacks`` and call ``admit`` before a turn.
+    """
+
+    def __init__(
+        self,
+        scheduler: TurnScheduler,
+        *,
+        limiter: AIMDLimiter | None = None,
+        breaker: CircuitBreaker | None = None,
+        latency_threshold: float = 5.0,
+    ) -> None:
+        self.scheduler = scheduler
+        self.limiter = limiter
+        self.breaker = breaker
+        self.latency_threshold = latency_threshold
+        # run_id -> start time, until the call's first token or end
+        self._calls: dict[UUID, float] = {}
+        if limiter is not None:
+            scheduler.set_limit(limiter.limit)
+            CONCURRENCY_LIMIT.set(limiter.limit)
+
+    def admit(self) -> None:
+        """Raise ``UpstreamUnavailable`` if the breaker does not let a new turn through."""
+        if self.breaker is not None and not self.breaker.allow(time.monotonic()):
+            SHED_TURNS.inc()
+            raise UpstreamUnavailable("Model circuit breaker is open")
+
+    def record(self, ok: bool, latency: float) -> None:
+        now = time.monotonic()
+        ok = ok and latency <= self.latency_threshold
+        MODEL_CALLS.inc(outcome="ok" if ok else "failed")
+        if self.breaker is not None:
+            self.breaker.record(ok, now)
+        if self.limiter is not None:
+            self.limiter.record(ok, latency, self.scheduler.active, now)
+            if self.limiter.limit != self.scheduler.limit:
+                self.scheduler.set_limit(self.limiter.limit)
+                CONCURRENCY_LIMIT.set(self.limiter.limit)
+
+    async def on_chat_model_start(
+        self, serialized: dict[str, Any], messages: list, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._calls[run_id] = time.monotonic()
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if (started := self._calls.pop(run_id, None)) is not None:
+            self.record(True, time.monotonic() - started)
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        # Calls that streamed no tokens, e.g. tool calls only
+        await self.on_llm_new_token("", run_id=run_id)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._calls.pop(run_id, None)
+        self.record(False, time.monotonic() - started if started is not None else 0.0)
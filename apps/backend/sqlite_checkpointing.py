@@ -0,0 +1,499 @@
+"""Checkpoints in an embedded SQLite database, for single-node deployments.
+
+SQLite in WAL mode lets readers proceed while a writer commits, and serialises writers
+across processes with file locks, so every uvicorn worker on the host can open the same
+database file. Each worker holds one connection, driven by a thread of its own as async
+SQLite drivers do, so the event loop never waits on the disk.
+
+Writes are group committed: the thread runs every write queued since its last commit
+in one ``BEGIN IMMEDIATE`` transaction, each in a savepoint so one failure does not fail
+the others, and acknowledges them once ``COMMIT`` returns. Concurrent turns thus share
+commits without giving up ``sync`` durability. With ``synchronous=NORMAL``, committed
+writes survive a crash of the process, but the last ones may be lost on power failure;
+``full_sync`` syncs every commit to disk.
+
+As with Postgres, channel values are stored once per version, so a checkpoint only
+adds the channels that changed.
+"""
+
+import asyncio
+import contextlib
+import itertools
+import queue
+import random
+import sqlite3
+import threading
+from collections.abc import AsyncIterator, Callable, Sequence
+from dataclasses import dataclass, field
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+from checkpointing import PendingPut, PendingWrites, next_checkpoint_config
+
+CREATE_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        checkpoint_id TEXT NOT NULL,
+        parent_checkpoint_id TEXT,
+        type TEXT NOT NULL,
+        checkpoint BLOB NOT NULL,
+        metadata_type TEXT NOT NULL,
+        metadata BLOB NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        channel TEXT NOT NULL,
+        version TEXT NOT NULL,
+        type TEXT NOT NULL,
+        blob BLOB,
+        PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS checkpoint_writes (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL DEFAULT '',
+        checkpoint_id TEXT NOT NULL,
+        task_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        channel TEXT NOT NULL,
+        type TEXT NOT NULL,
+        blob BLOB,
+        task_path TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+    )
+    """,
+]
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    # Page cache of 64 MiB (negative sizes are in KiB), and reads through mmap
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+
+UPSERT_CHECKPOINT_SQL = """
+    INSERT OR REPLACE INTO checkpoints
+    (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint,
+     metadata_type, metadata)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+UPSERT_BLOB_SQL = """
+    INSERT OR REPLACE INTO checkpoint_blobs
+    (thread_id, checkpoint_ns, channel, version, type, blob) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_WRITES_SQL = """
+    INTO checkpoint_writes
+    (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, blob, task_path)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# Writes to special channels replace earlier ones, others keep them (as with Postgres)
+UPSERT_WRITES_SQL = "INSERT OR REPLACE" + _WRITES_SQL
+INSERT_WRITES_SQL = "INSERT OR IGNORE" + _WRITES_SQL
+
+SELECT_CHECKPOINTS_SQL = """
+    SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint,
+           metadata_type, metadata
+    FROM checkpoints
+"""
+
+SELECT_WRITES_SQL = """
+    SELECT task_id, channel, type, blob FROM checkpoint_writes
+    WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+    ORDER BY task_id, idx
+"""
+
+SELECT_LATEST_CHECKPOINT_ID_SQL = """
+    SELECT checkpoint_id FROM checkpoints
+    WHERE thread_id = ? AND checkpoint_ns = ?
+    ORDER BY checkpoint_id DESC LIMIT 1
+"""
+
+
+@dataclass(slots=True)
+class _Job:
+    fn: Callable[..., Any]
+    args: tuple
+    write: bool
+    loop: asyncio.AbstractEventLoop = field(default_factory=asyncio.get_running_loop)
+    future: asyncio.Future = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.future = self.loop.create_future()
+
+    def resolve(self, result: Any = None, error: BaseException | None = None) -> None:
+        # RuntimeError: the caller's event loop is closed, nobody is waiting
+        with contextlib.suppress(RuntimeError):
+            self.loop.call_soon_threadsafe(_settle, self.future, result, error)
+
+
+def _settle(future: asyncio.Future, result: Any, error: BaseException | None) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class SqliteCheckpointer(BaseCheckpointSaver):
+    """Checkpoint saver over one SQLite connection per process, in WAL mode.
+
+    The connection and schema are created by a thread of its own on first use (or in
+    ``aopen``). ``aput_batch`` stores checkpoints and writes of many threads in one
+    savepoint, for the write-behind queue.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        serde=None,
+        busy_timeout: float = 5.0,
+        batch_size: int = 256,
+        full_sync: bool = False,
+    ) -> None:
+        super().__init__(serde=serde)
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.batch_size = batch_size
+        self.full_sync = full_sync
+        self.commits = 0
+        self._jobs: queue.SimpleQueue[_Job | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    async def aopen(self) -> None:
+        await self._read(lambda conn: None)
+
+    async def aclose(self) -> None:
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._jobs.put(None)
+            await asyncio.to_thread(thread.join)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f"PRAGMA synchronous = {'FULL' if self.full_sync else 'NORMAL'}")
+        # Workers starting together create the schema one at a time
+        conn.execute("BEGIN IMMEDIATE")
+        for sql in CREATE_TABLES_SQL:
+            conn.execute(sql)
+        conn.execute("COMMIT")
+        return conn
+
+    def _run(self) -> None:
+        conn: sqlite3.Connection | None = None
+        while True:
+            jobs = [self._jobs.get()]
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            closing = None in jobs
+            jobs = [job for job in jobs if job is not None]
+            if conn is None and jobs:
+                try:
+                    conn = self._connect()
+                except Exception as e:
+                    for job in jobs:
+                        job.resolve(error=e)
+                    jobs = []
+            for write, run in itertools.groupby(jobs, key=lambda job: job.write):
+                if write:
+                    batch = list(run)
+                    try:
+                        self._commit(conn, batch)
+                    except Exception as e:
+                        # Keep the thread, which every queued and future write waits on
+                        for job in batch:
+                            job.resolve(error=e)
+                else:
+                    for job in run:
+                        try:
+                            job.resolve(job.fn(conn, *job.args))
+                        except Exception as e:
+                            job.resolve(error=e)
+            if closing:
+                if conn is not None:
+                    conn.close()
+                return
+
+    def _commit(self, conn: sqlite3.Connection, jobs: list[_Job]) -> None:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for job in jobs:
+                job.resolve(error=e)
+            return
+        results = []
+        try:
+            for job in jobs:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((job, job.fn(conn, *job.args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    results.append((job, None, e))
+                conn.execute("RELEASE job")
+            conn.execute("COMMIT")
+            self.commits += 1
+        except sqlite3.Error as e:
+            # A savepoint or the commit failed (locked, disk full): none of the batch is kept
+            if conn.in_transaction:
+                with contextlib.suppress(sqlite3.Error):
+                    conn.execute("ROLLBACK")
+            results = [(job, None, e) for job in jobs]
+        for job, result, error in results:
+            job.resolve(result, error)
+
+    async def _submit(self, fn: Callable[..., Any], *args: Any, write: bool) -> Any:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="sqlite-checkpointer", daemon=True
+                )
+                self._thread.start()
+        job = _Job(fn, args, write)
+        self._jobs.put(job)
+        return await job.future
+
+    async def _read(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await self._submit(fn, *args, write=False)
+
+    async def _write(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await self._submit(fn, *args, write=True)
+
+    def _store(
+        self, conn: sqlite3.Connection, puts: list[PendingPut], writes: list[PendingWrites]
+    ) -> None:
+        for put in puts:
+            configurable = put.config["configurable"]
+            thread_id, checkpoint_ns = configurable["thread_id"], configurable["checkpoint_ns"]
+            checkpoint = put.checkpoint.copy()
+            values = checkpoint.pop("channel_values")
+            conn.executemany(
+                UPSERT_BLOB_SQL,
+                [
+                    (
+                        thread_id,
+                        checkpoint_ns,
+                        channel,
+                        str(version),
+                        *(
+                            self.serde.dumps_typed(values[channel])
+                            if channel in values
+                            else ("empty", None)
+                        ),
+                    )
+                    for channel, version in put.new_versions.items()
+                ],
+            )
+            conn.execute(
+                UPSERT_CHECKPOINT_SQL,
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    put.checkpoint["id"],
+                    configurable.get("checkpoint_id"),
+                    *self.serde.dumps_typed(checkpoint),
+                    *self.serde.dumps_typed(get_checkpoint_metadata(put.config, put.metadata)),
+                ),
+            )
+        for item in writes:
+            configurable = item.config["configurable"]
+            upsert = all(channel in WRITES_IDX_MAP for channel, _ in item.writes)
+            conn.executemany(
+                UPSERT_WRITES_SQL if upsert else INSERT_WRITES_SQL,
+                [
+                    (
+                        configurable["thread_id"],
+                        configurable["checkpoint_ns"],
+                        configurable["checkpoint_id"],
+                        item.task_id,
+                        WRITES_IDX_MAP.get(channel, idx),
+                        channel,
+                        *self.serde.dumps_typed(value),
+                        item.task_path,
+                    )
+                    for idx, (channel, value) in enumerate(item.writes)
+                ],
+            )
+
+    def _load(self, conn: sqlite3.Connection, row: tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, blob, mtype, mblob = row
+        checkpoint = self.serde.loads_typed((type_, blob))
+        versions = list(checkpoint["channel_versions"].items())
+        values = {}
+        if versions:
+            pairs = ", ".join(["(?, ?)"] * len(versions))
+            blobs = conn.execute(
+                "SELECT channel, type, blob FROM checkpoint_blobs"
+                " WHERE thread_id = ? AND checkpoint_ns = ?"
+                f" AND (channel, version) IN (VALUES {pairs})",
+                (thread_id, checkpoint_ns, *(str(v) for pair in versions for v in pair)),
+            )
+            for channel, blob_type, value in blobs:
+                if blob_type != "empty":
+                    values[channel] = self.serde.loads_typed((blob_type, value))
+        writes = conn.execute(SELECT_WRITES_SQL, (thread_id, checkpoint_ns, checkpoint_id))
+        return CheckpointTuple(
+            {
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            {**checkpoint, "channel_values": values},
+            self.serde.loads_typed((mtype, mblob)),
+            (
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+            [
+                (task_id, channel, self.serde.loads_typed((write_type, value)))
+                for task_id, channel, write_type, value in writes
+            ],
+        )
+
+    def _get(self, conn: sqlite3.Connection, config: RunnableConfig) -> CheckpointTuple | None:
+        configurable = config["configurable"]
+        args = [configurable["thread_id"], configurable.get("checkpoint_ns", "")]
+        if checkpoint_id := get_checkpoint_id(config):
+            where = "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+            args.append(checkpoint_id)
+        else:
+            where = "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1"
+        row = conn.execute(SELECT_CHECKPOINTS_SQL + where, args).fetchone()
+        return self._load(conn, row) if row else None
+
+    def _list(
+        self,
+        conn: sqlite3.Connection,
+        config: RunnableConfig | None,
+        filter: dict[str, Any] | None,
+        before: RunnableConfig | None,
+        limit: int | None,
+    ) -> list[CheckpointTuple]:
+        clauses, args = [], []
+        if config is not None:
+            configurable = config["configurable"]
+            clauses.append("thread_id = ?")
+            args.append(configurable["thread_id"])
+            if (checkpoint_ns := configurable.get("checkpoint_ns")) is not None:
+                clauses.append("checkpoint_ns = ?")
+                args.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                args.append(checkpoint_id)
+        if before is not None and (before_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            args.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        rows = conn.execute(f"{SELECT_CHECKPOINTS_SQL}{where}ORDER BY checkpoint_id DESC", args)
+        results = []
+        for row in rows:
+            if limit is not None and len(results) >= limit:
+                break
+            if filter:
+                metadata = self.serde.loads_typed((row[6], row[7]))
+                if not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+            results.append(self._load(conn, row))
+        return results
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await self._read(self._get, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        for item in await self._read(self._list, config, filter, before, limit):
+            yield item
+
+    async def alatest_checkpoint_id(self, thread_id: str, checkpoint_ns: str) -> str | None:
+        """Id of the thread's latest checkpoint, without loading it."""
+
+        def latest(conn: sqlite3.Connection) -> str | None:
+            row = conn.execute(SELECT_LATEST_CHECKPOINT_ID_SQL, (thread_id, checkpoint_ns))
+            return next((checkpoint_id for (checkpoint_id,) in row), None)
+
+        return await self._read(latest)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        await self.aput_batch([PendingPut(config, checkpoint, metadata, new_versions)], [])
+        return next_checkpoint_config(config, checkpoint)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await self.aput_batch([], [PendingWrites(config, list(writes), task_id, task_path)])
+
+    async def aput_batch(self, puts: list[PendingPut], writes: list[PendingWrites]) -> None:
+        """Store checkpoints and writes from many threads, committed together."""
+        await self._write(self._store, puts, writes)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        def delete(conn: sqlite3.Connection) -> None:
+            for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes"):
+                conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+        await self._write(delete)
+
+    def get_next_version(self, current: str | None, channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
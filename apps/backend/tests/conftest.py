@@ -1,17 +1,70 @@
+import json
+import logging
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+from starlette.applications import Starlette
+from starlette.routing import BaseRoute, WebSocketRoute
 from starlette.testclient import TestClient
 
+from agent import AgentWebSocket
+from fake_model import FakeStreamingChatModel
 from main import app
 
 
+def receive_turn(websocket, text: str | None = None) -> list[dict]:
+    """Frames of one turn, up to and including its END or ERROR; ``text`` starts it."""
+    if text is not None:
+        websocket.send_text(text)
+    frames = []
+    while (frame := json.loads(websocket.receive_text()))["type"] not in ("end", "error"):
+        frames.append(frame)
+    return [*frames, frame]
+
+
 @pytest.fixture
 def test_client():
     """Create a test client for the Starlette app."""
     return TestClient(app)
 
 
+@pytest.fixture
+def agent_client():
+    """Build test clients of an ``AgentWebSocket`` served at ``/ws``.
+
+    The agent is a ReAct agent over ``model`` (the fake model by default), ``tools`` and
+    ``checkpointer`` (a ``MemorySaver`` by default), unless a built ``agent`` is given.
+    Other keyword arguments configure the ``AgentWebSocket``. ``multiplexed`` serves the
+    multiplexed endpoint instead, and ``routes`` are served next to it.
+    """
+
+    def build(
+        *,
+        agent=None,
+        model=None,
+        tools=(),
+        prompt: str | None = None,
+        checkpointer=None,
+        multiplexed: bool = False,
+        routes: list[BaseRoute] = (),
+        **kwargs,
+    ) -> TestClient:
+        if agent is None:
+            agent = create_react_agent(
+                model=model if model is not None else FakeStreamingChatModel(),
+                tools=list(tools),
+                prompt=prompt,
+                checkpointer=checkpointer if checkpointer is not None else MemorySaver(),
+            )
+        aws = AgentWebSocket(agent, logging.getLogger("test"), **kwargs)
+        endpoint = aws.multiplexed_endpoint if multiplexed else aws.agent_websocket_endpoint
+        return TestClient(Starlette(routes=[WebSocketRoute("/ws", endpoint), *routes]))
+
+    return build
+
+
 @pytest.fixture
 def mock_agent():
     """Create a mock LangGraph agent for testing."""
@@ -0,0 +1,158 @@
+import asyncio
+import json
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+from starlette.testclient import TestClient
+
+from accounting import TURN_SECONDS, TURNS, ModelPrices, TimedCheckpointer, TurnAccounting
+from fake_model import FakeStreamingChatModel
+from main import app
+from metrics import Counter, Histogram, Registry
+from tests.conftest import receive_turn
+
+PRICES = ModelPrices(input=1.0, cached_input=0.5, output=2.0)
+
+
+async def get_transactions() -> dict:
+    """Get financial transactions."""
+    await asyncio.sleep(0.01)
+    return {"data": [{"id": "1", "amount": "-10.99"}]}
+
+
+@pytest.fixture
+def client(agent_client) -> TestClient:
+    return agent_client(
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        checkpointer=TimedCheckpointer(MemorySaver()),
+        prices=PRICES,
+    )
+
+
+class TestTurnAccounting:
+    """Test usage and timings reported in END messages."""
+
+    def test_end_reports_usage_and_cost(self, client):
+        """Token counts from the streamed chunks are summed over the turn's model calls."""
+        with client.websocket_connect("/ws") as websocket:
+            end = receive_turn(websocket, "show my transactions")[-1]
+
+        usage = end["usage"]
+        assert usage["input_tokens"] > 0
+        assert usage["output_tokens"] > 0
+        assert usage["total_tokens"] == usage["input_tokens"] + usage["output_tokens"]
+        expected = (usage["input_tokens"] * 1.0 + usage["output_tokens"] * 2.0) / 1_000_000
+        assert usage["cost_usd"] == pytest.approx(expected)
+
+    def test_session_usage_accumulates(self, client):
+        """Session usage is the sum of the session's turns."""
+        with client.websocket_connect("/ws") as websocket:
+            first = receive_turn(websocket, "My name is Alice")[-1]
+            second = receive_turn(websocket, "What is my name?")[-1]
+
+        assert first["session_usage"] == first["usage"]
+        for key in ("input_tokens", "output_tokens", "total_tokens"):
+            assert second["session_usage"][key] == first["usage"][key] + second["usage"][key]
+
+    def test_end_reports_timings(self, client):
+        """Every phase of a tool-calling turn is timed."""
+        with client.websocket_connect("/ws") as websocket:
+            timings = receive_turn(websocket, "show my transactions")[-1]["timings"]
+
+        assert 0 < timings["ttft_ms"] < timings["total_ms"]
+        assert timings["model_ms"] > 0
+        assert timings["tool_ms"] >= 10
+        assert timings["checkpoint_ms"] > 0
+        assert timings["model_ms"] + timings["tool_ms"] < timings["total_ms"]
+
+    def test_turns_are_exported(self, client):
+        """Finished turns are counted and timed on the metrics surface."""
+        turns = TURNS.value(status="ok")
+        timed = TURN_SECONDS.count(phase="tool")
+        with client.websocket_connect("/ws") as websocket:
+            receive_turn(websocket, "show my transactions")
+
+        assert TURNS.value(status="ok") == turns + 1
+        assert TURN_SECONDS.count(phase="tool") == timed + 1
+
+    def test_disconnected_turns_are_exported(self, client):
+        """A turn the client leaves in the middle of is counted too."""
+        turns = TURNS.value(status="disconnected")
+        with client.websocket_connect("/ws") as websocket:
+            websocket.send_text("show my transactions")
+            assert json.loads(websocket.receive_text())["type"] == "start"
+
+        assert TURNS.value(status="disconnected") == turns + 1
+
+    def test_cached_input_is_priced_separately(self):
+        """Prompt cache reads are charged at the cached input price."""
+        usage = {
+            "input_tokens": 1000,
+            "output_tokens": 10,
+            "total_tokens": 1010,
+            "input_token_details": {"cache_read": 800},
+        }
+        assert PRICES.cost(usage) == pytest.approx((200 * 1.0 + 800 * 0.5 + 10 * 2.0) / 1e6)
+
+
+class TestTimedCheckpointer:
+    """Test the checkpointer that times the one it wraps."""
+
+    async def test_sync_and_async_methods(self):
+        """The graph's sync state methods work too, and every read is timed."""
+        agent = create_react_agent(
+            model=FakeStreamingChatModel(),
+            tools=[],
+            checkpointer=TimedCheckpointer(MemorySaver()),
+        )
+        config = {"configurable": {"thread_id": "t1"}}
+        await agent.ainvoke({"messages": [("user", "Hello")]}, config)
+
+        turn = TurnAccounting().start()
+        state = agent.get_state(config)
+        history = list(agent.get_state_history(config))
+        after_get = turn.checkpoint_seconds
+        ahistory = [item async for item in agent.aget_state_history(config)]
+        turn.finish("ok")
+
+        assert state.values == (await agent.aget_state(config)).values
+        assert [item.config for item in history] == [item.config for item in ahistory]
+        assert 0 < after_get < turn.checkpoint_seconds
+
+
+class TestMetrics:
+    """Test the Prometheus text exposition."""
+
+    def test_counter_and_histogram_render(self):
+        """Counters and cumulative histogram buckets render in the text format."""
+        registry = Registry()
+        counter = Counter("requests_total", "Requests", ["code"], registry=registry)
+        histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1), registry=registry)
+        counter.inc(code="200")
+        counter.inc(2, code="200")
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        lines = registry.render().splitlines()
+        assert "# TYPE requests_total counter" in lines
+        assert 'requests_total{code="200"} 3.0' in lines
+        assert 'latency_seconds_bucket{le="0.1"} 1.0' in lines
+        assert 'latency_seconds_bucket{le="1.0"} 2.0' in lines
+        assert 'latency_seconds_bucket{le="+Inf"} 3.0' in lines
+        assert "latency_seconds_sum 5.55" in lines
+        assert "latency_seconds_count 3.0" in lines
+
+    def test_labels_are_validated(self):
+        """Observations must carry exactly the declared labels."""
+        counter = Counter("errors_total", "Errors", ["code"], registry=Registry())
+        with pytest.raises(ValueError):
+            counter.inc(status="500")
+
+    def test_metrics_endpoint(self):
+        """The app serves its metrics at /metrics."""
+        response = TestClient(app).get("/metrics")
+        assert response.status_code == 200
+        assert "agent_turns_total" in response.text
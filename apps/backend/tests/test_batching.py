@@ -0,0 +1,219 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from agent import SYSTEM_PROMPT, TOOLS, get_transactions
+from batching import BatchItem, BatchRunner, ProviderBatch
+from fake_model import FakeStreamingChatModel
+from prompting import PromptPrefix
+
+
+def post_batch(runner: BatchRunner, body: dict) -> tuple[int, list[dict]]:
+    client = TestClient(
+        Starlette(routes=[Route("/batch", runner.batch_endpoint, methods=["POST"])])
+    )
+    response = client.post("/batch", json=body)
+    if response.status_code != 200:
+        return response.status_code, [response.json()]
+    return 200, [json.loads(line) for line in response.text.splitlines()]
+
+
+def agent_for(model: FakeStreamingChatModel):
+    return create_react_agent(model=model, tools=[get_transactions], checkpointer=MemorySaver())
+
+
+class TestBatchRunner:
+    """Test batches run through the agent."""
+
+    def test_results_tagged_by_id(self):
+        """Every request gets one result line, tagged with its id."""
+        runner = BatchRunner(agent_for(FakeStreamingChatModel()))
+        requests = [{"id": f"q{n}", "message": "Hello"} for n in range(5)]
+        requests.append({"id": "tx", "message": "Show my transactions"})
+        status, results = post_batch(runner, {"requests": requests})
+        assert status == 200
+        by_id = {result["id"]: result for result in results}
+        assert sorted(by_id) == sorted(r["id"] for r in requests)
+        assert all(result["status"] == "ok" for result in results)
+        assert by_id["q0"]["content"] == FakeStreamingChatModel().reply
+        assert by_id["q0"]["tool_calls"] == []
+        assert by_id["tx"]["content"] == "You have 2 recent transactions."
+        assert [call["name"] for call in by_id["tx"]["tool_calls"]] == ["get_transactions"]
+        assert by_id["tx"]["usage"]["input_tokens"] > by_id["q0"]["usage"]["input_tokens"]
+
+    def test_bounded_parallelism(self):
+        """No more than ``concurrency`` requests of a batch run at once."""
+        running, peak = 0, 0
+
+        class CountingModel(FakeStreamingChatModel):
+            async def _agenerate(self, *args, **kwargs):
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                try:
+                    return await super()._agenerate(*args, **kwargs)
+                finally:
+                    running -= 1
+
+        runner = BatchRunner(agent_for(CountingModel(token_delay=0.001)), concurrency=3)
+        requests = [{"id": str(n), "message": "Hello"} for n in range(12)]
+        status, results = post_batch(runner, {"requests": requests})
+        assert status == 200
+        assert len(results) == 12
+        assert peak == 3
+
+    def test_threads_deleted(self):
+        """Requests leave no threads behind in the checkpointer, whether or not they fail."""
+        saver = MemorySaver()
+        for model in (FakeStreamingChatModel(), FakeStreamingChatModel(error_rate=1.0)):
+            agent = create_react_agent(model=model, tools=[get_transactions], checkpointer=saver)
+            requests = [{"id": "a", "message": "Hello"}, {"id": "b", "message": "transactions"}]
+            status, _ = post_batch(BatchRunner(agent), {"requests": requests})
+            assert status == 200
+        assert list(saver.list(None)) == []
+
+    def test_failed_requests(self):
+        """Failures are reported per request and do not stop the batch."""
+        runner = BatchRunner(agent_for(FakeStreamingChatModel(error_rate=1.0)))
+        status, results = post_batch(runner, {"requests": [{"id": "a", "message": "Hello"}]})
+        assert status == 200
+        assert results[0]["status"] == "error"
+        assert results[0]["code"] == "PROCESSING_ERROR"
+
+    def test_invalid_batches(self):
+        """Malformed, oversized, duplicate-id and unavailable-mode batches are rejected."""
+        runner = BatchRunner(agent_for(FakeStreamingChatModel()), max_items=2)
+        assert post_batch(runner, {"requests": []})[0] == 422
+        assert post_batch(runner, {"requests": [{"id": "a"}]})[0] == 422
+        requests = [{"id": "a", "message": "Hello"}] * 2
+        assert post_batch(runner, {"requests": requests})[0] == 422
+        requests = [{"id": str(n), "message": "Hello"} for n in range(3)]
+        assert post_batch(runner, {"requests": requests})[0] == 413
+        body = {"requests": [{"id": "a", "message": "Hello"}], "mode": "provider"}
+        assert post_batch(runner, body)[0] == 422
+
+
+class FakeBatchAPI:
+    """The files and batches endpoints of an OpenAI client, answering immediately."""
+
+    def __init__(self) -> None:
+        self.submitted: list[list[dict]] = []
+        self._outputs: dict[str, str] = {}
+        self.files = SimpleNamespace(create=self._upload, content=self._content)
+        self.batches = SimpleNamespace(create=self._create, retrieve=None, cancel=None)
+
+    async def _upload(self, file, purpose):
+        assert purpose == "batch"
+        lines = [json.loads(line) for line in file[1].decode().splitlines()]
+        self.submitted.append(lines)
+        return SimpleNamespace(id=f"file-{len(self.submitted)}")
+
+    async def _create(self, input_file_id, endpoint, completion_window):
+        rows = [self._answer(line) for line in self.submitted[-1]]
+        self._outputs[f"out-{input_file_id}"] = "\n".join(json.dumps(row) for row in rows)
+        return SimpleNamespace(
+            id="batch",
+            status="completed",
+            output_file_id=f"out-{input_file_id}",
+            error_file_id=None,
+        )
+
+    async def _content(self, file_id):
+        return SimpleNamespace(text=self._outputs[file_id])
+
+    def _answer(self, line: dict) -> dict:
+        messages = line["body"]["messages"]
+        if messages[-1]["role"] == "tool":
+            message = {"role": "assistant", "content": f"Got {messages[-1]['content']}"}
+        elif "transaction" in messages[-1]["content"]:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": "call_1",
+                        "type": "function",
+                        "function": {"name": "get_transactions", "arguments": "{}"},
+                    }
+                ],
+            }
+        else:
+            message = {"role": "assistant", "content": "Hi"}
+        usage = {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110}
+        body = {"choices": [{"message": message}], "usage": usage}
+        return {"custom_id": line["custom_id"], "response": {"status_code": 200, "body": body}}
+
+
+class TestProviderBatch:
+    """Test batches through the provider's batch API."""
+
+    def test_tool_rounds(self):
+        """Tool calls are run locally and sent back in a second batch."""
+        api = FakeBatchAPI()
+        prefix = PromptPrefix(SYSTEM_PROMPT, TOOLS)
+        provider = ProviderBatch(api, "gpt-4o-mini", prefix)
+        runner = BatchRunner(agent_for(FakeStreamingChatModel()), provider=provider)
+        requests = [
+            {"id": "a", "message": "Hello"},
+            {"id": "b", "message": "Show my transactions"},
+        ]
+        status, results = post_batch(runner, {"requests": requests, "mode": "provider"})
+        assert status == 200
+        by_id = {result["id"]: result for result in results}
+        assert by_id["a"]["content"] == "Hi"
+        assert by_id["b"]["content"] == f"Got {json.dumps(get_transactions())}"
+        assert by_id["b"]["tool_calls"] == [
+            {"id": "call_1", "name": "get_transactions", "args": {}}
+        ]
+        assert by_id["b"]["usage"]["input_tokens"] == 200
+
+        first, second = api.submitted
+        assert [line["custom_id"] for line in first] == ["a", "b"]
+        assert [line["custom_id"] for line in second] == ["b"]
+        body = first[0]["body"]
+        assert body["messages"][0] == {"role": "system", "content": SYSTEM_PROMPT}
+        assert body["tools"] == prefix.schemas
+        assert body["prompt_cache_key"] == first[1]["body"]["prompt_cache_key"]
+
+    def test_invalid_tool_arguments(self):
+        """A request whose tool call does not parse fails alone, without running the tool."""
+
+        class BadArgumentsAPI(FakeBatchAPI):
+            def _answer(self, line: dict) -> dict:
+                row = super()._answer(line)
+                for call in row["response"]["body"]["choices"][0]["message"].get("tool_calls", []):
+                    call["function"]["arguments"] = '{"limit": '
+                return row
+
+        api = BadArgumentsAPI()
+        provider = ProviderBatch(api, "gpt-4o-mini", PromptPrefix(SYSTEM_PROMPT, TOOLS))
+        runner = BatchRunner(agent_for(FakeStreamingChatModel()), provider=provider)
+        requests = [{"id": "a", "message": "Hello"}, {"id": "b", "message": "transactions"}]
+        status, results = post_batch(runner, {"requests": requests, "mode": "provider"})
+        assert status == 200
+        by_id = {result["id"]: result for result in results}
+        assert by_id["a"]["status"] == "ok"
+        assert (by_id["b"]["status"], by_id["b"]["code"]) == ("error", "INVALID_TOOL_CALL")
+        assert len(api.submitted) == 1
+
+    def test_unfinished_rounds(self):
+        """Requests still calling tools after ``max_rounds`` fail."""
+        api = FakeBatchAPI()
+        provider = ProviderBatch(
+            api, "gpt-4o-mini", PromptPrefix(SYSTEM_PROMPT, TOOLS), max_rounds=1
+        )
+
+        async def run():
+            return [
+                result
+                async for result in provider.run([BatchItem(id="b", message="transactions")], "t")
+            ]
+
+        (result,) = asyncio.run(run())
+        assert (result.status, result.code) == ("error", "TOO_MANY_TOOL_ROUNDS")
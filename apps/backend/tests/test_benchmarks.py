@@ -0,0 +1,46 @@
+import pytest
+
+from benchmarks.common import compare, load_results, write_results
+
+
+def latency(p50: float, p99: float) -> dict[str, float]:
+    return {"mean": p50, "p50": p50, "p95": p99, "p99": p99}
+
+
+BASELINE = {"100": {"ttft_ms": latency(100, 200), "turns_per_sec": 50.0}}
+
+
+class TestBaselineComparison:
+    """Test regression detection against stored benchmark results."""
+
+    def test_within_threshold(self):
+        """Changes within the thresholds are not regressions."""
+        current = {"100": {"ttft_ms": latency(125, 250), "turns_per_sec": 41.0}}
+        assert compare(current, BASELINE, {"ttft_ms": 0.3, "turns_per_sec": 0.2}) == []
+
+    def test_latency_and_throughput_regressions(self):
+        """Slower latencies and lower rates beyond the thresholds are reported."""
+        current = {"100": {"ttft_ms": latency(100, 300), "turns_per_sec": 30.0}}
+        regressions = compare(current, BASELINE, {"ttft_ms": 0.3, "turns_per_sec": 0.2})
+        assert len(regressions) == 2
+        assert regressions[0].startswith("100 ttft_ms p99")
+        assert regressions[1].startswith("100 turns_per_sec")
+
+    def test_small_absolute_changes_are_noise(self):
+        """Sub-millisecond latencies may double without failing the run."""
+        baseline = {"1": {"start_ms": latency(0.4, 0.5)}}
+        current = {"1": {"start_ms": latency(0.8, 1.0)}}
+        assert compare(current, baseline, {"start_ms": 0.3}) == []
+
+    def test_results_round_trip(self, tmp_path):
+        """Results files are stable JSON tagged with their schema version."""
+        path = tmp_path / "results.json"
+        write_results(path, "suite", {"turns": 1}, BASELINE)
+        first = path.read_text()
+        write_results(path, "suite", {"turns": 1}, BASELINE)
+        assert path.read_text() == first
+        assert load_results(path)["results"] == BASELINE
+
+        path.write_text('{"schema": 99}')
+        with pytest.raises(ValueError):
+            load_results(path)
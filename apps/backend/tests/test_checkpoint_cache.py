@@ -0,0 +1,176 @@
+import asyncio
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from agent import get_checkpointer
+from checkpointing import CachedCheckpointer, WriteBehindCheckpointer
+from config import CheckpointCacheValidation, CheckpointDurability, Settings
+from tests.test_checkpoint_durability import build_agent, run_turn, stored_messages
+
+
+class SharedStore(MemorySaver):
+    """MemorySaver standing in for Postgres shared by workers: counts loads, reports ids."""
+
+    def __init__(self):
+        super().__init__()
+        self.loads = 0
+        self.changes: asyncio.Queue = asyncio.Queue()
+
+    async def aget_tuple(self, config):
+        self.loads += 1
+        return await super().aget_tuple(config)
+
+    async def alatest_checkpoint_id(self, thread_id: str, checkpoint_ns: str) -> str | None:
+        latest = self.get_tuple({"configurable": {"thread_id": thread_id}})
+        return latest.checkpoint["id"] if latest else None
+
+    async def anotifications(self):
+        yield None
+        while True:
+            yield await self.changes.get()
+
+
+def thread(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+class TestCachedCheckpointer:
+    """Test the write-through cache of latest checkpoints."""
+
+    async def test_hits_match_store(self):
+        """Turns after the first load their checkpoint from the cache, as stored."""
+        store = SharedStore()
+        cache = CachedCheckpointer(store)
+        agent = build_agent(cache)
+        for text in ["Hello", "Show my transactions", "Thanks"]:
+            await run_turn(agent, "t1", text, "sync")
+        assert store.loads == 1
+        assert (cache.hits, cache.misses) == (2, 1)
+
+        cached, stored = await cache.aget_tuple(thread("t1")), store.get_tuple(thread("t1"))
+        assert cached.config == stored.config
+        assert cached.parent_config == stored.parent_config
+        assert cached.metadata == stored.metadata
+        assert cached.checkpoint == stored.checkpoint
+        assert len(cached.checkpoint["channel_values"]["messages"]) == 8
+
+    async def test_pending_writes(self):
+        """Writes to the cached checkpoint are returned as the store returns them."""
+        store = SharedStore()
+        cache = CachedCheckpointer(store)
+        await run_turn(build_agent(cache), "t1", "Hello", "sync")
+        latest = (await cache.aget_tuple(thread("t1"))).config
+        await cache.aput_writes(latest, [("messages", "b"), ("__error__", "x")], "task-b")
+        await cache.aput_writes(latest, [("messages", "a")], "task-a")
+        await cache.aput_writes(latest, [("messages", "ignored")], "task-a")
+        await cache.aput_writes(latest, [("__error__", "y")], "task-b")
+        cached = await cache.aget_tuple(thread("t1"))
+        assert cached.pending_writes == [
+            ("task-a", "messages", "a"),
+            ("task-b", "__error__", "y"),
+            ("task-b", "messages", "b"),
+        ]
+        stored = store.get_tuple(thread("t1")).pending_writes
+        assert sorted(cached.pending_writes) == sorted(stored)
+
+    async def test_loaded_checkpoints_are_copies(self):
+        """Updating a loaded checkpoint in place leaves the cached one untouched."""
+        cache = CachedCheckpointer(SharedStore())
+        await run_turn(build_agent(cache), "t1", "Hello", "sync")
+        loaded = await cache.aget_tuple(thread("t1"))
+        loaded.checkpoint["versions_seen"].clear()
+        loaded.checkpoint["channel_values"].clear()
+        again = await cache.aget_tuple(thread("t1"))
+        assert again.checkpoint["versions_seen"]
+        assert again.checkpoint["channel_values"]["messages"]
+
+    async def test_bounded(self):
+        """The least recently used threads are evicted beyond ``max_threads``."""
+        store = SharedStore()
+        cache = CachedCheckpointer(store, max_threads=2)
+        agent = build_agent(cache)
+        for thread_id in ["a", "b", "c"]:
+            await run_turn(agent, thread_id, "Hello", "sync")
+        loads = store.loads
+        await cache.aget_tuple(thread("b"))
+        await cache.aget_tuple(thread("c"))
+        assert store.loads == loads
+        await cache.aget_tuple(thread("a"))
+        assert store.loads == loads + 1
+
+    async def test_version_validation(self):
+        """A checkpoint written by another worker is loaded instead of a stale one."""
+        store = SharedStore()
+        first = CachedCheckpointer(store, validation=CheckpointCacheValidation.VERSION)
+        second = CachedCheckpointer(store, validation=CheckpointCacheValidation.VERSION)
+        await run_turn(build_agent(first), "t1", "Hello", "sync")
+        await run_turn(build_agent(second), "t1", "My name is Bob", "sync")
+        stale = first.misses
+        loaded = await first.aget_tuple(thread("t1"))
+        assert first.misses == stale + 1
+        assert loaded.checkpoint == store.get_tuple(thread("t1")).checkpoint
+        assert (await first.aget_tuple(thread("t1"))).checkpoint["id"] == loaded.checkpoint["id"]
+        assert first.hits == 1
+
+    async def test_notify_validation(self):
+        """Notifications of newer checkpoints and writes by other workers evict entries."""
+        store = SharedStore()
+        cache = CachedCheckpointer(store, validation=CheckpointCacheValidation.NOTIFY)
+        await run_turn(build_agent(cache), "t1", "Hello", "sync")
+        # Not listening yet: lookups go to the store
+        assert cache.hits == 0
+        await cache.aopen()
+        await asyncio.sleep(0)
+        await run_turn(build_agent(cache), "t1", "Thanks", "sync")
+        cached_id = (await cache.aget_tuple(thread("t1"))).checkpoint["id"]
+        assert cache.hits == 1
+
+        for change, evicted in [
+            (("put", "t1", "", cached_id), False),
+            (("delete", "t1", "", "0"), False),
+            (("put", "t1", "", cached_id + "0"), True),
+        ]:
+            await cache.aget_tuple(thread("t1"))
+            hits = cache.hits
+            store.changes.put_nowait(change)
+            await asyncio.sleep(0)
+            await cache.aget_tuple(thread("t1"))
+            assert cache.hits == hits + (not evicted)
+        await cache.aclose()
+
+    async def test_deleted_threads(self):
+        """Deleting a thread evicts its checkpoint."""
+        cache = CachedCheckpointer(SharedStore())
+        await run_turn(build_agent(cache), "t1", "Hello", "sync")
+        await cache.adelete_thread("t1")
+        assert await cache.aget_tuple(thread("t1")) is None
+
+
+class TestCacheConfiguration:
+    """Test where the cache sits among the checkpointer wrappers."""
+
+    def test_cache_under_write_behind(self):
+        """The cache wraps the store, under the write-behind queue."""
+        config = Settings(
+            openai_api_key="test",
+            checkpoint_cache_size=100,
+            checkpoint_durability=CheckpointDurability.ASYNC,
+        )
+        checkpointer = get_checkpointer(config)
+        assert isinstance(checkpointer, WriteBehindCheckpointer)
+        assert isinstance(checkpointer.inner, CachedCheckpointer)
+        assert checkpointer.inner.max_threads == 100
+        assert checkpointer.inner.validation is None
+        assert not isinstance(get_checkpointer(Settings(openai_api_key="test")), CachedCheckpointer)
+
+    async def test_write_behind_reads(self):
+        """Under write-behind, reads still wait for the thread's queued writes."""
+        store = SharedStore()
+        checkpointer = WriteBehindCheckpointer(CachedCheckpointer(store), flush_interval=10)
+        agent = build_agent(checkpointer)
+        await run_turn(agent, "t1", "Hello", "sync")
+        await run_turn(agent, "t1", "Thanks", "sync")
+        await checkpointer.aflush()
+        assert len(stored_messages(store, "t1")) == 4
+        assert store.loads == 1
+        await checkpointer.aclose()
@@ -0,0 +1,207 @@
+import asyncio
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from agent import get_checkpointer
+from checkpointing import PendingPut, PendingWrites, WriteBehindCheckpointer
+from config import CheckpointDurability, CheckpointerType, Settings
+from fake_model import FakeStreamingChatModel
+
+
+class BatchRecordingSaver(MemorySaver):
+    """MemorySaver that records batched writes, standing in for the database."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches: list[tuple[list[PendingPut], list[PendingWrites]]] = []
+
+    async def aput_batch(self, puts, writes):
+        self.batches.append((puts, writes))
+        for put in puts:
+            await self.aput(put.config, put.checkpoint, put.metadata, put.new_versions)
+        for item in writes:
+            await self.aput_writes(item.config, item.writes, item.task_id, item.task_path)
+
+
+def build_agent(checkpointer, tool_gate: asyncio.Event | None = None):
+    async def get_transactions() -> dict:
+        """Get financial transactions."""
+        if tool_gate is not None:
+            await tool_gate.wait()
+        return {"data": [{"id": "1", "amount": "-10.99"}]}
+
+    return create_react_agent(
+        model=FakeStreamingChatModel(),
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        checkpointer=checkpointer,
+    )
+
+
+async def run_turn(agent, thread_id: str, text: str, durability: str) -> None:
+    config = {"configurable": {"thread_id": thread_id}}
+    async for _ in agent.astream(
+        {"messages": [{"role": "user", "content": text}]},
+        stream_mode="messages",
+        config=config,
+        durability=durability,
+    ):
+        pass
+
+
+def stored_messages(saver: MemorySaver, thread_id: str) -> list:
+    checkpoint = saver.get_tuple({"configurable": {"thread_id": thread_id}})
+    return checkpoint.checkpoint["channel_values"]["messages"] if checkpoint else []
+
+
+class TestDurabilityCrashSemantics:
+    """What is durable while a turn is still running (i.e. if the worker died now)."""
+
+    async def _run_until_tool(self, durability: str) -> tuple[list, MemorySaver]:
+        store = MemorySaver()
+        gate = asyncio.Event()
+        agent = build_agent(store, tool_gate=gate)
+        turn = asyncio.create_task(run_turn(agent, "t1", "show my transactions", durability))
+        # Let the model step finish and the tool start blocking
+        for _ in range(50):
+            await asyncio.sleep(0)
+        snapshot = list(stored_messages(store, "t1"))
+        gate.set()
+        await turn
+        return snapshot, store
+
+    async def test_sync_persists_each_step(self):
+        """In sync mode the model's tool call is durable before the tool runs."""
+        snapshot, store = await self._run_until_tool("sync")
+        assert [m.type for m in snapshot] == ["human", "ai"]
+        assert len(stored_messages(store, "t1")) == 4
+
+    async def test_exit_persists_nothing_mid_turn(self):
+        """In exit mode a crash mid-turn loses the whole turn."""
+        snapshot, store = await self._run_until_tool("exit")
+        assert snapshot == []
+        assert [m.type for m in stored_messages(store, "t1")] == ["human", "ai", "tool", "ai"]
+
+    async def test_exit_writes_single_checkpoint_per_turn(self):
+        """Exit mode writes one checkpoint per turn instead of one per super-step."""
+        store = MemorySaver()
+        agent = build_agent(store)
+        await run_turn(agent, "t1", "show my transactions", "exit")
+        exit_count = len(list(store.list({"configurable": {"thread_id": "t1"}})))
+
+        store = MemorySaver()
+        agent = build_agent(store)
+        await run_turn(agent, "t1", "show my transactions", "sync")
+        sync_count = len(list(store.list({"configurable": {"thread_id": "t1"}})))
+
+        assert exit_count == 1
+        assert sync_count > exit_count
+
+
+class TestWriteBehindCheckpointer:
+    """Test the async write-behind queue."""
+
+    async def test_writes_are_deferred_until_flush(self):
+        """Queued writes are not in the store until flushed; a crash would lose them."""
+        store = BatchRecordingSaver()
+        saver = WriteBehindCheckpointer(store, flush_interval=60, batch_size=10_000)
+        agent = build_agent(saver)
+
+        await run_turn(agent, "t1", "Hello", "async")
+        assert stored_messages(store, "t1") == []
+
+        await saver.aclose()
+        assert [m.type for m in stored_messages(store, "t1")] == ["human", "ai"]
+
+    async def test_reads_see_own_queued_writes(self):
+        """A second turn on the same thread sees the first turn's history."""
+        store = BatchRecordingSaver()
+        saver = WriteBehindCheckpointer(store, flush_interval=0.01)
+        agent = build_agent(saver)
+
+        await run_turn(agent, "t1", "My name is Alice", "async")
+        await run_turn(agent, "t1", "What is my name?", "async")
+        await saver.aclose()
+
+        messages = stored_messages(store, "t1")
+        assert messages[-1].content == "Your name is Alice."
+
+    async def test_batches_across_sessions(self):
+        """Concurrent sessions are flushed together in far fewer batches than writes."""
+        store = BatchRecordingSaver()
+        saver = WriteBehindCheckpointer(store, flush_interval=0.05, batch_size=1000)
+        agent = build_agent(saver)
+
+        await asyncio.gather(
+            *(run_turn(agent, f"t{i}", "show my transactions", "async") for i in range(20))
+        )
+        await saver.aclose()
+
+        writes = sum(len(puts) + len(writes) for puts, writes in store.batches)
+        threads = {p.config["configurable"]["thread_id"] for puts, _ in store.batches for p in puts}
+        assert len(threads) == 20
+        assert len(store.batches) < writes / 10
+        for i in range(20):
+            assert len(stored_messages(store, f"t{i}")) == 4
+
+    async def test_bounded_queue_applies_backpressure(self):
+        """Writers block once max_queue items are waiting."""
+        release = asyncio.Event()
+
+        class SlowSaver(MemorySaver):
+            async def aput_batch(self, puts, writes):
+                await release.wait()
+
+        saver = WriteBehindCheckpointer(SlowSaver(), max_queue=2, batch_size=1)
+        config = {"configurable": {"thread_id": "t1", "checkpoint_ns": "", "checkpoint_id": "c"}}
+        # First item is taken by the writer, two more fill the queue
+        for _ in range(3):
+            await saver.aput_writes(config, [("x", 1)], "task")
+        blocked = asyncio.create_task(saver.aput_writes(config, [("x", 1)], "task"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        release.set()
+        await blocked
+        await saver.aclose()
+
+    async def test_failed_flush_is_retried_then_dropped(self):
+        """Failed batches are retried and counted as dropped once retries run out."""
+        attempts = 0
+
+        class FailingSaver(MemorySaver):
+            async def aput_batch(self, puts, writes):
+                nonlocal attempts
+                attempts += 1
+                raise ConnectionError("database unavailable")
+
+        saver = WriteBehindCheckpointer(FailingSaver(), max_retries=2, flush_interval=0)
+        config = {"configurable": {"thread_id": "t1", "checkpoint_ns": "", "checkpoint_id": "c"}}
+        await saver.aput_writes(config, [("x", 1)], "task")
+        await saver.aclose()
+
+        assert attempts == 2
+        assert saver.dropped == 1
+
+
+class TestCheckpointerConfiguration:
+    """Test durability settings select the right checkpointer."""
+
+    @pytest.mark.parametrize(
+        ("durability", "expected"),
+        [
+            (CheckpointDurability.SYNC, MemorySaver),
+            (CheckpointDurability.EXIT, MemorySaver),
+            (CheckpointDurability.ASYNC, WriteBehindCheckpointer),
+        ],
+    )
+    def test_durability_selects_checkpointer(self, durability, expected):
+        """Only async durability wraps the checkpointer in a write-behind queue."""
+        config = Settings(
+            openai_api_key="test",
+            checkpointer_type=CheckpointerType.MEMORY,
+            checkpoint_durability=durability,
+        )
+        assert type(get_checkpointer(config)) is expected
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from agent import get_transactions
+from coalescing import COALESCED_TURNS, TurnCoalescer
+from fake_model import FakeStreamingChatModel
+from tests.conftest import receive_turn
+
+
+@pytest.fixture
+def client(agent_client):
+    with agent_client(
+        model=FakeStreamingChatModel(token_delay=0.02),
+        tools=[get_transactions],
+        prompt="You are a helpful financial assistant.",
+        coalesce=True,
+    ) as client:
+        yield client
+
+
+def deltas(frames: list[dict]) -> list[str]:
+    return [f["delta"] for f in frames if f["type"] == "content_delta"]
+
+
+class TestTurnCoalescer:
+    """Test single-flight fan-out."""
+
+    async def test_identical_keys_share_one_flight(self):
+        """Subscribers of a key get every frame from the start, produced once."""
+        coalescer = TurnCoalescer()
+        calls = 0
+
+        async def produce(flight):
+            nonlocal calls
+            calls += 1
+            for n in range(5):
+                flight.publish({"n": n})
+                await asyncio.sleep(0.01)
+            return "done"
+
+        async def subscriber(delay: float) -> list[dict]:
+            await asyncio.sleep(delay)
+            flight, _ = coalescer.subscribe("key", produce)
+            try:
+                return [frame async for frame in flight]
+            finally:
+                coalescer.unsubscribe(flight)
+
+        results = await asyncio.gather(subscriber(0), subscriber(0.025), subscriber(0.04))
+        assert calls == 1
+        assert results == [[{"n": n} for n in range(5)]] * 3
+        assert coalescer.in_flight == 0
+
+    async def test_detaching_subscribers(self):
+        """One subscriber leaving does not stop the flight; the last one cancels it."""
+        coalescer = TurnCoalescer()
+        finished = asyncio.Event()
+
+        async def produce(flight):
+            for n in range(3):
+                flight.publish({"n": n})
+                await asyncio.sleep(0.01)
+            finished.set()
+
+        first, _ = coalescer.subscribe("a", produce)
+        second, _ = coalescer.subscribe("a", produce)
+        coalescer.unsubscribe(first)
+        assert [frame async for frame in second] == [{"n": n} for n in range(3)]
+        coalescer.unsubscribe(second)
+
+        finished.clear()
+        abandoned, _ = coalescer.subscribe("b", produce)
+        coalescer.unsubscribe(abandoned)
+        await asyncio.sleep(0.05)
+        assert abandoned.done
+        assert not finished.is_set()
+
+
+class TestCoalescedEndpoint:
+    """Test coalescing over the websocket endpoint."""
+
+    def test_identical_turns_share_one_generation(self, client):
+        """Concurrent fresh sessions asking the same question get the same stream."""
+        leaders = COALESCED_TURNS.value(role="leader")
+        with (
+            client.websocket_connect("/ws") as first,
+            client.websocket_connect("/ws") as second,
+        ):
+            first.send_text("Hello there")
+            second.send_text("Hello there")
+            first_frames = receive_turn(first)
+            second_frames = receive_turn(second)
+
+        assert COALESCED_TURNS.value(role="leader") == leaders + 1
+        assert deltas(first_frames)
+        assert deltas(first_frames) == deltas(second_frames)
+        assert [f["type"] for f in first_frames] == [f["type"] for f in second_frames]
+        # Only the leader's turn made model calls
+        usage = sorted(
+            frames[-1]["usage"]["total_tokens"] for frames in (first_frames, second_frames)
+        )
+        assert usage[0] == 0 < usage[1]
+
+    def test_followers_keep_the_conversation(self, client):
+        """A follower's thread holds the shared turn, tool calls included."""
+        with (
+            client.websocket_connect("/ws") as first,
+            client.websocket_connect("/ws") as second,
+        ):
+            for text in ("My name is Alice", "Show my transactions"):
+                first.send_text(text)
+                second.send_text(text)
+                receive_turn(first)
+                receive_turn(second)
+
+            second.send_text("What is my name?")
+            assert "".join(deltas(receive_turn(second))) == "Your name is Alice."
+
+    def test_different_state_is_not_coalesced(self, client):
+        """The same question from sessions with different histories runs twice."""
+        leaders = COALESCED_TURNS.value(role="leader")
+        with (
+            client.websocket_connect("/ws") as first,
+            client.websocket_connect("/ws") as second,
+        ):
+            first.send_text("My name is Alice")
+            receive_turn(first)
+
+            first.send_text("What is my name?")
+            second.send_text("What is my name?")
+            first_frames = receive_turn(first)
+            second_frames = receive_turn(second)
+
+        assert COALESCED_TURNS.value(role="leader") == leaders + 3
+        assert "".join(deltas(first_frames)) == "Your name is Alice."
+        assert "".join(deltas(second_frames)) != "Your name is Alice."
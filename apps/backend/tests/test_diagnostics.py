@@ -0,0 +1,197 @@
+import asyncio
+import tracemalloc
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+from starlette.routing import Route
+from starlette.websockets import WebSocket
+
+from accounting import TimedCheckpointer
+from agent import get_transactions
+from diagnostics import (
+    LARGEST_SESSIONS,
+    SESSION_MEMORY,
+    HeapDiagnostics,
+    SessionMemory,
+    TurnBuffers,
+    connection_transport,
+    require_token,
+    socket_bytes,
+)
+from metrics import REGISTRY
+from tests.conftest import receive_turn
+
+TOKEN = "s3cret"
+AUTH = {"Authorization": f"Bearer {TOKEN}"}
+
+
+@pytest.fixture
+def diagnostics_client(agent_client):
+    """Clients of an agent accounted by ``memory``, with the protected admin endpoints."""
+
+    def build(memory: SessionMemory, heap: HeapDiagnostics):
+        return agent_client(
+            tools=[get_transactions],
+            prompt="You are a helpful financial assistant.",
+            checkpointer=memory.saver,
+            session_memory=memory,
+            routes=[
+                Route("/admin/sessions", require_token(TOKEN, memory.sessions_endpoint)),
+                Route(
+                    "/admin/heap",
+                    require_token(TOKEN, heap.endpoint),
+                    methods=["GET", "POST", "DELETE"],
+                ),
+            ],
+        )
+
+    return build
+
+
+class TestSessionMemory:
+    """Test accounting the memory of live sessions."""
+
+    def test_sessions_are_accounted_while_open(self, diagnostics_client):
+        """Each open session's checkpoints count, the larger conversation first."""
+        memory = SessionMemory(TimedCheckpointer(MemorySaver()), top=1)
+        client = diagnostics_client(memory, HeapDiagnostics())
+        with client.websocket_connect("/ws") as short, client.websocket_connect("/ws") as long:
+            receive_turn(short, "Hello")
+            for _ in range(3):
+                receive_turn(long, "Show my transactions")
+            larger, smaller = memory.usage()
+            assert larger.checkpoints > smaller.checkpoints > 0
+
+            memory.collect()
+            assert SESSION_MEMORY.value(component="checkpoints") == (
+                larger.checkpoints + smaller.checkpoints
+            )
+            assert LARGEST_SESSIONS.value(rank="1") == larger.total
+
+            response = client.get("/admin/sessions", headers=AUTH)
+            (reported,) = response.json()["sessions"][:1]
+            assert reported == larger.as_dict()
+
+        assert memory.usage() == []
+        memory.collect()
+        assert LARGEST_SESSIONS.value(rank="1") == 0
+
+    async def test_sampled_not_scraped(self, monkeypatch):
+        """Scrapes serve the last sample; sampling runs every ``interval`` seconds."""
+        memory = SessionMemory(MemorySaver(), interval=0.01)
+        memory.open("s1", WebSocket({"type": "websocket"}, None, None))
+        walks = []
+        monkeypatch.setattr(memory, "usage", lambda: walks.append(1) or [])
+        REGISTRY.render()
+        assert walks == []
+
+        sampler = asyncio.create_task(memory.run_periodically())
+        await asyncio.sleep(0.05)
+        sampler.cancel()
+        assert len(walks) >= 2
+
+    def test_turn_buffers(self):
+        """A turn's buffers grow with its answer and tool calls."""
+        buffers = TurnBuffers()
+        empty = buffers.nbytes()
+        for _ in range(10):
+            buffers.append("x" * 100)
+        buffers.tool_names["call_1"] = "get_transactions"
+        assert buffers.nbytes() > empty + 1000
+        assert buffers.content == "x" * 1000
+        assert buffers.parts == [buffers.content]
+
+    def test_socket_without_transport(self):
+        """Sockets whose server does not expose the transport count as 0 bytes."""
+
+        class Transport(asyncio.Transport):
+            def is_closing(self) -> bool:
+                return False
+
+            def get_write_buffer_size(self) -> int:
+                return 123
+
+            def get_extra_info(self, name, default=None):
+                return default
+
+        class Protocol:
+            def __init__(self, transport) -> None:
+                self.transport = transport
+
+            async def send(self, message) -> None:
+                pass
+
+        async def send(message) -> None:
+            pass
+
+        scope = {"type": "websocket"}
+        uvicorn_like = WebSocket(scope, None, Protocol(Transport()).send)
+        assert socket_bytes(uvicorn_like) == 123
+        for other in (send, Protocol(object()).send, Protocol(None).send):
+            websocket = WebSocket(scope, None, other)
+            assert connection_transport(websocket) is None
+            assert socket_bytes(websocket) == 0
+
+
+class TestHeapDiagnostics:
+    """Test the admin heap snapshot endpoint."""
+
+    def test_protected_and_diffed(self, diagnostics_client):
+        """Snapshots need the token, and report what was allocated since tracing began."""
+        client = diagnostics_client(SessionMemory(MemorySaver()), HeapDiagnostics())
+        assert client.get("/admin/heap").status_code == 401
+        assert (
+            client.get("/admin/heap", headers={"Authorization": "Bearer nope"}).status_code == 401
+        )
+        assert client.get("/admin/heap", headers=AUTH).status_code == 409
+        assert not tracemalloc.is_tracing()
+
+        try:
+            assert client.post("/admin/heap", headers=AUTH).json()["tracing"]
+            leak = [bytearray(1024) for _ in range(1000)]
+            report = client.get("/admin/heap", headers=AUTH, params={"top": 5}).json()
+            grown = {site: stat for stat in report["top"] for site in stat["trace"]}
+            assert any(__file__ in site for site in grown)
+            assert max(stat["size_diff"] for stat in report["top"]) >= 1024 * 1000
+        finally:
+            status = client.delete("/admin/heap", headers=AUTH).json()
+        assert not status["tracing"]
+        assert not tracemalloc.is_tracing()
+        del leak
+
+    async def test_start_and_stop(self):
+        """Starting again keeps one timer; diffs after stopping report nothing."""
+        heap = HeapDiagnostics()
+        try:
+            await asyncio.gather(heap.start(), heap.start())
+            timer = heap._stop_timer
+            await heap.start()
+            assert heap._stop_timer is timer
+            assert (await heap.diff())["tracing"]
+        finally:
+            heap.stop()
+        assert timer.cancelled()
+        assert await heap.diff() is None
+
+        await heap.start()
+        diff = asyncio.create_task(heap.diff())
+        heap.stop()
+        assert await diff is None
+        assert not tracemalloc.is_tracing()
+
+    def test_invalid_counts(self, diagnostics_client):
+        """Counts that are not positive integers are rejected, and tracing is not started."""
+        client = diagnostics_client(SessionMemory(MemorySaver()), HeapDiagnostics())
+        for value in ("x", "-1", "0", "1.5"):
+            params = {"frames": value}
+            assert client.post("/admin/heap", headers=AUTH, params=params).status_code == 400
+            response = client.get("/admin/sessions", headers=AUTH, params={"top": value})
+            assert response.status_code == 400
+        assert not tracemalloc.is_tracing()
+        try:
+            client.post("/admin/heap", headers=AUTH, params={"frames": "2"})
+            response = client.get("/admin/heap", headers=AUTH, params={"top": "many"})
+            assert response.status_code == 400
+            assert response.json() == {"error": "top must be a positive integer"}
+        finally:
+            client.delete("/admin/heap", headers=AUTH)
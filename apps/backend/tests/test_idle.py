@@ -0,0 +1,167 @@
+import asyncio
+import json
+
+from idle import PONG, IdleConnection, IdlePolicy, IdleScheduler, TimerWheel, is_pong
+from scheduling import classify_turn
+from tests.conftest import receive_turn
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent: list[dict] = []
+        self.closed = False
+
+    async def send_json(self, data: dict) -> None:
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed = True
+
+
+class TestTimerWheel:
+    """Test the hashed timer wheel."""
+
+    def test_entries_fire_in_their_slot(self):
+        """An entry comes due after ceil(delay / tick) advances."""
+        wheel = TimerWheel(tick=0.5, slots=8)
+        entry = IdleConnection(None, 0.0)
+        wheel.schedule(entry, 1.2)
+        assert [wheel.advance() for _ in range(2)] == [set(), set()]
+        assert wheel.advance() == {entry}
+        assert entry.slot == -1
+
+    def test_far_deadlines_are_capped(self):
+        """Deadlines beyond the wheel's span land in its furthest slot."""
+        wheel = TimerWheel(tick=1, slots=8)
+        entry = IdleConnection(None, 0.0)
+        wheel.schedule(entry, 100)
+        assert [bool(wheel.advance()) for _ in range(7)] == [False] * 6 + [True]
+
+    def test_cancel_and_reschedule(self):
+        """Rescheduling moves an entry; cancelled entries never fire."""
+        wheel = TimerWheel(tick=1, slots=8)
+        entry = IdleConnection(None, 0.0)
+        wheel.schedule(entry, 1)
+        wheel.schedule(entry, 3)
+        assert [bool(wheel.advance()) for _ in range(3)] == [False, False, True]
+        wheel.schedule(entry, 1)
+        wheel.cancel(entry)
+        assert not any(wheel.advance() for _ in range(8))
+
+
+class TestIdleScheduler:
+    """Test the idle policy applied by the scheduler."""
+
+    def _scheduler(self, policy: IdlePolicy) -> IdleScheduler:
+        return IdleScheduler(
+            policy,
+            timeout_frame=lambda: {"type": "error", "code": "TIMEOUT"},
+            warning_frame=lambda remaining: {"type": "warning"},
+            ping_frame=lambda: {"type": "ping"},
+            tick=0.01,
+        )
+
+    async def test_one_task_for_many_connections(self):
+        """Thousands of idle connections are timed out by a single task."""
+        scheduler = self._scheduler(IdlePolicy(timeout=0.1))
+        tasks = len(asyncio.all_tasks())
+        sockets = [FakeWebSocket() for _ in range(2000)]
+        for websocket in sockets:
+            scheduler.register(websocket)
+        assert len(asyncio.all_tasks()) == tasks + 1
+
+        await asyncio.sleep(0.3)
+        assert all(
+            ws.closed and ws.sent == [{"type": "error", "code": "TIMEOUT"}] for ws in sockets
+        )
+
+    async def test_busy_connections_are_not_timed_out(self):
+        """A turn longer than the idle timeout does not close the connection."""
+        scheduler = self._scheduler(IdlePolicy(timeout=0.05))
+        websocket = FakeWebSocket()
+        conn = scheduler.register(websocket)
+        scheduler.begin_turn(conn)
+        await asyncio.sleep(0.15)
+        assert not websocket.closed
+
+        scheduler.end_turn(conn)
+        await asyncio.sleep(0.15)
+        assert websocket.closed
+
+    async def test_keepalive_timeout_reaps_silent_peers(self):
+        """Peers that do not answer pings are closed before the idle timeout."""
+        scheduler = self._scheduler(
+            IdlePolicy(timeout=10, keepalive_interval=0.03, keepalive_timeout=0.1)
+        )
+        answering, silent = FakeWebSocket(), FakeWebSocket()
+        answering_conn = scheduler.register(answering)
+        scheduler.register(silent)
+        for _ in range(10):
+            await asyncio.sleep(0.02)
+            scheduler.received(answering_conn)
+
+        assert silent.closed
+        assert not answering.closed
+        assert {"type": "ping"} in silent.sent
+
+
+class TestIdleEndpoint:
+    """Test the idle policy over the websocket endpoint."""
+
+    def test_timeout(self, agent_client):
+        """Idle connections get a TIMEOUT error after the configured timeout."""
+        client = agent_client(idle_policy=IdlePolicy(timeout=0.2), idle_tick=0.02)
+        with client.websocket_connect("/ws") as websocket:
+            msg = json.loads(websocket.receive_text())
+        assert msg["type"] == "error"
+        assert msg["code"] == "TIMEOUT"
+
+    def test_warning_before_timeout(self, agent_client):
+        """A warning is sent before the timeout closes the connection."""
+        client = agent_client(idle_policy=IdlePolicy(timeout=0.3, warning=0.2), idle_tick=0.02)
+        with client.websocket_connect("/ws") as websocket:
+            warning = json.loads(websocket.receive_text())
+            timeout = json.loads(websocket.receive_text())
+        assert warning["type"] == "warning"
+        assert warning["code"] == "IDLE_WARNING"
+        assert timeout["code"] == "TIMEOUT"
+
+    def test_pings_and_pongs(self, agent_client):
+        """Idle connections are pinged; a pong is not treated as a user message."""
+        policy = IdlePolicy(timeout=5, keepalive_interval=0.05)
+        with agent_client(idle_policy=policy, idle_tick=0.02).websocket_connect("/ws") as websocket:
+            assert json.loads(websocket.receive_text()) == {"type": "ping"}
+            websocket.send_text(PONG)
+            websocket.send_text("Hello")
+            while (msg := json.loads(websocket.receive_text()))["type"] == "ping":
+                pass
+            assert msg["type"] == "start"
+
+    def test_compact_pong(self, agent_client):
+        """Pongs are recognised however the client's JSON encoder spaces them."""
+        policy = IdlePolicy(timeout=5, keepalive_interval=0.05)
+        turns = []
+
+        def classify(websocket, user_msg: str):
+            turns.append(user_msg)
+            return classify_turn(websocket, user_msg)
+
+        client = agent_client(idle_policy=policy, idle_tick=0.02, classify=classify)
+        with client.websocket_connect("/ws") as websocket:
+            assert json.loads(websocket.receive_text()) == {"type": "ping"}
+            # As JSON.stringify({type: "pong"}) sends it
+            websocket.send_text('{"type":"pong"}')
+            assert receive_turn(websocket, "Hello")[-1]["type"] == "end"
+        assert turns == ["Hello"]
+        assert is_pong('{ "type" : "pong" }')
+        assert not is_pong('{"type": "ping"}')
+        assert not is_pong("pong")
+
+    def test_turn_resets_idle_timer(self, agent_client):
+        """The timeout counts from the end of the last turn."""
+        client = agent_client(idle_policy=IdlePolicy(timeout=0.3), idle_tick=0.02)
+        with client.websocket_connect("/ws") as websocket:
+            for _ in range(3):
+                receive_turn(websocket, "Hello")
+            msg = json.loads(websocket.receive_text())
+        assert msg["code"] == "TIMEOUT"
@@ -0,0 +1,121 @@
+import io
+import json
+import logging
+import sys
+import threading
+
+from config import LogFormat
+from log_pipeline import (
+    LOG_RECORDS_DROPPED,
+    LogPipeline,
+    QueuedLogHandler,
+    RepeatFilter,
+    log_context,
+)
+
+
+def record(message: str = "Turn failed: %s", level: int = logging.ERROR) -> logging.LogRecord:
+    return logging.LogRecord("test", level, "agent.py", 42, message, ("boom",), None)
+
+
+class TestRepeatFilter:
+    """Test rate limiting and sampling of repeated records."""
+
+    def test_burst_then_sample(self):
+        """A call site's burst goes through, then one in ``sample`` with the count skipped."""
+        repeats = RepeatFilter(burst=2, interval=60, sample=3)
+        passed = [r for r in (record() for _ in range(7)) if repeats.filter(r)]
+        assert len(passed) == 3
+        assert getattr(passed[1], "suppressed", 0) == 0
+        assert passed[2].suppressed == 2
+        # Other call sites and info records are not limited
+        other = record()
+        other.lineno = 43
+        assert repeats.filter(other)
+        assert all(repeats.filter(record(level=logging.INFO)) for _ in range(10))
+
+    def test_new_window(self):
+        """Suppressed records are reported by the first record of the next window."""
+        repeats = RepeatFilter(burst=1, interval=0, sample=100)
+        assert repeats.filter(record())
+        window = next(iter(repeats._windows.values()))
+        window.suppressed = 5
+        first = record()
+        assert repeats.filter(first)
+        assert first.suppressed == 5
+
+    def test_threads(self):
+        """Records logged from many threads at once are counted exactly."""
+        repeats = RepeatFilter(burst=10, interval=60, sample=7)
+        passed = []
+
+        def log() -> None:
+            passed.extend(r for r in (record() for _ in range(5000)) if repeats.filter(r))
+
+        switch = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=log) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch)
+        assert len(passed) == 10 + (8 * 5000 - 10) // 7
+        (window,) = repeats._windows.values()
+        suppressed = sum(getattr(r, "suppressed", 0) for r in passed) + window.suppressed
+        assert len(passed) + suppressed == window.count == 8 * 5000
+
+
+class TestLogPipeline:
+    """Test records written by the pipeline's thread."""
+
+    def test_text_keeps_handlers(self):
+        """Records go to the replaced handlers' streams and formats, from the writer thread."""
+        stream = io.StringIO()
+        writes = []
+        write = stream.write
+        stream.write = lambda text: writes.append(threading.current_thread().name) or write(text)
+        log = logging.getLogger("test.pipeline.text")
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        log.handlers = [handler]
+
+        pipeline = LogPipeline(LogFormat.TEXT, burst=1, sample=2)
+        pipeline.install([log.name])
+        for _ in range(3):
+            log.error("Turn failed: %s", "boom")
+        pipeline.close()
+
+        assert log.handlers == [handler]
+        assert stream.getvalue().splitlines() == [
+            "ERROR Turn failed: boom",
+            "ERROR Turn failed: boom (1 similar suppressed)",
+        ]
+        assert set(writes) == {"log-writer"}
+
+    def test_json_with_context(self, capsys):
+        """JSON records carry the session and turn of the context they were logged in."""
+        log = logging.getLogger("test.pipeline.json")
+        pipeline = LogPipeline(LogFormat.JSON)
+        pipeline.install([log.name])
+        with log_context(session_id="s1", turn=3):
+            log.warning("Turn rejected: %s", "overloaded")
+        log.warning("Outside a turn")
+        pipeline.close()
+
+        inside, outside = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert inside["message"] == "Turn rejected: overloaded"
+        assert (inside["level"], inside["session_id"], inside["turn"]) == ("WARNING", "s1", 3)
+        assert "session_id" not in outside
+
+    def test_bounded_queue(self):
+        """Records past ``max_queue`` are dropped and counted."""
+        pipeline = LogPipeline(max_queue=2)
+        handler = QueuedLogHandler(pipeline, logging.Formatter(), io.StringIO())
+        dropped = LOG_RECORDS_DROPPED.value(reason="queue_full")
+        for _ in range(5):
+            handler.emit(record(level=logging.INFO))
+        assert len(pipeline._queue) == 2
+        assert LOG_RECORDS_DROPPED.value(reason="queue_full") == dropped + 3
@@ -0,0 +1,162 @@
+import asyncio
+import json
+from collections import defaultdict
+
+import pytest
+
+from agent import get_transactions
+from fake_model import FakeStreamingChatModel
+from multiplexing import FairSender
+
+
+@pytest.fixture
+def mux_client(agent_client):
+    def build(**kwargs):
+        return agent_client(
+            model=FakeStreamingChatModel(token_delay=0.01),
+            tools=[get_transactions],
+            prompt="You are a helpful financial assistant.",
+            multiplexed=True,
+            **kwargs,
+        )
+
+    return build
+
+
+def send(websocket, session_id: str, message: str) -> None:
+    websocket.send_text(json.dumps({"session_id": session_id, "message": message}))
+
+
+def receive_turns(websocket, turns: int) -> list[dict]:
+    """Frames received until ``turns`` turns have ended, in arrival order."""
+    frames = []
+    while turns:
+        frames.append(frame := json.loads(websocket.receive_text()))
+        turns -= frame["type"] in ("end", "error")
+    return frames
+
+
+def by_session(frames: list[dict]) -> dict[str, list[str]]:
+    types = defaultdict(list)
+    for frame in frames:
+        types[frame["session_id"]].append(frame["type"])
+    return types
+
+
+def content(frames: list[dict], session_id: str) -> list[str]:
+    return [
+        f["content"]
+        for f in frames
+        if f["session_id"] == session_id and f["type"] == "content_complete"
+    ]
+
+
+class TestFairSender:
+    """Test the round robin between sessions' frames."""
+
+    async def test_round_robin(self):
+        """Sessions take turns one frame at a time, each in its own order."""
+        sent = []
+
+        async def record(frame):
+            sent.append((frame["session_id"], frame["n"]))
+
+        sender = FairSender(record)
+        for n in range(3):
+            await sender.put("a", {"n": n})
+        await sender.put("b", {"n": 0})
+        await sender.put("c", {"n": 0})
+        await sender.put("c", {"n": 1})
+        writer = asyncio.create_task(sender.run())
+        await asyncio.sleep(0.01)
+        writer.cancel()
+        assert sent == [("a", 0), ("b", 0), ("c", 0), ("a", 1), ("c", 1), ("a", 2)]
+
+    async def test_backpressure(self):
+        """A session waits once ``buffer`` of its frames are unsent; others do not."""
+        sender = FairSender(lambda frame: asyncio.sleep(0), buffer=2)
+        await sender.put("a", {})
+        await sender.put("a", {})
+        blocked = asyncio.create_task(sender.put("a", {}))
+        await asyncio.wait_for(sender.put("b", {}), 1)
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        writer = asyncio.create_task(sender.run())
+        await asyncio.wait_for(blocked, 1)
+        sender.discard("a")
+        writer.cancel()
+
+    async def test_discard_releases_put(self):
+        """Discarding a session releases its ``put`` waiting for space, whose frame is dropped."""
+        sent = []
+
+        async def record(frame):
+            sent.append(frame["session_id"])
+
+        sender = FairSender(record, buffer=1)
+        await sender.put("a", {})
+        blocked = asyncio.create_task(sender.put("a", {}))
+        await asyncio.sleep(0.01)
+        sender.discard("a")
+        await asyncio.wait_for(blocked, 1)
+        await sender.put("b", {})
+        writer = asyncio.create_task(sender.run())
+        await asyncio.sleep(0.01)
+        writer.cancel()
+        assert sent == ["b"]
+
+
+class TestMultiplexedEndpoint:
+    """Test sessions sharing one websocket."""
+
+    def test_concurrent_sessions(self, mux_client):
+        """Turns of different sessions stream interleaved, each session's frames in order."""
+        with mux_client().websocket_connect("/ws") as websocket:
+            send(websocket, "a", "Hello")
+            send(websocket, "b", "Hello")
+            frames = receive_turns(websocket, 2)
+
+        for types in by_session(frames).values():
+            assert types[0] == "start"
+            assert types[-2:] == ["content_complete", "end"]
+            assert set(types[1:-2]) == {"content_delta"}
+        order = [f["session_id"] for f in frames if f["type"] == "content_delta"]
+        # b's answer starts before a's has ended
+        last_a = max(i for i, session_id in enumerate(order) if session_id == "a")
+        assert order.index("b") < last_a
+
+    def test_sessions_are_separate_conversations(self, mux_client):
+        """Each session has its own thread; a session's turns run in the order sent."""
+        with mux_client().websocket_connect("/ws") as websocket:
+            send(websocket, "a", "My name is Bob")
+            send(websocket, "a", "What is my name?")
+            send(websocket, "b", "What is my name?")
+            frames = receive_turns(websocket, 3)
+
+        assert by_session(frames)["a"].count("start") == 2
+        assert content(frames, "a")[1] == "Your name is Bob."
+        assert "Bob" not in content(frames, "b")[0]
+
+    def test_invalid_frames_and_limits(self, mux_client):
+        """Malformed frames and sessions beyond the limit get errors; closing frees a slot."""
+        with mux_client(mux_max_sessions=1).websocket_connect("/ws") as websocket:
+            websocket.send_text("Hello")
+            error = json.loads(websocket.receive_text())
+            assert (error["code"], "session_id" in error) == ("INVALID_FRAME", False)
+
+            websocket.send_text(json.dumps({"session_id": "a"}))
+            error = json.loads(websocket.receive_text())
+            assert (error["code"], "session_id" in error) == ("INVALID_FRAME", False)
+
+            send(websocket, "a", "Hello")
+            receive_turns(websocket, 1)
+            send(websocket, "b", "Hello")
+            error = json.loads(websocket.receive_text())
+            assert (error["code"], error["session_id"]) == ("TOO_MANY_SESSIONS", "b")
+
+            websocket.send_text(json.dumps({"session_id": "a", "type": "close"}))
+            send(websocket, "b", "Hello")
+            frames = receive_turns(websocket, 1)
+            assert {f["session_id"] for f in frames} == {"b"}
+            assert frames[-1]["type"] == "end"
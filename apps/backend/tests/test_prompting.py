@@ -0,0 +1,71 @@
+import asyncio
+
+from langchain_core.tools import tool
+from langgraph.checkpoint.memory import MemorySaver
+
+from agent import SYSTEM_PROMPT, get_transactions
+from fake_model import FakeStreamingChatModel
+from prompting import PromptPrefix, build_agent
+
+
+@tool
+def get_balance() -> str:
+    """Get the account balance."""
+    return "100.00"
+
+
+async def cached_tokens(agent, thread_id: str, *messages: str) -> list[int]:
+    """``cache_read`` tokens of the last model call of each turn."""
+    config = {"configurable": {"thread_id": thread_id}}
+    cached = []
+    for message in messages:
+        state = await agent.ainvoke({"messages": [{"role": "user", "content": message}]}, config)
+        usage = state["messages"][-1].usage_metadata
+        cached.append(usage.get("input_token_details", {}).get("cache_read", 0))
+    return cached
+
+
+class TestPromptPrefix:
+    """Test the stable prompt prefix and per-session cache keys."""
+
+    def test_prefix_is_stable(self):
+        """Tool order does not change the schemas sent or the fingerprint."""
+        first = PromptPrefix(SYSTEM_PROMPT, [get_transactions, get_balance])
+        second = PromptPrefix(SYSTEM_PROMPT, [get_balance, get_transactions])
+        assert [s["function"]["name"] for s in first.schemas] == [
+            "get_balance",
+            "get_transactions",
+        ]
+        assert first.schemas == second.schemas
+        assert first.fingerprint == second.fingerprint
+        assert PromptPrefix("Another prompt", [get_balance]).fingerprint != first.fingerprint
+
+    def test_session_requests_hit_the_prompt_cache(self):
+        """Keyed calls go to the cache shard that holds the session's earlier turns."""
+        model = FakeStreamingChatModel(cache_shards=64)
+        agent = build_agent(model, [get_transactions], SYSTEM_PROMPT, MemorySaver())
+        cached = asyncio.run(cached_tokens(agent, "a", "Hello", "Hello again", "And again"))
+        assert cached[0] == 0
+        assert 0 < cached[1] < cached[2]
+
+    def test_cache_key_per_session(self):
+        """Calls carry the prefix fingerprint and thread id, unless disabled."""
+        keys = []
+
+        class RecordingModel(FakeStreamingChatModel):
+            def _prefill(self, messages, kwargs):
+                keys.append(kwargs.get("prompt_cache_key"))
+                return super()._prefill(messages, kwargs)
+
+        prefix = PromptPrefix(SYSTEM_PROMPT, [get_transactions])
+        agent = build_agent(RecordingModel(), [get_transactions], SYSTEM_PROMPT, MemorySaver())
+        asyncio.run(cached_tokens(agent, "a", "Hello"))
+        asyncio.run(cached_tokens(agent, "b", "Hello"))
+        assert keys == [f"{prefix.fingerprint}-a", f"{prefix.fingerprint}-b"]
+
+        keys.clear()
+        agent = build_agent(
+            RecordingModel(), [get_transactions], SYSTEM_PROMPT, MemorySaver(), cache_key_param=None
+        )
+        asyncio.run(cached_tokens(agent, "a", "Hello"))
+        assert keys == [None]
@@ -0,0 +1,118 @@
+import glob
+import gzip
+import json
+import time
+
+import pytest
+
+from agent import get_transactions
+from fake_model import FakeStreamingChatModel
+from recording import ReplayChatModel, SessionRecorder, read_turns
+from tests.conftest import receive_turn
+
+
+@pytest.fixture
+def run_turns(agent_client):
+    """Frames of each turn of one session, START excluded, END included."""
+
+    def run(model, *messages: str, recorder: SessionRecorder | None = None) -> list[list[dict]]:
+        client = agent_client(model=model, tools=[get_transactions], recorder=recorder)
+        turns = []
+        with client.websocket_connect("/ws") as websocket:
+            for message in messages:
+                start, *frames = receive_turn(websocket, message)
+                assert start["type"] == "start"
+                turns.append(frames)
+        if recorder is not None:
+            recorder.close()
+        return turns
+
+    return run
+
+
+class TestSessionRecorder:
+    """Test the turn records written by the websocket endpoint."""
+
+    def test_turn_record(self, run_turns, tmp_path):
+        """A tool-calling turn records its calls, tokens, tools and frames."""
+        recorder = SessionRecorder(str(tmp_path))
+        (frames, _) = run_turns(
+            FakeStreamingChatModel(), "Show my transactions", "Hello", recorder=recorder
+        )
+        first, second = read_turns([str(tmp_path / "*.jsonl")])
+        assert (first["n"], second["n"]) == (0, 1)
+        assert first["s"] == second["s"]
+        assert first["in"] == "Show my transactions"
+        assert first["st"] == "ok"
+        assert first["ms"] >= first["calls"][-1]["at"]
+
+        tool_call, answer = first["calls"]
+        (call,) = [frame for frame in frames if frame["type"] == "tool_call"]
+        assert [tc[:2] for tc in tool_call["tc"]] == [[call["tool_call_id"], "get_transactions"]]
+        assert json.loads(tool_call["tc"][0][2]) == {}
+        ((tool_id, name, at, _),) = first["tools"]
+        assert (tool_id, name) == (call["tool_call_id"], "get_transactions")
+        assert tool_call["at"] <= at <= answer["at"]
+
+        text = "".join(token for _, token in answer["tok"])
+        (complete,) = [frame for frame in frames if frame["type"] == "content_complete"]
+        assert text == complete["content"]
+        end = frames[-1]
+        assert sum(c["u"][0] for c in first["calls"]) == end["usage"]["input_tokens"]
+        assert sum(c["u"][1] for c in first["calls"]) == end["usage"]["output_tokens"]
+        assert [t for _, t in first["out"]][:3] == ["start", "tool_call_delta", "tool_call"]
+        assert first["out"][-1][1] == "end"
+
+    def test_redaction(self, run_turns, tmp_path):
+        """Redacted records keep sizes and timings, not text or tool arguments."""
+        recorder = SessionRecorder(str(tmp_path), redact=True)
+        run_turns(FakeStreamingChatModel(), "Show my transactions", recorder=recorder)
+        (turn,) = read_turns([str(tmp_path / "*.jsonl")])
+        assert turn["in"] == "xxxx xx xxxxxxxxxxxx"
+        assert turn["calls"][0]["tc"][0][2] == "{}"
+        assert set("".join(token for _, token in turn["calls"][1]["tok"])) <= {"x", " "}
+
+    def test_rotation(self, tmp_path):
+        """Full segments are gzipped and only the newest ``max_files`` are kept."""
+        recorder = SessionRecorder(str(tmp_path), max_bytes=200, max_files=2)
+        for n in range(10):
+            recorder.write({"s": "a", "n": n, "in": "x" * 100})
+            time.sleep(0.01)
+        recorder.close()
+        assert len(glob.glob(str(tmp_path / "*.jsonl"))) == 1
+        closed = sorted(glob.glob(str(tmp_path / "*.jsonl.gz")))
+        assert len(closed) == 2
+        with gzip.open(closed[-1], "rt") as f:
+            assert [json.loads(line)["n"] for line in f] == [8]
+        assert [turn["n"] for turn in read_turns([str(tmp_path / "*")])] == [7, 8, 9]
+
+
+class TestReplay:
+    """Test replaying recorded model calls."""
+
+    def test_replay_reproduces_calls(self, run_turns, tmp_path):
+        """Tagged turns stream the recorded tokens, tool calls and usage, at the recorded pace."""
+        recorder = SessionRecorder(str(tmp_path))
+        recorded = run_turns(
+            FakeStreamingChatModel(token_delay=0.02), "Show my transactions", recorder=recorder
+        )[0]
+        (turn,) = read_turns([str(tmp_path / "*.jsonl")])
+
+        model = ReplayChatModel.from_logs([str(tmp_path / "*.jsonl")], speed=2.0)
+        started = time.perf_counter()
+        replayed = run_turns(model, f"[replay:{turn['s']}:0] Show my transactions")[0]
+        elapsed = time.perf_counter() - started
+
+        def strip(frames):
+            return [
+                {k: v for k, v in f.items() if k not in ("timestamp", "timings")} for f in frames
+            ]
+
+        assert strip(replayed) == strip(recorded)
+        # Half the recorded model time, give or take scheduling
+        recorded_ms = sum(gap for call in turn["calls"] for gap, _ in call["tok"])
+        assert elapsed * 1000 >= recorded_ms / 2 * 0.9
+
+        # Unrecorded turns are answered by the fake model
+        (frames,) = run_turns(model, "Hello")
+        assert frames[-2]["content"] == model.reply
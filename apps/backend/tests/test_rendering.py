@@ -0,0 +1,90 @@
+import pytest
+
+from agent import get_transactions
+from config import RenderCadence
+from fake_model import FakeStreamingChatModel
+from rendering import DeltaBuffer
+from tests.conftest import receive_turn
+
+REPLY = "Hello there. How are you?\n```py\nx = 1. y = 2\n```\nDone."
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def push_words(buffer: DeltaBuffer, text: str) -> list[str]:
+    """What ``buffer`` releases for ``text`` pushed word by word, flushed at the end."""
+    words = text.replace(" ", " \0").split("\0")
+    ready = [buffer.push(word) for word in words]
+    return [chunk for chunk in [*ready, buffer.flush()] if chunk]
+
+
+@pytest.fixture
+def turn_frames(agent_client):
+    """Frames of one turn answered with ``REPLY``, START and END excluded."""
+
+    def run(path: str, **kwargs) -> list[dict]:
+        model = FakeStreamingChatModel(reply=REPLY)
+        client = agent_client(model=model, tools=[get_transactions], **kwargs)
+        with client.websocket_connect(path) as websocket:
+            start, *frames, end = receive_turn(websocket, "Hello")
+        assert (start["type"], end["type"]) == ("start", "end")
+        return frames
+
+    return run
+
+
+class TestDeltaBuffer:
+    """Test where held-back content is released."""
+
+    def test_sentence_and_block_boundaries(self):
+        """Text is released at sentence ends and line ends, whole code blocks by line."""
+        chunks = push_words(DeltaBuffer(max_delay=60), REPLY)
+        assert "".join(chunks) == REPLY
+        # Tokens can span lines; a sentence end inside the code block is not a boundary
+        assert chunks == ["Hello there. ", "How are you?\n```py\n", "x = 1. y = 2\n```\n", "Done."]
+
+    def test_max_chars(self):
+        """Text without a boundary is released once ``max_chars`` are held."""
+        buffer = DeltaBuffer(max_delay=60, max_chars=10)
+        assert buffer.push("abcdef") == ""
+        assert buffer.push("ghijkl") == "abcdefghijkl"
+        assert buffer.flush() == ""
+
+    def test_max_delay(self):
+        """Text is held no longer than ``max_delay`` seconds."""
+        clock = FakeClock()
+        buffer = DeltaBuffer(max_delay=0.25, clock=clock)
+        assert buffer.push("Slow ") == ""
+        clock.now = 0.2
+        assert buffer.push("tokens ") == ""
+        clock.now = 0.3
+        assert buffer.push("arrive") == "Slow tokens arrive"
+
+
+class TestRenderCadence:
+    """Test the content deltas sent for each cadence."""
+
+    def test_block_cadence(self, turn_frames):
+        """Block deltas carry no accumulated text and add up to the complete content."""
+        frames = turn_frames("/ws?cadence=block")
+        deltas = [frame for frame in frames if frame["type"] == "content_delta"]
+        (complete,) = [frame for frame in frames if frame["type"] == "content_complete"]
+        assert all("accumulated" not in delta for delta in deltas)
+        assert "".join(delta["delta"] for delta in deltas) == complete["content"] == REPLY
+        assert len(deltas) < len(REPLY.split())
+        assert frames.index(complete) > frames.index(deltas[-1])
+
+    def test_default_cadence(self, turn_frames):
+        """Clients that do not ask get the server's cadence, per token by default."""
+        deltas = [f for f in turn_frames("/ws") if f["type"] == "content_delta"]
+        assert len(deltas) == len(REPLY.split())
+        assert deltas[-1]["accumulated"] == REPLY
+
+        block = turn_frames("/ws", render_cadence=RenderCadence.BLOCK)
+        assert all("accumulated" not in f for f in block if f["type"] == "content_delta")
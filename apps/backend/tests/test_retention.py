@@ -0,0 +1,177 @@
+import asyncio
+import gzip
+import json
+import os
+import uuid
+from datetime import timedelta
+
+import pytest
+from langgraph.prebuilt import create_react_agent
+
+from config import CheckpointerType, Settings
+from fake_model import FakeStreamingChatModel
+from retention import CheckpointRetention, retention_from_settings
+from serialization import CheckpointSerializer
+
+DSN = os.environ.get("TEST_POSTGRES_DSN")
+
+
+class TestRetentionConfiguration:
+    """Test the retention job is only configured when there is work for it."""
+
+    def test_disabled_without_policy(self):
+        """No keep-last or TTL means nothing to run."""
+        config = Settings(openai_api_key="test", checkpointer_type=CheckpointerType.POSTGRES)
+        assert retention_from_settings(config) is None
+
+    def test_disabled_for_memory(self):
+        """Retention only applies to the Postgres checkpointer."""
+        config = Settings(
+            openai_api_key="test",
+            checkpointer_type=CheckpointerType.MEMORY,
+            checkpoint_keep_last=5,
+        )
+        assert retention_from_settings(config) is None
+
+    def test_configured_from_settings(self):
+        """Settings map onto the retention policy."""
+        config = Settings(
+            openai_api_key="test",
+            checkpointer_type=CheckpointerType.POSTGRES,
+            checkpoint_keep_last=5,
+            checkpoint_thread_ttl=60,
+        )
+        retention = retention_from_settings(config)
+        assert retention.keep_last == 5
+        assert retention.ttl == timedelta(seconds=60)
+
+    def test_keep_last_must_keep_something(self):
+        """Keeping zero checkpoints would break every thread."""
+        with pytest.raises(ValueError):
+            CheckpointRetention("postgresql://", keep_last=0)
+
+
+async def run_retention(retention: CheckpointRetention):
+    # Other test workers may hold the advisory lock
+    while (stats := await retention.run()) is None:
+        await asyncio.sleep(0.05)
+    return stats
+
+
+@pytest.mark.skipif(not DSN, reason="TEST_POSTGRES_DSN not set")
+class TestPostgresRetention:
+    """Run the retention job against a real database."""
+
+    @pytest.fixture
+    async def saver(self):
+        from checkpointing import PostgresCheckpointer
+
+        saver = PostgresCheckpointer(DSN, serde=CheckpointSerializer(dedup_min_bytes=10))
+        await saver.aopen()
+        self.threads = []
+        yield saver
+        for thread_id in self.threads:
+            await saver.adelete_thread(thread_id)
+        await saver.aclose()
+
+    async def _session(self, saver, turns: int) -> str:
+        thread_id = f"retention-{uuid.uuid4()}"
+        self.threads.append(thread_id)
+
+        async def get_transactions() -> dict:
+            """Get financial transactions."""
+            # Unique per thread so payloads are not shared with other tests
+            return {"data": [{"id": thread_id, "amount": "-10.99", "date_time": "2025-10-05"}]}
+
+        agent = create_react_agent(
+            model=FakeStreamingChatModel(),
+            tools=[get_transactions],
+            checkpointer=saver,
+        )
+        config = {"configurable": {"thread_id": thread_id}}
+        for _ in range(turns):
+            await agent.ainvoke({"messages": [("user", "show my transactions")]}, config)
+        return thread_id
+
+    async def _count(self, saver, table: str, thread_id: str) -> int:
+        async with saver._cursor() as cur:
+            await cur.execute(
+                f"SELECT count(*) AS n FROM {table} WHERE thread_id = %s", [thread_id]
+            )
+            return (await cur.fetchone())["n"]
+
+    async def test_keep_last_prunes_history(self, saver):
+        """Old checkpoints, writes and blobs go; the latest state still loads."""
+        thread_id = await self._session(saver, turns=3)
+        config = {"configurable": {"thread_id": thread_id}}
+        before = await saver.aget_tuple(config)
+        blobs_before = await self._count(saver, "checkpoint_blobs", thread_id)
+
+        stats = await run_retention(CheckpointRetention(DSN, keep_last=2, pause=0))
+
+        assert stats.checkpoints_deleted >= 10
+        assert await self._count(saver, "checkpoints", thread_id) == 2
+        assert await self._count(saver, "checkpoint_blobs", thread_id) < blobs_before
+        after = await saver.aget_tuple(config)
+        assert after.checkpoint == before.checkpoint
+        assert len(after.checkpoint["channel_values"]["messages"]) == 12
+
+    async def test_ttl_expires_and_archives_idle_threads(self, saver, tmp_path):
+        """Idle threads are archived then deleted; active threads are untouched."""
+        idle = await self._session(saver, turns=1)
+        active = await self._session(saver, turns=1)
+        async with saver._cursor() as cur:
+            await cur.execute(
+                "UPDATE checkpoints SET checkpoint = jsonb_set(checkpoint, '{ts}', "
+                "'\"2020-01-01T00:00:00+00:00\"') WHERE thread_id = %s",
+                [idle],
+            )
+
+        retention = CheckpointRetention(DSN, ttl=timedelta(days=365), archive_dir=tmp_path, pause=0)
+        stats = await run_retention(retention)
+
+        assert stats.threads_expired >= 1
+        assert await self._count(saver, "checkpoints", idle) == 0
+        assert await self._count(saver, "checkpoint_blobs", idle) == 0
+        assert await self._count(saver, "checkpoint_writes", idle) == 0
+        assert await self._count(saver, "checkpoints", active) > 0
+
+        [archive] = tmp_path.glob("checkpoints-*.jsonl.gz")
+        with gzip.open(archive, "rt") as f:
+            records = [json.loads(line) for line in f]
+        [record] = [r for r in records if r["thread_id"] == idle]
+        assert record["checkpoints"]
+        assert record["blobs"] and record["writes"]
+        # The tool result was deduplicated, so the archive carries it
+        assert len(record["payloads"]) == 1
+
+    async def test_unreferenced_payloads_are_deleted(self, saver):
+        """Payloads are kept while referenced and deleted once their threads are gone."""
+        thread_id = await self._session(saver, turns=1)
+        async with saver._cursor() as cur:
+            await cur.execute(
+                "SELECT count(DISTINCT p.digest) AS n "
+                "FROM checkpoint_payloads p, checkpoint_blobs b "
+                "WHERE b.thread_id = %s AND position(p.digest IN b.blob) > 0",
+                [thread_id],
+            )
+            assert (await cur.fetchone())["n"] == 1
+
+        retention = CheckpointRetention(DSN, payload_grace=timedelta(0), pause=0)
+        await run_retention(retention)
+        loaded = await saver.aget_tuple({"configurable": {"thread_id": thread_id}})
+        assert thread_id in loaded.checkpoint["channel_values"]["messages"][2].content
+
+        await saver.adelete_thread(thread_id)
+        stats = await run_retention(retention)
+        assert stats.payloads_deleted >= 1
+
+    async def test_single_runner(self, saver):
+        """A second concurrent run backs off while the first holds the lock."""
+        from psycopg import AsyncConnection
+
+        from retention import ADVISORY_LOCK_KEY
+
+        async with await AsyncConnection.connect(DSN, autocommit=True) as conn:
+            await conn.execute("SELECT pg_advisory_lock(%s)", [ADVISORY_LOCK_KEY])
+            assert await CheckpointRetention(DSN, keep_last=1).run() is None
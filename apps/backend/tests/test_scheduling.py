@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+
+from config import TurnPriority
+from fake_model import FakeStreamingChatModel
+from scheduling import QUEUE_SECONDS, DeadlineExceeded, TurnScheduler
+from tests.conftest import receive_turn
+
+INTERACTIVE, BATCH = TurnPriority.INTERACTIVE, TurnPriority.BATCH
+
+
+@pytest.fixture
+def scheduled_client(agent_client):
+    def build(scheduler: TurnScheduler):
+        return agent_client(model=FakeStreamingChatModel(token_delay=0.02), scheduler=scheduler)
+
+    return build
+
+
+async def grant_order(scheduler: TurnScheduler, turns: list[tuple[TurnPriority, str]]) -> list:
+    """Queue ``turns`` behind a held slot and return the order they are granted in."""
+    order = []
+
+    async def turn(priority: TurnPriority, tenant: str) -> None:
+        async with scheduler.slot(priority, tenant):
+            order.append((priority, tenant))
+            await asyncio.sleep(0)
+
+    await scheduler.acquire(INTERACTIVE)
+    tasks = [asyncio.create_task(turn(*t)) for t in turns]
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+class TestTurnScheduler:
+    """Test slot admission order and deadlines."""
+
+    async def test_higher_priority_first(self):
+        """Interactive turns are granted before batch turns queued earlier."""
+        order = await grant_order(
+            TurnScheduler(1), [(BATCH, "a"), (BATCH, "a"), (INTERACTIVE, "b")]
+        )
+        assert order == [(INTERACTIVE, "b"), (BATCH, "a"), (BATCH, "a")]
+
+    async def test_fair_share_between_tenants(self):
+        """A tenant with a backlog does not delay another tenant's turns."""
+        turns = [(INTERACTIVE, "busy")] * 4 + [(INTERACTIVE, "quiet")] * 2
+        order = [tenant for _, tenant in await grant_order(TurnScheduler(1), turns)]
+        assert order == ["busy", "quiet", "busy", "quiet", "busy", "busy"]
+
+    async def test_weighted_share(self):
+        """Slots are shared in proportion to tenant weights."""
+        turns = [(INTERACTIVE, "gold")] * 4 + [(INTERACTIVE, "free")] * 4
+        scheduler = TurnScheduler(1, weights={"gold": 2})
+        order = [tenant for _, tenant in await grant_order(scheduler, turns)]
+        assert order[:6].count("gold") == 4
+
+    async def test_deadline_exceeded(self):
+        """A turn that cannot start before its deadline fails without taking a slot."""
+        scheduler = TurnScheduler(1, deadlines={INTERACTIVE: 0.05})
+        await scheduler.acquire(INTERACTIVE)
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.acquire(INTERACTIVE)
+        assert scheduler.pending == 0
+        scheduler.release()
+        assert await scheduler.acquire(INTERACTIVE) == 0.0
+
+    async def test_turns_near_deadline_jump_the_queue(self):
+        """A batch turn about to miss its deadline goes ahead of interactive turns."""
+        scheduler = TurnScheduler(1, deadlines={BATCH: 0.1}, slack=0.08)
+        await scheduler.acquire(INTERACTIVE)
+        batch = asyncio.create_task(scheduler.acquire(BATCH))
+        await asyncio.sleep(0.03)
+        interactive = asyncio.create_task(scheduler.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await batch
+        assert not interactive.done()
+        scheduler.release()
+        await interactive
+
+    async def test_cancelled_waiters_do_not_leak_slots(self):
+        """A turn cancelled while queued leaves no slot or queue entry behind."""
+        scheduler = TurnScheduler(1)
+        await scheduler.acquire(INTERACTIVE)
+        waiting = asyncio.create_task(scheduler.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        assert (scheduler.active, scheduler.pending) == (0, 0)
+
+
+class TestScheduledEndpoint:
+    """Test turn scheduling over the websocket endpoint."""
+
+    def test_queued_turns_report_wait(self, scheduled_client):
+        """A turn queued behind another reports its wait, per priority class."""
+        waits = QUEUE_SECONDS.count(priority="batch")
+        with (
+            scheduled_client(TurnScheduler(1)) as client,
+            client.websocket_connect("/ws") as first,
+            client.websocket_connect("/ws?priority=batch&tenant=acme") as second,
+        ):
+            first.send_text("Hello")
+            json.loads(first.receive_text())
+            second.send_text("Hello")
+            receive_turn(first)
+            end = receive_turn(second)[-1]
+
+        assert end["type"] == "end"
+        assert end["timings"]["queue_ms"] > 0
+        assert end["timings"]["ttft_ms"] > end["timings"]["queue_ms"]
+        assert QUEUE_SECONDS.count(priority="batch") == waits + 1
+
+    def test_deadline_exceeded_error(self, scheduled_client):
+        """Turns that cannot start in time get a DEADLINE_EXCEEDED error."""
+        scheduler = TurnScheduler(1, deadlines={INTERACTIVE: 0.05})
+        with (
+            scheduled_client(scheduler) as client,
+            client.websocket_connect("/ws") as first,
+            client.websocket_connect("/ws") as second,
+        ):
+            first.send_text("Hello")
+            json.loads(first.receive_text())
+            second.send_text("Hello")
+            error = receive_turn(second)[-1]
+            assert receive_turn(first)[-1]["type"] == "end"
+
+        assert error["type"] == "error"
+        assert error["code"] == "DEADLINE_EXCEEDED"
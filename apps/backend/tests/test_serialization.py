@@ -0,0 +1,156 @@
+import json
+import os
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from config import CheckpointCompression
+from serialization import CheckpointSerializer, PayloadCache
+
+TOOL_RESULT = json.dumps(
+    {"data": [{"id": str(i), "amount": f"{i}.99", "date_time": "2025-10-05"} for i in range(200)]}
+)
+
+
+def session_messages() -> list:
+    return [
+        SystemMessage("You are a helpful financial assistant."),
+        HumanMessage("What are my transactions?", id="h1"),
+        AIMessage(
+            "",
+            id="a1",
+            tool_calls=[{"name": "get_transactions", "args": {}, "id": "call_1"}],
+            usage_metadata={"input_tokens": 10, "output_tokens": 5, "total_tokens": 15},
+        ),
+        ToolMessage(TOOL_RESULT, tool_call_id="call_1", name="get_transactions", id="t1"),
+        AIMessage("You have 200 transactions.", id="a2"),
+    ]
+
+
+class TestCheckpointSerializer:
+    """Test the compact checkpoint serializer."""
+
+    @pytest.mark.parametrize("compression", list(CheckpointCompression))
+    def test_round_trip(self, compression):
+        """Messages and plain values survive a round trip with every codec."""
+        serde = CheckpointSerializer(compression)
+        value = {"messages": session_messages(), "step": 3, "flag": None}
+        assert serde.loads_typed(serde.dumps_typed(value)) == value
+
+    def test_smaller_than_default(self):
+        """Compact encoding beats JsonPlusSerializer even without compression."""
+        messages = session_messages()
+        _, default = JsonPlusSerializer().dumps_typed(messages)
+        _, compact = CheckpointSerializer().dumps_typed(messages)
+        _, zstd = CheckpointSerializer(CheckpointCompression.ZSTD).dumps_typed(messages)
+        assert len(compact) < len(default)
+        assert len(zstd) < len(compact)
+
+    def test_type_records_encoding(self):
+        """The type string names the codec, so settings can change between writes."""
+        type_, _ = CheckpointSerializer(CheckpointCompression.LZ4).dumps_typed(session_messages())
+        assert type_ == "compact+lz4"
+        # A reader configured differently still decodes it
+        writer = CheckpointSerializer(CheckpointCompression.LZ4)
+        reader = CheckpointSerializer(CheckpointCompression.NONE)
+        assert reader.loads_typed(writer.dumps_typed(session_messages())) == session_messages()
+
+    def test_reads_default_serializer_blobs(self):
+        """Blobs written by the default serializer remain readable."""
+        data = JsonPlusSerializer().dumps_typed(session_messages())
+        assert CheckpointSerializer().loads_typed(data) == session_messages()
+
+    def test_small_bodies_are_not_compressed(self):
+        """Compression is skipped below compress_min_bytes."""
+        serde = CheckpointSerializer(CheckpointCompression.ZSTD, compress_min_bytes=1000)
+        assert serde.dumps_typed([HumanMessage("hi")])[0] == "compact"
+
+
+class TestPayloadDedup:
+    """Test content-addressed storage of large tool payloads."""
+
+    def test_payloads_inline_without_collector(self):
+        """Outside collect_payloads (e.g. MemorySaver) content stays inline."""
+        serde = CheckpointSerializer(dedup_min_bytes=100)
+        type_, blob = serde.dumps_typed(session_messages())
+        assert "ref" not in type_
+        assert serde.referenced_payloads(type_, blob) == []
+
+    def test_repeated_payload_collected_once(self):
+        """The same tool result in many checkpoints yields one payload."""
+        serde = CheckpointSerializer(dedup_min_bytes=100)
+        with serde.collect_payloads() as payloads:
+            blobs = [serde.dumps_typed(session_messages()[: n + 4]) for n in range(3)]
+        assert len(payloads) == 1
+        for type_, blob in blobs:
+            assert "+ref" in type_
+            assert serde.referenced_payloads(type_, blob) == list(payloads)
+            assert len(blob) < len(TOOL_RESULT)
+
+    def test_short_payloads_stay_inline(self):
+        """Tool results below dedup_min_bytes are not referenced."""
+        serde = CheckpointSerializer(dedup_min_bytes=len(TOOL_RESULT) + 1)
+        with serde.collect_payloads() as payloads:
+            serde.dumps_typed(session_messages())
+        assert payloads == {}
+
+    def test_load_resolves_provided_payloads(self):
+        """A fresh process resolves references from payloads fetched by the saver."""
+        writer = CheckpointSerializer(CheckpointCompression.ZSTD, dedup_min_bytes=100)
+        with writer.collect_payloads() as payloads:
+            data = writer.dumps_typed(session_messages())
+
+        reader = CheckpointSerializer()
+        fetched = {d: reader.decode_payload(t, p) for d, (t, p) in payloads.items()}
+        with reader.provide_payloads(fetched):
+            assert reader.loads_typed(data) == session_messages()
+
+    def test_missing_payload_raises(self):
+        """Loading a reference that cannot be resolved fails loudly."""
+        writer = CheckpointSerializer(dedup_min_bytes=100)
+        with writer.collect_payloads():
+            data = writer.dumps_typed(session_messages())
+        with pytest.raises(LookupError):
+            CheckpointSerializer().loads_typed(data)
+
+    def test_payload_cache_is_bounded(self):
+        """The payload LRU evicts least recently used entries past its budget."""
+        cache = PayloadCache(max_chars=10)
+        cache.put(b"a", "12345")
+        cache.put(b"b", "12345")
+        cache.get(b"a")
+        cache.put(b"c", "12345")
+        assert cache.get(b"b") is None
+        assert cache.get(b"a") == "12345"
+        assert cache.size <= 10
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_POSTGRES_DSN"), reason="TEST_POSTGRES_DSN not set")
+class TestPostgresPayloads:
+    """Round trip through Postgres with payloads stored once."""
+
+    async def test_checkpoint_round_trip_with_dedup(self):
+        """Checkpoints referencing stored payloads load with a cold cache."""
+        from checkpointing import PostgresCheckpointer
+
+        serde = CheckpointSerializer(CheckpointCompression.ZSTD, dedup_min_bytes=100)
+        saver = PostgresCheckpointer(os.environ["TEST_POSTGRES_DSN"], serde=serde)
+        await saver.aopen()
+        try:
+            config = {"configurable": {"thread_id": f"serde-{os.getpid()}", "checkpoint_ns": ""}}
+            checkpoint = {
+                "v": 4,
+                "id": "1f000000-0000-6000-8000-000000000001",
+                "ts": "2025-10-05T00:00:00+00:00",
+                "channel_values": {"messages": session_messages()},
+                "channel_versions": {"messages": saver.get_next_version(None, None)},
+                "versions_seen": {},
+            }
+            await saver.aput(config, checkpoint, {}, checkpoint["channel_versions"])
+            serde.cache = PayloadCache()
+            loaded = await saver.aget_tuple(config)
+            assert loaded.checkpoint["channel_values"]["messages"] == session_messages()
+        finally:
+            await saver.adelete_thread(config["configurable"]["thread_id"])
+            await saver.aclose()
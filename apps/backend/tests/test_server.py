@@ -0,0 +1,76 @@
+import os
+import signal
+import socket
+
+import pytest
+
+from config import Settings
+from server import (
+    RestartBackoff,
+    available_cores,
+    reuse_port_socket,
+    run_reuse_port,
+    server_options,
+)
+
+
+class TestServerProfile:
+    """Test the tuned uvicorn server profile."""
+
+    def test_options_from_settings(self):
+        """Websocket limits come from settings; deflate and protocol pings are off."""
+        config = Settings(openai_api_key="sk-test", ws_max_size=1024, ws_max_queue=4)
+        options = server_options(config, "app:create", factory=True)
+        assert options["app"] == "app:create"
+        assert options["factory"] is True
+        assert options["ws_max_size"] == 1024
+        assert options["ws_max_queue"] == 4
+        assert options["ws_per_message_deflate"] is False
+        assert options["ws_ping_interval"] is None
+        assert options["loop"] in ("uvloop", "asyncio")
+        assert options["http"] in ("httptools", "h11")
+
+    def test_available_cores(self):
+        """At least one core, and no more than the process may run on."""
+        assert 1 <= available_cores() <= len(os.sched_getaffinity(0))
+
+    def test_reuse_port_sockets_share_a_port(self):
+        """Each worker can bind its own listening socket to the same port."""
+        first = reuse_port_socket("127.0.0.1", 0)
+        port = first.getsockname()[1]
+        second = reuse_port_socket("127.0.0.1", port)
+        try:
+            assert second.getsockname()[1] == port
+            assert second.type == socket.SOCK_STREAM
+        finally:
+            first.close()
+            second.close()
+
+
+class TestWorkerRestarts:
+    """Test restarting crashed SO_REUSEPORT workers."""
+
+    def test_backoff(self):
+        """Delays double with recent crashes, up to the maximum, until the limit is hit."""
+        backoff = RestartBackoff(5, 60, initial=0.5, maximum=1.5)
+        assert [backoff.crashed(t) for t in range(4)] == [0.5, 1.0, 1.5, 1.5]
+        assert backoff.crashed(4) is None
+        # Crashes older than the window are forgotten
+        backoff = RestartBackoff(3, 10)
+        backoff.crashed(0)
+        backoff.crashed(1)
+        assert backoff.crashed(12) == 0.5
+        assert RestartBackoff(0, 10).crashed(0) is not None
+
+    def test_gives_up_on_crash_loops(self):
+        """Workers that keep crashing are not restarted forever."""
+        config = Settings(openai_api_key="sk-test", server_port=0)
+        options = server_options(config, "no_such_module:app")
+        handlers = signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM)
+        try:
+            with pytest.raises(SystemExit) as exited:
+                run_reuse_port(options, 1, RestartBackoff(2, 60, initial=0.01))
+        finally:
+            signal.signal(signal.SIGINT, handlers[0])
+            signal.signal(signal.SIGTERM, handlers[1])
+        assert exited.value.code == 1
@@ -0,0 +1,178 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+
+from agent import get_checkpointer
+from checkpointing import PostgresCheckpointer, WriteBehindCheckpointer
+from config import CheckpointerType, Settings
+from serialization import CheckpointSerializer
+from sharding import SHARD_OPERATIONS, HashRing, ShardedCheckpointer, rebalance
+from tests.test_checkpoint_cache import SharedStore
+from tests.test_checkpoint_durability import build_agent, run_turn, stored_messages
+
+# Comma-separated DSNs of at least three empty databases
+SHARD_DSNS = [dsn for dsn in os.environ.get("TEST_POSTGRES_SHARD_DSNS", "").split(",") if dsn]
+
+
+def thread(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+class TestHashRing:
+    """Test the placement of threads on shards."""
+
+    def test_balanced(self):
+        """Each shard owns about as many threads as the others."""
+        ring = HashRing(4)
+        counts = [0] * 4
+        for n in range(20000):
+            counts[ring.shard(f"thread-{n}")] += 1
+        assert all(4250 < count < 5750 for count in counts)
+
+    def test_adding_a_shard(self):
+        """A new shard takes its share of threads, and only those threads move."""
+        before, after = HashRing(3), HashRing(4)
+        threads = [str(uuid.uuid4()) for _ in range(20000)]
+        moved = [t for t in threads if before.shard(t) != after.shard(t)]
+        assert all(after.shard(t) == 3 for t in moved)
+        assert 0.2 < len(moved) / len(threads) < 0.3
+
+
+class TestShardedCheckpointer:
+    """Test routing checkpoints to the shard of their thread."""
+
+    async def test_threads_live_on_their_shard(self):
+        """Conversations are stored on, and loaded from, their thread's shard only."""
+        shards = [MemorySaver() for _ in range(3)]
+        sharded = ShardedCheckpointer(shards)
+        agent = build_agent(sharded)
+        threads = [f"t{n}" for n in range(12)]
+        puts = SHARD_OPERATIONS.count(shard="0", op="put")
+        for thread_id in threads:
+            await run_turn(agent, thread_id, "Show my transactions", "sync")
+
+        for thread_id in threads:
+            owner = sharded.ring.shard(thread_id)
+            assert [len(stored_messages(s, thread_id)) for s in shards].count(0) == 2
+            assert len(stored_messages(shards[owner], thread_id)) == 4
+            loaded = await sharded.aget_tuple(thread(thread_id))
+            assert loaded.checkpoint == shards[owner].get_tuple(thread(thread_id)).checkpoint
+        assert {t.config["configurable"]["thread_id"] async for t in sharded.alist(None)} == set(
+            threads
+        )
+        assert len([t async for t in sharded.alist(None, limit=5)]) == 5
+        assert SHARD_OPERATIONS.count(shard="0", op="put") > puts
+
+        await sharded.adelete_thread("t0")
+        assert await sharded.aget_tuple(thread("t0")) is None
+
+    async def test_write_behind_batches(self):
+        """Batches of writes from many threads are split between the shards."""
+        shards = [MemorySaver() for _ in range(2)]
+        checkpointer = WriteBehindCheckpointer(ShardedCheckpointer(shards), flush_interval=10)
+        agent = build_agent(checkpointer)
+        await asyncio.gather(*(run_turn(agent, f"t{n}", "Hello", "async") for n in range(8)))
+        await checkpointer.aflush()
+        ring = HashRing(2)
+        for n in range(8):
+            assert len(stored_messages(shards[ring.shard(f"t{n}")], f"t{n}")) == 2
+
+    async def test_notifications(self):
+        """Changes on every shard are reported, after all of them are being listened to."""
+        shards = [SharedStore(), SharedStore()]
+        changes = ShardedCheckpointer(shards).anotifications()
+        assert await anext(changes) is None
+        shards[1].changes.put_nowait(("put", "t1", "", "1"))
+        assert await anext(changes) == ("put", "t1", "", "1")
+        shards[0].changes.put_nowait(("write", "t0", "", "2"))
+        assert await anext(changes) == ("write", "t0", "", "2")
+        await changes.aclose()
+
+    def test_configured_from_settings(self):
+        """Several shard DSNs give a sharded checkpointer, one pool per shard."""
+        config = Settings(
+            openai_api_key="test",
+            checkpointer_type=CheckpointerType.POSTGRES,
+            postgres_shards="postgresql://db0/agent, postgresql://db1/agent,",
+            postgres_shards_before=1,
+            postgres_pool_size=4,
+        )
+        checkpointer = get_checkpointer(config)
+        assert isinstance(checkpointer, ShardedCheckpointer)
+        assert [shard.conn.conninfo for shard in checkpointer.shards] == [
+            "postgresql://db0/agent",
+            "postgresql://db1/agent",
+        ]
+        assert checkpointer.shards[0].conn.max_size == 4
+        assert checkpointer.previous.shards == 1
+
+        single = Settings(openai_api_key="test")
+        assert single.postgres_shard_dsns == [single.postgres_connection_string]
+        with pytest.raises(ValueError):
+            ShardedCheckpointer([MemorySaver()], migrate_from=2)
+
+
+@pytest.mark.skipif(len(SHARD_DSNS) < 3, reason="TEST_POSTGRES_SHARD_DSNS not set")
+class TestAddingShards:
+    """Move threads onto new shards, against real databases."""
+
+    async def _open(self, dsns: list[str], migrate_from: int = 0) -> ShardedCheckpointer:
+        serde = CheckpointSerializer(dedup_min_bytes=10)
+        sharded = ShardedCheckpointer(
+            [PostgresCheckpointer(dsn, serde=serde) for dsn in dsns], migrate_from=migrate_from
+        )
+        await sharded.aopen()
+        return sharded
+
+    async def _count(self, saver: PostgresCheckpointer, thread_id: str) -> int:
+        async with saver.conn.connection() as conn:
+            cur = await conn.execute(
+                "SELECT (SELECT count(*) FROM checkpoints WHERE thread_id = %(t)s)"
+                " + (SELECT count(*) FROM checkpoint_blobs WHERE thread_id = %(t)s)"
+                " + (SELECT count(*) FROM checkpoint_writes WHERE thread_id = %(t)s) AS n",
+                {"t": thread_id},
+            )
+            return (await cur.fetchone())["n"]
+
+    async def test_moved_on_access_then_rebalanced(self):
+        """Threads move when touched or rebalanced, and load as they were."""
+        dsns = SHARD_DSNS[:3]
+        threads = [f"shard-{uuid.uuid4()}" for _ in range(30)]
+        before = await self._open(dsns[:2])
+        agent = build_agent(before)
+        for thread_id in threads:
+            await run_turn(agent, thread_id, "Show my transactions", "sync")
+        expected = {t: (await before.aget_tuple(thread(t))).checkpoint for t in threads}
+        await before.aclose()
+
+        after = await self._open(dsns, migrate_from=2)
+        moving = [t for t in threads if after.ring.shard(t) == 2]
+        assert moving
+        touched, untouched = moving[: len(moving) // 2], moving[len(moving) // 2 :]
+        try:
+            for thread_id in touched:
+                loaded = await after.aget_tuple(thread(thread_id))
+                assert loaded.checkpoint == expected[thread_id]
+                assert await self._count(after.shards[2], thread_id) > 0
+                old = after.shards[after.previous.shard(thread_id)]
+                assert await self._count(old, thread_id) == 0
+
+            planned = await rebalance(dsns, 2, pause=0, dry_run=True)
+            assert sum(planned.values()) >= len(untouched)
+            moved = await rebalance(dsns, 2, pause=0)
+            assert moved == planned
+            assert await rebalance(dsns, 2, pause=0, dry_run=True) == {}
+
+            settled = await self._open(dsns)
+            for thread_id in threads:
+                loaded = await settled.aget_tuple(thread(thread_id))
+                assert loaded.checkpoint == expected[thread_id]
+            await settled.aclose()
+        finally:
+            for thread_id in threads:
+                for shard in after.shards:
+                    await shard.adelete_thread(thread_id)
+            await after.aclose()
@@ -0,0 +1,101 @@
+import time
+
+from fake_model import FakeStreamingChatModel
+from scheduling import TurnScheduler
+from shedding import SHED_TURNS, AIMDLimiter, BreakerState, CircuitBreaker, LoadShedder
+from tests.conftest import receive_turn
+
+
+class TestAIMDLimiter:
+    """Test the adaptive concurrency limit."""
+
+    def test_failures_back_off_once_per_round_trip(self):
+        """Failures that arrive together shrink the limit once."""
+        limiter = AIMDLimiter(10, backoff=0.5)
+        for _ in range(5):
+            limiter.record(False, latency=1.0, in_flight=10, now=100.0)
+        assert limiter.limit == 5
+        limiter.record(False, latency=1.0, in_flight=10, now=101.0)
+        assert limiter.limit == 2
+
+    def test_successes_grow_a_used_limit(self):
+        """Successes add one slot per window, but only while the limit is in use."""
+        limiter = AIMDLimiter(4, max_limit=5)
+        for _ in range(4):
+            limiter.record(True, latency=0.1, in_flight=0, now=0.0)
+        assert limiter.limit == 4
+        for _ in range(20):
+            limiter.record(True, latency=0.1, in_flight=4, now=0.0)
+        assert limiter.limit == 5
+
+
+class TestCircuitBreaker:
+    """Test breaker state transitions."""
+
+    def test_opens_on_failure_rate_and_probes(self):
+        """The breaker opens, half-opens after the cooldown and closes on a good probe."""
+        breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, cooldown=10)
+        for ok in (True, False, True):
+            breaker.record(ok, now=0)
+        assert breaker.state == BreakerState.CLOSED
+        breaker.record(False, now=1)
+        assert breaker.state == BreakerState.OPEN
+        assert not breaker.allow(now=5)
+
+        assert breaker.allow(now=11)
+        assert breaker.state == BreakerState.HALF_OPEN
+        # One probe at a time
+        assert not breaker.allow(now=11)
+        breaker.record(True, now=12)
+        assert breaker.state == BreakerState.CLOSED
+        assert breaker.allow(now=12)
+
+    def test_failed_probe_reopens(self):
+        """A failing probe opens the breaker for another cooldown."""
+        breaker = CircuitBreaker(window=2, min_calls=2, cooldown=10)
+        breaker.record(False, now=0)
+        breaker.record(False, now=0)
+        assert breaker.allow(now=10)
+        breaker.record(False, now=10)
+        assert breaker.state == BreakerState.OPEN
+        assert not breaker.allow(now=15)
+        assert breaker.allow(now=20)
+
+
+class TestLoadSheddingEndpoint:
+    """Test load shedding over the websocket endpoint with a failing fake model."""
+
+    def test_outage_rejects_turns_then_recovers(self, agent_client):
+        """Failing calls trip the breaker; turns are rejected until a probe succeeds."""
+        model = FakeStreamingChatModel(error_rate=1.0)
+        breaker = CircuitBreaker(window=2, min_calls=2, cooldown=0.2)
+        shedder = LoadShedder(TurnScheduler(), breaker=breaker)
+        shed = SHED_TURNS.value()
+        client = agent_client(model=model, scheduler=shedder.scheduler, shedder=shedder)
+        with client.websocket_connect("/ws") as websocket:
+            assert receive_turn(websocket, "Hello")[-1]["code"] == "PROCESSING_ERROR"
+            assert receive_turn(websocket, "Hello")[-1]["code"] == "PROCESSING_ERROR"
+            assert receive_turn(websocket, "Hello")[-1]["code"] == "UPSTREAM_UNAVAILABLE"
+
+            model.error_rate = 0.0
+            time.sleep(0.25)
+            assert receive_turn(websocket, "Hello")[-1]["type"] == "end"
+            assert breaker.state == BreakerState.CLOSED
+        assert SHED_TURNS.value() == shed + 1
+
+    def test_latency_spike_lowers_turn_limit(self, agent_client):
+        """Calls slower than the latency threshold shrink the scheduler's limit."""
+        model = FakeStreamingChatModel(first_token_delay=0.05)
+        scheduler = TurnScheduler()
+        shedder = LoadShedder(
+            scheduler, limiter=AIMDLimiter(8, backoff=0.5), latency_threshold=0.02
+        )
+        assert scheduler.limit == 8
+        client = agent_client(model=model, scheduler=shedder.scheduler, shedder=shedder)
+        with client.websocket_connect("/ws") as websocket:
+            assert receive_turn(websocket, "Hello")[-1]["type"] == "end"
+            assert scheduler.limit == 4
+
+            model.first_token_delay = 0.0
+            assert receive_turn(websocket, "Hello")[-1]["type"] == "end"
+            assert scheduler.limit == 4
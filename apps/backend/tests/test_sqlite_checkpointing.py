@@ -0,0 +1,195 @@
+import asyncio
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from agent import get_checkpointer
+from checkpointing import CachedCheckpointer
+from config import CheckpointCacheValidation, CheckpointerType, Settings
+from sqlite_checkpointing import SqliteCheckpointer
+from tests.test_checkpoint_durability import build_agent, run_turn
+
+
+def thread(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+
+
+async def write_threads(path: str, prefix: str, count: int) -> None:
+    checkpointer = SqliteCheckpointer(path, busy_timeout=30)
+    agent = build_agent(checkpointer)
+    await asyncio.gather(*(run_turn(agent, f"{prefix}-{n}", "Hello", "sync") for n in range(count)))
+    await checkpointer.aclose()
+
+
+def write_threads_process(path: str, prefix: str, count: int) -> None:
+    asyncio.run(write_threads(path, prefix, count))
+
+
+@pytest.fixture
+async def checkpointer(tmp_path):
+    checkpointer = SqliteCheckpointer(str(tmp_path / "checkpoints.sqlite"))
+    await checkpointer.aopen()
+    yield checkpointer
+    await checkpointer.aclose()
+
+
+class TestSqliteCheckpointer:
+    """Test checkpoints stored in SQLite."""
+
+    async def test_conversation(self, checkpointer, tmp_path):
+        """A conversation resumes from its checkpoints, in WAL mode."""
+        agent = build_agent(checkpointer)
+        for text in ["My name is Bob", "Show my transactions", "What is my name?"]:
+            await run_turn(agent, "t1", text, "sync")
+        latest = await checkpointer.aget_tuple(thread("t1"))
+        messages = latest.checkpoint["channel_values"]["messages"]
+        assert [m.type for m in messages] == [
+            *("human", "ai"),
+            *("human", "ai", "tool", "ai"),
+            *("human", "ai"),
+        ]
+        assert "Bob" in messages[-1].content
+        assert latest.metadata["step"] > 0
+        assert (
+            latest.parent_config["configurable"]["checkpoint_id"]
+            < latest.config["configurable"]["checkpoint_id"]
+        )
+
+        conn = sqlite3.connect(tmp_path / "checkpoints.sqlite")
+        assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+    async def test_list(self, checkpointer):
+        """Checkpoints are listed newest first, filtered and limited."""
+        agent = build_agent(checkpointer)
+        await run_turn(agent, "t1", "Hello", "sync")
+        await run_turn(agent, "t2", "Hello", "sync")
+        listed = [item async for item in checkpointer.alist(thread("t1"))]
+        ids = [item.config["configurable"]["checkpoint_id"] for item in listed]
+        assert ids == sorted(ids, reverse=True)
+        assert {item.config["configurable"]["thread_id"] for item in listed} == {"t1"}
+
+        (second,) = [
+            item
+            async for item in checkpointer.alist(thread("t1"), limit=1, before=listed[0].config)
+        ]
+        assert second.config == listed[1].config
+        inputs = [item async for item in checkpointer.alist(None, filter={"source": "input"})]
+        assert len(inputs) == 2
+
+    async def test_pending_writes(self, checkpointer):
+        """Writes to special channels replace earlier ones; others keep the first."""
+        await run_turn(build_agent(checkpointer), "t1", "Hello", "sync")
+        latest = (await checkpointer.aget_tuple(thread("t1"))).config
+        await checkpointer.aput_writes(latest, [("messages", "b"), ("__error__", "x")], "task-b")
+        await checkpointer.aput_writes(latest, [("messages", "a")], "task-a")
+        await checkpointer.aput_writes(latest, [("messages", "ignored")], "task-a")
+        await checkpointer.aput_writes(latest, [("__error__", "y")], "task-b")
+        assert (await checkpointer.aget_tuple(thread("t1"))).pending_writes == [
+            ("task-a", "messages", "a"),
+            ("task-b", "__error__", "y"),
+            ("task-b", "messages", "b"),
+        ]
+
+    async def test_group_commit(self, checkpointer):
+        """Concurrent writes share commits; a failed write does not fail the others."""
+        await run_turn(build_agent(checkpointer), "t1", "Hello", "sync")
+        latest = (await checkpointer.aget_tuple(thread("t1"))).config
+
+        def fail(conn):
+            conn.execute("INSERT INTO checkpoints (thread_id) VALUES ('broken')")
+
+        commits = checkpointer.commits
+        results = await asyncio.gather(
+            *(checkpointer.aput_writes(latest, [("messages", n)], f"task-{n}") for n in range(20)),
+            checkpointer._write(fail),
+            return_exceptions=True,
+        )
+        assert isinstance(results[-1], sqlite3.IntegrityError)
+        assert results[:-1] == [None] * 20
+        assert checkpointer.commits - commits < 20
+        assert len((await checkpointer.aget_tuple(thread("t1"))).pending_writes) == 20
+
+    async def test_failed_commit(self, tmp_path):
+        """A batch whose savepoint or commit fails fails as a whole; the writer goes on."""
+
+        class FailingConnection:
+            def __init__(self, conn: sqlite3.Connection) -> None:
+                self.conn = conn
+                self.failing: set[str] = set()
+
+            def execute(self, sql: str, *args):
+                if sql in self.failing:
+                    self.failing.discard(sql)
+                    raise sqlite3.OperationalError("database is locked")
+                return self.conn.execute(sql, *args)
+
+            def __getattr__(self, name: str):
+                return getattr(self.conn, name)
+
+        class FailingCheckpointer(SqliteCheckpointer):
+            def _connect(self):
+                self.connection = FailingConnection(super()._connect())
+                return self.connection
+
+        checkpointer = FailingCheckpointer(str(tmp_path / "checkpoints.sqlite"))
+        await checkpointer.aopen()
+        try:
+            await run_turn(build_agent(checkpointer), "t1", "Hello", "sync")
+            latest = (await checkpointer.aget_tuple(thread("t1"))).config
+            for statement in ["SAVEPOINT job", "RELEASE job", "COMMIT"]:
+                checkpointer.connection.failing.add(statement)
+                with pytest.raises(sqlite3.OperationalError):
+                    await asyncio.wait_for(
+                        checkpointer.aput_writes(latest, [("messages", statement)], statement), 5
+                    )
+                assert not checkpointer.connection.in_transaction
+            await asyncio.wait_for(checkpointer.aput_writes(latest, [("messages", "ok")], "ok"), 5)
+            assert (await checkpointer.aget_tuple(thread("t1"))).pending_writes == [
+                ("ok", "messages", "ok")
+            ]
+        finally:
+            await checkpointer.aclose()
+
+    async def test_delete_thread(self, checkpointer):
+        """Deleting a thread removes its checkpoints."""
+        await run_turn(build_agent(checkpointer), "t1", "Hello", "sync")
+        await checkpointer.adelete_thread("t1")
+        assert await checkpointer.aget_tuple(thread("t1")) is None
+
+    def test_worker_processes(self, tmp_path):
+        """Processes sharing the database file write concurrently without errors."""
+        path = str(tmp_path / "checkpoints.sqlite")
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=write_threads_process, args=(path, f"p{n}", 10))
+            for n in range(3)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+        assert [process.exitcode for process in processes] == [0, 0, 0]
+        conn = sqlite3.connect(path)
+        (threads,) = conn.execute("SELECT count(DISTINCT thread_id) FROM checkpoints").fetchone()
+        assert threads == 30
+
+
+class TestSqliteConfiguration:
+    """Test selecting the SQLite checkpointer."""
+
+    def test_settings(self, tmp_path):
+        """``CHECKPOINTER_TYPE=sqlite`` opens the configured file, validated when cached."""
+        config = Settings(
+            openai_api_key="test",
+            checkpointer_type=CheckpointerType.SQLITE,
+            sqlite_path=str(tmp_path / "db.sqlite"),
+            sqlite_busy_timeout=1.0,
+        )
+        checkpointer = get_checkpointer(config)
+        assert isinstance(checkpointer, SqliteCheckpointer)
+        assert (checkpointer.path, checkpointer.busy_timeout) == (config.sqlite_path, 1.0)
+
+        cached = get_checkpointer(config.model_copy(update={"checkpoint_cache_size": 10}))
+        assert isinstance(cached, CachedCheckpointer)
+        assert cached.validation == CheckpointCacheValidation.VERSION
@@ -0,0 +1,67 @@
+from langchain_core.messages import AIMessageChunk, ToolMessage
+
+from accounting import TurnAccounting
+from agent import (
+    ContentDeltaMessage,
+    MessageType,
+    ToolCallDeltaMessage,
+    _chunk_handler,
+    _TurnStream,
+)
+from benchmarks.token_loop import measure
+from config import RenderCadence
+
+# Bytes in flight per token, block cadence. It was about 7 KB at 2000 tokens, a copy of
+# the answer per token, when the answer was concatenated as it grew.
+TOKEN_BYTES_BUDGET = 1024
+# Token cadence frames carry the text so far, so a token needs the frame's text and its
+# encoding in flight, about twice what is sent; a further copy of the text makes it 3
+FRAME_COPIES_BUDGET = 2.75
+
+
+class TestTokenLoop:
+    """Test the per-token work of streaming an answer."""
+
+    async def test_memory_per_token_does_not_grow_with_the_answer(self):
+        """Handling a token costs the same memory at the end of a long answer."""
+        short = await measure(200, RenderCadence.BLOCK, rounds=1)
+        long = await measure(2000, RenderCadence.BLOCK, rounds=1)
+        assert long["bytes_per_token"] < TOKEN_BYTES_BUDGET
+        assert long["bytes_per_token"] < short["bytes_per_token"] * 1.5
+
+    async def test_memory_per_token_is_the_frame(self):
+        """With the text so far in every frame, a token holds little more than its frame."""
+        long = await measure(2000, RenderCadence.TOKEN, rounds=1)
+        assert long["bytes_per_token"] < long["sent_per_token"] * FRAME_COPIES_BUDGET
+
+    def test_frames_match_the_models(self):
+        """Per-token frames have the fields of the messages they stand for."""
+        stream = _TurnStream(TurnAccounting(), "t1", [], None)
+        chunk = AIMessageChunk(
+            content="Hi",
+            id="run-1",
+            tool_call_chunks=[
+                {"id": "call_1", "name": "get_transactions", "args": "{}", "index": 0}
+            ],
+        )
+        _chunk_handler(type(chunk))(stream, chunk)
+        delta, call, content = stream.frames
+        assert (
+            delta
+            == ToolCallDeltaMessage(
+                tool_call_id="call_1", tool_name="get_transactions", args_delta="{}"
+            ).model_dump()
+        )
+        assert list(delta) == list(ToolCallDeltaMessage.model_fields)
+        assert call["type"] == MessageType.TOOL_CALL
+        assert content == ContentDeltaMessage(delta="Hi").model_dump(exclude_none=True)
+        assert stream.buffers.content == "Hi"
+
+    def test_subclasses_are_dispatched(self):
+        """Subclasses of streamed messages are handled as their base, others skipped."""
+
+        class Result(ToolMessage):
+            pass
+
+        assert _chunk_handler(Result) is _TurnStream.tool_message
+        assert _chunk_handler(str) is None
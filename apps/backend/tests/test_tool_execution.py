@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from langchain_core.messages import ToolMessage
+
+from tool_execution import (
+    TOOL_RUNS,
+    TOOL_WORKER_RESTARTS,
+    ToolExecution,
+    ToolExecutor,
+    ToolTimeout,
+    runs_in,
+)
+from tool_streaming import EagerTools, side_effect_free
+
+
+@runs_in(ToolExecution.PROCESS)
+def categorize(transactions: list[dict], fail: bool = False) -> dict:
+    """Categorize transactions."""
+    if fail:
+        raise ValueError("bad transactions")
+    return {
+        "pid": os.getpid(),
+        "categories": [{"id": t["id"], "category": "groceries"} for t in transactions],
+    }
+
+
+@runs_in(ToolExecution.PROCESS, timeout=0.2)
+def forecast(seconds: float) -> int:
+    """Forecast spending, spinning the CPU for ``seconds``."""
+    end = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < end:
+        n += 1
+    return os.getpid()
+
+
+@side_effect_free
+@runs_in(ToolExecution.THREAD)
+def lookup(account: str) -> str:
+    """Look up an account."""
+    return f"{account} on {threading.current_thread().name}"
+
+
+@runs_in(ToolExecution.INLINE)
+def balance() -> str:
+    """Get the balance."""
+    return threading.current_thread().name
+
+
+def undeclared() -> str:
+    """Left to LangChain."""
+    return "x"
+
+
+async def start(*tools) -> tuple[ToolExecutor, dict]:
+    executor = ToolExecutor(process_workers=1, shm_threshold=1024, grace=0.5)
+    wrapped = executor.wrap(tools)
+    await executor.start()
+    return executor, {getattr(t, "name", None): t for t in wrapped}
+
+
+class TestProcessTools:
+    """Test tools running in warm worker processes."""
+
+    async def test_large_payloads(self):
+        """Calls and results above the threshold round trip through shared memory."""
+        executor, tools = await start(categorize)
+        try:
+            transactions = [{"id": str(n), "amount": "-10.99"} for n in range(2000)]
+            args = {"transactions": transactions}
+            call = {"type": "tool_call", "id": "c1", "name": "categorize", "args": args}
+            message = await tools["categorize"].ainvoke(call)
+            assert isinstance(message, ToolMessage)
+            assert "groceries" in message.content
+            result = await executor.run(categorize, ToolExecution.PROCESS, args, 5)
+            assert result["pid"] != os.getpid()
+            assert len(result["categories"]) == 2000
+
+            with pytest.raises(ValueError, match="bad transactions"):
+                args = {"transactions": [], "fail": True}
+                await executor.run(categorize, ToolExecution.PROCESS, args, 5)
+        finally:
+            await executor.close()
+
+    async def test_deadline_and_cancellation(self):
+        """Overrunning and cancelled calls are interrupted; the worker is reused."""
+        executor, _ = await start(forecast)
+        restarts = TOOL_WORKER_RESTARTS.value()
+        try:
+            pid = await executor.run(forecast, ToolExecution.PROCESS, {"seconds": 0}, 1)
+            with pytest.raises(ToolTimeout):
+                await executor.run(forecast, ToolExecution.PROCESS, {"seconds": 5}, 0.2)
+            assert TOOL_RUNS.value(mode="process", outcome="timeout") >= 1
+
+            # The event loop keeps running while the worker spins
+            run = asyncio.create_task(
+                executor.run(forecast, ToolExecution.PROCESS, {"seconds": 5}, None)
+            )
+            started = time.perf_counter()
+            await asyncio.sleep(0.2)
+            assert time.perf_counter() - started < 0.5
+            run.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await run
+
+            again = await executor.run(forecast, ToolExecution.PROCESS, {"seconds": 0}, 1)
+            assert again == pid
+            assert TOOL_WORKER_RESTARTS.value() == restarts
+        finally:
+            await executor.close()
+
+
+class TestThreadAndInlineTools:
+    """Test tools running in the thread pool and in the event loop."""
+
+    async def test_modes(self):
+        """Declared tools run where declared; undeclared ones are left as they are."""
+        executor, tools = await start(lookup, balance, undeclared)
+        try:
+            assert tools[None] is undeclared
+            assert "on tool" in await tools["lookup"].ainvoke({"account": "a"})
+            assert await tools["balance"].ainvoke({}) == threading.current_thread().name
+            assert not executor._modules
+        finally:
+            await executor.close()
+
+    async def test_side_effect_free_survives_wrapping(self):
+        """Eager runs still pick up tools marked before they were wrapped."""
+        executor = ToolExecutor()
+        (tool,) = EagerTools(executor.wrap([lookup])).tools
+        assert type(tool).__name__ == "EagerTool"
+        await executor.close()
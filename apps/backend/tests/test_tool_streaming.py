@@ -0,0 +1,147 @@
+import asyncio
+import time
+from typing import Any
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+
+from fake_model import FakeStreamingChatModel
+from prompting import build_agent
+from tests.conftest import receive_turn
+from tool_streaming import EAGER_TOOL_RUNS, EagerTools, ToolCallAssembler, side_effect_free
+
+# When the model finished streaming, and when the tool started, per call
+model_ended: list[float] = []
+tool_started: list[float] = []
+
+
+class TimedModel(FakeStreamingChatModel):
+    async def _astream(self, *args: Any, **kwargs: Any):
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+        model_ended.append(time.perf_counter())
+
+
+@side_effect_free
+async def get_transactions() -> dict[str, Any]:
+    """Get financial transactions."""
+    tool_started.append(time.perf_counter())
+    await asyncio.sleep(0.05)
+    return {"data": [{"id": "1", "amount": "-10.99"}]}
+
+
+@pytest.fixture
+def tool_frames(agent_client):
+    """Frames of a turn whose tool arguments stream a character at a time, START excluded."""
+
+    def run(eager: EagerTools | None) -> list[dict]:
+        model = TimedModel(token_delay=0.05, tool_args_chunk_size=1)
+        tools = eager.tools if eager is not None else [get_transactions]
+        agent = build_agent(model, tools, "You are a helpful financial assistant.", MemorySaver())
+        client = agent_client(agent=agent, eager_tools=eager)
+        with client.websocket_connect("/ws") as websocket:
+            start, *frames, end = receive_turn(websocket, "Show my transactions")
+        assert (start["type"], end["type"]) == ("start", "end")
+        return frames
+
+    return run
+
+
+class TestToolCallAssembler:
+    """Test assembling tool calls from their chunks."""
+
+    def test_interleaved_calls(self):
+        """Calls complete once their arguments parse, each from its own chunks."""
+        calls = ToolCallAssembler()
+        a, args = calls.push("m1", {"id": "a", "name": "lookup", "args": '{"q": ', "index": 0})
+        assert (a.name, args) == ("lookup", None)
+        calls.push("m1", {"id": "b", "name": "lookup", "args": '{"q": "x', "index": 1})
+        a, args = calls.push("m1", {"id": None, "name": None, "args": '"y"}', "index": 0})
+        assert (a.id, args) == ("a", {"q": "y"})
+        # Completed calls are not completed again
+        assert calls.push("m1", {"id": None, "name": None, "args": " ", "index": 0})[1] is None
+
+        (b,) = calls.unsent()
+        assert (b.id, b.parsed_args()) == ("b", {"q": "x"})
+        assert calls.unsent() == []
+
+    def test_messages_are_separate(self):
+        """The same index in a later model message is a new call."""
+        calls = ToolCallAssembler()
+        calls.push("m1", {"id": "a", "name": "lookup", "args": "{}", "index": 0})
+        b, args = calls.push("m2", {"id": "b", "name": "lookup", "args": "{}", "index": 0})
+        assert (b.id, args) == ("b", {})
+
+
+class TestToolCallFrames:
+    """Test the tool call frames of a turn."""
+
+    def test_deltas_then_call(self, tool_frames):
+        """The name goes out with the first chunk; the call once its arguments are complete."""
+        frames = tool_frames(None)
+        types = [f["type"] for f in frames]
+        assert types[:4] == ["tool_call_delta", "tool_call_delta", "tool_call", "tool_result"]
+        first, second, call, result = frames[:4]
+        assert (first["tool_name"], first["args_delta"], second["args_delta"]) == (
+            "get_transactions",
+            "{",
+            "}",
+        )
+        assert first["tool_call_id"] == call["tool_call_id"] == result["tool_call_id"]
+        assert call["tool_args"] == {}
+
+
+class TestEagerTools:
+    """Test running side-effect-free tools before the model finishes."""
+
+    def test_runs_once_before_model_ends(self, tool_frames):
+        """The tool starts while the model streams, and the graph uses its result."""
+        model_ended.clear()
+        tool_started.clear()
+        used = EAGER_TOOL_RUNS.value(result="used")
+        frames = tool_frames(EagerTools([get_transactions]))
+        (result,) = [f for f in frames if f["type"] == "tool_result"]
+        assert result["result"]["data"][0]["id"] == "1"
+        assert len(tool_started) == 1
+        assert tool_started[0] < model_ended[0]
+        assert EAGER_TOOL_RUNS.value(result="used") == used + 1
+
+    def test_only_marked_tools(self):
+        """Unmarked tools are neither wrapped nor started."""
+
+        def lookup() -> str:
+            """Look something up."""
+            return "x"
+
+        eager = EagerTools([lookup])
+        assert eager.tools == [lookup]
+        assert not eager.start("t1", "call-1", "lookup", {}, [])
+
+    def test_sync_run(self):
+        """Wrapped tools still run synchronously, by their wrapped tool."""
+
+        @side_effect_free
+        def lookup(query: str) -> str:
+            """Look something up."""
+            return query.upper()
+
+        (tool,) = EagerTools([lookup]).tools
+        assert tool.run({"query": "rent"}) == "RENT"
+        call = {"type": "tool_call", "id": "call-1", "name": "lookup", "args": {"query": "tax"}}
+        assert tool.invoke(call).content == "TAX"
+
+    async def test_claims(self):
+        """Runs are claimed with matching arguments only; unclaimed ones are cancelled."""
+        eager = EagerTools([get_transactions])
+        assert eager.start("t1", "call-1", "get_transactions", {}, [])
+        assert eager.claim("t1", "call-1", {"q": 1}) is None
+        assert eager.start("t1", "call-2", "get_transactions", {}, [])
+        message = await eager.claim("t1", "call-2", {})
+        assert (message.tool_call_id, message.name) == ("call-2", "get_transactions")
+        assert eager.claim("t1", "call-2", {}) is None
+
+        eager.start("t1", "call-3", "get_transactions", {}, [])
+        (run,) = [run for _, run in eager._runs["t1"].values()]
+        eager.discard("t1")
+        await asyncio.sleep(0)
+        assert run.cancelled()
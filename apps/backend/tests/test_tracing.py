@@ -0,0 +1,171 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+
+from accounting import TimedCheckpointer
+from agent import get_transactions
+from fake_model import FakeStreamingChatModel
+from tests.conftest import receive_turn
+from tracing import (
+    SPANS_DROPPED,
+    BatchSpanProcessor,
+    FileSpanExporter,
+    OTLPHttpSpanExporter,
+    Span,
+    SpanExporter,
+    Tracer,
+)
+
+
+class ListExporter(SpanExporter):
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+
+    def export(self, spans: list[Span]) -> None:
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def run_turns(agent_client):
+    """Run turns of one session traced by ``tracer``; their frames, ENDs and ERRORs excluded."""
+
+    def run(tracer: Tracer, *messages: str, model: FakeStreamingChatModel | None = None):
+        client = agent_client(
+            model=model,
+            tools=[get_transactions],
+            checkpointer=TimedCheckpointer(MemorySaver()),
+            tracer=tracer,
+        )
+        frames = []
+        with client.websocket_connect("/ws") as websocket:
+            for message in messages:
+                frames.extend(receive_turn(websocket, message)[:-1])
+        tracer.close()
+        return frames
+
+    return run
+
+
+class TestTurnTraces:
+    """Test the spans recorded for turns over the websocket endpoint."""
+
+    def test_turn_spans(self, run_turns):
+        """A tool-calling turn is one trace covering nodes, calls, checkpoints and sends."""
+        exporter = ListExporter()
+        frames = run_turns(Tracer(BatchSpanProcessor(exporter)), "Show my transactions")
+        spans = exporter.spans
+        by_id = {span.span_id: span for span in spans}
+        (root,) = [span for span in spans if span.parent_id is None]
+        assert root.name == "agent.turn"
+        assert root.attributes["turn.status"] == "ok"
+        assert root.attributes["turn.priority"] == "interactive"
+        assert all(span.trace_id == root.trace_id for span in spans)
+        assert all(span.parent_id in by_id for span in spans if span is not root)
+        assert all(span.end_ns >= span.start_ns for span in spans)
+
+        names = [span.name for span in spans]
+        assert names.count("node agent") == 2
+        assert names.count("node tools") == 1
+        assert names.count("chat fake-streaming") == 2
+        assert "scheduler.queue" in names
+        assert "checkpoint.get" in names
+        assert "checkpoint.put" in names
+
+        # Model and tool calls nest under their graph nodes
+        (tool,) = [span for span in spans if span.name == "tool get_transactions"]
+        assert by_id[tool.parent_id].name == "node tools"
+        (call,) = [frame for frame in frames if frame["type"] == "tool_call"]
+        assert tool.attributes["tool.call_id"] == call["tool_call_id"]
+        chat = next(span for span in spans if span.name == "chat fake-streaming")
+        assert by_id[chat.parent_id].name == "node agent"
+        assert [event[1] for event in chat.events] == ["first_token"]
+
+        # Sends are one span per frame type
+        (deltas,) = [span for span in spans if span.name == "ws.send content_delta"]
+        content = [frame for frame in frames if frame["type"] == "content_delta"]
+        assert deltas.attributes["ws.frames"] == len(content)
+        assert "ws.send end" in names
+
+    def test_sampling(self, run_turns):
+        """Unsampled turns record nothing, unless they fail with tail sampling on."""
+        exporter = ListExporter()
+        run_turns(Tracer(BatchSpanProcessor(exporter), sample_rate=0.0), "Hello")
+        assert exporter.spans == []
+
+        exporter = ListExporter()
+        tracer = Tracer(BatchSpanProcessor(exporter), sample_rate=0.0, slow_threshold=60)
+        run_turns(tracer, "Hello", "Hello")
+        assert exporter.spans == []
+
+        exporter = ListExporter()
+        tracer = Tracer(BatchSpanProcessor(exporter), sample_rate=0.0, slow_threshold=60)
+        run_turns(tracer, "Hello", model=FakeStreamingChatModel(error_rate=1.0))
+        (root,) = [span for span in exporter.spans if span.parent_id is None]
+        assert root.attributes["turn.status"] == "error"
+        assert root.status == 2
+
+
+class TestExport:
+    """Test batching and the OTLP/JSON exporters."""
+
+    def test_full_queue_drops_whole_traces(self):
+        """Traces that do not fit the queue are dropped and counted, not split."""
+        processor = BatchSpanProcessor(ListExporter(), max_queue=3, flush_interval=60)
+        dropped = SPANS_DROPPED.value()
+        spans = [Span("t", None, f"span {n}") for n in range(4)]
+        processor.submit(spans[:2])
+        processor.submit(spans[2:])
+        assert SPANS_DROPPED.value() == dropped + 2
+        processor.close()
+        assert [span.name for span in processor.exporter.spans] == ["span 0", "span 1"]
+
+    def test_file_exporter(self, tmp_path):
+        """Batches are appended as OTLP/JSON documents, one per line."""
+        path = tmp_path / "spans.jsonl"
+        span = Span("0" * 32, None, "agent.turn", attributes={"n": 1, "ok": True})
+        span.end()
+        processor = BatchSpanProcessor(FileSpanExporter(str(path)))
+        processor.submit([span])
+        processor.close()
+        (line,) = path.read_text().splitlines()
+        (resource,) = json.loads(line)["resourceSpans"]
+        (exported,) = resource["scopeSpans"][0]["spans"]
+        assert exported["name"] == "agent.turn"
+        assert exported["spanId"] == span.span_id
+        assert exported["attributes"] == [
+            {"key": "n", "value": {"intValue": "1"}},
+            {"key": "ok", "value": {"boolValue": True}},
+        ]
+
+    def test_otlp_http_exporter(self):
+        """Spans are posted to the collector's /v1/traces."""
+        received = []
+
+        class Collector(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                received.append((self.path, json.loads(body)))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Collector)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            span = Span("0" * 32, None, "agent.turn")
+            span.end()
+            processor = BatchSpanProcessor(
+                OTLPHttpSpanExporter(f"http://127.0.0.1:{server.server_port}")
+            )
+            processor.submit([span])
+            processor.close()
+        finally:
+            server.shutdown()
+        ((path, document),) = received
+        assert path == "/v1/traces"
+        assert document["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["name"] == "agent.turn"
@@ -0,0 +1,212 @@
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from agent import SYSTEM_PROMPT, get_transactions
+from config import Settings
+from diagnostics import require_token
+from fake_model import FakeStreamingChatModel
+from prompting import MEMORIES_PREAMBLE, build_agent
+from tests.conftest import receive_turn
+from user_memory import (
+    MEMORIES_EVICTED,
+    USER_IDENTITIES_REJECTED,
+    Fact,
+    FactExtractor,
+    UserMemoryStore,
+    sign_user_id,
+    user_memory_from_settings,
+)
+
+TOKEN = "s3cret"
+SECRET = "signing-key"
+
+
+@pytest.fixture
+def memory_client(agent_client):
+    """Clients of an agent that recalls ``memory``, with its admin endpoint; and its saver."""
+
+    def build(memory: UserMemoryStore) -> tuple[TestClient, MemorySaver]:
+        saver = MemorySaver()
+        agent = build_agent(
+            FakeStreamingChatModel(), [get_transactions], SYSTEM_PROMPT, saver, user_memories=True
+        )
+        route = Route(
+            "/admin/users/{user_id}/memories",
+            require_token(TOKEN, memory.memories_endpoint),
+            methods=["GET", "DELETE"],
+        )
+        return agent_client(agent=agent, user_memory=memory, routes=[route]), saver
+
+    return build
+
+
+def answer(client: TestClient, user: str | None, *messages: str, header: str = "") -> str:
+    """The answer to the last of ``messages``, sent in a new session of ``user``.
+
+    ``header`` is sent as ``x-user-id`` instead of ``user`` signed with ``SECRET``.
+    """
+    headers = {"x-user-id": header or sign_user_id(user, SECRET)} if header or user else {}
+    with client.websocket_connect("/ws", headers=headers) as websocket:
+        for message in messages:
+            frames = receive_turn(websocket, message)
+    return "".join(frame["delta"] for frame in frames if frame["type"] == "content_delta")
+
+
+def fact(key: str, text: str) -> Fact:
+    return Fact("preference", key, text)
+
+
+class TestFactExtractor:
+    """Test picking facts out of users' messages."""
+
+    def test_statements_about_the_user(self):
+        """Names and preferences are kept, in the third person; questions are not."""
+        facts = FactExtractor().facts(
+            "Hi, my name is ada. I prefer weekly summaries of my spending! "
+            "My favourite shop is the corner bakery. Do I like coffee?"
+        )
+        assert [(f.kind, f.text) for f in facts] == [
+            ("name", "The user's name is Ada."),
+            ("preference", "The user prefers weekly summaries of their spending."),
+            ("preference", "The user's favorite shop is the corner bakery."),
+        ]
+        assert FactExtractor().facts("What is my name?") == []
+
+
+class TestUserMemoryStore:
+    """Test indexing and retrieving facts about users."""
+
+    def test_relevant_facts_first(self):
+        """Facts sharing words, or forms of them, with the message rank first."""
+        store = UserMemoryStore(k=2, min_score=0.1)
+        store.add("u1", Fact("name", "name", "The user's name is Ada."))
+        store.add("u1", fact("p1", "The user prefers weekly budgeting reports."))
+        store.add("u1", fact("p2", "The user hates overdraft fees."))
+        store.add("u2", fact("p1", "The user prefers monthly budgets."))
+
+        assert [m.key for m in store.search("u1", "How is my budget looking?")] == ["p1"]
+        assert [m.key for m in store.search("u1", "What is my name?")] == ["name"]
+        assert store.search("u1", "Tell me a joke") == []
+        assert store.search("u3", "budget") == []
+
+    def test_replaced_and_evicted(self):
+        """A fact replaces the one with its key; the least recently used go first."""
+        store = UserMemoryStore(max_per_user=2, max_memories=3)
+        assert store.add("u1", fact("p1", "The user likes tea."))
+        assert not store.add("u1", fact("p1", "The user likes tea."))
+        assert store.add("u1", fact("p1", "The user likes coffee."))
+        store.add("u1", fact("p2", "The user likes savings goals."))
+        store.search("u1", "coffee")
+        evicted = MEMORIES_EVICTED.value(reason="user")
+        store.add("u1", fact("p3", "The user likes charts."))
+        assert [m.key for m in store.facts_of("u1")] == ["p1", "p3"]
+        assert MEMORIES_EVICTED.value(reason="user") == evicted + 1
+
+        store.add("u2", fact("p1", "The user likes tea."))
+        store.add("u2", fact("p2", "The user likes cash."))
+        assert store.count == 3
+        assert [m.key for m in store.facts_of("u1")] == ["p3"]
+        assert store.document_frequency["tea"] == 1
+
+    async def test_recurring_requests(self):
+        """A request made again is remembered, whatever the order of its words."""
+        store = UserMemoryStore(recurring_after=2)
+        assert await store.remember("u1", "Show my transactions from March") == []
+        (learned,) = await store.remember("u1", "transactions from March, show my")
+        assert learned.kind == "recurring"
+        assert await store.recall("u1", "March transactions") == (learned.text,)
+        assert await store.remember("u1", "Show my transactions from March") == []
+
+    async def test_journal_shared_by_workers(self, tmp_path):
+        """Facts learned by one worker are recalled by another, and forgotten by both."""
+        path = str(tmp_path / "memories.jsonl")
+        first, second = UserMemoryStore(path), UserMemoryStore(path)
+        await first.remember("u1", "Call me Grace. I love travel rewards.")
+        assert await second.recall("u1", "Which rewards?") == ("The user loves travel rewards.",)
+        assert await second.forget_user("u1") == 2
+        assert await first.recall("u1", "Which rewards?") == ()
+
+        with open(path, "a") as f:
+            f.write('{"op": "add", "user": "u2"')
+        restarted = UserMemoryStore(path)
+        await restarted.refresh()
+        assert restarted.count == 0
+
+    async def test_forgotten_in_the_journal(self, tmp_path):
+        """Forgetting a user rewrites the journal without their facts; workers follow."""
+        path = str(tmp_path / "memories.jsonl")
+        first, second = UserMemoryStore(path), UserMemoryStore(path)
+        await first.remember("u1", "Call me Grace. I love travel rewards.")
+        await first.remember("u2", "My name is Alan.")
+        assert await second.recall("u1", "Which rewards?")
+        assert await second.forget_user("u1") == 2
+
+        with open(path) as f:
+            journal = f.read()
+        assert "Grace" not in journal
+        assert "travel" not in journal
+        assert "Alan" in journal
+        assert await first.recall("u1", "Which rewards?") == ()
+        assert await first.recall("u2", "What is my name?") == ("The user's name is Alan.",)
+        await first.remember("u1", "My name is Ada.")
+        assert await second.recall("u1", "What is my name?") == ("The user's name is Ada.",)
+        assert await UserMemoryStore(path).recall("u1", "What is my name?") == (
+            "The user's name is Ada.",
+        )
+
+    def test_configured_from_settings(self):
+        """User memory is off by default, and cannot be turned on without a secret."""
+        assert user_memory_from_settings(Settings(openai_api_key="test")) is None
+        with pytest.raises(ValueError, match="USER_MEMORY_SECRET"):
+            user_memory_from_settings(Settings(openai_api_key="test", user_memory=True))
+        config = Settings(openai_api_key="test", user_memory=True, user_memory_secret=SECRET)
+        assert user_memory_from_settings(config).secret == SECRET
+
+
+class TestCrossSession:
+    """Test users' facts carrying over to their new sessions."""
+
+    def test_remembered_in_a_new_session(self, memory_client):
+        """A returning user's name is recalled; other users' and anonymous sessions
+        do not see it, and it is not stored in the thread."""
+        memory = UserMemoryStore(secret=SECRET)
+        client, saver = memory_client(memory)
+        answer(client, "ada", "My name is Ada")
+
+        assert "Ada" in answer(client, "ada", "What is my name?")
+        assert "Ada" not in answer(client, "bob", "What is my name?")
+        assert "Ada" not in answer(client, None, "My name is Ada", "Hello")
+        assert "Ada" not in answer(client, None, "What is my name?")
+        for checkpoint in saver.list(None):
+            for message in checkpoint.checkpoint["channel_values"].get("messages", []):
+                assert MEMORIES_PREAMBLE not in str(message.content)
+
+    def test_unsigned_users(self, memory_client):
+        """A user id not signed with the secret identifies nobody."""
+        memory = UserMemoryStore(secret=SECRET)
+        client, _ = memory_client(memory)
+        answer(client, "ada", "My name is Ada")
+        rejected = USER_IDENTITIES_REJECTED.value()
+        forged = sign_user_id("ada", "guessed")
+        for header in ("ada", forged, f"{forged[:-1]}0", ".", sign_user_id("ada", SECRET)[3:]):
+            assert "Ada" not in answer(client, None, "What is my name?", header=header)
+        assert USER_IDENTITIES_REJECTED.value() == rejected + 5
+        assert memory.facts_of("ada") and len(memory.users) == 1
+
+        unsigned, _ = memory_client(UserMemoryStore())
+        answer(unsigned, None, "My name is Ada", header="ada")
+        assert "Ada" not in answer(unsigned, None, "What is my name?", header="ada")
+
+    def test_admin_endpoint(self, memory_client):
+        """Admins can see and delete what is known about a user."""
+        memory = UserMemoryStore(secret=SECRET)
+        client, _ = memory_client(memory)
+        answer(client, "ada", "My name is Ada")
+        auth = {"Authorization": f"Bearer {TOKEN}"}
+        assert client.get("/admin/users/ada/memories").status_code == 401
+        facts = client.get("/admin/users/ada/memories", headers=auth).json()["facts"]
+        assert facts == [{"kind": "name", "key": "name", "text": "The user's name is Ada."}]
+        assert client.delete("/admin/users/ada/memories", headers=auth).json()["forgotten"] == 1
+        assert "Ada" not in answer(client, "ada", "What is my name?")
@@ -0,0 +1,430 @@
+"""Where tools run: in the event loop, in a thread pool, or in a pool of warm processes.
+
+A tool's function declares its mode with ``runs_in``; ``ToolExecutor.wrap`` turns the
+declared ones into tools that run there, and leaves the others to LangChain, which runs
+sync functions in the default thread executor.
+
+- ``inline``: called in the event loop. For cheap tools, which then skip the thread hop;
+  only async ones can be stopped at their deadline.
+- ``thread``: a bounded thread pool. For tools that wait on blocking I/O or release the
+  GIL. A deadline only stops waiting for the thread; the call runs to its end.
+- ``process``: a pool of worker processes, started with the server and importing the
+  tools' modules up front. For CPU-bound tools, which would otherwise hold the GIL and
+  stall every socket of the worker. Functions must be sync, defined at module level,
+  and take and return picklable values.
+
+Calls to a worker process and their results are pickled over a pipe; those larger than
+``shm_threshold`` go through a shared memory segment instead, so that the event loop
+never blocks writing to, or reading from, a full pipe. A deadline interrupts the tool
+inside the worker with a timer signal; cancelling the call (the turn ended, or the
+client went away) interrupts it with ``SIGINT``. A worker that does not answer either
+within ``grace`` seconds is killed and replaced.
+"""
+
+import asyncio
+import contextvars
+import functools
+import importlib
+import inspect
+import logging
+import multiprocessing
+import os
+import pickle
+import signal
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from enum import StrEnum
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+from langchain_core.tools import BaseTool, StructuredTool
+from langchain_core.tools import tool as create_tool
+
+from metrics import Counter
+
+logger = logging.getLogger("uvicorn")
+
+TOOL_RUNS = Counter(
+    "tool_runs_total", "Tool runs by execution mode and outcome", ["mode", "outcome"]
+)
+TOOL_WORKER_RESTARTS = Counter(
+    "tool_worker_restarts_total", "Tool worker processes replaced after a crash or kill"
+)
+
+_READY = b"ready"
+
+
+class ToolExecution(StrEnum):
+    INLINE = "inline"
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+class ToolTimeout(TimeoutError):
+    """A tool did not finish before its deadline."""
+
+
+def runs_in(mode: ToolExecution, timeout: float | None = None) -> Callable[[Callable], Callable]:
+    """Declare where a tool function runs, and its deadline if not the executor's."""
+
+    def declare(fn: Callable) -> Callable:
+        if mode == ToolExecution.PROCESS and inspect.iscoroutinefunction(fn):
+            raise ValueError(f"{fn.__name__}: only sync functions can run in a process")
+        fn.tool_execution = mode
+        fn.tool_timeout = timeout
+        return fn
+
+    return declare
+
+
+# Payloads: pickles sent inline, or the name and size of the segment holding them
+
+
+def _pack(value: Any, shm_threshold: int) -> bytes:
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) <= shm_threshold:
+        return pickle.dumps(("inline", data))
+    segment = SharedMemory(create=True, size=len(data))
+    segment.buf[: len(data)] = data
+    segment.close()
+    return pickle.dumps(("shm", segment.name, len(data)))
+
+
+def _unpack(message: bytes) -> Any:
+    kind, *payload = pickle.loads(message)
+    if kind == "inline":
+        return pickle.loads(payload[0])
+    name, size = payload
+    # The receiver owns the segment
+    segment = SharedMemory(name=name)
+    try:
+        with segment.buf[:size] as data:
+            return pickle.loads(data)
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def _discard(message: bytes) -> None:
+    """Free the segment of a message that will not be read."""
+    kind, *payload = pickle.loads(message)
+    if kind == "shm":
+        try:
+            segment = SharedMemory(name=payload[0])
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+
+# Worker processes
+
+
+class _Interrupted(BaseException):
+    """Raised in a worker's tool by a signal; not caught by the tool's ``except Exception``."""
+
+    def __init__(self, outcome: str) -> None:
+        self.outcome = outcome
+
+
+_running = False
+
+
+def _interrupt(signum: int, _frame: Any) -> None:
+    # Signals arriving between calls are ignored
+    if _running:
+        raise _Interrupted("timeout" if signum == signal.SIGALRM else "cancelled")
+
+
+def _serve(conn: Connection, modules: Sequence[str], shm_threshold: int) -> None:
+    """A worker process's loop: run calls one at a time until the pipe closes."""
+    global _running
+    signal.signal(signal.SIGINT, _interrupt)
+    signal.signal(signal.SIGALRM, _interrupt)
+    for module in modules:
+        importlib.import_module(module)
+    conn.send_bytes(_READY)
+    while True:
+        try:
+            message = conn.recv_bytes()
+        except (EOFError, OSError):
+            return
+        try:
+            fn, kwargs, timeout = _unpack(message)
+            _running = True
+            try:
+                if timeout:
+                    signal.setitimer(signal.ITIMER_REAL, timeout)
+                reply = ("ok", fn(**kwargs))
+            finally:
+                _running = False
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        except _Interrupted as e:
+            reply = (e.outcome, None)
+        except Exception as e:
+            reply = ("error", e)
+        try:
+            conn.send_bytes(_pack(reply, shm_threshold))
+        except Exception as e:
+            # The result, or the exception, does not pickle
+            conn.send_bytes(_pack(("error", RuntimeError(f"Unpicklable tool result: {e}")), 0))
+
+
+async def _pack_in_thread(value: Any, shm_threshold: int) -> bytes:
+    """``_pack`` in a thread, which lets the event loop run between GIL switches."""
+    packing = asyncio.ensure_future(asyncio.to_thread(_pack, value, shm_threshold))
+    try:
+        return await asyncio.shield(packing)
+    except asyncio.CancelledError:
+        packing.add_done_callback(lambda task: task.exception() or _discard(task.result()))
+        raise
+
+
+async def _receive(conn: Connection) -> bytes:
+    """The next message on the pipe, waited for without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    while not conn.poll():
+        readable = loop.create_future()
+        loop.add_reader(
+            conn.fileno(), lambda ready=readable: ready.done() or ready.set_result(None)
+        )
+        try:
+            await readable
+        finally:
+            loop.remove_reader(conn.fileno())
+    return conn.recv_bytes()
+
+
+class _Worker:
+    def __init__(self, modules: Sequence[str], shm_threshold: int) -> None:
+        context = multiprocessing.get_context("spawn")
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_serve, args=(child, modules, shm_threshold), name="tool-worker", daemon=True
+        )
+        self.process.start()
+        child.close()
+        # The message in flight, freed if the worker dies before reading it
+        self.request: bytes | None = None
+
+    async def ready(self) -> None:
+        if await _receive(self.conn) != _READY:
+            raise RuntimeError("Tool worker failed to start")
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        if self.request is not None:
+            _discard(self.request)
+
+
+class ProcessPool:
+    """Warm worker processes, each running one tool call at a time."""
+
+    def __init__(
+        self,
+        workers: int,
+        modules: Sequence[str] = (),
+        shm_threshold: int = 32 * 1024,
+        grace: float = 1.0,
+    ) -> None:
+        self.workers = workers
+        self.modules = tuple(modules)
+        self.shm_threshold = shm_threshold
+        self.grace = grace
+        self._idle: asyncio.Queue[_Worker] = asyncio.Queue()
+        self._all: set[_Worker] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _spawn(self) -> _Worker:
+        # Starting a process blocks while it is forked and sent its arguments
+        worker = await asyncio.to_thread(_Worker, self.modules, self.shm_threshold)
+        self._all.add(worker)
+        try:
+            await worker.ready()
+        except BaseException:
+            self._retire(worker)
+            raise
+        return worker
+
+    def _retire(self, worker: _Worker) -> None:
+        self._all.discard(worker)
+        worker.kill()
+
+    async def start(self) -> None:
+        """Start the workers and wait for them to import the tools' modules."""
+        for worker in await asyncio.gather(*(self._spawn() for _ in range(self.workers))):
+            self._idle.put_nowait(worker)
+
+    def _background(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _replace(self, worker: _Worker) -> None:
+        await asyncio.to_thread(self._retire, worker)
+        TOOL_WORKER_RESTARTS.inc()
+        self._idle.put_nowait(await self._spawn())
+
+    async def _recover(self, worker: _Worker) -> None:
+        """Wait for an interrupted worker's answer, then reuse it, or replace it."""
+        try:
+            message = await asyncio.wait_for(_receive(worker.conn), self.grace)
+        except (TimeoutError, EOFError, OSError):
+            await self._replace(worker)
+            return
+        worker.request = None
+        _discard(message)
+        self._idle.put_nowait(worker)
+
+    async def run(self, fn: Callable, kwargs: dict[str, Any], timeout: float | None) -> Any:
+        """Call ``fn(**kwargs)`` in a worker; raises ``ToolTimeout`` past ``timeout``."""
+        # Pickling a large call takes a while
+        request = await _pack_in_thread((fn, kwargs, timeout), self.shm_threshold)
+        try:
+            worker = await self._idle.get()
+        except asyncio.CancelledError:
+            _discard(request)
+            raise
+        try:
+            worker.request = request
+            worker.conn.send_bytes(worker.request)
+            reply = await asyncio.wait_for(
+                _receive(worker.conn), timeout + self.grace if timeout else None
+            )
+        except asyncio.CancelledError:
+            # Interrupt the call, and free the worker once it answers
+            os.kill(worker.process.pid, signal.SIGINT)
+            self._background(self._recover(worker))
+            raise
+        except TimeoutError:
+            # The timer did not interrupt the tool (it is stuck outside Python code)
+            self._background(self._replace(worker))
+            raise ToolTimeout(f"Tool did not finish within {timeout}s") from None
+        except (EOFError, OSError):
+            self._background(self._replace(worker))
+            raise RuntimeError("Tool worker exited during the call") from None
+        worker.request = None
+        self._idle.put_nowait(worker)
+
+        outcome, value = await asyncio.to_thread(_unpack, reply)
+        if outcome == "ok":
+            return value
+        if outcome == "error":
+            raise value
+        if outcome == "timeout":
+            raise ToolTimeout(f"Tool did not finish within {timeout}s")
+        raise RuntimeError("Tool run was interrupted")
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for worker in list(self._all):
+            worker.conn.close()
+        for worker in list(self._all):
+            await asyncio.to_thread(worker.process.join, self.grace)
+            if worker.process.is_alive():
+                worker.process.kill()
+        self._all.clear()
+
+
+class ToolExecutor:
+    """Runs tools in the mode they declare, with the pools they share.
+
+    Args:
+        thread_workers: Threads of the pool for ``thread`` tools
+        process_workers: Worker processes for ``process`` tools, started by ``start``
+            only if a wrapped tool runs in one
+        timeout: Deadline of tool calls, in seconds, unless the tool declares its own
+        shm_threshold: Size in bytes above which calls and results to and from worker
+            processes go through shared memory
+        grace: Seconds an interrupted worker process has to answer before it is killed
+    """
+
+    def __init__(
+        self,
+        thread_workers: int = 4,
+        process_workers: int = 2,
+        timeout: float | None = 30.0,
+        shm_threshold: int = 32 * 1024,
+        grace: float = 1.0,
+    ) -> None:
+        self.timeout = timeout
+        self.threads = ThreadPoolExecutor(thread_workers, thread_name_prefix="tool")
+        self.processes = ProcessPool(process_workers, shm_threshold=shm_threshold, grace=grace)
+        self._modules: set[str] = set()
+
+    def wrap(self, tools: Sequence[BaseTool | Callable]) -> list[BaseTool | Callable]:
+        """The tool list with functions that declare a mode wrapped to run in it."""
+        wrapped: list[BaseTool | Callable] = []
+        for tool in tools:
+            mode = getattr(tool, "tool_execution", None)
+            if mode is None or isinstance(tool, BaseTool):
+                wrapped.append(tool)
+                continue
+            if mode == ToolExecution.PROCESS:
+                self._modules.add(tool.__module__)
+            wrapped.append(self._wrap(tool, ToolExecution(mode)))
+        self.processes.modules = tuple(sorted(self._modules))
+        return wrapped
+
+    def _wrap(self, fn: Callable, mode: ToolExecution) -> BaseTool:
+        schema = create_tool(fn)
+        timeout = getattr(fn, "tool_timeout", None) or self.timeout
+
+        async def call(**kwargs: Any) -> Any:
+            return await self.run(fn, mode, kwargs, timeout)
+
+        return StructuredTool(
+            name=schema.name,
+            description=schema.description,
+            args_schema=schema.args_schema,
+            coroutine=call,
+            metadata={"side_effect_free": getattr(fn, "side_effect_free", False)},
+        )
+
+    async def run(
+        self, fn: Callable, mode: ToolExecution, kwargs: dict[str, Any], timeout: float | None
+    ) -> Any:
+        outcome = "error"
+        try:
+            if mode == ToolExecution.PROCESS:
+                result = await self.processes.run(fn, kwargs, timeout)
+            elif mode == ToolExecution.THREAD:
+                loop = asyncio.get_running_loop()
+                context = contextvars.copy_context()
+                call = functools.partial(context.run, fn, **kwargs)
+                result = await asyncio.wait_for(loop.run_in_executor(self.threads, call), timeout)
+            elif inspect.iscoroutinefunction(fn):
+                result = await asyncio.wait_for(fn(**kwargs), timeout)
+            else:
+                result = fn(**kwargs)
+            outcome = "ok"
+            return result
+        except TimeoutError as e:
+            outcome = "timeout"
+            if isinstance(e, ToolTimeout):
+                raise
+            raise ToolTimeout(f"Tool did not finish within {timeout}s") from None
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            TOOL_RUNS.inc(mode=mode, outcome=outcome)
+
+    async def start(self) -> None:
+        """Start the worker processes, if a tool runs in one."""
+        if self._modules:
+            await self.processes.start()
+            logger.info(
+                "Started %d tool worker processes for %s",
+                self.processes.workers,
+                ", ".join(self.processes.modules),
+            )
+
+    async def close(self) -> None:
+        await self.processes.close()
+        self.threads.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,211 @@
+"""Tool calls sent to the client, and run, while the model is still streaming them.
+
+A model streams each tool call as ``tool_call_chunks``: the first carries the call's
+id and name, the following ones pieces of its JSON arguments. ``ToolCallAssembler``
+puts the pieces of each call back together, so that the endpoint can send:
+
+- a ``tool_call_delta`` frame per chunk, the first as soon as the model has chosen the
+  tool, each with the new piece of arguments;
+- the ``tool_call`` frame as soon as the arguments are complete, that is once they
+  parse as a JSON object, rather than when the model's message ends.
+
+With ``EagerTools``, tools marked ``side_effect_free`` also start running as soon as
+their arguments are complete, while the model streams the rest of its message (other
+tool calls, or its finish). When the graph's tool node gets to such a call, it waits
+for the run already in flight instead of calling the tool again. Eager runs can be
+wasted: the model call may still fail, or the tool node may get to the call before the
+endpoint has seen its last chunk, in which case it runs the tool itself. Only mark
+tools that are harmless to run for nothing.
+"""
+
+import asyncio
+import json
+import logging
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForToolRun, Callbacks
+from langchain_core.messages import ToolCallChunk, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
+from langchain_core.tools import tool as create_tool
+from langchain_core.utils.json import parse_partial_json
+from pydantic import Field
+
+from metrics import Counter
+
+logger = logging.getLogger("uvicorn")
+
+EAGER_TOOL_RUNS = Counter(
+    "eager_tool_runs_total", "Tools started before the model finished, by outcome", ["result"]
+)
+
+
+def side_effect_free(fn: Callable) -> Callable:
+    """Mark a tool function as safe to run eagerly, or more often than called."""
+    fn.side_effect_free = True
+    return fn
+
+
+def is_side_effect_free(tool: BaseTool | Callable) -> bool:
+    """Whether the tool, or the function a tool was built from, is marked."""
+    if isinstance(tool, BaseTool):
+        return bool((tool.metadata or {}).get("side_effect_free"))
+    return getattr(tool, "side_effect_free", False)
+
+
+@dataclass(slots=True)
+class StreamedToolCall:
+    id: str | None
+    name: str | None
+    args: str = ""
+    # Whether its tool_call frame was sent
+    sent: bool = False
+
+    def parsed_args(self) -> dict[str, Any]:
+        """The arguments so far, completed as partial JSON."""
+        try:
+            args = parse_partial_json(self.args) if self.args.strip() else {}
+        except ValueError:
+            return {}
+        return args if isinstance(args, dict) else {}
+
+
+def _complete_args(args: str) -> dict[str, Any] | None:
+    # A JSON object is complete once it is closed
+    if not args.rstrip().endswith("}"):
+        return None
+    try:
+        parsed = json.loads(args)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+class ToolCallAssembler:
+    """The tool calls of a turn's streamed model messages, assembled from their chunks."""
+
+    def __init__(self) -> None:
+        self._calls: dict[tuple[str | None, int | str | None], StreamedToolCall] = {}
+
+    def push(
+        self, message_id: str | None, chunk: ToolCallChunk
+    ) -> tuple[StreamedToolCall, dict[str, Any] | None]:
+        """Add a chunk to its call; returns the call, and its arguments if now complete."""
+        index = chunk.get("index")
+        key = (message_id, index if index is not None else chunk.get("id"))
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = StreamedToolCall(chunk.get("id"), chunk.get("name"))
+        call.id = call.id or chunk.get("id")
+        call.name = call.name or chunk.get("name")
+        call.args += chunk.get("args") or ""
+        if call.sent or call.id is None or call.name is None:
+            return call, None
+        args = _complete_args(call.args)
+        if args is not None:
+            call.sent = True
+        return call, args
+
+    def unsent(self) -> list[StreamedToolCall]:
+        """Calls whose arguments never completed, marked as sent."""
+        calls = [c for c in self._calls.values() if not c.sent and c.id and c.name]
+        for call in calls:
+            call.sent = True
+        return calls
+
+
+class EagerTool(BaseTool):
+    """A tool that returns the result of its eager run for the call, if there is one."""
+
+    tool: BaseTool
+    eager: Any = Field(exclude=True)
+
+    def __init__(self, tool: BaseTool, eager: "EagerTools") -> None:
+        super().__init__(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            tool=tool,
+            eager=eager,
+        )
+
+    def _run(
+        self,
+        *args: Any,
+        config: RunnableConfig,
+        run_manager: CallbackManagerForToolRun | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        # Sync runs, e.g. ``run``: nothing runs eagerly outside the event loop
+        callbacks = run_manager.get_child() if run_manager else None
+        return self.tool.invoke(
+            args[0] if args else kwargs, {**(config or {}), "callbacks": callbacks}
+        )
+
+    def invoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        return self.tool.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        if isinstance(input, dict) and input.get("type") == "tool_call":
+            thread_id = (config or {}).get("configurable", {}).get("thread_id")
+            run = self.eager.claim(thread_id, input["id"], input["args"])
+            if run is not None:
+                return await run
+        return await self.tool.ainvoke(input, config, **kwargs)
+
+
+class EagerTools:
+    """Eager runs of side-effect-free tools, per thread and tool call id.
+
+    ``tools`` is the tool list to build the graph with; side-effect-free ones are
+    wrapped to pick up eager runs. The endpoint calls ``start`` when a call's arguments
+    are complete and ``discard`` when its turn ends.
+    """
+
+    def __init__(self, tools: Sequence[BaseTool | Callable]) -> None:
+        self.tools: list[BaseTool | Callable] = []
+        self._eager: dict[str, BaseTool] = {}
+        for tool in tools:
+            if is_side_effect_free(tool):
+                converted = tool if isinstance(tool, BaseTool) else create_tool(tool)
+                self._eager[converted.name] = converted
+                tool = EagerTool(converted, self)
+            self.tools.append(tool)
+        self._runs: dict[str, dict[str, tuple[dict[str, Any], asyncio.Task]]] = {}
+
+    def start(
+        self, thread_id: str, call_id: str, name: str, args: dict[str, Any], callbacks: Callbacks
+    ) -> bool:
+        """Start the call if its tool is side-effect-free; the turn's callbacks see it."""
+        tool = self._eager.get(name)
+        if tool is None:
+            return False
+        call = {"type": "tool_call", "id": call_id, "name": name, "args": args}
+        run = asyncio.create_task(tool.ainvoke(call, {"callbacks": callbacks}))
+        # Retrieve the outcome of runs nobody waits for
+        run.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self._runs.setdefault(thread_id, {})[call_id] = (args, run)
+        return True
+
+    def claim(
+        self, thread_id: str | None, call_id: str, args: dict[str, Any]
+    ) -> asyncio.Task[ToolMessage] | None:
+        """The eager run of the call, if it was started with the same arguments."""
+        runs = self._runs.get(thread_id)
+        started_args, run = runs.pop(call_id, (None, None)) if runs else (None, None)
+        if run is None:
+            return None
+        if started_args != args:
+            run.cancel()
+            EAGER_TOOL_RUNS.inc(result="wasted")
+            return None
+        EAGER_TOOL_RUNS.inc(result="used")
+        return run
+
+    def discard(self, thread_id: str) -> None:
+        """Cancel the thread's runs that were not claimed."""
+        for _, run in self._runs.pop(thread_id, {}).values():
+            run.cancel()
+            EAGER_TOOL_RUNS.inc(result="wasted")
@@ -0,0 +1,500 @@
+"""Traces of agent turns as OpenTelemetry spans, exported as OTLP/JSON.
+
+Each turn is one trace. Its root span covers the turn from the user's message to the
+``end`` frame. Child spans cover:
+
+- waiting for a scheduler slot;
+- the graph and each graph node;
+- each model call, with an event at its first token;
+- each tool call, tagged with its ``tool_call_id``;
+- each checkpointer operation;
+- sends to the client, one span per frame type covering the first to last such send.
+
+``TurnTrace`` collects the spans of one turn in memory. Graph, model and tool spans
+come from callbacks; pass the instance in the run's ``callbacks``. Checkpointer spans
+are attributed through ``TimedCheckpointer`` to the trace started in the current
+context, like checkpoint timings.
+
+Sampling keeps the overhead bounded. ``sample_rate`` of turns are traced; the others
+record nothing. With ``slow_threshold`` set, every turn is recorded, and turns that
+failed or took at least that long are exported even if not sampled.
+
+Finished traces go to ``BatchSpanProcessor``, which hands them to the exporter in
+batches from a background thread, so the event loop never waits on a file or the
+network. When the queue is full, whole traces are dropped and counted. Exporters
+write the OTLP/JSON encoding, either appended to a file one batch per line (as the
+collector's file exporter writes it), or posted to an OTLP/HTTP collector's
+``/v1/traces``.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import ToolMessage
+
+from config import Settings
+from metrics import Counter
+
+if TYPE_CHECKING:
+    # accounting records checkpointer spans through this module
+    from accounting import TokenUsage
+
+logger = logging.getLogger("uvicorn")
+
+SPANS_EXPORTED = Counter("agent_trace_spans_exported_total", "Spans handed to the trace exporter")
+SPANS_DROPPED = Counter(
+    "agent_trace_spans_dropped_total", "Spans dropped on a full queue or failed export"
+)
+
+SERVICE_NAME = "langchain-websocket"
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_trace: ContextVar["TurnTrace | None"] = ContextVar("current_trace", default=None)
+
+
+class Span:
+    """One timed operation in a trace; times are Unix epoch nanoseconds."""
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "kind",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "events",
+        "status",
+        "message",
+    )
+
+    def __init__(
+        self,
+        trace_id: str,
+        parent_id: str | None,
+        name: str,
+        *,
+        kind: int = KIND_INTERNAL,
+        start_ns: int | None = None,
+        attributes: dict[str, Any] | None = None,
+    ) -> None:
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.events: list[tuple[int, str, dict[str, Any]]] = []
+        self.status = 0
+        self.message = ""
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self.events.append((time.time_ns(), name, attributes))
+
+    def end(self, error: BaseException | None = None, end_ns: int | None = None) -> None:
+        self.end_ns = end_ns if end_ns is not None else time.time_ns()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.message = f"{type(error).__name__}: {error}"
+            self.add_event("exception", **{"exception.type": type(error).__name__})
+
+    def to_otlp(self) -> dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _attributes(self.attributes),
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [
+                {"timeUnixNano": str(at), "name": name, "attributes": _attributes(attributes)}
+                for at, name, attributes in self.events
+            ]
+        if self.status:
+            span["status"] = {"code": self.status, "message": self.message}
+        return span
+
+
+def _value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+    return [{"key": k, "value": _value(v)} for k, v in attributes.items() if v is not None]
+
+
+def otlp_document(spans: list[Span], service_name: str = SERVICE_NAME) -> dict[str, Any]:
+    """An OTLP ``ExportTraceServiceRequest`` in its JSON encoding."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _attributes({"service.name": service_name})},
+                "scopeSpans": [
+                    {"scope": {"name": "agent"}, "spans": [span.to_otlp() for span in spans]}
+                ],
+            }
+        ]
+    }
+
+
+class SpanExporter:
+    """Writes batches of finished spans; called from the processor's thread."""
+
+    def export(self, spans: list[Span]) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends one OTLP/JSON document per batch to ``path``."""
+
+    def __init__(self, path: str, service_name: str = SERVICE_NAME) -> None:
+        self.service_name = service_name
+        self._file = open(path, "a", encoding="utf-8")  # noqa: SIM115
+
+    def export(self, spans: list[Span]) -> None:
+        document = otlp_document(spans, self.service_name)
+        self._file.write(json.dumps(document, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def shutdown(self) -> None:
+        self._file.close()
+
+
+class OTLPHttpSpanExporter(SpanExporter):
+    """Posts OTLP/JSON to a collector, e.g. ``http://localhost:4318``."""
+
+    def __init__(
+        self, endpoint: str, *, timeout: float = 10.0, service_name: str = SERVICE_NAME
+    ) -> None:
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+        self.service_name = service_name
+
+    def export(self, spans: list[Span]) -> None:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(otlp_document(spans, self.service_name)).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchSpanProcessor:
+    """Queues finished traces and exports them in batches from a background thread."""
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        *,
+        max_queue: int = 8192,
+        batch_size: int = 512,
+        flush_interval: float = 2.0,
+    ) -> None:
+        self.exporter = exporter
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: deque[Span] = deque()
+        self._ready = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, spans: list[Span]) -> None:
+        """Queue a finished trace, or drop all of it if it does not fit."""
+        with self._ready:
+            if self._closed or len(self._queue) + len(spans) > self.max_queue:
+                SPANS_DROPPED.inc(len(spans))
+                return
+            self._queue.extend(spans)
+            if len(self._queue) >= self.batch_size:
+                self._ready.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._ready:
+                if not self._closed and len(self._queue) < self.batch_size:
+                    self._ready.wait(self.flush_interval)
+                count = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for _ in range(count)]
+                closed = self._closed
+            if batch:
+                try:
+                    self.exporter.export(batch)
+                    SPANS_EXPORTED.inc(len(batch))
+                except Exception as e:
+                    SPANS_DROPPED.inc(len(batch))
+                    logger.warning("Span export failed: %s", e)
+            elif closed:
+                return
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Export what is queued, then stop the thread and the exporter."""
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self._thread.join(timeout)
+        self.exporter.shutdown()
+
+
+class Tracer:
+    """Starts turn traces and decides which of them are exported."""
+
+    def __init__(
+        self,
+        processor: BatchSpanProcessor,
+        *,
+        sample_rate: float = 1.0,
+        slow_threshold: float = 0.0,
+    ) -> None:
+        self.processor = processor
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    def start_turn(self, **attributes: Any) -> "TurnTrace | None":
+        """A trace for a new turn, or ``None`` if the turn is not recorded."""
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_threshold <= 0:
+            return None
+        return TurnTrace(self, sampled, attributes).start()
+
+    def finished(self, trace: "TurnTrace") -> None:
+        seconds = (trace.root.end_ns - trace.root.start_ns) / 1e9
+        failed = trace.root.status == STATUS_ERROR
+        slow = 0 < self.slow_threshold <= seconds
+        if trace.sampled or failed or slow:
+            self.processor.submit(trace.spans)
+
+    def close(self) -> None:
+        self.processor.close()
+
+
+class TurnTrace(AsyncCallbackHandler):
+    """Spans of one turn, under a root ``agent.turn`` span."""
+
+    def __init__(self, tracer: Tracer, sampled: bool, attributes: dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.sampled = sampled
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.root = Span(self.trace_id, None, "agent.turn", kind=KIND_SERVER, attributes=attributes)
+        self.spans = [self.root]
+        # run_id -> open span, or the nearest traced ancestor for untraced runs
+        self._runs: dict[UUID, Span] = {}
+        self._open: set[UUID] = set()
+        # frame type -> span covering its sends
+        self._sends: dict[str, Span] = {}
+        self._token = None
+
+    def start(self) -> "TurnTrace":
+        self._token = _current_trace.set(self)
+        return self
+
+    def span(
+        self, name: str, parent: Span | None = None, *, kind: int = KIND_INTERNAL, **attributes
+    ) -> Span:
+        span = Span(
+            self.trace_id, (parent or self.root).span_id, name, kind=kind, attributes=attributes
+        )
+        self.spans.append(span)
+        return span
+
+    def record(self, name: str, seconds: float, **attributes: Any) -> Span:
+        """A child of the root that ended now, after ``seconds``."""
+        now = time.time_ns()
+        span = self.span(name, **attributes)
+        span.start_ns = now - int(seconds * 1e9)
+        span.end(end_ns=now)
+        return span
+
+    def queued(self, seconds: float) -> None:
+        self.record("scheduler.queue", seconds)
+
+    def sent(self, frame: dict[str, Any], seconds: float) -> None:
+        """Count a send of ``seconds`` into the span of its frame type."""
+        now = time.time_ns()
+        frame_type = frame["type"]
+        if (span := self._sends.get(frame_type)) is None:
+            span = self._sends[frame_type] = self.span(f"ws.send {frame_type}")
+            span.start_ns = now - int(seconds * 1e9)
+            span.attributes["ws.frames"] = 0
+            span.attributes["ws.send_ms"] = 0.0
+        span.attributes["ws.frames"] += 1
+        span.attributes["ws.send_ms"] += seconds * 1000
+        span.end_ns = now
+
+    def finish(
+        self, status: str, error: BaseException | None = None, usage: "TokenUsage | None" = None
+    ) -> None:
+        """End the turn and hand it to the tracer; stop attributing checkpointer spans."""
+        if self._token is not None:
+            _current_trace.reset(self._token)
+            self._token = None
+        for run_id in self._open:
+            self._runs[run_id].end()
+        self.root.attributes["turn.status"] = status
+        if usage is not None:
+            self.root.attributes["gen_ai.usage.input_tokens"] = usage.input_tokens
+            self.root.attributes["gen_ai.usage.output_tokens"] = usage.output_tokens
+        self.root.end(error)
+        self.tracer.finished(self)
+
+    def _start(self, run_id: UUID, parent_run_id: UUID | None, name: str | None, **kw) -> None:
+        parent = self._runs.get(parent_run_id) if parent_run_id is not None else None
+        if name is None:
+            self._runs[run_id] = parent or self.root
+            return
+        self._runs[run_id] = self.span(name, parent, **kw)
+        self._open.add(run_id)
+
+    def _end(self, run_id: UUID, error: BaseException | None = None) -> Span | None:
+        span = self._runs.pop(run_id, None)
+        if run_id not in self._open:
+            return None
+        self._open.discard(run_id)
+        span.end(error)
+        return span
+
+    async def on_chain_start(
+        self,
+        serialized: dict[str, Any],
+        inputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        name = kwargs.get("name")
+        node = (metadata or {}).get("langgraph_node")
+        if parent_run_id is None:
+            self._start(run_id, None, f"graph {name}")
+        elif node is not None and node == name:
+            step = (metadata or {}).get("langgraph_step")
+            self._start(run_id, parent_run_id, f"node {node}", **{"langgraph.step": step})
+        else:
+            self._start(run_id, parent_run_id, None)
+
+    async def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    async def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    async def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs: Any,
+    ) -> None:
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or params.get("_type")
+        self._start(
+            run_id,
+            parent_run_id,
+            f"chat {model}",
+            kind=KIND_CLIENT,
+            **{"gen_ai.request.model": model},
+        )
+
+    async def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._runs.get(run_id)
+        if span is not None and run_id in self._open and not span.events:
+            span.add_event("first_token")
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._end(run_id)
+        if span is None:
+            return
+        try:
+            usage = response.generations[0][0].message.usage_metadata or {}
+        except (AttributeError, IndexError):
+            usage = {}
+        span.attributes["gen_ai.usage.input_tokens"] = usage.get("input_tokens")
+        span.attributes["gen_ai.usage.output_tokens"] = usage.get("output_tokens")
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    async def on_tool_start(
+        self,
+        serialized: dict[str, Any],
+        input_str: str,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs: Any,
+    ) -> None:
+        name = serialized.get("name") or kwargs.get("name")
+        self._start(run_id, parent_run_id, f"tool {name}", **{"tool.name": name})
+
+    async def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._end(run_id)
+        # The call id only reaches callbacks on the tool's result
+        if span is not None and isinstance(output, ToolMessage):
+            span.attributes["tool.call_id"] = output.tool_call_id
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+
+def record_span(name: str, seconds: float, **attributes: Any) -> None:
+    """Record a span of the turn traced in the current context, if any."""
+    if (trace := _current_trace.get()) is not None:
+        trace.record(name, seconds, **attributes)
+
+
+def tracer_from_settings(config: Settings) -> Tracer | None:
+    """The configured tracer, or ``None`` if no exporter is configured."""
+    if config.trace_otlp_endpoint:
+        exporter = OTLPHttpSpanExporter(config.trace_otlp_endpoint)
+    elif config.trace_file:
+        exporter = FileSpanExporter(config.trace_file)
+    else:
+        return None
+    processor = BatchSpanProcessor(
+        exporter,
+        max_queue=config.trace_queue_size,
+        batch_size=config.trace_batch_size,
+        flush_interval=config.trace_flush_interval,
+    )
+    return Tracer(
+        processor,
+        sample_rate=config.trace_sample_rate,
+        slow_threshold=config.trace_slow_turn_threshold,
+    )
@@ -0,0 +1,575 @@
+"""Long-term memory of each user across sessions: facts picked out of their messages,
+retrieved by relevance to each new one.
+
+A session's thread holds one conversation. A user who comes back starts a new thread,
+and carrying over what they said before would mean replaying their old threads into
+the prompt, which grows with their history. Instead, after each turn,
+``FactExtractor`` picks facts out of the user's message:
+
+- ``name``: "my name is Ada", "call me Ada";
+- ``preference``: "I prefer ...", "I don't like ...", "my favourite ... is ...";
+- ``recurring``: a request the user has made ``recurring_after`` times, with the same
+  words in any order.
+
+Questions are not taken as facts ("do I like ...?"). Each fact has a key, and a new
+fact replaces the one with its key: a user has one name. A fact already known is not
+stored again.
+
+``UserMemoryStore`` indexes facts by user. Before a turn, the message is scored against
+its user's facts, and the ``k`` best, scoring at least ``min_score``, are added to the
+prompt (see ``prompting.with_memories``). A score in [0, 1] mixes:
+
+- keywords: the share of the message's words, less stop words, that the fact has,
+  each word weighted by its inverse document frequency over all facts;
+- vectors: the cosine similarity of the words' character trigrams, hashed into
+  ``DIM``-bit vectors, which also matches other forms of a word ("budgets", "budgeting").
+
+Retrieval scans the user's facts, at about a microsecond each, so it costs the same
+however many facts the other users have. Past ``max_per_user`` facts, a user's least
+recently used fact is evicted; past ``max_memories`` in all, the least recently used
+fact of the least recently active user.
+
+Each worker keeps its index in memory. With a ``path``, new facts are appended to a
+journal shared by the workers of a host. Workers read it at startup and read what was
+appended since before each retrieval, so a user's facts follow them to any worker.
+Evictions are not journaled: each worker evicts by its own use. ``forget_user`` deletes
+a user's facts, in the journal too: it is rewritten without the user's records, but for
+a ``forget`` record that carries none of their facts, and replaces the old one. Workers
+see the new file, and read it from the start again, which the ``forget`` record makes
+them apply. Appends and rewrites take a lock on ``<path>.lock``, on POSIX systems.
+
+The user comes from the ``x-user-id`` header (``user_identity``), which must be signed
+with the store's ``secret``: ``<user id>.<HMAC-SHA256 of the user id, in hex>``, as
+``sign_user_id`` makes it. The proxy or service that authenticates users sets it; a
+client cannot name another user without the secret. Connections whose header is
+missing, unsigned or badly signed have no long-term memory.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import hmac
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from operator import itemgetter
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.websockets import WebSocket
+
+try:
+    import fcntl
+except ImportError:
+    # Not POSIX: one worker per journal
+    fcntl = None
+
+from config import Settings
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger("uvicorn")
+
+# Bits of the hashed trigram vectors
+DIM = 1024
+# Header with the signed user id, set by an authenticating proxy
+USER_HEADER = "x-user-id"
+# Longest fact text stored, in characters
+MAX_FACT_CHARS = 200
+# Recent requests counted, over all users, to find recurring ones
+MAX_COUNTED_QUERIES = 100_000
+
+MEMORY_SEARCHES = Histogram(
+    "user_memory_search_seconds",
+    "Time to retrieve a user's memories for a turn",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+MEMORIES = Gauge("user_memories", "Facts about users held by this worker")
+FACTS_LEARNED = Counter(
+    "user_memory_facts_total", "Facts learned from users' messages, by kind", ["kind"]
+)
+MEMORIES_EVICTED = Counter(
+    "user_memories_evicted_total",
+    "Facts evicted to stay within max_per_user (user) or max_memories (total)",
+    ["reason"],
+)
+USER_IDENTITIES_REJECTED = Counter(
+    "user_identities_rejected_total", "x-user-id headers not signed with the secret"
+)
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_SENTENCE_RE = re.compile(r"[^.!?\n]+[.!?\n]*")
+# Words left out of keywords and vectors
+_STOP_WORDS = """
+a about all am an and any are as at be been but by can could did do does doing for from had
+has have how i i'd i'll i'm i've if in into is it it's its just me more most my no not of on
+or our please show so some such than that the their them then there these they this those to
+too us user user's very was we were what when where which who why will with would you your
+"""
+STOP_WORDS = frozenset(_STOP_WORDS.split())
+
+_NAME_RE = re.compile(r"\b(?:my name is|call me)\s+([a-z][\w'-]*)", re.IGNORECASE)
+_FAVORITE_RE = re.compile(r"\bmy favou?rite ([\w' -]+?) is (.+)", re.IGNORECASE)
+_PREFERENCE_RE = re.compile(
+    r"\bI (?:really |usually |always )?(prefer|like|love|hate|dislike|don't like|do not like)"
+    r"\s+(.+)",
+    re.IGNORECASE,
+)
+# The user's words about themselves, as said of them
+_THIRD_PERSON = {
+    "prefer": "prefers",
+    "like": "likes",
+    "love": "loves",
+    "hate": "hates",
+    "dislike": "dislikes",
+    "don't like": "doesn't like",
+    "do not like": "does not like",
+}
+_PRONOUNS = {"i": "they", "me": "them", "my": "their", "mine": "theirs", "myself": "themselves"}
+_PRONOUN_RE = re.compile(r"\b(?:I|me|my|mine|myself)\b", re.IGNORECASE)
+
+
+def keywords(text: str) -> tuple[str, ...]:
+    """The words of ``text`` that tell it apart, lower case and in order, once each."""
+    # Interned, so that a million facts share one copy of each word
+    return tuple(
+        dict.fromkeys(
+            sys.intern(word) for word in _WORD_RE.findall(text.lower()) if word not in STOP_WORDS
+        )
+    )
+
+
+def trigram_vector(words: tuple[str, ...]) -> int:
+    """The character trigrams of ``words``, hashed into the bits of a ``DIM``-bit int."""
+    # hash() differs between processes, but vectors never leave the process
+    vector = 0
+    for word in words:
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vector |= 1 << (hash(padded[i : i + 3]) % DIM)
+    return vector
+
+
+def _about_them(text: str) -> str:
+    return _PRONOUN_RE.sub(lambda m: _PRONOUNS[m.group(0).lower()], text)
+
+
+@dataclass(frozen=True)
+class Fact:
+    """Something a user said about themselves; facts with the same ``key`` replace each other."""
+
+    kind: str
+    key: str
+    text: str
+
+
+class FactExtractor:
+    """Picks facts about the user out of their messages, by pattern."""
+
+    def facts(self, message: str) -> list[Fact]:
+        facts = []
+        for sentence in _SENTENCE_RE.findall(message):
+            if sentence.rstrip().endswith("?"):
+                continue
+            sentence = sentence.strip(" \t.!\n")
+            if match := _NAME_RE.search(sentence):
+                name = match.group(1).capitalize()
+                facts.append(Fact("name", "name", f"The user's name is {name}."))
+            if match := _FAVORITE_RE.search(sentence):
+                thing, value = match.group(1).strip().lower(), _about_them(match.group(2).strip())
+                facts.append(
+                    Fact(
+                        "preference",
+                        f"favorite:{thing}",
+                        f"The user's favorite {thing} is {value}."[:MAX_FACT_CHARS],
+                    )
+                )
+            elif match := _PREFERENCE_RE.search(sentence):
+                verb, what = _THIRD_PERSON[match.group(1).lower()], match.group(2).strip()
+                facts.append(
+                    Fact(
+                        "preference",
+                        f"preference:{' '.join(sorted(keywords(what)))}",
+                        f"The user {verb} {_about_them(what)}."[:MAX_FACT_CHARS],
+                    )
+                )
+        return facts
+
+    def query(self, message: str) -> tuple[str, str] | None:
+        """Key and text of ``message`` as a request that may recur, if it is short enough."""
+        text = " ".join(message.split())
+        words = keywords(text)
+        if not words or len(text) > MAX_FACT_CHARS:
+            return None
+        return " ".join(sorted(words)), text
+
+
+class Memory:
+    """A fact as indexed: its words and trigram vector."""
+
+    __slots__ = ("bits", "key", "keywords", "kind", "text", "vector")
+
+    def __init__(self, fact: Fact) -> None:
+        self.kind = sys.intern(fact.kind)
+        self.key = fact.key
+        self.text = fact.text
+        self.keywords = keywords(fact.text)
+        self.vector = trigram_vector(self.keywords)
+        self.bits = self.vector.bit_count()
+
+
+def sign_user_id(user_id: str, secret: str) -> str:
+    """The ``x-user-id`` header naming ``user_id``, signed with ``secret``."""
+    signature = hmac.new(secret.encode(), user_id.encode(), hashlib.sha256).hexdigest()
+    return f"{user_id}.{signature}"
+
+
+def user_identity(websocket: WebSocket, secret: str | None) -> str | None:
+    """The user of a connection, if its header is signed with ``secret``."""
+    header = websocket.headers.get(USER_HEADER)
+    if not header or not secret:
+        return None
+    user_id, _, signature = header.rpartition(".")
+    expected = sign_user_id(user_id, secret).rpartition(".")[2]
+    if not user_id or not hmac.compare_digest(signature.encode(), expected.encode()):
+        USER_IDENTITIES_REJECTED.inc()
+        return None
+    return user_id
+
+
+class UserMemoryStore:
+    """Facts about each user, indexed for retrieval by relevance to a message."""
+
+    def __init__(
+        self,
+        path: str | None = None,
+        *,
+        secret: str | None = None,
+        k: int = 5,
+        min_score: float = 0.2,
+        max_per_user: int = 1000,
+        max_memories: int = 1_000_000,
+        keyword_weight: float = 0.5,
+        recurring_after: int = 2,
+        extractor: FactExtractor | None = None,
+    ) -> None:
+        self.path = path
+        # Key the x-user-id header is signed with; without it, no user is identified
+        self.secret = secret
+        self.k = k
+        self.min_score = min_score
+        self.max_per_user = max_per_user
+        self.max_memories = max_memories
+        self.keyword_weight = keyword_weight
+        self.recurring_after = recurring_after
+        self.extractor = extractor or FactExtractor()
+        # Users' facts by key; least recently active users and used facts first
+        self.users: OrderedDict[str, OrderedDict[str, Memory]] = OrderedDict()
+        self.count = 0
+        # Facts with each word, over all users
+        self.document_frequency: dict[str, int] = {}
+        # Times each recent request was made by its user, least recent first
+        self._queries: OrderedDict[tuple[str, str], int] = OrderedDict()
+        # Bytes of the journal read so far, and the file they were read from
+        self._offset = 0
+        self._inode: int | None = None
+        self._refresh_lock = asyncio.Lock()
+
+    def add(self, user_id: str, fact: Fact) -> bool:
+        """Index ``fact``, replacing the user's fact with its key; ``False`` if known."""
+        facts = self.users.get(user_id)
+        if facts is None:
+            facts = self.users[user_id] = OrderedDict()
+        self.users.move_to_end(user_id)
+        if (known := facts.get(fact.key)) is not None:
+            facts.move_to_end(fact.key)
+            if known.text == fact.text:
+                return False
+            self._remove(facts, known)
+
+        memory = Memory(fact)
+        facts[fact.key] = memory
+        self.count += 1
+        MEMORIES.inc()
+        for word in memory.keywords:
+            self.document_frequency[word] = self.document_frequency.get(word, 0) + 1
+
+        while len(facts) > self.max_per_user:
+            self._remove(facts, next(iter(facts.values())))
+            MEMORIES_EVICTED.inc(reason="user")
+        while self.count > self.max_memories:
+            self._evict_least_active()
+        return True
+
+    def forget(self, user_id: str) -> int:
+        """Drop everything known about a user; returns the number of facts dropped."""
+        facts = self.users.pop(user_id, None)
+        if facts is None:
+            return 0
+        dropped = len(facts)
+        for memory in list(facts.values()):
+            self._remove(facts, memory)
+        self._queries = OrderedDict((k, n) for k, n in self._queries.items() if k[0] != user_id)
+        return dropped
+
+    def facts_of(self, user_id: str) -> list[Memory]:
+        return list(self.users.get(user_id, {}).values())
+
+    def _remove(self, facts: OrderedDict[str, Memory], memory: Memory) -> None:
+        del facts[memory.key]
+        self.count -= 1
+        MEMORIES.dec()
+        for word in memory.keywords:
+            if (df := self.document_frequency[word] - 1) > 0:
+                self.document_frequency[word] = df
+            else:
+                del self.document_frequency[word]
+
+    def _evict_least_active(self) -> None:
+        user_id, facts = next(iter(self.users.items()))
+        if facts:
+            self._remove(facts, next(iter(facts.values())))
+            MEMORIES_EVICTED.inc(reason="total")
+        if not facts:
+            del self.users[user_id]
+
+    def search(self, user_id: str, query: str, k: int | None = None) -> list[Memory]:
+        """The user's ``k`` facts most relevant to ``query``, best first."""
+        facts = self.users.get(user_id)
+        if not facts:
+            return []
+        words = keywords(query)
+        vector = trigram_vector(words)
+        bits = vector.bit_count()
+        if not bits:
+            return []
+        total = self.count + 1
+        weights = {w: math.log(total / (self.document_frequency.get(w, 0) + 0.5)) for w in words}
+        keyword_scale = self.keyword_weight / sum(weights.values())
+        vector_scale = (1 - self.keyword_weight) / math.sqrt(bits)
+        min_score = self.min_score
+
+        scored = []
+        for memory in facts.values():
+            score = vector_scale * (vector & memory.vector).bit_count() / math.sqrt(memory.bits)
+            for word in memory.keywords:
+                if word in weights:
+                    score += keyword_scale * weights[word]
+            if score >= min_score:
+                scored.append((score, memory))
+        best = [memory for _, memory in heapq.nlargest(k or self.k, scored, key=itemgetter(0))]
+
+        self.users.move_to_end(user_id)
+        for memory in best:
+            facts.move_to_end(memory.key)
+        return best
+
+    def _count_query(self, user_id: str, key: str) -> int:
+        count = self._queries.pop((user_id, key), 0) + 1
+        self._queries[user_id, key] = count
+        if len(self._queries) > MAX_COUNTED_QUERIES:
+            self._queries.popitem(last=False)
+        return count
+
+    async def recall(self, user_id: str, message: str) -> tuple[str, ...]:
+        """Texts of the user's facts to add to the prompt of a turn answering ``message``."""
+        started = time.perf_counter()
+        if self.path is not None:
+            await self.refresh()
+        memories = self.search(user_id, message)
+        MEMORY_SEARCHES.observe(time.perf_counter() - started)
+        return tuple(memory.text for memory in memories)
+
+    async def remember(self, user_id: str, message: str) -> list[Fact]:
+        """Learn the facts in a message of the user's; returns those that were new."""
+        facts = self.extractor.facts(message)
+        query = self.extractor.query(message)
+        if query is not None and self._count_query(user_id, query[0]) == self.recurring_after:
+            key, text = query
+            facts.append(
+                Fact(
+                    "recurring", f"recurring:{key}", f"The user often asks: {text}"[:MAX_FACT_CHARS]
+                )
+            )
+
+        known = {memory.key: memory.text for memory in self.facts_of(user_id)}
+        new = [fact for fact in facts if known.get(fact.key) != fact.text]
+        if not new:
+            return []
+        if self.path is None:
+            for fact in new:
+                self.add(user_id, fact)
+        else:
+            await asyncio.to_thread(
+                self._append,
+                [
+                    {"op": "add", "user": user_id, "kind": f.kind, "key": f.key, "text": f.text}
+                    for f in new
+                ],
+            )
+            await self.refresh()
+        for fact in new:
+            FACTS_LEARNED.inc(kind=fact.kind)
+        return new
+
+    async def forget_user(self, user_id: str) -> int:
+        """``forget`` the user, on every worker sharing the journal, and in the journal."""
+        if self.path is None:
+            return self.forget(user_id)
+        await self.refresh()
+        dropped = len(self.facts_of(user_id))
+        async with self._refresh_lock:
+            records = await asyncio.to_thread(self._rewrite_without, user_id)
+            self._apply(records)
+            self.forget(user_id)
+        return dropped
+
+    async def refresh(self) -> None:
+        """Apply what was appended to the journal since it was last read."""
+        async with self._refresh_lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if stat.st_ino == self._inode and stat.st_size == self._offset:
+                return
+            self._apply(await asyncio.to_thread(self._read))
+
+    def _apply(self, records: list[dict]) -> None:
+        for record in records:
+            if record["op"] == "add":
+                self.add(record["user"], Fact(record["kind"], record["key"], record["text"]))
+            elif record["op"] == "forget":
+                self.forget(record["user"])
+
+    def _read(self) -> list[dict]:
+        with open(self.path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self._inode:
+                # Rewritten since it was last read (or never read): read it all
+                self._inode, self._offset = inode, 0
+            f.seek(self._offset)
+            data = f.read()
+        # A line still being written by another worker is read next time
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        return _parse(data[:end])
+
+    def _append(self, records: list[dict]) -> None:
+        data = "".join(_line(r) for r in records)
+        # One write to a file opened for appending, so workers' lines do not interleave
+        with self._locked(fcntl.LOCK_SH if fcntl else 0):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, data.encode())
+            finally:
+                os.close(fd)
+
+    def _rewrite_without(self, user_id: str) -> list[dict]:
+        """Replace the journal with one without the user's records, durably.
+
+        Returns the other records appended since it was last read, which are not
+        applied yet.
+        """
+        with self._locked(fcntl.LOCK_EX if fcntl else 0):
+            try:
+                with open(self.path, "rb") as f:
+                    data = f.read()
+                    unread = self._offset if os.fstat(f.fileno()).st_ino == self._inode else 0
+            except FileNotFoundError:
+                data, unread = b"", 0
+            # Lines are complete: appends hold the lock
+            kept = [r for r in _parse(data) if r.get("user") != user_id]
+            new = [r for r in _parse(data[unread:]) if r.get("user") != user_id]
+            kept.append({"op": "forget", "user": user_id})
+            content = "".join(_line(r) for r in kept).encode()
+            temp = f"{self.path}.tmp"
+            fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                os.write(fd, content)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(temp, self.path)
+            _fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+            self._inode, self._offset = os.stat(self.path).st_ino, len(content)
+        return new
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(f"{self.path}.lock", os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    async def memories_endpoint(self, request: Request) -> JSONResponse:
+        """``GET`` lists what is known about the user in the path, ``DELETE`` forgets it."""
+        user_id = request.path_params["user_id"]
+        if request.method == "DELETE":
+            return JSONResponse({"user_id": user_id, "forgotten": await self.forget_user(user_id)})
+        if self.path is not None:
+            await self.refresh()
+        return JSONResponse(
+            {
+                "user_id": user_id,
+                "facts": [
+                    {"kind": m.kind, "key": m.key, "text": m.text} for m in self.facts_of(user_id)
+                ],
+            }
+        )
+
+
+def _line(record: dict) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def _parse(data: bytes) -> list[dict]:
+    records = []
+    for line in data.splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            logger.warning("Skipping a malformed line of the user memory journal")
+    return records
+
+
+def _fsync_directory(path: str) -> None:
+    """Make a rename in ``path`` durable, where directories can be opened."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def user_memory_from_settings(config: Settings) -> UserMemoryStore | None:
+    """The configured user memory, or ``None`` if it is off."""
+    if not config.user_memory:
+        return None
+    if not config.user_memory_secret:
+        raise ValueError("USER_MEMORY needs USER_MEMORY_SECRET to verify the x-user-id header")
+    return UserMemoryStore(
+        config.user_memory_path,
+        secret=config.user_memory_secret,
+        k=config.user_memory_top_k,
+        min_score=config.user_memory_min_score,
+        max_per_user=config.user_memory_max_per_user,
+        max_memories=config.user_memory_max,
+    )
@@ -1,27 +1,56 @@
 import { useEffect, useRef, useState } from 'react';
 
+// Ask the server to send content in sentence and markdown block sized deltas, without
+// the accumulated text (see apps/backend/rendering.py)
+const withBlockCadence = (url) => {
+  const wsUrl = new URL(url, window.location.href);
+  wsUrl.searchParams.set('cadence', 'block');
+  return wsUrl.toString();
+};
+
 export function useAgentWebSocket(url) {
   const [isConnected, setIsConnected] = useState(false);
   const [messages, setMessages] = useState([]);
   const [streamingContent, setStreamingContent] = useState('');
   const [toolCalls, setToolCalls] = useState([]);
   const wsRef = useRef(null);
+  // Content received so far; rendered at most once per animation frame
   const streamingContentRef = useRef('');
+  const renderFrameRef = useRef(null);
   const toolCallsRef = useRef([]);
 
   // Keep refs in sync with state
-  useEffect(() => {
-    streamingContentRef.current = streamingContent;
-  }, [streamingContent]);
-
   useEffect(() => {
     toolCallsRef.current = toolCalls;
   }, [toolCalls]);
 
   useEffect(() => {
-    const ws = new WebSocket(url);
+    const ws = new WebSocket(withBlockCadence(url));
     wsRef.current = ws;
 
+    const cancelRender = () => {
+      if (renderFrameRef.current !== null) {
+        cancelAnimationFrame(renderFrameRef.current);
+        renderFrameRef.current = null;
+      }
+    };
+
+    const setContent = (content) => {
+      cancelRender();
+      streamingContentRef.current = content;
+      setStreamingContent(content);
+    };
+
+    const appendContent = (delta) => {
+      streamingContentRef.current += delta;
+      if (renderFrameRef.current === null) {
+        renderFrameRef.current = requestAnimationFrame(() => {
+          renderFrameRef.current = null;
+          setStreamingContent(streamingContentRef.current);
+        });
+      }
+    };
+
     ws.onopen = () => {
       setIsConnected(true);
     };
@@ -41,21 +70,34 @@ export function useAgentWebSocket(url) {
       switch (msg.type) {
         case 'start':
           // Reset streaming state for new response
-          setStreamingContent('');
+          setContent('');
           setToolCalls([]);
           break;
 
+        case 'tool_call_delta':
+          // Show the tool as soon as the model picks it; its arguments follow in tool_call
+          setToolCalls((prev) =>
+            prev.some((tc) => tc.id === msg.tool_call_id)
+              ? prev
+              : [...prev, { id: msg.tool_call_id, name: msg.tool_name, args: null, result: null }]
+          );
+          break;
+
         case 'tool_call':
-          // Add tool call to list
-          setToolCalls((prev) => [
-            ...prev,
-            {
-              id: msg.tool_call_id,
-              name: msg.tool_name,
-              args: msg.tool_args,
-              result: null,
-            },
-          ]);
+          // Add tool call to list, or complete the one announced by tool_call_delta
+          setToolCalls((prev) =>
+            prev.some((tc) => tc.id === msg.tool_call_id)
+              ? prev.map((tc) => (tc.id === msg.tool_call_id ? { ...tc, args: msg.tool_args } : tc))
+              : [
+                  ...prev,
+                  {
+                    id: msg.tool_call_id,
+                    name: msg.tool_name,
+                    args: msg.tool_args,
+                    result: null,
+                  },
+                ]
+          );
           break;
 
         case 'tool_result':
@@ -68,13 +110,13 @@ export function useAgentWebSocket(url) {
           break;
 
         case 'content_delta':
-          // Update streaming content with accumulated text
-          setStreamingContent(msg.accumulated);
+          // Buffer the new text; the next animation frame renders it
+          appendContent(msg.delta);
           break;
 
         case 'content_complete':
           // Finalize content
-          setStreamingContent(msg.content);
+          setContent(msg.content);
           break;
 
         case 'end':
@@ -86,9 +128,10 @@ export function useAgentWebSocket(url) {
               content: streamingContentRef.current,
               toolCalls: toolCallsRef.current,
               timestamp: msg.timestamp,
+              usage: msg.usage,
             },
           ]);
-          setStreamingContent('');
+          setContent('');
           setToolCalls([]);
           break;
 
@@ -102,16 +145,26 @@ export function useAgentWebSocket(url) {
               code: msg.code,
             },
           ]);
-          setStreamingContent('');
+          setContent('');
           setToolCalls([]);
           break;
 
+        case 'ping':
+          // Keepalive from the server; answering keeps a silent connection open
+          ws.send(JSON.stringify({ type: 'pong' }));
+          break;
+
+        case 'warning':
+          console.warn(msg.message);
+          break;
+
         default:
           console.warn('Unknown message type:', msg.type);
       }
     };
 
     return () => {
+      cancelRender();
       if (ws.readyState === WebSocket.OPEN || ws.readyState === WebSocket.CONNECTING) {
         ws.close();
       }